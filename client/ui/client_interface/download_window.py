@@ -493,16 +493,17 @@ class DownloadWindow(QWidget):
             logging.error(f"{i18n.get_text('process_browser_download_failed')}: {e}")
             raise
     
-    def update_task_progress(self, row, progress_data, file_size=0):
+    def update_task_progress(self, row, progress_data, file_size=0, changed=None):
         """更新任务进度
         
         参数:
             row (int): 任务行号
             progress_data (list): 进度数据
             file_size (int): 文件大小
+            changed (list): 变化的块序号，None表示全部
         """
         if hasattr(self, 'task_window') and self.task_window:
-            self.task_window.update_progress(row, progress_data, file_size)
+            self.task_window.update_progress(row, progress_data, file_size, changed)
     
     def update_task_speed(self, row, speed_bytes):
         """更新任务速度
@@ -9,6 +9,10 @@ from PySide6.QtWidgets import QSystemTrayIcon, QGraphicsOpacityEffect, QGridLayo
 from client.ui.components.progressBar import ProgressBar
 from client.ui.title_styles.titleStyles import TitleBar
 from connect.fallback_connector import FallbackConnector
+from core.download_core.task_scheduler import get_download_scheduler
+from client.ui.extension_interface.pop_dialog import launch_scheduled_download
+from core.download_core.NSF_Utils.Progress_Snapshot import ProgressSnapshot, get_progress_hub
+from core.download_core.NSF_Utils.Multi_Source import normalize_mirrors
 from core.font.font_manager import FontManager
 from client.ui.client_interface.about_window import AboutWindow
 from client.ui.client_interface.settings.settings_container import SettingsContainer
@@ -128,6 +132,8 @@ class DownloadManagerWindow(QMainWindow):
         """初始化内部状态和变量"""
         # 任务列表
         self.download_tasks = []
+        # 进度订阅标识（行号 -> ProgressHub订阅）
+        self._progress_subscriptions = {}
         # 当前保存路径
         self.save_path = os.path.expanduser("~/Downloads")
         # 窗口状态
@@ -649,6 +655,20 @@ class DownloadManagerWindow(QMainWindow):
     
     def _initialize_download_system(self):
         """初始化下载系统"""
+        # 所有下载任务通过调度器启动，限制同时下载的任务数
+        self.download_scheduler = get_download_scheduler()
+        self.download_scheduler.set_max_active(self.config_manager.get_max_tasks())
+        self.download_scheduler.register_launcher(
+            "main_window",
+            self._launch_scheduled_download,
+            restore=self.config_manager.get_setting("startup", "restore_tasks", True)
+        )
+        self.download_scheduler.register_launcher(
+            "extension",
+            launch_scheduled_download,
+            restore=self.config_manager.get_setting("startup", "restore_tasks", True)
+        )
+        
         # 延迟初始化浏览器下载监听器，确保主窗口已完全加载
         QTimer.singleShot(2000, self.init_browser_download_listener)
     
@@ -894,6 +914,12 @@ class DownloadManagerWindow(QMainWindow):
             if len(self._processed_extension_requests) > 100:
                 self._processed_extension_requests = set(list(self._processed_extension_requests)[-50:])
             
+            # 备用下载链接（镜像、CDN等）只保留有效的http/https链接
+            mirrors = download_data.get("mirrors")
+            if mirrors:
+                download_data["mirrors"] = normalize_mirrors(url, mirrors)
+                logging.info(f"扩展请求附带 {len(download_data['mirrors'])} 个备用下载源")
+            
             # 确保headers字段存在
             if "headers" not in download_data:
                 download_data["headers"] = {
@@ -1089,40 +1115,33 @@ class DownloadManagerWindow(QMainWindow):
                 
             logging.info(f"成功添加下载任务到UI, row={row}")
             
-            # 创建downlaod manager
-            connector = FallbackConnector()
-            download_manager = connector.create_download_task(download_data)
-            
-            # 设置保存路径
-            download_manager.save_path = task_data.get("save_path", self.save_path)
-        
-            # 连接信号
-            download_manager.initialized.connect(lambda supports_multi: self.on_download_initialized(row, download_manager))
-            download_manager.block_progress_updated.connect(lambda progress_data: self.on_progress_updated(row, progress_data))
-            download_manager.speed_updated.connect(lambda speed: self.on_speed_updated(row, speed))
-            download_manager.download_completed.connect(lambda: self.on_download_completed(row))
-            download_manager.error_occurred.connect(lambda error: self.on_download_error(row, error))
+            # 交给调度器排队，名额空闲时再启动
+            self._update_row_status(row, "排队中")
+            file_size = task_data.get("file_size", -1)
+            scheduler_id = self.download_scheduler.submit(
+                {"task_data": task_data, "download_data": download_data},
+                source="main_window",
+                launcher=lambda payload: self._launch_download(row, payload["task_data"], payload["download_data"]),
+                size=file_size if isinstance(file_size, int) else -1
+            )
             
-            # 保存任务信息
-            task_id = f"task_{int(time.time() * 1000)}_{len(self.download_tasks)}"
+            # 排队期间也保存任务信息，取消或暂停时从调度器队列中移除
             self.download_tasks.append({
                 "row": row,
-                "task_id": task_id,
-                "manager": download_manager,
+                "task_id": f"task_{int(time.time() * 1000)}_{len(self.download_tasks)}",
+                "scheduler_id": scheduler_id,
+                "manager": None,
                 "url": task_data["url"],
                 "save_path": task_data.get("save_path", self.save_path),
-                "status": "下载中",
+                "status": "排队中",
                 "start_time": datetime.datetime.now(),
                 "source": task_data.get("source", "unknown")
             })
             
-            # 启动下载
-            download_manager.start()
-            
             # 切换到下载页面
             self.switch_page(0)
             
-            logging.info(f"已开始下载任务: {task_data['url']}")
+            logging.info(f"已提交下载任务: {task_data['url']}")
             return True
             
         except Exception as e:
@@ -1131,6 +1150,76 @@ class DownloadManagerWindow(QMainWindow):
             logging.error(traceback.format_exc())
             return False
     
+    def _update_row_status(self, row, status_text):
+        """更新任务行的状态文本"""
+        if hasattr(self, 'download_window'):
+            self.download_window.update_task_status(row, status_text)
+        elif hasattr(self, 'task_window') and self.task_window:
+            with self.thread_lock:
+                self.task_window.update_status(row, status_text)
+    
+    def _launch_scheduled_download(self, payload):
+        """启动上次退出时仍在排队的任务（由调度器恢复）"""
+        task_data = payload.get("task_data", {})
+        download_data = payload.get("download_data", {})
+        if hasattr(self, 'download_window'):
+            row = self.download_window.add_download_task(task_data)
+        elif hasattr(self, 'task_window') and self.task_window:
+            with self.thread_lock:
+                row = self.task_window.add_task(task_data)
+        else:
+            raise RuntimeError("任务窗口和下载窗口均未初始化")
+        if row < 0:
+            raise RuntimeError(f"添加任务返回错误: row={row}")
+        return self._launch_download(row, task_data, download_data)
+    
+    def _launch_download(self, row, task_data, download_data):
+        """创建并启动下载引擎（由调度器在有空闲名额时调用）
+        
+        返回:
+            下载引擎实例
+        """
+        # 创建downlaod manager
+        connector = FallbackConnector()
+        download_manager = connector.create_download_task(download_data)
+        
+        # 设置保存路径
+        download_manager.save_path = task_data.get("save_path", self.save_path)
+    
+        # 连接信号
+        download_manager.initialized.connect(lambda supports_multi: self.on_download_initialized(row, download_manager))
+        self._connect_progress(row, download_manager)
+        download_manager.speed_updated.connect(lambda speed: self.on_speed_updated(row, speed))
+        download_manager.download_completed.connect(lambda: self.on_download_completed(row))
+        download_manager.error_occurred.connect(lambda error: self.on_download_error(row, error))
+        
+        # 保存任务信息（排队时已记录的任务只更新下载管理器和状态）
+        task = next((t for t in self.download_tasks if t["row"] == row and t["status"] == "排队中"), None)
+        if task:
+            task["manager"] = download_manager
+            task["status"] = "下载中"
+            task["start_time"] = datetime.datetime.now()
+        else:
+            task_id = f"task_{int(time.time() * 1000)}_{len(self.download_tasks)}"
+            self.download_tasks.append({
+                "row": row,
+                "task_id": task_id,
+                "manager": download_manager,
+                "url": task_data["url"],
+                "save_path": task_data.get("save_path", self.save_path),
+                "status": "下载中",
+                "start_time": datetime.datetime.now(),
+                "source": task_data.get("source", "unknown")
+            })
+        
+        # 启动下载
+        if not download_manager.isRunning():
+            download_manager.start()
+        self._update_row_status(row, "下载中")
+        
+        logging.info(f"已开始下载任务: {task_data['url']}")
+        return download_manager
+    
     def on_download_initialized(self, row, manager):
         """下载初始化完成回调"""
         try:
@@ -1152,8 +1241,14 @@ class DownloadManagerWindow(QMainWindow):
         except Exception as e:
             logging.error(f"更新文件信息失败: {e}")
     
-    def on_progress_updated(self, row, progress_data):
-        """进度更新回调"""
+    def on_progress_updated(self, row, progress_data, changed=None):
+        """进度更新回调
+        
+        参数:
+            row: 任务行号
+            progress_data: 各块进度（字典列表或进度快照）
+            changed: 自上次更新以来变化过的块序号，None表示全部
+        """
         try:
             # 查找任务
             task = next((t for t in self.download_tasks if t["row"] == row), None)
@@ -1166,13 +1261,16 @@ class DownloadManagerWindow(QMainWindow):
             
             # 更新进度条 - 使用下载窗口或任务窗口
             if hasattr(self, 'download_window'):
-                self.download_window.update_task_progress(row, progress_data, file_size)
+                self.download_window.update_task_progress(row, progress_data, file_size, changed)
             elif hasattr(self, 'task_window') and self.task_window:
                 with self.thread_lock:
-                    self.task_window.update_progress(row, progress_data, file_size)
+                    self.task_window.update_progress(row, progress_data, file_size, changed)
             
-            # 计算总进度
-            progress_percent = self._calculate_progress_percent(progress_data)
+            # 计算总进度（快照直接按数组求和，不再逐块遍历）
+            if isinstance(progress_data, ProgressSnapshot):
+                progress_percent = progress_data.percent
+            else:
+                progress_percent = self._calculate_progress_percent(progress_data)
             
             # 检查下载完成
             if progress_percent >= 99.9 and task["status"] != "已完成":
@@ -1191,6 +1289,30 @@ class DownloadManagerWindow(QMainWindow):
         except Exception as e:
             logging.error(f"更新进度出错: {e}")
     
+    def _connect_progress(self, row, manager):
+        """连接任务的进度更新
+        
+        NSF引擎在界面线程的进度派发器上订阅进度快照（每行500毫秒一次，无变化时不刷新），
+        进度条只重新计算变化的块，并关闭引擎的逐块字典信号；其他引擎仍使用block_progress_updated信号。
+        """
+        tracker = getattr(manager, "progress_tracker", None)
+        if tracker is None:
+            manager.block_progress_updated.connect(lambda progress_data: self.on_progress_updated(row, progress_data))
+            return
+        
+        self._disconnect_progress(row)
+        manager.emit_block_progress = False
+        self._progress_subscriptions[row] = get_progress_hub().subscribe(
+            lambda snapshot, changed: self.on_progress_updated(row, snapshot, changed),
+            interval_ms=500, task_key=tracker.task_key
+        )
+    
+    def _disconnect_progress(self, row):
+        """取消任务的进度订阅（先派发尚未送达的最终进度）"""
+        token = self._progress_subscriptions.pop(row, None)
+        if token is not None:
+            get_progress_hub().unsubscribe(token)
+    
     def _calculate_progress_percent(self, progress_data):
         """计算下载进度百分比"""
         if not progress_data:
@@ -1251,6 +1373,8 @@ class DownloadManagerWindow(QMainWindow):
     def on_download_completed(self, row):
         """下载完成回调"""
         try:
+            self._disconnect_progress(row)
+            
             # 查找任务
             task = next((t for t in self.download_tasks if t["row"] == row), None)
             if not task:
@@ -1365,6 +1489,8 @@ class DownloadManagerWindow(QMainWindow):
     def on_download_error(self, row, error):
         """下载错误回调"""
         try:
+            self._disconnect_progress(row)
+            
             # 错误消息
             error_message = str(error)
             logging.error(f"下载错误: {error_message}")
@@ -1405,8 +1531,9 @@ class DownloadManagerWindow(QMainWindow):
         """暂停下载任务"""
         try:
             for task in self.download_tasks:
-                if task['row'] == row and task['status'] == '下载中':
-                    # 停止下载
+                if task['row'] == row and task['status'] in ['下载中', '排队中']:
+                    # 停止下载，仍在排队的任务从调度器队列中移除
+                    self._cancel_queued_task(task)
                     if task.get('manager'):
                         task['manager'].stop()
                     
@@ -1442,35 +1569,19 @@ class DownloadManagerWindow(QMainWindow):
                         }
                     }
                 
-                    # 创建新的下载管理器
-                    connector = FallbackConnector()
-                    download_manager = connector.create_download_task(download_data)
-                
-                    # 设置保存路径
-                    download_manager.save_path = save_path
-                
-                    # 连接信号
-                    download_manager.initialized.connect(lambda supports_multi: self.on_download_initialized(row, download_manager))
-                    download_manager.block_progress_updated.connect(lambda progress_data: self.on_progress_updated(row, progress_data))
-                    download_manager.speed_updated.connect(lambda speed: self.on_speed_updated(row, speed))
-                    download_manager.download_completed.connect(lambda: self.on_download_completed(row))
-                    download_manager.error_occurred.connect(lambda error: self.on_download_error(row, error))
-                    
-                    # 更新任务信息
-                    task["manager"] = download_manager
-                    task["status"] = "下载中"
-                
-                    # 启动下载
-                    download_manager.start()
-                
-                    # 更新UI - 使用下载窗口或任务窗口
-                    if hasattr(self, 'download_window'):
-                        self.download_window.update_task_status(row, "下载中")
-                    elif hasattr(self, 'task_window') and self.task_window:
-                        with self.thread_lock:
-                            self.task_window.update_status(row, "下载中")
+                    # 交给调度器排队，名额空闲时再启动
+                    task_data = {"url": url, "save_path": save_path, "source": task.get("source", "unknown")}
+                    task["manager"] = None
+                    task["status"] = "排队中"
+                    self._update_row_status(row, "排队中")
+                    task["scheduler_id"] = self.download_scheduler.submit(
+                        {"task_data": task_data, "download_data": download_data},
+                        source="main_window",
+                        launcher=lambda payload: self._launch_download(row, payload["task_data"], payload["download_data"]),
+                        size=task.get("file_size", -1) if isinstance(task.get("file_size"), int) else -1
+                    )
                     
-                    logging.info(f"已恢复任务: {row}")
+                    logging.info(f"已提交恢复任务: {row}")
                     break
         except Exception as e:
             logging.error(f"恢复下载任务失败: {e}")
@@ -1480,7 +1591,8 @@ class DownloadManagerWindow(QMainWindow):
         try:
             for task in self.download_tasks:
                 if task['row'] == row:
-                    # 停止下载
+                    # 停止下载，仍在排队的任务从调度器队列中移除
+                    self._cancel_queued_task(task)
                     if task.get('manager'):
                         task['manager'].stop()
                     
@@ -1499,6 +1611,13 @@ class DownloadManagerWindow(QMainWindow):
         except Exception as e:
             logging.error(f"取消下载任务失败: {e}")
     
+    def _cancel_queued_task(self, task):
+        """任务仍在调度器中排队时将其移除"""
+        scheduler_id = task.get('scheduler_id')
+        if scheduler_id and self.download_scheduler.is_queued(scheduler_id):
+            self.download_scheduler.cancel(scheduler_id)
+            logging.info(f"已从下载队列移除任务: {task['row']}")
+    
     def switch_page(self, index):
         # 将索引转换为页面ID
         page_id = None
@@ -1603,7 +1722,7 @@ class DownloadManagerWindow(QMainWindow):
             # 保存活跃下载任务状态等
             active_tasks = []
             for task in self.download_tasks:
-                if task['status'] in ['下载中', '已暂停']:
+                if task['status'] in ['下载中', '已暂停'] and task.get('manager'):
                     active_tasks.append({
                         'url': task['manager'].url,
                         'filename': task['manager'].file_name,
@@ -2293,40 +2412,37 @@ class DownloadManagerWindow(QMainWindow):
                         "requestId": f"history_{int(time.time() * 1000)}"
                     }
                     
-                    # 创建下载管理器
-                    connector = FallbackConnector()
-                    download_manager = connector.create_download_task(download_data)
-                    
-                    # 设置保存路径
-                    download_manager.save_path = self.save_path
-                    
-                    # 连接信号
-                    download_manager.initialized.connect(lambda supports_multi: self.on_download_initialized(row, download_manager))
-                    download_manager.block_progress_updated.connect(lambda progress_data: self.on_progress_updated(row, progress_data))
-                    download_manager.speed_updated.connect(lambda speed: self.on_speed_updated(row, speed))
-                    download_manager.download_completed.connect(lambda: self.on_download_completed(row))
-                    download_manager.error_occurred.connect(lambda error: self.on_download_error(row, error))
+                    # 交给调度器排队，名额空闲时再启动
+                    task_data = {
+                        "url": history_record.get("url", ""),
+                        "save_path": self.save_path,
+                        "source": "history"
+                    }
+                    self._update_row_status(row, "排队中")
+                    scheduler_id = self.download_scheduler.submit(
+                        {"task_data": task_data, "download_data": download_data},
+                        source="main_window",
+                        launcher=lambda payload: self._launch_download(row, payload["task_data"], payload["download_data"])
+                    )
                     
                     # 保存任务信息
                     task_id = f"task_{int(time.time() * 1000)}_{len(self.download_tasks)}"
                     self.download_tasks.append({
                         "row": row,
                         "task_id": task_id,
-                        "manager": download_manager,
+                        "scheduler_id": scheduler_id,
+                        "manager": None,
                         "url": history_record.get("url", ""),
                         "save_path": self.save_path,
-                        "status": "下载中",
+                        "status": "排队中",
                         "start_time": datetime.datetime.now(),
                         "source": "history"
                     })
                     
-                    # 启动下载
-                    download_manager.start()
-                    
                     # 切换到下载页面
                     self.switch_page(0)
                     
-                    logging.info(f"已开始从历史记录重新下载: {history_record.get('filename', '未知文件')}")
+                    logging.info(f"已提交从历史记录重新下载: {history_record.get('filename', '未知文件')}")
                     return True
                 else:
                     logging.error("从历史记录重新下载失败")
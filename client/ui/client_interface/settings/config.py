@@ -30,6 +30,16 @@ class ConfigManager:
                 "default_segments": 8,       # 默认下载分段数
                 "dynamic_threads": True,     # 智能线程管理
                 "force_segments": False,     # 强制分段
+                "work_stealing": True,       # 工作窃取动态分段（空闲连接分担剩余最多的块）
+                "ip_pinning": False,         # 连接CDN优选IP（保留原域名和SNI，IP变差时切换）
+                "nsf_engine": "thread",      # NSF引擎: thread(每分段一个线程) 或 async(单事件循环驱动所有分段)
+                "http2": False,              # HTTP/2多路复用分段（服务器不支持时自动使用HTTP/1.1）
+                "ftp_segments": 4,           # FTP分段下载的连接数（1为单连接下载）
+                "adaptive_concurrency": True, # 自适应连接数（按边际吞吐量、错误率和延迟增减连接）
+                "max_task_connections": 64,  # 自适应模式下单个任务的最大连接数
+                "max_connections": 128,      # 所有任务合计的最大连接数
+                "host_profiles": True,       # 记录各主机的下载特性（连接数、较快IP等），再次下载时直接使用
+                "circuit_breaker": True,     # 服务器限流或连续失败时暂停请求该主机并减少连接
                 "ask_path": True,            # 是否询问下载路径
                 "auto_rename": True,         # 自动重命名重复文件
                 "continue_download": True,   # 断点续传
@@ -733,6 +733,10 @@ class DownloadControlWidget(QWidget):
             self.config_manager.set_setting("download", "auto_start", auto_start)
             self.config_manager.set_setting("download", "max_retries", max_retries)
             
+            # 立即调整同时下载的任务数
+            from core.download_core.task_scheduler import get_download_scheduler
+            get_download_scheduler().set_max_active(max_tasks)
+            
             # 保存配置
             if self.config_manager.save_config():
                 # 显示成功通知
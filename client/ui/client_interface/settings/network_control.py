@@ -1,3 +1,5 @@
+import logging
+
 from PySide6.QtCore import Qt, Signal
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
@@ -68,6 +70,13 @@ class NetworkControlWidget(QWidget):
             password = proxy_config.get("password", "")
             self.password_input.setText(password)
             
+            # 速度限制
+            speed_limit_config = network_config.get("speed_limit", {})
+            self.download_limit_checkbox.setChecked(speed_limit_config.get("download_enabled", False))
+            self.download_limit_spinbox.setValue(speed_limit_config.get("download_limit", 0))
+            self.upload_limit_checkbox.setChecked(speed_limit_config.get("upload_enabled", False))
+            self.upload_limit_spinbox.setValue(speed_limit_config.get("upload_limit", 0))
+            
             # 更新UI状态
             self.update_ui_state()
             
@@ -465,13 +474,24 @@ class NetworkControlWidget(QWidget):
             # 更新网络配置
             network_config["proxy"] = proxy_config
             network_config["user_agent"] = user_agent
-            network_config["download_limit"] = download_limit if download_limit_enabled else 0
-            network_config["upload_limit"] = upload_limit if upload_limit_enabled else 0
+            network_config["speed_limit"] = {
+                "download_enabled": download_limit_enabled,
+                "download_limit": download_limit,
+                "upload_enabled": upload_limit_enabled,
+                "upload_limit": upload_limit
+            }
             
             # 保存配置
             self.config_manager.set("network", network_config)
             success = self.config_manager.save_config()
             
+            # 立即应用到正在进行的下载
+            try:
+                from core.download_core.NSF_Utils.Speed_Limiter import set_global_speed_limit
+                set_global_speed_limit(download_limit * 1024 if download_limit_enabled else 0)
+            except Exception as e:
+                logging.warning(f"应用下载限速失败: {e}")
+            
             if success:
                 self.settings_applied.emit(True, i18n.get_text("network_settings_saved"))
             else:
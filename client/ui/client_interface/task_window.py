@@ -462,8 +462,14 @@ class TaskItemWidget(QFrame):
         speed_text = self.get_readable_size(speed_bytes) + "/s"
         self.speed_label.setText(f"下载速度: {speed_text}")
     
-    def update_progress(self, progress_data, file_size=0):
-        """更新进度条"""
+    def update_progress(self, progress_data, file_size=0, changed=None):
+        """更新进度条
+        
+        参数:
+            progress_data: 各块进度
+            file_size: 文件大小
+            changed: 自上次更新以来变化过的块序号（None表示全部）
+        """
         if not progress_data and isinstance(file_size, (int, float)) and file_size > 0:
             # 可能是进度百分比
             percentage = int((file_size / 100) * 100)
@@ -474,88 +480,26 @@ class TaskItemWidget(QFrame):
             return
             
         if file_size > 0 and progress_data:
-            # 使用分段功能
-            self.progress_bar.updateFromDownloadSegments(progress_data, file_size)
+            # 使用分段功能，进度条只重新计算变化的块并维护总量
+            self.progress_bar.updateFromDownloadSegments(progress_data, file_size, changed)
             
             # 计算总进度
             total_progress = 0
-            total_size = 0
-            total_downloaded = 0
+            total_downloaded, total_size = self.progress_bar.totals()
             
-            try:
-                if isinstance(progress_data[0], dict):
-                    # 遍历所有分块计算进度
-                    for segment in progress_data:
-                        # 兼容新旧字段名
-                        start_pos = segment.get('start_position', segment.get('start_pos', segment.get('startPos', 0)))
-                        end_pos = segment.get('end_position', segment.get('end_pos', segment.get('endPos', 0)))
-                        current = segment.get('current_position', segment.get('progress', start_pos))
-                        
-                        # 确保值有效
-                        start_pos = max(0, start_pos)
-                        end_pos = max(start_pos, end_pos)
-                        current = max(start_pos, min(end_pos, current))
-                        
-                        # 计算当前块的下载量和总大小
-                        current_downloaded = current - start_pos
-                        segment_size = end_pos - start_pos + 1
-                        
-                        # 累加总下载量和总大小
-                        total_downloaded += current_downloaded
-                        total_size += segment_size
-                        
-                    # 防止除零错误
-                    if total_size > 0:
-                        # 计算进度百分比，四舍五入到整数
-                        total_progress_float = (total_downloaded / total_size) * 100
-                        total_progress = int(total_progress_float)
-                        
-                        # 防止因舍入或浮点误差导致显示100%
-                        # 只有真正结束才显示100%
-                        if total_progress_float >= 99.5 and total_downloaded < total_size:
-                            total_progress = 99
-                            
-                elif isinstance(progress_data[0], (list, tuple)) and len(progress_data[0]) >= 3:
-                    # 处理旧格式 [start, current, end]
-                    for segment in progress_data:
-                        start_pos = segment[0]
-                        current = segment[1]
-                        end_pos = segment[2]
-                        
-                        # 确保值有效
-                        start_pos = max(0, start_pos)
-                        end_pos = max(start_pos, end_pos)
-                        current = max(start_pos, min(end_pos, current))
-                        
-                        # 计算当前块的下载量和总大小
-                        current_downloaded = current - start_pos
-                        segment_size = end_pos - start_pos + 1
-                        
-                        # 累加总下载量和总大小
-                        total_downloaded += current_downloaded
-                        total_size += segment_size
-                        
-                    # 防止除零错误
-                    if total_size > 0:
-                        # 计算进度百分比，四舍五入到整数
-                        total_progress_float = (total_downloaded / total_size) * 100
-                        total_progress = int(total_progress_float)
-                        
-                        # 防止因舍入或浮点误差导致显示100%
-                        # 只有真正结束才显示100%
-                        if total_progress_float >= 99.5 and total_downloaded < total_size:
-                            total_progress = 99
-
-                # 设置进度标签
-                self.total_progress_label.setText(f"进度: {total_progress}%")
+            # 防止除零错误
+            if total_size > 0:
+                # 计算进度百分比，四舍五入到整数
+                total_progress_float = (total_downloaded / total_size) * 100
+                total_progress = int(total_progress_float)
                 
-                # 打印调试信息
-                print(f"进度更新: 已下载={total_downloaded}, 总大小={total_size}, 进度={total_progress}%")
+                # 防止因舍入或浮点误差导致显示100%
+                # 只有真正结束才显示100%
+                if total_progress_float >= 99.5 and total_downloaded < total_size:
+                    total_progress = 99
 
-            except Exception as e:
-                print(f"计算进度错误: {e}")
-                import traceback
-                traceback.print_exc()
+            # 设置进度标签
+            self.total_progress_label.setText(f"进度: {total_progress}%")
     
     def update_status(self, status_text, is_complete=False, error_info=None):
         """更新任务状态"""
@@ -1167,13 +1111,13 @@ class TaskWindow(QWidget):
         if size is not None:
             task_item.update_size(size)
     
-    def update_progress(self, row, progress_data, file_size=0):
-        """更新进度条显示"""
+    def update_progress(self, row, progress_data, file_size=0, changed=None):
+        """更新进度条显示（changed为变化的块序号，None表示全部）"""
         if row not in self.task_items:
             return
             
         task_item = self.task_items[row]
-        task_item.update_progress(progress_data, file_size)
+        task_item.update_progress(progress_data, file_size, changed)
     
     def update_speed(self, row, speed_bytes):
         """更新下载速度显示"""
@@ -13,6 +13,12 @@ class ProgressBar(QWidget):
         self._showSegments = True
         self._idmStyle = True  # 启用IDM风格
         
+        # 按块缓存的分段信息，只有变化的块需要重新计算
+        self._blockCache = []  # 每块一项: (已下载字节, 块大小, 分段列表)，无效块为None
+        self._blockFileSize = 0
+        self._totalDownloaded = 0
+        self._totalSize = 0
+        
         # 各种颜色
         self.progressColor = "#1FB15F"  # 绿色
         self.downloadingColor = "#3478F6"  # 蓝色
@@ -47,70 +53,102 @@ class ProgressBar(QWidget):
         self._idmStyle = enable
         self.update()
         
-    def updateFromDownloadSegments(self, progress_data, file_size):
-        """根据下载管理器提供的分段数据更新进度条显示"""
+    def totals(self):
+        """最近一次更新后的(已下载字节, 总字节)"""
+        return self._totalDownloaded, self._totalSize
+        
+    def _parseSegment(self, seg):
+        """把一个块的进度解析为(起始, 当前, 结束)，无效时返回None"""
+        if isinstance(seg, dict):
+            # 新格式：字典形式
+            start = seg.get('start_position', seg.get('start_pos', seg.get('startPos', 0)))
+            end = seg.get('end_position', seg.get('end_pos', seg.get('endPos', 0)))
+            current = seg.get('current_position', seg.get('progress', start))
+        elif isinstance(seg, (list, tuple)) and len(seg) >= 3:
+            # 旧格式：列表形式
+            start, current, end = seg[:3]
+        else:
+            return None
+        
+        # 确保数值类型
+        try:
+            start = int(start)
+            current = int(current)
+            end = int(end)
+        except (ValueError, TypeError):
+            return None
+        
+        # 确保逻辑正确
+        if start < 0 or end < start or current < start:
+            return None
+        
+        # 限制最大值
+        return start, min(current, end), end
+        
+    def _blockEntry(self, seg, file_size):
+        """计算一个块的缓存项: (已下载字节, 块大小, 分段列表)"""
+        parsed = self._parseSegment(seg)
+        if parsed is None:
+            return None
+        start, current, end = parsed
+        
+        parts = []
+        # 避免除零错误
+        if end > start and file_size > 0:
+            start_percent = (start / file_size) * 100
+            end_percent = ((end + 1) / file_size) * 100
+            current_percent = (current / file_size) * 100
+            
+            # 添加已下载部分(绿色)
+            if current > start:
+                parts.append((start_percent, current_percent, self.progressColor))
+            
+            # 添加未下载部分(灰色)
+            if current < end:
+                parts.append((current_percent, end_percent, self.pendingColor))
+
+        return current - start, end - start + 1, parts
+        
+    def updateFromDownloadSegments(self, progress_data, file_size, changed=None):
+        """根据下载管理器提供的分段数据更新进度条显示
+        
+        参数:
+            progress_data: 各块进度（字典、(起始, 当前, 结束)元组或进度快照）
+            file_size: 文件大小
+            changed: 自上次更新以来变化过的块序号，只重新计算这些块；None表示全部重新计算
+        """
         
         if not progress_data or file_size <= 0:
             return
             
         try:
-            # 初始计算
-            total_downloaded = 0
-            total_size = 0
+            count = len(progress_data)
+            if changed is None or file_size != self._blockFileSize or count < len(self._blockCache):
+                # 全部重新计算
+                self._blockCache = [None] * count
+                self._blockFileSize = file_size
+                self._totalDownloaded = 0
+                self._totalSize = 0
+                changed = range(count)
+            elif count > len(self._blockCache):
+                # 新增的块（工作窃取拆分出的块）总是包含在changed中
+                self._blockCache.extend([None] * (count - len(self._blockCache)))
             
-            # 收集所有块信息
-            segments = []
-            for seg in progress_data:
-                if isinstance(seg, dict):
-                    # 新格式：字典形式
-                    start = seg.get('start_position', seg.get('start_pos', seg.get('startPos', 0)))
-                    end = seg.get('end_position', seg.get('end_pos', seg.get('endPos', 0)))
-                    current = seg.get('current_position', seg.get('progress', start))
-                elif isinstance(seg, (list, tuple)) and len(seg) >= 3:
-                    # 旧格式：列表形式
-                    start, current, end = seg[:3]
-                else:
-                    continue
-                
-                # 确保数值类型
-                try:
-                    start = int(start)
-                    current = int(current)
-                    end = int(end)
-                except (ValueError, TypeError):
-                    continue
-                
-                # 确保逻辑正确
-                if start < 0 or end < start or current < start:
-                    continue
-                    
-                # 限制最大值
-                current = min(current, end)
-                
-                # 计算当前块的下载量和总大小
-                current_downloaded = current - start
-                segment_size = end - start + 1
-                
-                # 累加已下载和总大小
-                total_downloaded += current_downloaded
-                total_size += segment_size
-                
-                # 避免除零错误
-                if end > start and file_size > 0:
-                    start_percent = (start / file_size) * 100
-                    end_percent = ((end + 1) / file_size) * 100
-                    current_percent = (current / file_size) * 100
-                    
-                    # 添加已下载部分(绿色)
-                    if current > start:
-                        segments.append((start_percent, current_percent, self.progressColor))
-                    
-                    # 添加未下载部分(灰色)
-                    if current < end:
-                        segments.append((current_percent, end_percent, self.pendingColor))
-                        
-                # 打印调试信息
-                print(f"块 {start}-{end}, 当前={current}, 进度={((current-start)/(end-start+1))*100:.1f}%")
+            # 只重新计算变化的块，总量按差值更新
+            for index in changed:
+                entry = self._blockEntry(progress_data[index], file_size)
+                previous = self._blockCache[index]
+                if previous is not None:
+                    self._totalDownloaded -= previous[0]
+                    self._totalSize -= previous[1]
+                if entry is not None:
+                    self._totalDownloaded += entry[0]
+                    self._totalSize += entry[1]
+                self._blockCache[index] = entry
+            
+            segments = [part for entry in self._blockCache if entry is not None for part in entry[2]]
+            total_downloaded, total_size = self._totalDownloaded, self._totalSize
+            percentage = 0
             
             # 计算进度百分比
             if total_size > 0:
@@ -122,9 +160,6 @@ class ProgressBar(QWidget):
                 
                 # 限制范围
                 percentage = max(0, min(100, percentage))
-                
-                # 调试输出
-                print(f"[DEBUG] 进度条计算总进度: {percentage:.2f}%, 已下载: {total_downloaded}, 总大小: {total_size}")
             
             # 设置分段和总进度
             if segments:
@@ -135,6 +170,8 @@ class ProgressBar(QWidget):
             import traceback
             print(f"[ERROR] 更新进度条出错: {e}")
             traceback.print_exc()
+            # 缓存可能只更新了一部分，下次全部重新计算
+            self._blockFileSize = 0
             # 强制设置一个小进度值
             self.setProgress(1, False)
             
@@ -23,6 +23,8 @@ from client.ui.client_interface.utils.file_icons_get import FileIconGetter
 from core.download_core.Hanabi_NSF_Kernel import DownloadEngine
 from core.download_core.Hanabi_AS_Kernel import HanabiASKernel
 from connect.fallback_connector import FallbackConnector
+from core.download_core.task_scheduler import get_download_scheduler
+from core.download_core.NSF_Utils.Progress_Snapshot import get_progress_hub
 from core.font.font_manager import FontManager
 from client.ui.components.scrollStyle import ScrollStyle
 
@@ -409,6 +411,9 @@ class DownloadPopDialog(QDialog):
     def closeEvent(self, event):
         """关闭窗口事件处理"""
         try:
+            # 取消进度订阅
+            self._unsubscribe_progress()
+            
             # ===== 关键修复 =====
             # 第一步：确保窗口不会导致应用程序退出
             # 1. 显式标记此窗口关闭时不会退出应用程序
@@ -425,6 +430,13 @@ class DownloadPopDialog(QDialog):
             self.setAttribute(Qt.WA_DeleteOnClose, False)
             
             # ==== 常规清理逻辑 ====
+            # 仍在排队的任务随窗口一起取消
+            task_id = getattr(self, 'scheduler_task_id', None)
+            if task_id and get_download_scheduler().is_queued(task_id):
+                get_download_scheduler().cancel(task_id)
+            if task_id and _waiting_dialogs.get(task_id) is self:
+                del _waiting_dialogs[task_id]
+            
             # 关闭前停止所有定时器
             if hasattr(self, 'auto_close_timer') and self.auto_close_timer:
                 try:
@@ -1983,11 +1995,45 @@ class DownloadPopDialog(QDialog):
             logging.debug(f"设置线程优先级失败: {e}")
     
     def _start_download(self, task_data):
-        """开始下载任务
+        """提交下载任务到调度器，有空闲名额时再启动
         
         参数:
             task_data (dict): 下载任务数据
         """
+        try:
+            scheduler = get_download_scheduler()
+            # 使用弹窗任务ID作为调度器任务ID，重启后恢复的任务仍能对应到同一个ID
+            task_data.setdefault("task_id", f"popup_{int(time.time() * 1000)}")
+            _waiting_dialogs[task_data["task_id"]] = self
+            self.scheduler_task_id = scheduler.submit(
+                task_data,
+                source="extension",
+                size=task_data.get("file_size", -1) if isinstance(task_data.get("file_size", -1), int) else -1,
+                task_id=task_data["task_id"]
+            )
+            
+            # 没有立即启动时显示排队状态
+            if scheduler.is_queued(self.scheduler_task_id) and hasattr(self, 'status_label'):
+                self.status_label.setText("排队中")
+        except Exception as e:
+            logging.error(f"提交下载任务失败: {e}")
+            self._on_download_error(str(e))
+    
+    def _release_scheduler_slot(self, success=True):
+        """通知调度器任务已结束或取消，释放下载名额"""
+        task_id = getattr(self, 'scheduler_task_id', None)
+        if task_id:
+            get_download_scheduler().finish(task_id, success)
+    
+    def _launch_download(self, task_data):
+        """开始下载任务（由调度器调用）
+        
+        参数:
+            task_data (dict): 下载任务数据
+            
+        返回:
+            下载引擎实例，NCT内核返回None（结束时通过_release_scheduler_slot释放名额）
+        """
         try:
             # 获取必要参数
             url = task_data.get("url", "")
@@ -2034,7 +2080,9 @@ class DownloadPopDialog(QDialog):
                         file_name=file_name,
                         max_concurrent=max_concurrent,
                         smart_threading=smart_threading,
-                        default_segments=default_segments
+                        default_segments=default_segments,
+                        mirrors=task_data.get("mirrors"),
+                        checksum=task_data.get("checksum")
                     )
                 )
                 
@@ -2063,7 +2111,7 @@ class DownloadPopDialog(QDialog):
                     
                     # 连接信号
                     self.download_engine.initialized.connect(self._on_download_initialized)
-                    self.download_engine.block_progress_updated.connect(self._on_progress_updated)
+                    self._subscribe_progress()
                     self.download_engine.speed_updated.connect(self._on_speed_updated)
                     self.download_engine.download_completed.connect(self._on_download_completed)
                     self.download_engine.error_occurred.connect(self._on_download_error)
@@ -2190,10 +2238,12 @@ class DownloadPopDialog(QDialog):
                     self.kernel_type_label.setText(f"核心: {self.kernel_type}")
                 
                 logging.info(f"弹窗已启动下载任务: {url}, 内核类型: {kernel_type}, 智能线程管理: {smart_threading}, 默认分段数: {default_segments}")
+                return self.download_engine
                 
         except Exception as e:
             logging.error(f"启动下载任务失败: {e}")
             self._on_download_error(str(e))
+            return None
     
     def _on_download_initialized(self, multi_thread_support):
         """下载初始化完成回调
@@ -2249,6 +2299,28 @@ class DownloadPopDialog(QDialog):
             if hasattr(self, 'progress_bar'):
                 self.progress_bar.setEnabled(True)
     
+    def _subscribe_progress(self):
+        """订阅NSF引擎的进度快照（250毫秒刷新一次，无变化时不刷新），并关闭引擎的逐块字典信号"""
+        self._unsubscribe_progress()
+        tracker = getattr(self.download_engine, 'progress_tracker', None)
+        if tracker is None:
+            self.download_engine.block_progress_updated.connect(self._on_progress_updated)
+            return
+        
+        self.download_engine.emit_block_progress = False
+        # 分段详情按所有块的状态做稳定处理，这里不使用变化的块序号
+        self._progress_subscription = get_progress_hub().subscribe(
+            lambda snapshot, changed: self._on_progress_updated(snapshot.block_dicts()),
+            interval_ms=250, task_key=tracker.task_key
+        )
+    
+    def _unsubscribe_progress(self):
+        """取消进度快照订阅（先派发尚未送达的最终进度）"""
+        token = getattr(self, '_progress_subscription', None)
+        if token is not None:
+            self._progress_subscription = None
+            get_progress_hub().unsubscribe(token)
+    
     def _on_progress_updated(self, progress_data):
         """进度更新回调
         
@@ -2425,6 +2497,8 @@ class DownloadPopDialog(QDialog):
     def _on_download_completed(self, status=None):
         """下载完成回调"""
         logging.info("下载任务完成")
+        self._release_scheduler_slot(True)
+        self._unsubscribe_progress()
         
         # 停止定时器
         self.progress_timer.stop()
@@ -2566,6 +2640,8 @@ class DownloadPopDialog(QDialog):
             error_msg (str): 错误信息
         """
         logging.error(f"下载失败: {error_msg}")
+        self._release_scheduler_slot(False)
+        self._unsubscribe_progress()
         
         # 停止定时器
         self.progress_timer.stop()
@@ -2900,6 +2976,8 @@ class DownloadPopDialog(QDialog):
         """取消下载按钮点击处理"""
         # 设置取消标志
         self.cancelled = True
+        self._release_scheduler_slot(False)
+        self._unsubscribe_progress()
         
         # 检查下载引擎和AS内核是否存在
         has_download_engine = hasattr(self, 'download_engine') and self.download_engine is not None
@@ -4721,4 +4799,29 @@ class DownloadPopDialog(QDialog):
             logging.error(f"打开文件夹失败: {e}")
             
             # 即使打开失败也关闭窗口
-            QTimer.singleShot(500, self.close)
\ No newline at end of file
+            QTimer.singleShot(500, self.close)
+
+
+# 在调度器中排队、等待启动的下载弹窗（键为调度器任务ID）
+_waiting_dialogs = {}
+
+
+def launch_scheduled_download(task_data):
+    """启动扩展弹窗提交的排队任务（注册为调度器"extension"来源的启动函数）
+    
+    弹窗仍然打开时由该弹窗启动下载；上次退出时仍在排队的任务重新打开一个下载弹窗。
+    
+    参数:
+        task_data (dict): 下载任务数据
+        
+    返回:
+        下载引擎实例，NCT内核返回None
+    """
+    task_id = task_data.get("task_id", "")
+    dialog = _waiting_dialogs.pop(task_id, None)
+    if dialog is None or DownloadPopDialog._is_destroyed(dialog):
+        logging.info(f"[pop_dialog.py] 恢复排队中的下载任务 [ID: {task_id}]")
+        dialog = DownloadPopDialog.create_and_show()
+        dialog.scheduler_task_id = task_id
+        dialog._create_downloading_ui(task_data)
+    return dialog._launch_download(task_data)
@@ -434,7 +434,9 @@ class FallbackConnector(QObject):
                 max_concurrent=8,  # 可以从配置中读取
                 save_path=None,    # 使用默认保存路径，也可以从请求中获取
                 file_name=filename,
-                smart_threading=True
+                smart_threading=True,
+                mirrors=download_data.get('mirrors'),  # 扩展提供的同一文件的备用链接
+                checksum=download_data.get('checksum')  # 扩展提供的期望文件摘要
             )
         )
         
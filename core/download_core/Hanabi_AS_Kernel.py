@@ -14,8 +14,8 @@ import urllib.parse
 from typing import Dict, List, Optional, Tuple, Union, Any, Callable
 
 # Kernel List
-from core.download_core.Hanabi_NSF_Kernel import DownloadEngine as NSFKernel
 from core.download_core.Hanabi_NCT_Kernel import HanabiNCTAsyncKernel as NCTKernel
+from core.download_core.NSF_Utils.Async_Mode import get_engine_class
 
 # log
 logging.basicConfig(
@@ -115,8 +115,9 @@ class HanabiASKernel:
             
             # 根据内核类型初始化相应内核
             if kernel_type == "NSF":
-                # 初始化NSF内核 (HTTP/HTTPS下载)
-                self.nsf_kernel = NSFKernel(
+                # 初始化NSF内核 (HTTP/HTTPS下载)，按设置选择线程引擎或异步引擎
+                engine_class = get_engine_class(kwargs.pop("nsf_engine", None))
+                self.nsf_kernel = engine_class(
                     url=url,
                     headers=headers or {},
                     max_concurrent=max_concurrent,
@@ -125,7 +126,7 @@ class HanabiASKernel:
                     **kwargs
                 )
                 self.current_kernel = self.nsf_kernel
-                self.logger.info(f"已初始化{self.current_kernel_fullname}(NSF)用于下载: {url}")
+                self.logger.info(f"已初始化{self.current_kernel_fullname}(NSF, {engine_class.__name__})用于下载: {url}")
                 return True, ""
                 
             elif kernel_type == "NCT":
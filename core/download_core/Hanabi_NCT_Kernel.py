@@ -14,16 +14,52 @@ import socket
 import threading
 import asyncio
 import functools
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Union, Any, Callable
 
+from core.download_core.NSF_Utils.Resume_Journal import ResumeJournal
+from core.download_core.NSF_Utils.Work_Stealing import WorkStealer
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+# 分段下载配置
+DEFAULT_FTP_SEGMENTS = 4                    # 默认连接数（很多FTP服务器限制单个IP的连接数）
+MIN_FTP_SEGMENT_SIZE = 4 * 1024 * 1024      # 每段最小大小，也是工作窃取的最小分割大小
+FTP_READ_SIZE = 256 * 1024                  # 数据连接每次读取的大小
+FTP_SEGMENT_RETRIES = 3                     # 连接连续失败多少次后放弃
+FTP_PROGRESS_INTERVAL = 0.5                 # 进度回调和断点续传检查点的间隔（秒）
+
+
+def get_ftp_segments() -> int:
+    """读取设置中的FTP分段连接数（download.ftp_segments，默认4）"""
+    try:
+        from client.ui.client_interface.settings.config import config
+        return max(1, int(config.get_setting("download", "ftp_segments", DEFAULT_FTP_SEGMENTS)))
+    except ImportError:
+        return DEFAULT_FTP_SEGMENTS
+    except Exception as e:
+        logging.warning(f"读取FTP分段设置失败: {e}")
+        return DEFAULT_FTP_SEGMENTS
+
+
+class FtpSegment:
+    """FTP分段下载的一个区间（结束位置包含在区间内），字段与NSF下载块一致，可直接交给WorkStealer分配"""
+    
+    def __init__(self, start: int, current: int, end: int):
+        self.start_position = start
+        self.current_position = current
+        self.end_position = end
+        self.assigned = False
+        self.active = False
+    
+    def is_complete(self) -> bool:
+        return self.current_position > self.end_position
+
 class HanabiNCTAsyncKernel:
     """
     Hanabi的异步FTP下载核心
@@ -43,6 +79,7 @@ class HanabiNCTAsyncKernel:
         self.current_dir = "/"
         self.transfer_tasks = {}
         self._lock = threading.Lock()
+        self._connection_info = None  # 分段下载为每个连接重新登录时使用
         # 创建线程池
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
     
@@ -76,6 +113,7 @@ class HanabiNCTAsyncKernel:
             self.client = ftplib.FTP()
             self.client.connect(host, port, timeout)
             self.client.login(user, password)
+            self._connection_info = (host, port, user, password, timeout)
             self.is_connected = True
             self.current_dir = self.client.pwd()
             
@@ -178,14 +216,18 @@ class HanabiNCTAsyncKernel:
             raise
     
     async def download_file(self, remote_path: str, local_path: str, 
-                          progress_callback=None) -> bool:
+                          progress_callback=None, segments: int = None) -> bool:
         """
         异步下载文件
         
+        服务器支持REST时按分段并发下载（每段一个控制连接+数据连接），支持断点续传；
+        否则在当前连接上单线程下载
+        
         参数:
             remote_path: 远程文件路径
             local_path: 本地保存路径
             progress_callback: 进度回调函数，接收参数(已下载大小, 总大小)
+            segments: 分段连接数，默认读取设置（download.ftp_segments）
             
         返回:
             下载是否成功
@@ -205,10 +247,10 @@ class HanabiNCTAsyncKernel:
         
         return await asyncio.get_event_loop().run_in_executor(
             self.executor, 
-            functools.partial(self._download_file_sync, remote_path, local_path, async_callback)
+            functools.partial(self._download_file_sync, remote_path, local_path, async_callback, segments)
         )
     
-    def _download_file_sync(self, remote_path, local_path, async_callback=None):
+    def _download_file_sync(self, remote_path, local_path, async_callback=None, segments=None):
         """同步下载文件实现"""
         task_id = f"{remote_path}_{int(time.time())}"
         try:
@@ -259,9 +301,21 @@ class HanabiNCTAsyncKernel:
                 
                 return data
             
-            # 下载文件
-            with open(local_path, 'wb') as f:
-                self.client.retrbinary(f"RETR {remote_path}", lambda data: f.write(callback(data)))
+            # 下载文件：大文件且服务器支持REST时分段下载
+            segments = self._get_segment_count(file_size, segments)
+            connection = self._open_rest_connection() if segments > 1 else None
+            if connection is not None:
+                try:
+                    completed = self._download_segmented(task_id, remote_path, local_path, file_size, segments,
+                                                         connection, _async_callback)
+                finally:
+                    # 正常情况下分段工作线程已关闭该连接，这里保证分段开始前出错时连接也被关闭
+                    self._close_connection(connection)
+                if not completed:
+                    return False
+            else:
+                with open(local_path, 'wb') as f:
+                    self.client.retrbinary(f"RETR {remote_path}", lambda data: f.write(callback(data)))
             
             # 最后一次回调确保显示100%
             if _async_callback:
@@ -286,6 +340,261 @@ class HanabiNCTAsyncKernel:
             self.logger.error(f"下载文件失败 {remote_path}: {str(e)}")
             return False
     
+    def _get_segment_count(self, file_size: int, segments: Optional[int]) -> int:
+        """按文件大小确定分段连接数，每段不小于MIN_FTP_SEGMENT_SIZE"""
+        if segments is None:
+            segments = get_ftp_segments()
+        if self._connection_info is None:
+            return 1
+        return max(1, min(int(segments), file_size // MIN_FTP_SEGMENT_SIZE))
+    
+    def _open_rest_connection(self) -> Optional[ftplib.FTP]:
+        """
+        新建一个分段控制连接，并检测服务器是否支持REST断点（STREAM模式下的REST是分段下载的前提）
+        
+        探测在分段连接上进行，主控制连接上不会留下待生效的断点；探测留下的REST 0
+        会被该连接RETR前发送的REST <偏移>覆盖
+        
+        返回:
+            支持REST时返回该连接（交给第一个分段使用），否则返回None
+        """
+        try:
+            ftp = self._open_connection()
+        except (ftplib.Error, OSError, EOFError) as e:
+            self.logger.info(f"无法建立分段连接，使用单连接下载: {str(e)}")
+            return None
+        try:
+            if ftp.sendcmd("REST 0").startswith("350"):
+                return ftp
+        except (ftplib.Error, OSError, EOFError) as e:
+            self.logger.info(f"服务器不支持REST，使用单连接下载: {str(e)}")
+        self._close_connection(ftp)
+        return None
+    
+    def _get_modify_time(self, remote_path: str) -> str:
+        """获取远程文件修改时间（MDTM），用于发现断点续传期间文件已变更，不支持时返回空字符串"""
+        try:
+            response = self.client.sendcmd(f"MDTM {remote_path}")
+            return response[4:].strip() if response.startswith("213") else ""
+        except (ftplib.Error, OSError, EOFError):
+            return ""
+    
+    def _open_connection(self) -> ftplib.FTP:
+        """按当前连接的登录信息为一个分段新建控制连接"""
+        host, port, user, password, timeout = self._connection_info
+        ftp = ftplib.FTP()
+        try:
+            ftp.connect(host, port, timeout)
+            ftp.login(user, password)
+            ftp.voidcmd("TYPE I")
+        except Exception:
+            ftp.close()
+            raise
+        return ftp
+    
+    @staticmethod
+    def _close_connection(ftp: Optional[ftplib.FTP]) -> None:
+        if ftp is None:
+            return
+        try:
+            ftp.quit()
+        except Exception:
+            ftp.close()
+    
+    def _is_transfer_stopped(self, task_id: str) -> bool:
+        with self._lock:
+            return self.transfer_tasks.get(task_id, {}).get("status") == "canceled"
+    
+    def _download_segmented(self, task_id: str, remote_path: str, local_path: str,
+                            file_size: int, segments: int, connection: ftplib.FTP, progress_callback=None) -> bool:
+        """
+        分段并发下载
+        
+        每个连接用REST <偏移>+RETR从分段起点开始接收，到达分段终点后关闭数据连接并中止传输；
+        分段由NSF的WorkStealer分配（空闲连接窃取剩余最多的分段的后半部分），
+        进度记录在与NSF相同格式的.resume日志中，下次下载同一文件时从断点继续
+        
+        参数:
+            task_id: 传输任务ID
+            remote_path: 远程文件路径
+            local_path: 本地保存路径（预分配为完整大小）
+            file_size: 文件大小
+            segments: 并发连接数
+            connection: 已检测过REST的分段控制连接，由第一个分段工作线程接着使用
+            progress_callback: 进度回调函数，接收参数(已下载大小, 总大小)
+            
+        返回:
+            下载是否完成，取消时返回False（保留断点续传信息）；下载出错时抛出异常
+        """
+        host, port = self._connection_info[0], self._connection_info[1]
+        journal_key = f"ftp://{host}:{port}/{remote_path.lstrip('/')}"
+        journal_path = local_path + ".resume"
+        validator = self._get_modify_time(remote_path)
+        
+        # 读取断点续传信息，文件或日志与当前任务不匹配时重新下载
+        blocks = []
+        if os.path.exists(journal_path) and os.path.exists(local_path) and os.path.getsize(local_path) == file_size:
+            try:
+                positions = ResumeJournal.load(journal_path, journal_key, file_size, validator)
+                blocks = [FtpSegment(start, current, end) for start, current, end in positions]
+                resumed = sum(min(block.current_position, block.end_position + 1) - block.start_position for block in blocks)
+                self.logger.info(f"从断点继续下载 {remote_path}: 已完成 {resumed}/{file_size} 字节")
+            except (ValueError, OSError, UnicodeDecodeError) as e:
+                self.logger.warning(f"无法使用断点续传信息，重新下载: {str(e)}")
+                blocks = []
+        
+        if not blocks:
+            segment_size = file_size // segments
+            for i in range(segments):
+                start = i * segment_size
+                end = file_size - 1 if i == segments - 1 else start + segment_size - 1
+                blocks.append(FtpSegment(start, start, end))
+            # 预分配文件，各连接直接写入自己的区间
+            with open(local_path, 'wb') as f:
+                f.truncate(file_size)
+        
+        journal = ResumeJournal(journal_path, journal_key, file_size, validator=validator)
+        journal.compact([(block.start_position, block.current_position, block.end_position) for block in blocks])
+        stealer = WorkStealer(blocks, lambda start, end: FtpSegment(start, start, end),
+                              min_split_size=MIN_FTP_SEGMENT_SIZE,
+                              log_fn=lambda message: self.logger.debug(f"[FTP分段] {message}"))
+        errors = []
+        
+        def positions():
+            with stealer.lock:
+                return [(block.start_position, min(block.current_position, block.end_position + 1), block.end_position)
+                        for block in blocks]
+        
+        def downloaded_bytes():
+            return sum(current - start for start, current, end in positions())
+        
+        self.logger.info(f"FTP分段下载 {remote_path}: {segments} 个连接，文件大小 {file_size} 字节")
+        with self._lock:
+            self.transfer_tasks[task_id]["segments"] = segments
+        
+        sync_fd = os.open(local_path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        try:
+            with ThreadPoolExecutor(max_workers=segments, thread_name_prefix="NCT-Segment") as pool:
+                futures = [pool.submit(self._segment_worker, task_id, remote_path, local_path, stealer, errors,
+                                       connection if i == 0 else None)
+                           for i in range(segments)]
+                while True:
+                    done, _ = wait(futures, timeout=FTP_PROGRESS_INTERVAL)
+                    downloaded = downloaded_bytes()
+                    with self._lock:
+                        self.transfer_tasks[task_id]["downloaded"] = downloaded
+                    if progress_callback:
+                        try:
+                            progress_callback(downloaded, file_size)
+                        except Exception as e:
+                            self.logger.warning(f"进度回调异常: {str(e)}")
+                            progress_callback = None
+                    if len(done) == len(futures):
+                        break
+                    if journal.should_checkpoint(downloaded):
+                        # 检查点之前先把各连接写入的数据落盘
+                        os.fsync(sync_fd)
+                        journal.checkpoint(positions())
+            
+            os.fsync(sync_fd)
+        finally:
+            os.close(sync_fd)
+        
+        if all(block.is_complete() for block in blocks):
+            journal.discard()
+            self.logger.info(f"FTP分段下载完成: 共 {len(blocks)} 段，窃取 {stealer.steal_count} 次")
+            return True
+        
+        # 未完成：保存进度，下次从断点继续
+        journal.compact(positions())
+        if self._is_transfer_stopped(task_id):
+            self.logger.info(f"FTP分段下载已取消，已保存断点续传信息: {remote_path}")
+            return False
+        raise IOError(f"分段下载未完成: {errors[-1] if errors else '所有连接均已断开'}")
+    
+    def _segment_worker(self, task_id: str, remote_path: str, local_path: str,
+                        stealer: WorkStealer, errors: list, ftp: Optional[ftplib.FTP] = None) -> None:
+        """分段下载工作线程：反复领取分段并下载，连接失败时重连重试（ftp为已建立的控制连接，没有时按需新建）"""
+        failures = 0
+        stealer.worker_started()
+        try:
+            with open(local_path, 'r+b', buffering=0) as f:
+                while not self._is_transfer_stopped(task_id):
+                    block = stealer.claim()
+                    if block is None:
+                        break
+                    
+                    block.active = True
+                    start_position = block.current_position
+                    try:
+                        if ftp is None:
+                            ftp = self._open_connection()
+                        if not self._retrieve_segment(ftp, task_id, remote_path, f, block):
+                            # 控制连接状态未知，下一段重新登录
+                            self._close_connection(ftp)
+                            ftp = None
+                        failures = 0
+                    except (ftplib.Error, OSError, EOFError) as e:
+                        self._close_connection(ftp)
+                        ftp = None
+                        if block.current_position > start_position:
+                            failures = 0
+                        failures += 1
+                        self.logger.warning(f"FTP分段 {block.current_position}-{block.end_position} 下载出错({failures}/{FTP_SEGMENT_RETRIES}): {str(e)}")
+                        if failures >= FTP_SEGMENT_RETRIES:
+                            # 服务器限制连接数时多余的连接退出，剩余分段由其他连接接手
+                            if stealer.active_workers > 1:
+                                self.logger.info("FTP分段连接多次失败，减少一个连接")
+                            else:
+                                errors.append(e)
+                            break
+                        time.sleep(failures)
+                    finally:
+                        block.active = False
+                        stealer.release(block)
+        finally:
+            stealer.worker_finished()
+            self._close_connection(ftp)
+    
+    def _retrieve_segment(self, ftp: ftplib.FTP, task_id: str, remote_path: str, f, block: FtpSegment) -> bool:
+        """
+        用REST+RETR下载一个分段，到达分段终点（可能被窃取而缩短）后中止传输
+        
+        返回:
+            控制连接是否还能继续使用
+        """
+        conn = ftp.transfercmd(f"RETR {remote_path}", rest=block.current_position)
+        reached_eof = False
+        try:
+            f.seek(block.current_position)
+            while not self._is_transfer_stopped(task_id):
+                remaining = block.end_position - block.current_position + 1
+                if remaining <= 0:
+                    break
+                data = conn.recv(min(FTP_READ_SIZE, remaining))
+                if not data:
+                    reached_eof = True
+                    break
+                f.write(data)
+                block.current_position += len(data)
+        finally:
+            conn.close()
+        
+        if reached_eof:
+            ftp.voidresp()
+            if not block.is_complete():
+                raise EOFError("数据连接提前关闭")
+            return True
+        
+        # 提前关闭数据连接后服务器回复426（中止）或226（已发送完），读取后连接可继续使用
+        try:
+            ftp.voidresp()
+        except ftplib.error_temp:
+            pass
+        except (ftplib.Error, OSError, EOFError):
+            return False
+        return True
+    
     def _get_file_size(self, remote_path: str) -> int:
         """获取远程文件大小，如果失败返回-1"""
         try:
@@ -486,4 +795,74 @@ class HanabiNCTAsyncKernel:
     def __del__(self):
         """析构函数，确保关闭线程池"""
         if hasattr(self, 'executor'):
-            self.executor.shutdown(wait=False)
\ No newline at end of file
+            self.executor.shutdown(wait=False)
+
+
+# 测试代码
+if __name__ == "__main__":
+    # 用本地pyftpdlib服务器（每个数据连接限速）对比单连接下载、分段下载和断点续传
+    import hashlib
+    import tempfile
+    
+    try:
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler, ThrottledDTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+    except ImportError:
+        print("需要安装pyftpdlib: pip install pyftpdlib")
+        raise SystemExit(1)
+    
+    logging.getLogger("pyftpdlib").setLevel(logging.WARNING)
+    file_size = 24 * 1024 * 1024
+    per_connection_rate = 2 * 1024 * 1024
+    
+    root_dir = tempfile.mkdtemp(prefix="nct_ftp_")
+    out_dir = tempfile.mkdtemp(prefix="nct_out_")
+    content = os.urandom(file_size)
+    with open(os.path.join(root_dir, "test.bin"), "wb") as f:
+        f.write(content)
+    expected = hashlib.sha256(content).hexdigest()
+    
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(root_dir)
+    ThrottledDTPHandler.read_limit = per_connection_rate
+    ThrottledDTPHandler.write_limit = per_connection_rate
+    FTPHandler.dtp_handler = ThrottledDTPHandler
+    FTPHandler.authorizer = authorizer
+    server = ThreadedFTPServer(("127.0.0.1", 0), FTPHandler)
+    port = server.address[1]
+    threading.Thread(target=server.serve_forever, kwargs={"timeout": 0.5}, daemon=True).start()
+    
+    async def run(segments, local_name, cancel_after=None):
+        kernel = HanabiNCTAsyncKernel(max_workers=2)
+        await kernel.connect("127.0.0.1", port)
+        local_path = os.path.join(out_dir, local_name)
+        if cancel_after:
+            async def cancel_later():
+                await asyncio.sleep(cancel_after)
+                for task_id in list(kernel.transfer_tasks):
+                    await kernel.cancel_transfer(task_id)
+            asyncio.ensure_future(cancel_later())
+        start = time.time()
+        ok = await kernel.download_file("/test.bin", local_path, segments=segments)
+        elapsed = time.time() - start
+        await kernel.disconnect()
+        kernel.executor.shutdown(wait=True)
+        return ok, elapsed, local_path
+    
+    def digest(path):
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    
+    print(f"文件大小: {file_size // 1024 // 1024}MB，每个数据连接限速 {per_connection_rate // 1024 // 1024}MB/s")
+    for segments in (1, 4):
+        ok, elapsed, path = asyncio.run(run(segments, f"seg{segments}.bin"))
+        print(f"{segments} 个连接: 成功={ok}, 耗时 {elapsed:.2f}秒, "
+              f"速度 {file_size / elapsed / 1024 / 1024:.1f}MB/s, 校验{'通过' if digest(path) == expected else '失败'}")
+    
+    ok, elapsed, path = asyncio.run(run(4, "resume.bin", cancel_after=1.5))
+    print(f"取消后: 成功={ok}, 断点续传文件存在={os.path.exists(path + '.resume')}")
+    ok, elapsed, path = asyncio.run(run(4, "resume.bin"))
+    print(f"断点续传: 成功={ok}, 耗时 {elapsed:.2f}秒, 校验{'通过' if digest(path) == expected else '失败'}, "
+          f"断点续传文件已删除={not os.path.exists(path + '.resume')}")
+    server.close_all()
@@ -11,10 +11,10 @@ import re
 import logging
 import threading
 import io
-import struct
 import asyncio
 import queue
 from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_right
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple, Any, Union, Callable, Set
 from urllib.parse import urlparse, parse_qs, unquote
@@ -24,7 +24,30 @@ import httpx
 from PySide6.QtCore import QThread, Signal
 
 from core.download_core.core.config import cfg, download_cfg
-from core.download_core.core.methods import getProxy, getReadableSize, createSparseFile
+from core.download_core.core.methods import getProxy, getReadableSize, createSparseFile, preallocateFile
+
+from core.download_core.NSF_Utils.Resume_Journal import ResumeJournal
+from core.download_core.NSF_Utils.Speed_Limiter import bandwidth_limiter
+from core.download_core.NSF_Utils.Connection_Pool import PooledClient, shared_pool, get_origin, is_http2_enabled
+from core.download_core.NSF_Utils.IP_Pinning import pin_registry, get_response_ip, is_ip_pinning_enabled
+from core.download_core.NSF_Utils.Work_Stealing import WorkStealer, is_work_stealing_enabled, choose_steal_split
+from core.download_core.NSF_Utils.Concurrency_Control import (
+    ConcurrencyController, is_adaptive_concurrency_enabled, get_task_connection_limit, INITIAL_CONNECTIONS
+)
+from core.download_core.NSF_Utils.Adaptive_Chunk import AdaptiveChunkSizer
+from core.download_core.NSF_Utils.Progress_Snapshot import ProgressTracker, progress_board
+from core.download_core.NSF_Utils.Speed_Estimator import SpeedEstimator
+from core.download_core.NSF_Utils.Multi_Source import MirrorSet, SourceMirror
+from core.download_core.NSF_Utils.Integrity_Check import StreamingVerifier, parse_checksum, compute_file_digest
+from core.download_core.NSF_Utils.Range_Set import RangeSet
+from core.download_core.NSF_Utils.Host_Profile import host_profiles, host_key, is_host_profile_enabled
+from core.download_core.NSF_Utils.Retry_Policy import (
+    RetryTracker, classify_error, classify_status, parse_retry_after,
+    ERROR_TIMEOUT, ERROR_CONNECTION, ERROR_INTERNAL, ERROR_OTHER, ERROR_NAMES, BREAKER_POLL_INTERVAL
+)
+from core.download_core.NSF_Utils.Download_Log import (
+    DownloadLogSink, LEVEL_DEBUG as LOG_DEBUG, LEVEL_INFO as LOG_INFO, LEVEL_ERROR as LOG_ERROR
+)
 
 # 导入NSF增强工具
 try:
@@ -38,11 +61,29 @@ except ImportError:
 # 设置日志级别
 logging.basicConfig(level=logging.INFO)
 
+# 是否支持定位写入（Windows不支持os.pwrite）
+HAS_PWRITE = hasattr(os, 'pwrite')
+# 是否支持向量定位写入，多个数据片段一次系统调用写入且无需拼接
+HAS_PWRITEV = hasattr(os, 'pwritev')
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+except (ValueError, OSError):
+    IOV_MAX = 1024
+if IOV_MAX <= 0:
+    IOV_MAX = 1024
+
+# 主机性能记录：传输少于该字节数的下载不更新连接数和吞吐量；最近错误率超过该值时初始连接数减半
+PROFILE_MIN_BYTES = 8 * 1024 * 1024
+PROFILE_ERROR_RATE_LIMIT = 0.2
+
+# 所有连接结束后仍有缺口时重新下载缺口，连续这么多次没有进展就停止下载并报错
+GAP_REFETCH_ROUNDS = 3
+
 
 class DownloadBlock:
     """单个下载块，代表分段下载的一部分"""
     
-    def __init__(self, start_pos: int, current_pos: int, end_pos: int, client: httpx.Client = None):
+    def __init__(self, start_pos: int, current_pos: int, end_pos: int, client: "PooledClient" = None):
         self.start_position = start_pos      # 块起始位置
         self.current_position = current_pos  # 当前下载位置
         self.end_position = end_pos          # 块结束位置
@@ -50,23 +91,57 @@ class DownloadBlock:
         self.download_speed = 0              # 当前下载速度(字节/秒)
         self.last_update_time = time.time()  # 上次更新时间
         self.last_position = current_pos     # 上次位置
-        self.retries = 0                     # 重试次数
+        self.retries = 0                     # 连续失败次数（请求写入数据后清零）
+        self.error_class = None              # 最近一次请求失败的错误类型（没有失败为None）
+        self.retry_after = None              # 服务器给出的Retry-After（秒）
+        self.last_error = None               # 最近一次失败的错误信息（写入失败等），重试次数用尽时报告
         self.active = False                  # 是否活跃
+        self.assigned = False                # 是否已分配给工作线程（工作窃取模式）
         self.status = "未知"                 # 下载状态
+        self.server_ip = None                # 当前请求连接的服务器IP
         self.lock = threading.RLock()        # 块级锁，保护状态变更
 
 
 class OptimizedFileWriter:
-    """优化的文件写入类，使用直接I/O和内存映射提高性能"""
+    """优化的文件写入类，使用定位写入和内存映射提高性能
+    
+    各下载块写入的是互不重叠的区间，因此写入路径不需要全局锁：
+    内存映射模式下直接写入映射切片，否则使用os.pwrite按位置写入，
+    仅在不支持pwrite的平台上才退回到加锁的seek+write。
+    
+    submit()提供后写（write-behind）模式：网络线程只把数据块放入
+    以buffer_size为上限的队列，由独立的写入线程按位置排序、合并相邻
+    区间后顺序写盘；队列满时submit()阻塞，对网络读取形成背压。
+    数据可以是片段列表，合并后的片段用pwritev或内存映射直接写入，不做拼接复制。
+    每段数据写盘后调用on_written(位置, 数据片段列表, 长度)，供流式完整性校验使用。
+    入队的数据段按顺序编号：watermark()取得当前序号，wait_written()只等待该序号之前的数据写盘，
+    不受之后继续提交的数据影响。
+    """
+    
+    # 合并写入的单次最大字节数
+    MAX_COALESCE_SIZE = 4 * 1024 * 1024
     
     def __init__(self, file_path: str, file_size: int = 0, buffer_size: int = 8*1024*1024):
         self.file_path = file_path
         self.file_size = file_size
-        self.buffer_size = buffer_size
+        self.buffer_size = max(int(buffer_size), 1)
         self.lock = threading.RLock()
         self.file = None
+        self.fd = -1
+        self.closed = False
         self.use_mmap = False
         self.mmap_obj = None
+        
+        # 后写队列状态
+        self._queue_cond = threading.Condition(threading.Lock())
+        self._pending = []            # 待写入的(位置, 数据片段列表, 总长度)
+        self._pending_bytes = 0       # 队列中和正在写入的字节数
+        self._submitted_seq = 0       # 已入队的数据段序号
+        self._written_seq = 0         # 该序号及之前的数据段都已写盘
+        self._writer_thread = None
+        self._writer_error = None     # 写入线程的异常，下次submit/flush时抛出
+        self._stopping = False
+        self.on_written = None        # 数据写盘后的回调
         self.open()
     
     def open(self):
@@ -83,21 +158,23 @@ class OptimizedFileWriter:
                         with open(self.file_path, 'wb') as f:
                             pass
                     
-                    # 尝试预分配空间（如果文件大小已知）
+                    # 尝试预分配空间（如果文件大小已知，不会截断已有数据）
                     if self.file_size > 0:
                         try:
-                            createSparseFile(self.file_path, self.file_size)
+                            preallocateFile(self.file_path, self.file_size)
                         except Exception as e:
                             logging.warning(f"预分配文件空间失败: {e}")
                     
                     # 打开文件进行读写
                     self.file = open(self.file_path, 'r+b', buffering=0)  # 使用无缓冲I/O
+                    self.fd = self.file.fileno()
+                    self.closed = False
                     
                     # 对于大文件，尝试使用内存映射（提高写入效率）
                     if self.file_size > 10*1024*1024 and self.file_size < 1024*1024*1024:
                         try:
                             import mmap
-                            self.mmap_obj = mmap.mmap(self.file.fileno(), self.file_size)
+                            self.mmap_obj = mmap.mmap(self.fd, self.file_size)
                             self.use_mmap = True
                             logging.info(f"已启用内存映射模式，文件大小: {getReadableSize(self.file_size)}")
                         except Exception as e:
@@ -108,32 +185,105 @@ class OptimizedFileWriter:
                     logging.error(f"打开文件失败: {e}")
                     raise
     
-    def write_at(self, position: int, data: bytes):
-        """在指定位置写入数据"""
-        if not data:
+    def _pwrite_all(self, position: int, data) -> None:
+        """使用os.pwrite写入全部数据（处理部分写入的情况）"""
+        view = memoryview(data)
+        fd = self.fd
+        while view:
+            written = os.pwrite(fd, view, position)
+            if written <= 0:
+                raise OSError(f"pwrite写入字节数异常: {written}")
+            position += written
+            view = view[written:]
+    
+    def _pwritev_all(self, position: int, parts: List[Any]) -> None:
+        """使用os.pwritev写入连续的多个片段（处理部分写入和IOV_MAX限制）"""
+        fd = self.fd
+        views = [memoryview(part) for part in parts]
+        index = 0
+        while index < len(views):
+            batch = views[index:index + IOV_MAX]
+            written = os.pwritev(fd, batch, position)
+            if written <= 0:
+                raise OSError(f"pwritev写入字节数异常: {written}")
+            position += written
+            # 跳过已完整写入的片段，部分写入的片段保留剩余部分
+            while written > 0:
+                size = len(views[index])
+                if written >= size:
+                    written -= size
+                    index += 1
+                else:
+                    views[index] = views[index][written:]
+                    written = 0
+    
+    def write_parts(self, position: int, parts: List[Any]) -> None:
+        """在指定位置连续写入多个数据片段
+        
+        内存映射模式下逐片段写入映射切片，否则优先使用pwritev一次写入，
+        都不可用时逐片段写入；调用方需保证并发写入的区间互不重叠。
+        """
+        if len(parts) == 1:
+            self.write_at(position, parts[0])
             return
-            
-        with self.lock:
-            if self.file is None:
-                self.open()
-            
+        
+        if HAS_PWRITEV and self.mmap_obj is None and self.file is not None:
             try:
-                if self.use_mmap and self.mmap_obj:
-                    # 使用内存映射写入
-                    end_pos = position + len(data)
-                    if end_pos <= self.file_size:
-                        self.mmap_obj[position:end_pos] = data
-                    else:
-                        # 超出映射范围，使用普通写入
-                        self.file.seek(position)
-                        self.file.write(data)
-                else:
-                    # 普通文件写入
-                    self.file.seek(position)
-                    self.file.write(data)
+                self._pwritev_all(position, parts)
+                return
             except Exception as e:
-                logging.error(f"写入数据失败 [位置:{position}, 大小:{len(data)}]: {e}")
-                # 失败时尝试重新打开文件
+                if self.closed:
+                    raise
+                logging.warning(f"向量写入失败，改为逐片段写入 [位置:{position}]: {e}")
+        
+        for part in parts:
+            self.write_at(position, part)
+            position += len(part)
+    
+    def _write_locked(self, position: int, data) -> None:
+        """加锁的seek+write写入，用于不支持pwrite的平台"""
+        with self.lock:
+            self.file.seek(position)
+            self.file.write(data)
+    
+    def write_at(self, position: int, data: bytes):
+        """在指定位置写入数据
+        
+        调用方需保证并发写入的区间互不重叠，此方法在快速路径上不持有锁。
+        """
+        if not data:
+            return
+        
+        if self.file is None:
+            with self.lock:
+                if self.file is None:
+                    self.open()
+        
+        try:
+            end_pos = position + len(data)
+            mmap_obj = self.mmap_obj
+            if mmap_obj is not None and end_pos <= self.file_size:
+                # 使用内存映射写入，不同块写入不同切片
+                mmap_obj[position:end_pos] = data
+            elif HAS_PWRITE:
+                # 定位写入，不改变共享的文件偏移量
+                self._pwrite_all(position, data)
+            else:
+                # 普通文件写入
+                self._write_locked(position, data)
+        except Exception as e:
+            if self.closed:
+                raise
+            logging.error(f"写入数据失败 [位置:{position}, 大小:{len(data)}]: {e}")
+            # 失败时尝试重新打开文件
+            with self.lock:
+                try:
+                    if self.mmap_obj:
+                        self.mmap_obj.close()
+                except:
+                    pass
+                self.mmap_obj = None
+                self.use_mmap = False
                 try:
                     if self.file:
                         self.file.close()
@@ -141,23 +291,191 @@ class OptimizedFileWriter:
                     pass
                 self.file = None
                 self.open()
-                # 重试一次写入
-                self.file.seek(position)
-                self.file.write(data)
+            # 重试一次写入
+            if HAS_PWRITE:
+                self._pwrite_all(position, data)
+            else:
+                self._write_locked(position, data)
+    
+    def submit(self, position: int, data):
+        """将数据放入后写队列，由写入线程异步写盘
+        
+        队列中的字节数超过buffer_size时阻塞，直到写入线程腾出空间。
+        
+        Args:
+            position: 文件中的写入位置
+            data: 要写入的数据，或按顺序连续写入的数据片段列表（调用后不得再修改）
+        """
+        if isinstance(data, (list, tuple)):
+            parts = list(data)
+            size = sum(len(part) for part in parts)
+        else:
+            parts = [data]
+            size = len(data)
+        if not size:
+            return
+        with self._queue_cond:
+            self._raise_writer_error()
+            if self.closed or self._stopping:
+                raise ValueError("文件写入器已关闭")
+            # 背压：队列已满时等待写入线程消化（单个超大块允许直接入队）
+            while self._pending_bytes and self._pending_bytes + size > self.buffer_size:
+                self._queue_cond.wait(0.5)
+                self._raise_writer_error()
+                if self.closed or self._stopping:
+                    raise ValueError("文件写入器已关闭")
+            self._pending.append((position, parts, size))
+            self._pending_bytes += size
+            self._submitted_seq += 1
+            if self._writer_thread is None:
+                self._writer_thread = threading.Thread(
+                    target=self._writer_loop, name="NSF-FileWriter", daemon=True
+                )
+                self._writer_thread.start()
+            self._queue_cond.notify_all()
+    
+    def _raise_writer_error(self):
+        """抛出写入线程记录的异常（需持有_queue_cond）"""
+        if self._writer_error is not None:
+            error = self._writer_error
+            raise OSError(f"后台写入失败: {error}") from error
+    
+    @classmethod
+    def _coalesce(cls, items: List[Tuple[int, List[Any], int]]) -> List[Tuple[int, List[Any], int]]:
+        """按位置排序并合并相邻区间
+        
+        Args:
+            items: (位置, 数据片段列表, 总长度)列表
+        
+        Returns:
+            List[Tuple[int, List[Any], int]]: (起始位置, 数据片段列表, 总长度)
+        """
+        items.sort(key=lambda item: item[0])
+        runs = []
+        for position, data_parts, size in items:
+            if runs:
+                start, parts, length = runs[-1]
+                if start + length == position and length + size <= cls.MAX_COALESCE_SIZE:
+                    parts.extend(data_parts)
+                    runs[-1] = (start, parts, length + size)
+                    continue
+            runs.append((position, list(data_parts), size))
+        return runs
+    
+    def _writer_loop(self):
+        """写入线程：批量取出队列数据，合并后写盘"""
+        while True:
+            with self._queue_cond:
+                while not self._pending and not self._stopping:
+                    self._queue_cond.wait()
+                if not self._pending and self._stopping:
+                    return
+                batch = self._pending
+                batch_seq = self._submitted_seq
+                self._pending = []
+            
+            written = 0
+            try:
+                for position, parts, length in self._coalesce(batch):
+                    self.write_parts(position, parts)
+                    written += length
+                    callback = self.on_written
+                    if callback is not None:
+                        try:
+                            callback(position, parts, length)
+                        except Exception as e:
+                            logging.error(f"写入回调出错: {e}")
+            except Exception as e:
+                logging.error(f"后台写入线程出错: {e}")
+                with self._queue_cond:
+                    self._writer_error = e
+                    # 丢弃剩余数据，唤醒所有等待者，由它们抛出异常
+                    self._pending = []
+                    self._pending_bytes = 0
+                    self._queue_cond.notify_all()
+                return
+            
+            with self._queue_cond:
+                self._pending_bytes -= sum(size for _, _, size in batch)
+                self._written_seq = batch_seq
+                self._queue_cond.notify_all()
+    
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """等待后写队列中的数据全部写入
+        
+        Returns:
+            bool: 在超时前队列已清空返回True
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._queue_cond:
+            while self._pending_bytes and self._writer_error is None:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue_cond.wait(remaining if remaining is not None else 0.5)
+            self._raise_writer_error()
+        return True
+    
+    def watermark(self) -> int:
+        """当前已入队数据段的序号，配合wait_written()等待此前提交的数据写盘"""
+        with self._queue_cond:
+            return self._submitted_seq
+    
+    def wait_written(self, seq: int) -> bool:
+        """等待序号不超过seq的数据段全部写盘（之后提交的数据不需要等待）
+        
+        Returns:
+            bool: 数据已写盘返回True，写入器已关闭返回False
+        """
+        with self._queue_cond:
+            while self._written_seq < seq and self._writer_error is None:
+                if self.closed:
+                    return False
+                self._queue_cond.wait(0.5)
+            self._raise_writer_error()
+        return True
+    
+    @property
+    def pending_bytes(self) -> int:
+        """队列中尚未落盘的字节数"""
+        return self._pending_bytes
+    
+    def _stop_writer(self):
+        """排空队列并停止写入线程"""
+        try:
+            self.drain()
+        except Exception as e:
+            logging.error(f"排空写入队列失败: {e}")
+        with self._queue_cond:
+            self._stopping = True
+            self._queue_cond.notify_all()
+            thread = self._writer_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
     
     def flush(self):
-        """刷新文件缓冲区"""
+        """刷新文件缓冲区（先等待后写队列清空）"""
+        self.drain()
+        self.sync()
+    
+    def sync(self):
+        """把已写入的数据同步到磁盘（不等待后写队列）"""
         with self.lock:
             if self.file:
                 try:
+                    if self.mmap_obj:
+                        self.mmap_obj.flush()
                     self.file.flush()
-                    os.fsync(self.file.fileno())
+                    os.fsync(self.fd)
                 except Exception as e:
                     logging.error(f"刷新文件缓冲区失败: {e}")
     
     def close(self):
         """关闭文件"""
+        if not self.closed:
+            self._stop_writer()
         with self.lock:
+            self.closed = True
             try:
                 if self.mmap_obj:
                     self.mmap_obj.flush()
@@ -167,9 +485,10 @@ class OptimizedFileWriter:
                 
                 if self.file:
                     self.file.flush()
-                    os.fsync(self.file.fileno())
+                    os.fsync(self.fd)
                     self.file.close()
                     self.file = None
+                    self.fd = -1
             except Exception as e:
                 logging.error(f"关闭文件失败: {e}")
     
@@ -179,40 +498,30 @@ class OptimizedFileWriter:
 
 
 class HttpClientManager:
-    """HTTP客户端管理器，负责创建和管理下载连接"""
+    """HTTP客户端管理器，负责创建和管理下载连接
+    
+    客户端从进程级共享连接池（按源站划分）借用，多个下载任务可以复用同一源站的
+    TCP/TLS连接；close_all()只归还借用，连接留在池中等待复用或空闲回收。
+    """
     
     def __init__(self, use_ssl_verify: bool = True, timeout: float = 30.0):
         self.timeout = timeout
         self.ssl_verify = use_ssl_verify
         self._client_pool = {}
         self._pool_lock = threading.RLock()
-        self._pool_size_limit = 16
     
     def _log_debug(self, message: str) -> None:
         """记录调试日志"""
         logging.debug(f"[HttpClientManager] {message}")
     
-    def create_client(self, headers: Dict[str, str] = None) -> httpx.Client:
-        """创建新的HTTP客户端"""
+    def create_client(self, headers: Dict[str, str] = None) -> PooledClient:
+        """创建HTTP客户端（共享连接池的句柄）"""
+        # 生成客户端键
+        header_key = str(sorted(headers.items())) if headers else "default"
         with self._pool_lock:
-            # 清理过大的池
-            if len(self._client_pool) > self._pool_size_limit:
-                # 关闭多余的客户端
-                keys_to_remove = list(self._client_pool.keys())[self._pool_size_limit//2:]
-                for key in keys_to_remove:
-                    try:
-                        self._client_pool[key].close()
-                    except:
-                        pass
-                    del self._client_pool[key]
-            
-            # 生成客户端键
-            header_key = str(sorted(headers.items())) if headers else "default"
-            if header_key in self._client_pool:
-                client = self._client_pool[header_key]
-                # 验证客户端是否可用
-                if client:
-                    return client
+            client = self._client_pool.get(header_key)
+            if client:
+                return client
         
         # 配置代理
         proxy = getProxy()
@@ -226,21 +535,14 @@ class HttpClientManager:
                 proxy_url = f"http://{proxy}"
             self._log_debug(f"使用代理: {proxy_url}")
         
-        # 更合理的连接池限制
-        limits = httpx.Limits(
-            max_keepalive_connections=20,
-            max_connections=100,
-            keepalive_expiry=30.0
-        )
-        
-        # 创建httpx客户端（替代requests.Session）
-        client = httpx.Client(
+        # 从共享连接池借用客户端，请求头在每个请求上附加
+        client = PooledClient(
+            shared_pool,
             headers=headers,
+            proxy_url=proxy_url,
             verify=self.ssl_verify,
-            proxy=proxy_url,  # 使用proxy而不是proxies
             timeout=self.timeout,
-            limits=limits,
-            follow_redirects=True
+            http2=is_http2_enabled()
         )
         
         # 缓存客户端
@@ -250,7 +552,7 @@ class HttpClientManager:
         return client
     
     def close_all(self):
-        """关闭所有客户端"""
+        """归还所有客户端（共享连接保留在池中）"""
         with self._pool_lock:
             for client in self._client_pool.values():
                 try:
@@ -272,10 +574,15 @@ class DownloadEngine(QThread):
     error_occurred = Signal(str)           # 错误信号
     file_name_changed = Signal(str)        # 文件名变更信号
     status_updated = Signal(str)           # 状态更新信号
+    pause_changed = Signal(bool)           # 暂停状态变化信号，参数为是否已暂停
+    
+    # 线程数超过该值时启用疯狂模式（每个分段一个线程）
+    CRAZY_MODE_THRESHOLD = 32
 
     def __init__(self, url: str, headers: Dict[str, str] = None, max_concurrent: int = 32, 
                  save_path: str = None, file_name: str = None, smart_threading: bool = True, 
-                 file_size: int = -1, default_segments: int = 8, parent=None):
+                 file_size: int = -1, default_segments: int = 8, parent=None,
+                 mirrors: List[str] = None, checksum: str = None):
         """初始化下载引擎
         
         Args:
@@ -288,6 +595,8 @@ class DownloadEngine(QThread):
             file_size: 文件大小(如果已知)
             default_segments: 默认分段数
             parent: 父对象
+            mirrors: 同一文件的备用下载链接（镜像、CDN等），校验通过后与主链接一起分担分段
+            checksum: 期望的文件摘要，如"sha256:..."（支持SHA-256/SHA-1/MD5/CRC32C/CRC32），下载时流式校验
         """
         super().__init__(parent)
         self.url = url
@@ -300,7 +609,7 @@ class DownloadEngine(QThread):
         self.default_segments = default_segments
         
         # 检查线程数是否处于疯狂模式范围(64-128)
-        self.crazy_mode = max_concurrent > 32
+        self.crazy_mode = max_concurrent > self.CRAZY_MODE_THRESHOLD
         if self.crazy_mode:
             logging.warning(f"NSF内核启用疯狂模式! 线程数: {max_concurrent}")
             # 尝试导入并启用疯狂模式
@@ -337,6 +646,74 @@ class DownloadEngine(QThread):
         # 文件写入器
         self.file_writer = None
         
+        # 下载块是否从断点续传文件恢复
+        self.resumed_from_file = False
+        
+        # 断点续传日志（运行期间定期追加检查点）
+        self.resume_journal = None
+        self._checkpoint_thread = None
+        
+        # 限速器中的任务标识（全局限速之外可单独设置任务限速）
+        self.limiter_key = f"nsf-{id(self)}"
+        
+        # 工作窃取动态分段：空闲连接从剩余最多的块尾部窃取一半
+        self.work_stealing = is_work_stealing_enabled()
+        self.work_stealer = None
+        self.steal_worker_count = 0
+        
+        # 自适应连接数：工作窃取模式下按边际吞吐量、错误率和首字节时间调整连接数，
+        # 上限不受分块数表限制，所有任务的连接数之和受全局连接预算限制（疯狂模式不启用）
+        self.adaptive_concurrency = self.work_stealing and is_adaptive_concurrency_enabled() and not self.crazy_mode
+        self.connection_limit = max(self.thread_count, get_task_connection_limit()) if self.adaptive_concurrency else self.thread_count
+        self.concurrency = None
+        
+        # 主机性能记录：下载开始时读取该主机以往测得的连接数、较快IP等，结束时合并本次的测量结果
+        self.use_host_profile = is_host_profile_enabled()
+        self.host_profile = None
+        self.http1_from_profile = False
+        self.session_start = None
+        
+        # 重试策略：按错误类型退避重试，主机限流或连续失败时熔断并减少连接
+        self.retry_tracker = RetryTracker(
+            log_fn=lambda message: self._log_download_debug(f"重试: {message}", LOG_INFO),
+            on_trip=self._on_host_tripped
+        )
+        self.retries_exhausted = False
+        # 下载结束时仍有缺失区间或校验失败：保留断点续传日志，不当作完成处理
+        self.download_failed = False
+        
+        # 已下载区间：写入器接收的数据按字节区间记录，区间覆盖整个文件时立即完成；
+        # 所有连接都结束后仍有缺口时，监控线程只对缺口重新发起分段请求
+        self.downloaded_ranges = RangeSet()
+        self.block_runs = set()
+        
+        # 进度快照：监控线程在进度变化时向进度板发布数组快照，界面按自己的刷新间隔订阅；
+        # 订阅进度板的界面可关闭emit_block_progress，省去每次构建完整字典列表
+        self.progress_tracker = ProgressTracker(self.limiter_key)
+        self.emit_block_progress = True
+        
+        # 速度估计：按字节增量做指数移动平均（任务和每个下载块），并给出剩余时间
+        self.speed_estimator = SpeedEstimator()
+        
+        # 服务器能力探测结果：是否支持Range，以及用于If-Range的文件校验值
+        self.accept_ranges = False
+        self.etag = None
+        self.last_modified = None
+        self.range_validator = None
+        self.origin_changed = False
+        
+        # 多源下载：主链接和备用链接按实测吞吐量分担分段，失败的源暂时停用
+        self.mirror_set = MirrorSet(url, mirrors)
+        
+        # 流式完整性校验：数据写盘时计算摘要，不一致时重新下载出错的区间
+        self.expected_checksum = None
+        self.integrity_verifier = None
+        if checksum:
+            try:
+                self.expected_checksum = parse_checksum(checksum)
+            except ValueError as e:
+                logging.warning(f"忽略无效的文件摘要: {e}")
+        
         # 添加必要的请求头（如果未提供）
         if 'User-Agent' not in self.headers:
             # 尝试从配置获取UA
@@ -384,19 +761,23 @@ class DownloadEngine(QThread):
         if not logs_dir.exists():
             logs_dir.mkdir(exist_ok=True)
         
-        # 创建下载日志
+        # 创建下载日志（写入内存缓冲区，由后台线程批量写盘）
         self.debug_log_path = logs_dir / f"download_{int(time.time())}.log"
         try:
-            with open(self.debug_log_path, "w", encoding="utf-8") as f:
-                f.write(f"===== 下载任务日志 =====\n")
-                f.write(f"URL: {url}\n")
-                f.write(f"开始时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}\n")
-                f.write(f"最大线程数: {max_concurrent}\n")
-                f.write(f"默认分段数: {default_segments}\n")
-                f.write(f"智能线程: {smart_threading}\n")
-                f.write(f"初始文件大小: {file_size if file_size > 0 else '自动获取'}\n")
-                f.write(f"NSF增强器: {'已启用' if self.enhancer else '未启用'}\n")
-                f.write("=====================\n\n")
+            self.download_log = DownloadLogSink(self.debug_log_path)
+            self.download_log.write_raw(
+                f"===== 下载任务日志 =====\n"
+                f"URL: {url}\n"
+                f"开始时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}\n"
+                f"最大线程数: {max_concurrent}\n"
+                f"默认分段数: {default_segments}\n"
+                f"备用下载源: {len(self.mirror_set.alternates)}\n"
+                f"文件校验: {self.expected_checksum[0] if self.expected_checksum else '无'}\n"
+                f"智能线程: {smart_threading}\n"
+                f"初始文件大小: {file_size if file_size > 0 else '自动获取'}\n"
+                f"NSF增强器: {'已启用' if self.enhancer else '未启用'}\n"
+                f"=====================\n\n"
+            )
         except Exception as e:
             logging.warning(f"创建日志文件失败: {e}")
         
@@ -404,14 +785,11 @@ class DownloadEngine(QThread):
         self._init_thread = threading.Thread(target=self._prepare_download, daemon=True)
         self._init_thread.start()
     
-    def _log_download_debug(self, message: str) -> None:
-        """记录下载调试信息到专门的日志文件"""
-        try:
-            with open(self.debug_log_path, "a", encoding="utf-8") as f:
-                timestamp = time.strftime('%H:%M:%S', time.localtime())
-                f.write(f"[{timestamp}] {message}\n")
-        except Exception as e:
-            logging.error(f"写入调试日志失败: {e}")
+    def _log_download_debug(self, message: str, level: int = LOG_DEBUG) -> None:
+        """记录下载调试信息到专门的日志文件（先写入缓冲区，低于日志级别的直接丢弃）"""
+        download_log = getattr(self, 'download_log', None)
+        if download_log is not None:
+            download_log.log(message, level)
     
     def _prepare_download(self) -> None:
         """准备下载任务，包括获取文件信息、创建目录等"""
@@ -428,6 +806,9 @@ class DownloadEngine(QThread):
             self._log_download_debug(f"开始获取链接信息: {self.url}")
             self.status_updated.emit("正在获取文件信息...")
             
+            # 读取该主机以往的性能记录
+            self._load_host_profile(self.url)
+            
             # 使用增强器优化URL连接（如果可用）
             if self.enhancer and self.enhancer.dns_cdn_enabled:
                 self._log_download_debug("使用NSF增强器优化URL连接")
@@ -437,6 +818,8 @@ class DownloadEngine(QThread):
                     # 更新请求头
                     if result.get('headers'):
                         self.headers.update(result['headers'])
+                    # 新连接直接连接测出的IP（保留原主机名的Host和SNI）
+                    self._pin_addresses(result)
             
             # 获取文件信息
             final_url, file_name, file_size = self._get_link_info(self.url, self.headers, self.file_name)
@@ -445,6 +828,7 @@ class DownloadEngine(QThread):
             if final_url != self.url:
                 self.url = final_url
                 logging.info(f"重定向到: {final_url}")
+                self._load_host_profile(final_url)
             
             # 更新文件大小
             if self.known_file_size == -1:
@@ -455,8 +839,23 @@ class DownloadEngine(QThread):
                 self.file_name = file_name
                 self.file_name_changed.emit(file_name)
             
-            # 判断是否支持多线程
-            self.multi_thread_support = self.known_file_size > 0 and self.known_file_size > 1024 * 1024  # 至少1MB才分块
+            # 探测服务器是否真正支持Range请求，并记录文件校验值
+            probed_size = self._probe_range_support(self.url)
+            if probed_size > 0 and probed_size != self.known_file_size:
+                self._log_download_debug(f"按Content-Range修正文件大小: {self.known_file_size} -> {probed_size}")
+                self.known_file_size = probed_size
+            if self.host_profile and self.host_profile.accept_ranges is not None \
+                    and self.host_profile.accept_ranges != self.accept_ranges:
+                self._log_download_debug(f"Range支持情况与主机记录不同: 记录={self.host_profile.accept_ranges}, "
+                                         f"本次={self.accept_ranges}", LOG_INFO)
+            
+            # 判断是否支持多线程：服务器支持Range且文件至少1MB才分块
+            self.multi_thread_support = self.accept_ranges and self.known_file_size > 1024 * 1024
+            
+            # 校验备用下载源，只有分段下载时才使用多个源
+            self.mirror_set.set_primary(self.url, self.known_file_size, self.etag, self.last_modified)
+            if self.multi_thread_support and self.mirror_set.has_alternates():
+                self._verify_mirrors()
             
             # 设置保存路径
             if not self.save_path:
@@ -489,8 +888,10 @@ class DownloadEngine(QThread):
             # 创建文件
             file_path = Path(self.save_path) / self.file_name
             
-            # 如果文件已存在，添加序号避免覆盖
-            if file_path.exists() and file_path.stat().st_size > 0:
+            # 断点续传日志与本次任务匹配时继续使用原文件，否则添加序号避免覆盖
+            resume_file = file_path.with_suffix(file_path.suffix + '.resume')
+            resumable = self._resume_journal_matches(resume_file)
+            if file_path.exists() and file_path.stat().st_size > 0 and not resumable:
                 counter = 1
                 while True:
                     name, ext = os.path.splitext(self.file_name)
@@ -507,10 +908,10 @@ class DownloadEngine(QThread):
             if not file_path.exists():
                 file_path.touch()
                 
-                # 预分配文件空间
-                if self.known_file_size > 0:
+                # 预分配文件空间（可以续传时留给_execute_download检查数据是否保留）
+                if self.known_file_size > 0 and not resumable:
                     try:
-                        createSparseFile(file_path, self.known_file_size)
+                        preallocateFile(file_path, self.known_file_size)
                         self._log_download_debug(f"预分配文件空间: {getReadableSize(self.known_file_size)}")
                     except Exception as e:
                         logging.warning(f"预分配文件空间失败: {e}")
@@ -523,15 +924,38 @@ class DownloadEngine(QThread):
                 self.thread_count = 1
             
             # 记录初始化结果
-            self._log_download_debug(f"准备完成 - 文件名: {self.file_name}, 大小: {getReadableSize(self.known_file_size) if self.known_file_size > 0 else '未知'}, 多线程: {self.multi_thread_support}")
+            self._log_download_debug(f"准备完成 - 文件名: {self.file_name}, 大小: {getReadableSize(self.known_file_size) if self.known_file_size > 0 else '未知'}, 多线程: {self.multi_thread_support}", LOG_INFO)
             
         except Exception as e:
             error_msg = f"下载准备失败: {e}"
             logging.error(error_msg)
-            self._log_download_debug(error_msg)
+            self._log_download_debug(error_msg, LOG_ERROR)
             self._error = error_msg
             self._stopped = True
 
+    def _resume_journal_matches(self, resume_file: Path) -> bool:
+        """
+        检查断点续传日志能否用于本次下载
+        
+        只有日志能完整回放，且URL、文件大小和校验值都与本次任务一致时才返回True；
+        日志缺失、损坏或属于其他文件时，目标文件按普通同名文件处理。
+        
+        参数:
+            resume_file: 断点续传日志路径
+            
+        返回:
+            bool: 日志是否可用
+        """
+        if not resume_file.exists() or not self.multi_thread_support or self.known_file_size <= 0:
+            return False
+        try:
+            restored = ResumeJournal.load(resume_file, self.url, self.known_file_size,
+                                          self.range_validator or "")
+        except Exception as e:
+            self._log_download_debug(f"断点续传文件与当前任务不匹配: {e}，不覆盖已有文件")
+            return False
+        return bool(restored)
+
     def _get_link_info(self, url: str, headers: Dict[str, str], filename: str = None) -> Tuple[str, str, int]:
         """
         获取下载链接的信息
@@ -702,7 +1126,7 @@ class DownloadEngine(QThread):
         except Exception as e:
             error_msg = f"获取链接信息失败: {e}"
             logging.error(error_msg)
-            self._log_download_debug(error_msg)
+            self._log_download_debug(error_msg, LOG_ERROR)
             
             # 生成一个基本的文件名作为后备
             if not filename:
@@ -721,6 +1145,203 @@ class DownloadEngine(QThread):
             
             return url, filename, -1
 
+    def _pin_addresses(self, result: dict) -> None:
+        """把CDN优化测出的IP固定给下载源站
+        
+        新建连接分散到延迟最低的几个健康IP上；使用代理时由代理解析域名，不固定IP。
+        
+        参数:
+            result: CDNOptimizer.optimize_url的结果
+        """
+        if not is_ip_pinning_enabled() or getProxy():
+            return
+        
+        try:
+            scheme, host, port = get_origin(self.url)
+            addresses = result.get('ranked_ips') or [(result['best_ip'], None)]
+            if self.host_profile and self.host_profile.preferred_ips:
+                # 以往下载中较快的IP如果仍在解析结果中，排在前面
+                preferred = {ip: rank for rank, ip in enumerate(self.host_profile.preferred_ips)}
+                addresses = sorted(addresses, key=lambda item: preferred.get(item[0], len(preferred)))
+            pinned = pin_registry.pin(host, port, addresses)
+            if pinned:
+                ips = ", ".join(address.ip for address in pinned.addresses)
+                self._log_download_debug(f"固定IP: {host}:{port} -> {ips}", LOG_INFO)
+        except Exception as e:
+            self._log_download_debug(f"固定IP失败: {e}")
+
+    def _load_host_profile(self, url: str) -> None:
+        """读取下载URL所在主机的性能记录
+        
+        记录中该主机没有协商出HTTP/2时，直接对其使用HTTP/1.1，省去每次的协商回退。
+        
+        参数:
+            url: 下载URL（发生重定向时为最终URL）
+        """
+        self.host_profile = None
+        self.http1_from_profile = False
+        if not self.use_host_profile:
+            return
+        
+        profile = host_profiles.get(host_key(url))
+        if profile is None:
+            self._log_download_debug(f"没有主机性能记录: {host_key(url)}")
+            return
+        
+        self.host_profile = profile
+        self._log_download_debug(f"主机性能记录: {profile.describe()}", LOG_INFO)
+        if is_http2_enabled() and url.startswith("https://") and profile.skip_http2() \
+                and not shared_pool.is_http1_origin(url):
+            shared_pool.prefer_http1(url)
+            self.http1_from_profile = True
+            self._log_download_debug("主机记录为不支持HTTP/2，直接使用HTTP/1.1")
+
+    def _save_host_profile(self) -> None:
+        """把本次下载测得的主机特性合并到主机性能记录
+        
+        连接数和吞吐量只在本次传输了足够多的数据时记录，避免很小的文件或刚开始就取消的任务覆盖已有结果。
+        """
+        if not self.use_host_profile or not self.url or self.session_start is None:
+            return
+        
+        try:
+            facts = {"accept_ranges": self.accept_ranges}
+            
+            start_time, start_bytes = self.session_start
+            blocks = [block for block in list(self.blocks) if isinstance(block, DownloadBlock)]
+            downloaded = self._downloaded_bytes() - start_bytes
+            elapsed = time.time() - start_time
+            stats = self.concurrency.get_stats() if self.concurrency else None
+            if self.multi_thread_support and downloaded >= PROFILE_MIN_BYTES and elapsed > 0:
+                facts["throughput"] = downloaded / elapsed
+                facts["connection_speed"] = max((block.download_speed for block in blocks), default=0) or None
+                if stats:
+                    facts["connections"] = stats["best_target"] if stats["best_throughput"] > 0 else stats["target"]
+                
+                pinned = self._get_pinned_host()
+                if pinned is not None:
+                    fastest = sorted((item for item in pinned.get_stats() if item["speed"] > 0 and not item["down"]),
+                                     key=lambda item: item["speed"], reverse=True)
+                    facts["preferred_ips"] = [item["ip"] for item in fastest]
+            
+            if stats and stats["total_requests"] > 0:
+                facts["error_rate"] = stats["total_errors"] / stats["total_requests"]
+            
+            if is_http2_enabled() and self.url.startswith("https://") and not self.http1_from_profile:
+                facts["http2"] = not shared_pool.is_http1_origin(self.url)
+            
+            profile = host_profiles.record(host_key(self.url), **facts)
+            if profile is not None:
+                self._log_download_debug(f"已更新主机性能记录: {profile.describe()}")
+        except Exception as e:
+            self._log_download_debug(f"保存主机性能记录失败: {e}")
+
+    def _get_pinned_host(self, url: str = None):
+        """获取下载URL（默认为主链接）源站的固定IP集合（没有固定IP时返回None）"""
+        scheme, host, port = get_origin(url or self.url)
+        return pin_registry.get(host, port)
+
+    def _probe_range_support(self, url: str) -> int:
+        """用bytes=0-0请求探测服务器的Range支持情况并记录校验值
+        
+        探测请求使用identity编码，Content-Range中的总长度即文件的真实大小；
+        服务器忽略Range返回200时视为不支持分段下载。
+        
+        参数:
+            url: 下载URL
+            
+        返回:
+            int: Content-Range给出的文件大小，无法获取时返回-1
+        """
+        self.accept_ranges = False
+        self.etag = None
+        self.last_modified = None
+        self.range_validator = None
+        file_size = -1
+        
+        try:
+            headers = {'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'}
+            timeout = httpx.Timeout(15.0, connect=10.0)
+            with self.client.stream("GET", url, headers=headers, timeout=timeout, follow_redirects=True) as response:
+                self.etag = response.headers.get('ETag')
+                self.last_modified = response.headers.get('Last-Modified')
+                
+                if response.status_code == 206:
+                    content_range = response.headers.get('Content-Range', '')
+                    match = re.match(r'\s*bytes\s+(\d+)-(\d+)/(\d+|\*)', content_range)
+                    if match and match.group(1) == '0':
+                        self.accept_ranges = True
+                        if match.group(3) != '*':
+                            file_size = int(match.group(3))
+                    else:
+                        self._log_download_debug(f"Range探测: 206响应的Content-Range无效 ({content_range})，不使用分段下载")
+                elif response.status_code == 200:
+                    self._log_download_debug("Range探测: 服务器忽略Range请求，不使用分段下载")
+                else:
+                    self._log_download_debug(f"Range探测: 状态码 {response.status_code}，不使用分段下载")
+        except Exception as e:
+            self._log_download_debug(f"Range探测失败: {e}，不使用分段下载")
+        
+        # If-Range只接受强ETag，弱ETag时退回Last-Modified
+        if self.etag and not self.etag.startswith('W/'):
+            self.range_validator = self.etag
+        elif self.last_modified:
+            self.range_validator = self.last_modified
+        
+        self._log_download_debug(
+            f"Range探测结果: 支持分段={self.accept_ranges}, 文件大小={file_size}, "
+            f"ETag={self.etag}, Last-Modified={self.last_modified}",
+            LOG_INFO
+        )
+        return file_size
+    
+    def _verify_mirrors(self) -> None:
+        """并发探测所有备用下载源，文件大小和校验值与主链接一致的才参与下载"""
+        def probe(mirror: SourceMirror):
+            file_size, etag, last_modified, accept_ranges, final_url = -1, None, None, False, None
+            try:
+                headers = {'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'}
+                timeout = httpx.Timeout(15.0, connect=10.0)
+                with self.client.stream("GET", mirror.url, headers=headers, timeout=timeout,
+                                        follow_redirects=True) as response:
+                    etag = response.headers.get('ETag')
+                    last_modified = response.headers.get('Last-Modified')
+                    final_url = str(response.url)
+                    match = re.match(r'\s*bytes\s+0-\d+/(\d+)', response.headers.get('Content-Range', ''))
+                    if response.status_code == 206 and match:
+                        accept_ranges = True
+                        file_size = int(match.group(1))
+            except Exception as e:
+                self._log_download_debug(f"备用源探测失败: {mirror.url} ({e})")
+            return self.mirror_set.verify(mirror, file_size, etag, last_modified, accept_ranges, final_url)
+        
+        alternates = self.mirror_set.alternates
+        with ThreadPoolExecutor(max_workers=min(8, len(alternates))) as executor:
+            results = list(executor.map(probe, alternates))
+        
+        for mirror, verified in zip(alternates, results):
+            state = "可用" if verified else f"不可用({mirror.rejected or '探测失败'})"
+            self._log_download_debug(f"备用下载源 {mirror.url}: {state}", LOG_INFO)
+    
+    def _handle_origin_changed(self, block: DownloadBlock, status_code: int) -> None:
+        """分段请求得到完整响应：服务器文件已变更或不再支持Range，停止任务避免写坏文件"""
+        block.active = False
+        block.status = "文件已变更"
+        with self.thread_lock:
+            if self.origin_changed:
+                return
+            self.origin_changed = True
+        
+        error_msg = (f"服务器对分段请求返回了完整内容(状态码 {status_code})，"
+                     f"文件可能已在服务器上变更，请重新下载")
+        self._log_download_debug(error_msg, LOG_ERROR)
+        logging.error(error_msg)
+        
+        # 已下载的数据不再可信，断点续传日志随之作废
+        self.is_running = False
+        self._discard_resume_info()
+        self.error_occurred.emit(error_msg)
+    
     def _clean_header_value(self, value):
         """清理HTTP头值中的非法字符"""
         if not value:
@@ -764,8 +1385,10 @@ class DownloadEngine(QThread):
             
             # 使用增强器优化线程数（如果可用）
             if self.enhancer and self.enhancer.auto_adjust_enabled:
-                # 获取连接速度估计值
+                # 获取连接速度估计值（本任务还没有测量时使用主机记录的吞吐量）
                 connection_speed = self.avg_speed if self.avg_speed > 0 else -1
+                if connection_speed <= 0 and self.host_profile and self.host_profile.throughput:
+                    connection_speed = int(self.host_profile.throughput)
                 # 优化线程数
                 recommended_threads = self.enhancer.optimize_thread_count(self.known_file_size, connection_speed)
                 if recommended_threads > 0 and recommended_threads != self.thread_count:
@@ -816,6 +1439,14 @@ class DownloadEngine(QThread):
                 
                 logging.info(f"用户自定义分段，最终使用分段数: {segment_count}")
             
+            # 有主机记录时直接按记录的连接数分段（不超过连接上限，每段至少1MB）
+            if self.host_profile and self.host_profile.best_connections:
+                profiled = min(self.host_profile.best_connections, self.connection_limit,
+                               self.known_file_size // (1024 * 1024))
+                if profiled > 0 and profiled != segment_count:
+                    self._log_download_debug(f"按主机记录调整分段数: {segment_count} -> {profiled}", LOG_INFO)
+                    segment_count = profiled
+            
             # 确保至少有一个分段
             segment_count = max(1, segment_count)
             
@@ -867,7 +1498,7 @@ class DownloadEngine(QThread):
         except Exception as e:
             error_msg = f"计算分块出错: {e}"
             logging.error(error_msg)
-            self._log_download_debug(error_msg)
+            self._log_download_debug(error_msg, LOG_ERROR)
             return []  # 返回空列表，上层会切换到单线程模式
 
     def _init_blocks(self) -> None:
@@ -918,63 +1549,29 @@ class DownloadEngine(QThread):
                 try:
                     self._log_download_debug(f"检测到断点续传文件: {resume_file}, 尝试恢复")
                     
-                    with open(resume_file, "rb") as f:
-                        # 读取文件头信息：版本, URL, 文件大小
-                        header = f.read(16)  # 4字节版本号 + 8字节文件大小 + 4字节URL长度
-                        if len(header) < 16:
-                            raise ValueError("断点续传文件格式错误：文件头不完整")
-                        
-                        version, file_size, url_len = struct.unpack("<IQI", header)
-                        
-                        if version != 1:
-                            raise ValueError(f"断点续传文件版本不兼容: {version}")
-                        
-                        # 读取URL
-                        url_data = f.read(url_len)
-                        saved_url = url_data.decode('utf-8')
-                        
-                        # 检查URL和文件大小是否匹配
-                        if saved_url != self.url:
-                            self._log_download_debug(f"断点续传URL不匹配：{saved_url} != {self.url}")
-                            raise ValueError("断点续传URL不匹配")
-                        
-                        if file_size != self.known_file_size:
-                            self._log_download_debug(f"断点续传文件大小不匹配：{file_size} != {self.known_file_size}")
-                            raise ValueError("断点续传文件大小不匹配")
-                        
-                        # 读取块信息
-                        self.blocks.clear()
-                        block_count = 0
-                        
-                        while True:
-                            block_data = f.read(24)  # 每个块占24字节(3个int64)
-                            if not block_data or len(block_data) < 24:
-                                break
-                            
-                            start, current, end = struct.unpack("<QQQ", block_data)
-                            
-                            # 验证块范围
-                            if start > end or end >= self.known_file_size:
-                                raise ValueError(f"块{block_count}范围无效: {start}-{end}")
-                            
-                            # 创建块对象
-                            client = self.client_manager.create_client(self.headers)
-                            self.blocks.append(DownloadBlock(start, current, end, client))
-                            self._log_download_debug(
-                                f"恢复块 #{block_count}: 范围={start}-{end}, 当前进度={current}, "
-                                f"完成率={(current-start)/(end-start+1)*100:.2f}%"
-                            )
-                            block_count += 1
+                    # 回放断点续传日志（兼容旧版快照格式）
+                    restored = ResumeJournal.load(resume_file, self.url, self.known_file_size,
+                                                  self.range_validator or "")
+                    
+                    self.blocks.clear()
+                    for block_count, (start, current, end) in enumerate(restored):
+                        client = self.client_manager.create_client(self.headers)
+                        self.blocks.append(DownloadBlock(start, current, end, client))
+                        self._log_download_debug(
+                            f"恢复块 #{block_count}: 范围={start}-{end}, 当前进度={current}, "
+                            f"完成率={(current-start)/(end-start+1)*100:.2f}%"
+                        )
                     
                     if not self.blocks:
                         raise ValueError("未能从断点续传文件中读取任何块信息")
                     
                     self._log_download_debug(f"成功从断点续传文件恢复了 {len(self.blocks)} 个下载块")
+                    self.resumed_from_file = True
                     
                 except Exception as e:
                     error_msg = f"加载断点续传数据失败: {e}, 将重新计算分块"
                     logging.warning(error_msg)
-                    self._log_download_debug(error_msg)
+                    self._log_download_debug(error_msg, LOG_ERROR)
                     self._create_new_blocks()
             else:
                 # 没有断点续传文件，创建新的下载块
@@ -999,18 +1596,19 @@ class DownloadEngine(QThread):
         except Exception as e:
             error_msg = f"初始化下载块失败: {e}"
             logging.error(error_msg)
-            self._log_download_debug(error_msg)
+            self._log_download_debug(error_msg, LOG_ERROR)
             
             # 尝试使用单线程模式作为后备
             try:
                 self.multi_thread_support = False
                 self.blocks.clear()
-                self.blocks.append(DownloadBlock(0, 0, self.file_size - 1, self.client))
+                end_position = self.known_file_size - 1 if self.known_file_size > 0 else 2**63 - 1
+                self.blocks.append(DownloadBlock(0, 0, end_position, self.client))
                 
                 self.block_progress_updated.emit([
                     {
                         'start_pos': 0,
-                        'end_pos': self.file_size - 1,
+                        'end_pos': end_position,
                         'progress': 0
                     }
                 ])
@@ -1018,13 +1616,14 @@ class DownloadEngine(QThread):
             except Exception as e2:
                 error_msg = f"初始化单线程模式也失败: {e2}"
                 logging.error(error_msg)
-                self._log_download_debug(error_msg)
+                self._log_download_debug(error_msg, LOG_ERROR)
                 self.error_occurred.emit(f"下载初始化失败: {e}，后备方案也失败: {e2}")
                 self.is_running = False
     
     def _create_new_blocks(self) -> None:
         """创建新的下载块"""
         self.blocks.clear()
+        self.resumed_from_file = False
         
         # 如果是疯狂模式，优先使用疯狂模式的分块计算
         if self.crazy_mode:
@@ -1097,34 +1696,119 @@ class DownloadEngine(QThread):
             self.blocks.append(DownloadBlock(start, start, end, client))
             self._log_download_debug(f"创建块 #{i}: 范围={start}-{end}, 大小={getReadableSize(end-start+1)}")
     
+    def _block_positions(self) -> List[Tuple[int, int, int]]:
+        """获取所有块的(起始位置, 当前位置, 结束位置)快照"""
+        return [(block.start_position, block.current_position, block.end_position)
+                for block in list(self.blocks) if isinstance(block, DownloadBlock)]
+    
+    def _get_resume_journal(self) -> Optional[ResumeJournal]:
+        """获取断点续传日志，必要时创建"""
+        if self.origin_changed:
+            # 服务器文件已变更，不再记录进度
+            return None
+        if self.resume_journal is None and self.multi_thread_support and self.known_file_size > 0:
+            file_path = Path(self.save_path) / self.file_name
+            resume_file = file_path.with_suffix(file_path.suffix + '.resume')
+            self.resume_journal = ResumeJournal(resume_file, self.url, self.known_file_size,
+                                                validator=self.range_validator or "")
+        return self.resume_journal
+    
+    def _checkpoint_resume_info(self) -> None:
+        """追加断点续传检查点（由监控线程定期调用，不在下载热路径上）
+        
+        监控线程只记录块位置快照和写入队列的序号，等待快照对应的数据写盘、同步文件和追加日志
+        都在检查点线程中进行；上一个检查点尚未完成时跳过本次。
+        """
+        journal = self._get_resume_journal()
+        if journal is None:
+            return
+        if self._checkpoint_thread is not None and self._checkpoint_thread.is_alive():
+            return
+        
+        # 先记录块位置再取序号：块位置推进前数据已经入队，序号之前的数据包含快照中的全部进度
+        positions = self._block_positions()
+        writer = self.file_writer
+        watermark = writer.watermark() if writer else 0
+        self._checkpoint_thread = threading.Thread(
+            target=self._write_checkpoint, args=(journal, writer, positions, watermark),
+            name="NSF-Checkpoint", daemon=True
+        )
+        self._checkpoint_thread.start()
+    
+    def _write_checkpoint(self, journal: ResumeJournal, writer: Optional[OptimizedFileWriter],
+                          positions: List[Tuple[int, int, int]], watermark: int) -> None:
+        """检查点线程：等待快照对应的数据写盘并同步文件，然后追加日志
+        
+        参数:
+            journal: 断点续传日志
+            writer: 文件写入器（直接写入模式时为None）
+            positions: 块位置快照
+            watermark: 取快照时写入队列的序号
+        """
+        try:
+            if writer:
+                if not writer.wait_written(watermark):
+                    return
+                writer.sync()
+            journal.checkpoint(positions)
+        except Exception as e:
+            self._log_download_debug(f"写入断点续传检查点失败: {e}")
+    
+    def _wait_checkpoint(self) -> None:
+        """等待进行中的检查点完成（重写或删除日志前调用，避免旧快照追加在新记录之后）"""
+        thread = self._checkpoint_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+    
     def _save_resume_info(self) -> None:
-        """保存断点续传信息"""
+        """保存断点续传信息（压缩日志为每块一条记录）"""
         if not self.multi_thread_support or not self.blocks:
             return
         
         try:
-            file_path = Path(self.save_path) / self.file_name
-            resume_file = file_path.with_suffix(file_path.suffix + '.resume')
+            journal = self._get_resume_journal()
+            if journal is None:
+                return
+            self._wait_checkpoint()
             
-            with open(resume_file, "wb") as f:
-                # 写入文件头：版本号(1) + 文件大小 + URL长度
-                url_bytes = self.url.encode('utf-8')
-                url_len = len(url_bytes)
-                
-                f.write(struct.pack("<IQI", 1, self.known_file_size, url_len))
-                f.write(url_bytes)
-                
-                # 写入每个块的状态
-                for block in self.blocks:
-                    f.write(struct.pack("<QQQ", 
-                                      block.start_position,
-                                      block.current_position,
-                                      block.end_position))
+            # 先记录块位置，再等待后写队列落盘，保证记录的进度都已写入文件；
+            # 下载失败时块位置可能已越过缺失或出错的区间，改按实际下载的区间记录
+            positions = self._range_positions() if self.download_failed else self._block_positions()
+            if self.file_writer:
+                self.file_writer.flush()
             
-            self._log_download_debug(f"断点续传信息已保存到: {resume_file}")
+            journal.compact(positions)
+            self._log_download_debug(f"断点续传信息已保存到: {journal.path}")
         except Exception as e:
             logging.warning(f"保存断点续传信息失败: {e}")
             self._log_download_debug(f"保存断点续传信息失败: {e}")
+    
+    def _range_positions(self) -> List[Tuple[int, int, int]]:
+        """按已下载区间生成块记录：已下载的区间记为已完成的块，缺口记为从头下载的块"""
+        positions = [(start, end, end - 1) for start, end in self.downloaded_ranges.ranges()]
+        positions.extend((start, start, end - 1) for start, end in self.downloaded_ranges.gaps())
+        positions.sort()
+        return positions
+    
+    def _keep_unfinished_progress(self, bad_ranges: List[Tuple[int, int]] = ()) -> None:
+        """下载无法完成（缺失区间或校验失败）：结束任务，断点续传日志按实际下载的区间重写，
+        下次继续时只重新下载缺失和出错的部分
+        
+        参数:
+            bad_ranges: 已写入但内容有误、需要重新下载的[起始位置, 结束位置]区间
+        """
+        self.download_failed = True
+        self.is_running = False
+        for start, end in bad_ranges:
+            self.downloaded_ranges.discard(start, end + 1)
+        self._save_resume_info()
+    
+    def _discard_resume_info(self) -> None:
+        """下载完成后关闭并删除断点续传日志"""
+        self._wait_checkpoint()
+        if self.resume_journal is not None:
+            self.resume_journal.discard()
+            self.resume_journal = None
 
     def _execute_download(self) -> None:
         """执行下载任务"""
@@ -1133,11 +1817,32 @@ class DownloadEngine(QThread):
             file_path = Path(self.save_path) / self.file_name
             if self.known_file_size > 0:
                 try:
-                    createSparseFile(file_path, self.known_file_size)
+                    existing_size = preallocateFile(file_path, self.known_file_size)
                     self._log_download_debug(f"预分配文件空间: {getReadableSize(self.known_file_size)}")
+                    
+                    # 恢复的块依赖磁盘上已有的数据，文件被截断时超出部分只能重新下载
+                    if self.resumed_from_file:
+                        if existing_size <= 0:
+                            self._log_download_debug("断点续传文件存在但已下载数据丢失，重置所有块进度")
+                            self.resumed_from_file = False
+                        elif existing_size < self.known_file_size:
+                            self._log_download_debug(f"文件只剩 {getReadableSize(existing_size)}，超出部分的块进度回退后重新下载")
+                        for block in self.blocks:
+                            position = max(block.start_position, min(block.current_position, existing_size))
+                            block.current_position = position
+                            block.last_position = min(block.last_position, position)
                 except Exception as e:
                     self._log_download_debug(f"预分配文件空间失败: {e}")
             
+            # 从块进度重建已下载区间（断点续传时块的已下载部分已在文件中）
+            self.downloaded_ranges.reset(self.known_file_size if self.known_file_size > 0 else -1)
+            for block in self.blocks:
+                if isinstance(block, DownloadBlock):
+                    self.downloaded_ranges.add(block.start_position, block.current_position)
+            
+            # 本次运行的起点，结束时按本次传输的数据更新主机性能记录
+            self.session_start = (time.time(), self._downloaded_bytes())
+            
             # 初始化文件写入器
             try:
                 # 选择合适的缓冲区大小
@@ -1158,39 +1863,27 @@ class DownloadEngine(QThread):
                 self._log_download_debug(f"创建文件写入器失败: {e}，将使用直接写入模式")
                 self.file_writer = None
             
+            # 给出期望摘要时在写盘的同时计算摘要
+            self._start_integrity_check(file_path)
+            
+            # 以当前块状态重写断点续传日志，之后由监控线程追加检查点
+            self._save_resume_info()
+            
             # 设置状态
             self.is_running = True
             self.is_paused = False
             self.status_updated.emit("下载中...")
             
-            # 创建线程池
-            if self.crazy_mode:
-                # 疯狂模式下尝试使用疯狂模式管理器的线程池
-                try:
-                    from core.download_core.NSF_Utils.Crazy_Mode import crazy_mode_manager
-                    if crazy_mode_manager.enabled and hasattr(crazy_mode_manager, 'create_executor'):
-                        self.executor = crazy_mode_manager.create_executor()
-                        self._log_download_debug("使用疯狂模式线程池")
-                    else:
-                        # 创建标准线程池作为后备
-                        max_workers = min(128, self.thread_count * 2)
-                        self.executor = ThreadPoolExecutor(max_workers=max_workers)
-                        self._log_download_debug(f"疯狂模式创建标准线程池，最大工作线程数: {max_workers}")
-                except ImportError:
-                    # 创建标准线程池作为后备
-                    max_workers = min(128, self.thread_count * 2)
-                    self.executor = ThreadPoolExecutor(max_workers=max_workers)
-                    self._log_download_debug(f"疯狂模式模块导入失败，创建标准线程池: {max_workers}")
-            else:
-                # 标准模式下创建优化的线程池
-                max_workers = min(32, self.thread_count * 2)  # 控制线程池大小，避免资源过度占用
-                self._log_download_debug(f"创建标准线程池，最大工作线程数: {max_workers}")
-                self.executor = ThreadPoolExecutor(max_workers=max_workers)
+            # 创建执行下载任务的线程池
+            self.executor = self._create_executor()
             
-            # 启动NSF增强器（如果可用）
+            # 启动NSF增强器（如果可用），工作窃取模式下由窃取负责分块调整
             if self.enhancer and self.enhancer.auto_adjust_enabled:
-                self.enhancer.start_optimization()
-                self._log_download_debug("NSF增强器已启动")
+                if self.work_stealing and self.multi_thread_support:
+                    self._log_download_debug("工作窃取模式已启用，不启动NSF增强器的分块优化")
+                else:
+                    self.enhancer.start_optimization()
+                    self._log_download_debug("NSF增强器已启动")
             
             # 启动监控线程
             monitor_thread = threading.Thread(target=self._monitor_progress, daemon=True)
@@ -1198,10 +1891,15 @@ class DownloadEngine(QThread):
             
             # 提交下载任务
             futures = []
+            if self.multi_thread_support and self.work_stealing:
+                futures.extend(self._start_steal_workers())
+            stealing = bool(futures)
             for i, block in enumerate(self.blocks):
+                if stealing:
+                    break
                 self._log_download_debug(f"提交块 #{i} 至线程池, 范围: {block.start_position}-{block.end_position}")
                 if self.multi_thread_support:
-                    futures.append(self.executor.submit(self._process_block, block))
+                    futures.append(self._submit_block(block))
                 else:
                     # 如果不支持多线程，只处理第一个块并跳出循环
                     futures.append(self.executor.submit(self._process_single_block, block))
@@ -1210,78 +1908,21 @@ class DownloadEngine(QThread):
             # 等待监控线程结束
             monitor_thread.join()
             
-            # 检查是否有未完成的块
-            if self.is_running and not self.is_paused:  # 只有非暂停和非停止状态才检查
-                incomplete_blocks = []
-                for i, block in enumerate(self.blocks):
-                    if block.current_position < block.end_position:
-                        incomplete_blocks.append(i)
-                
-                if incomplete_blocks:
-                    # 检查是否接近完成（总进度>99.95%）
-                    total_downloaded = sum(b.current_position - b.start_position for b in self.blocks)
-                    total_size = sum(b.end_position - b.start_position + 1 for b in self.blocks)
-                    progress_percent = (total_downloaded / total_size) * 100 if total_size > 0 else 0
-                    remaining_bytes = total_size - total_downloaded if total_size > 0 else 0
-                    
-                    # 更宽松的完成条件：接近完成或只剩很小数据量
-                    if progress_percent > 99.9 or remaining_bytes <= 20 * 1024:  # 99.9%或剩余<20KB
-                        self._log_download_debug(f"下载接近完成 ({progress_percent:.2f}%)，剩余 {remaining_bytes} 字节，标记为完成")
-                        # 强制完成所有块
-                        for i in incomplete_blocks:
-                            self.blocks[i].current_position = self.blocks[i].end_position
-                    else:
-                        # 再给卡住的下载一次机会
-                        if progress_percent > 98.0:  # 已经下载了98%以上
-                            self._log_download_debug(f"下载未完成但进度很高 ({progress_percent:.2f}%)，尝试再次下载未完成部分")
-                            
-                            # 对于每个未完成的块，重新提交任务
-                            for i in incomplete_blocks:
-                                block = self.blocks[i]
-                                # 如果未完成部分较小，就修复这一部分
-                                if block.end_position - block.current_position < 1024 * 100:  # 小于100KB
-                                    # 重置块位置以重新下载最后部分
-                                    reset_position = max(block.start_position, block.end_position - 1024 * 100)
-                                    self._log_download_debug(f"重新下载块 #{i} 从位置 {reset_position} 开始")
-                                    block.current_position = reset_position
-                                    future = self.executor.submit(self._process_block, block)
-                                    futures.append(future)
-                            
-                            # 等待一小段时间让新任务执行
-                            time.sleep(5)
-                            
-                            # 再次检查未完成的块
-                            still_incomplete = []
-                            for i in incomplete_blocks:
-                                if self.blocks[i].current_position < self.blocks[i].end_position:
-                                    still_incomplete.append(i)
-                            
-                            # 如果还有未完成的，就放弃并报错
-                            if still_incomplete:
-                                # 如果进度真的很高（>99.5%），忽略错误
-                                if progress_percent > 99.5:
-                                    self._log_download_debug("进度非常高，忽略未完成部分")
-                                    for i in still_incomplete:
-                                        self.blocks[i].current_position = self.blocks[i].end_position
-                                else:
-                                    error_msg = f"下载未完成，有 {len(still_incomplete)} 个块未完成，进度 {progress_percent:.2f}%"
-                                    self._log_download_debug(error_msg)
-                                    self.error_occurred.emit(error_msg)
-                                    return
-                        else:
-                            error_msg = f"下载未完成，有 {len(incomplete_blocks)} 个块未完成，进度 {progress_percent:.2f}%"
-                            self._log_download_debug(error_msg)
-                            self.error_occurred.emit(error_msg)
-                            return
+            # 监控线程只在区间覆盖整个文件、文件大小未知的下载结束或任务停止时退出
+            if self.is_running and not self.is_paused and self.downloaded_ranges.total > 0 \
+                    and not self.downloaded_ranges.is_complete():
+                gaps = self.downloaded_ranges.gaps()
+                error_msg = (f"下载未完成，缺少 {len(gaps)} 个区间共 "
+                             f"{getReadableSize(sum(end - start for start, end in gaps))}")
+                self._log_download_debug(error_msg, LOG_ERROR)
+                self._keep_unfinished_progress()
+                self.error_occurred.emit(error_msg)
+                return
             
             # 如果正常完成，进行文件完整性最终检查
             if self.is_running and not self.is_paused:
-                # 确保所有块都处于完成状态
-                for block in self.blocks:
-                    block.current_position = block.end_position
-                
                 # 记录下载完成
-                self._log_download_debug("下载任务完成")
+                self._log_download_debug("下载任务完成", LOG_INFO)
                 self.status_updated.emit("下载完成")
                 
                 # 刷新文件写入器
@@ -1292,8 +1933,13 @@ class DownloadEngine(QThread):
                     except Exception as e:
                         self._log_download_debug(f"刷新文件数据失败: {e}")
                 
+                # 校验文件摘要（不一致且无法修复时已发出错误信号）
+                if not self._verify_integrity():
+                    return
+                
                 # 主动清理断点续传文件
                 try:
+                    self._discard_resume_info()
                     file_path = Path(self.save_path) / self.file_name
                     resume_file = file_path.with_suffix(file_path.suffix + '.resume')
                     
@@ -1313,10 +1959,14 @@ class DownloadEngine(QThread):
         except Exception as e:
             error_msg = f"下载过程出错: {e}"
             logging.error(error_msg)
-            self._log_download_debug(error_msg)
+            self._log_download_debug(error_msg, LOG_ERROR)
+            self._error = error_msg
             self.error_occurred.emit(str(e))
             
         finally:
+            # 移除本任务的限速桶
+            bandwidth_limiter.remove_task(self.limiter_key)
+            
             # 关闭线程池
             if self.executor:
                 try:
@@ -1327,6 +1977,10 @@ class DownloadEngine(QThread):
                     self.executor.shutdown(wait=False)
                 self.executor = None
             
+            # 归还本任务占用的全局连接预算
+            if self.concurrency:
+                self.concurrency.close()
+            
             # 关闭客户端
             try:
                 if self.client:
@@ -1346,120 +2000,303 @@ class DownloadEngine(QThread):
                 except Exception as e:
                     self._log_download_debug(f"关闭文件写入器失败: {e}")
             
-            # 记录任务结束
+            # 结束摘要计算线程
+            if self.integrity_verifier:
+                self.integrity_verifier.close()
+            
+            # 合并本次测得的主机特性
+            self._save_host_profile()
+            
+            # 记录任务结束（完成、停止和出错都只在这里写一次）
             self._write_download_summary()
 
-    def _monitor_progress(self) -> None:
-        """监控下载进度，更新速度和状态"""
-        start_time = time.time()
-        last_progress = 0
-        self.speed_history = []
-        last_progress_change_time = time.time()
-        stalled_count = 0
-        active_stalled_count = 0  # 活跃块停滞计数
+    def _start_integrity_check(self, file_path: Path) -> None:
+        """创建流式摘要计算（需要已知文件大小），从断点续传恢复的数据登记为文件中已有的区间"""
+        if not self.expected_checksum or self.known_file_size <= 0:
+            return
         
-        # 等待进入下载状态
-        time.sleep(0.5)
+        algorithm, expected = self.expected_checksum
+        try:
+            if self.integrity_verifier:
+                self.integrity_verifier.close()
+            self.integrity_verifier = StreamingVerifier(str(file_path), self.known_file_size, algorithm, expected)
+            if self.resumed_from_file:
+                for start, end in self.downloaded_ranges.ranges():
+                    self.integrity_verifier.mark_present(start, end)
+            if self.file_writer:
+                self.file_writer.on_written = self.integrity_verifier.written
+            self._log_download_debug(f"已启用流式{algorithm}校验，期望摘要: {expected}", LOG_INFO)
+        except Exception as e:
+            self._log_download_debug(f"启用文件校验失败: {e}", LOG_ERROR)
+            self.integrity_verifier = None
+    
+    def _verify_integrity(self) -> bool:
+        """下载完成后核对摘要，不一致时重新下载出错的区间并再校验一次
+        
+        返回:
+            bool: 摘要一致或未要求校验时返回True；校验失败时发出错误信号并返回False
+        """
+        verifier = self.integrity_verifier
+        if verifier is None:
+            return True
+        
+        self.status_updated.emit("正在校验文件...")
+        check_start = time.time()
+        digest = verifier.finish()
+        self._log_download_debug(f"{verifier.algorithm}摘要: {digest}，完成校验耗时 {time.time() - check_start:.2f}秒", LOG_INFO)
+        if verifier.matches():
+            return True
+        
+        # 找出写盘内容不对、从未写入或无法确认的区间，重新下载后读取整个文件再算一次；
+        # 写盘内容与收到的数据一致时说明数据在传输中出错，无法定位，按原分块重新下载整个文件
+        file_path = Path(self.save_path) / self.file_name
+        bad_ranges = []
+        if self.multi_thread_support:
+            bad_ranges = verifier.find_corrupt_ranges() or [
+                (block.start_position, block.end_position) for block in sorted(self.blocks, key=lambda b: b.start_position)
+            ]
+        if bad_ranges and self.executor and self.is_running:
+            self._log_download_debug(
+                f"摘要不一致，重新下载 {len(bad_ranges)} 个区间: "
+                f"{', '.join(f'{start}-{end}' for start, end in bad_ranges[:10])}", LOG_INFO
+            )
+            self.status_updated.emit("校验失败，正在重新下载出错部分...")
+            if self.file_writer:
+                self.file_writer.on_written = None
+            blocks = [DownloadBlock(start, start, end, self.client_manager.create_client(self.headers))
+                      for start, end in bad_ranges]
+            for _ in range(3):
+                pending = [block for block in blocks if block.current_position <= block.end_position]
+                if not pending or not self.is_running:
+                    break
+                futures = [self._submit_block(block) for block in pending]
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self._log_download_debug(f"重新下载区间出错: {e}")
+            
+            if all(block.current_position > block.end_position for block in blocks):
+                if self.file_writer:
+                    self.file_writer.flush()
+                digest = compute_file_digest(str(file_path), verifier.algorithm, self.known_file_size)
+                if digest == verifier.expected:
+                    self._log_download_debug("重新下载出错区间后摘要一致", LOG_INFO)
+                    return True
+        
+        error_msg = f"文件校验失败({verifier.algorithm})：期望 {verifier.expected}，实际 {digest}"
+        self._log_download_debug(error_msg, LOG_ERROR)
+        logging.error(error_msg)
+        self._keep_unfinished_progress(bad_ranges)
+        self.error_occurred.emit(error_msg)
+        return False
+    
+    def _create_executor(self):
+        """创建执行下载任务的线程池
+        
+        返回:
+            ThreadPoolExecutor: 线程池（疯狂模式下优先使用疯狂模式管理器的线程池）
+        """
+        if self.crazy_mode:
+            # 疯狂模式下尝试使用疯狂模式管理器的线程池
+            try:
+                from core.download_core.NSF_Utils.Crazy_Mode import crazy_mode_manager
+                if crazy_mode_manager.enabled and hasattr(crazy_mode_manager, 'create_executor'):
+                    executor = crazy_mode_manager.create_executor()
+                    self._log_download_debug("使用疯狂模式线程池")
+                else:
+                    # 创建标准线程池作为后备
+                    max_workers = min(128, self.thread_count * 2)
+                    executor = ThreadPoolExecutor(max_workers=max_workers)
+                    self._log_download_debug(f"疯狂模式创建标准线程池，最大工作线程数: {max_workers}")
+            except ImportError:
+                # 创建标准线程池作为后备
+                max_workers = min(128, self.thread_count * 2)
+                executor = ThreadPoolExecutor(max_workers=max_workers)
+                self._log_download_debug(f"疯狂模式模块导入失败，创建标准线程池: {max_workers}")
+        else:
+            # 标准模式下创建优化的线程池
+            max_workers = min(32, self.thread_count * 2)  # 控制线程池大小，避免资源过度占用
+            if self.adaptive_concurrency:
+                # 连接数由自适应控制器决定，线程池按连接数上限创建（线程按需启动）
+                max_workers = max(max_workers, self.connection_limit + 2)
+            self._log_download_debug(f"创建标准线程池，最大工作线程数: {max_workers}")
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+        
+        return executor
+    
+    def _submit_block(self, block: DownloadBlock):
+        """提交一个分段下载块到执行器"""
+        return self._track_block_run(self.executor.submit(self._run_block, block))
+    
+    def _track_block_run(self, future):
+        """记录提交的块下载任务，监控线程据此判断是否还有连接在下载"""
+        with self.thread_lock:
+            self.block_runs.add(future)
+        future.add_done_callback(self._block_run_done)
+        return future
+    
+    def _block_run_done(self, future) -> None:
+        with self.thread_lock:
+            self.block_runs.discard(future)
+    
+    def _submit_steal_worker(self):
+        """提交一个工作窃取工作线程到执行器"""
+        return self.executor.submit(self._steal_worker)
+    
+    def _run_block(self, block: DownloadBlock) -> bool:
+        """下载一个块，失败时按重试策略等待后继续，直到完成、任务结束或重试次数用尽
+        
+        参数:
+            block: 下载块对象
+            
+        返回:
+            bool: 块是否下载完成
+        """
+        while True:
+            success = self._process_block(block)
+            if success or not self.is_running or self.is_paused:
+                return success
+            if block.error_class is None:
+                # 切换IP或下载源时立即从其他IP或源继续，其余情况（文件已变更等）不再重试
+                if block.status in ("切换IP", "切换下载源"):
+                    continue
+                return False
+            delay = self._retry_delay(block)
+            if delay is None or not self._wait_retry(delay):
+                return False
+    
+    def _record_block_failure(self, block: DownloadBlock, url: str, error_class: str,
+                              retry_after: Optional[float] = None) -> None:
+        """记录块本次请求失败（计入所请求主机的熔断器），由调用者按重试策略决定何时重试
+        
+        程序错误不重试，在异常处理中调用时记录调用栈。
+        
+        参数:
+            block: 下载块对象
+            url: 请求的URL
+            error_class: 错误类型
+            retry_after: 服务器给出的Retry-After（秒）
+        """
+        if error_class == ERROR_INTERNAL:
+            logging.error(f"块{block.start_position}-{block.end_position}: 程序错误，不再重试", exc_info=True)
+        block.error_class = error_class
+        block.retry_after = retry_after
+        self.retry_tracker.on_failure(url, error_class, retry_after)
+    
+    def _retry_delay(self, block: DownloadBlock) -> Optional[float]:
+        """块请求失败后计算重试前的等待时间，超过该类错误的重试次数时结束任务
+        
+        参数:
+            block: 失败的下载块（error_class为本次的错误类型）
+            
+        返回:
+            Optional[float]: 等待秒数，重试次数用尽时为None
+        """
+        block.retries += 1
+        error_class = block.error_class or ERROR_CONNECTION
+        delay = self.retry_tracker.next_delay(block.retries, error_class, block.retry_after)
+        name = ERROR_NAMES.get(error_class, error_class)
+        if delay is None:
+            detail = f"({block.last_error})" if block.last_error else ""
+            self._give_up_block(block, f"{name}{detail}，已重试{block.retries - 1}次")
+            return None
+        
+        retry_after = f"，Retry-After={block.retry_after:.0f}秒" if block.retry_after is not None else ""
+        self._log_download_debug(f"块{block.start_position}-{block.end_position}: {name}{retry_after}，"
+                                 f"第{block.retries}次重试，{delay:.1f}秒后重试")
+        block.status = "等待重试"
+        return delay
+    
+    def _give_up_block(self, block: DownloadBlock, reason: str) -> None:
+        """块的重试次数用尽：停止任务并报告错误（已下载的数据和断点续传信息保留，可以稍后继续）"""
+        block.status = "重试次数用尽"
+        with self.thread_lock:
+            if self.retries_exhausted:
+                return
+            self.retries_exhausted = True
+        
+        error_msg = f"下载失败: 块{block.start_position}-{block.end_position} {reason}"
+        self._log_download_debug(error_msg, LOG_ERROR)
+        logging.error(error_msg)
+        self.is_running = False
+        self.error_occurred.emit(error_msg)
+    
+    def _wait_retry(self, delay: float) -> bool:
+        """等待重试（暂停或停止时提前返回False）"""
+        deadline = time.time() + delay
+        while self.is_running and not self.is_paused:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return True
+            time.sleep(min(remaining, 0.2))
+        return False
+    
+    def _wait_for_host(self, url: str) -> bool:
+        """请求前等待主机熔断结束（暂停或停止时返回False）"""
+        while self.is_running and not self.is_paused:
+            wait = self.retry_tracker.wait_time(url)
+            if wait <= 0:
+                return True
+            time.sleep(min(wait, BREAKER_POLL_INTERVAL))
+        return False
+    
+    def _on_host_tripped(self, host: str, cooldown: float, reason: str) -> None:
+        """主机熔断：通知界面，自适应模式下同时减少本任务的连接数"""
+        self.status_updated.emit(f"服务器{reason}，{cooldown:.0f}秒后重试")
+        if self.concurrency is not None:
+            self.concurrency.back_off(f"{host} {reason}")
+    
+    def get_retry_stats(self) -> dict:
+        """获取重试统计（供界面和日志使用）
+        
+        返回:
+            dict: retries 重试次数，failures 各错误类型的失败次数，backoff_time 退避总时间（秒），
+                breaker_trips 熔断次数，breaker_wait 熔断等待时间（秒），gave_up 放弃的次数
+        """
+        return self.retry_tracker.get_stats()
+    
+    def _monitor_progress(self) -> None:
+        """监控下载进度，更新速度和状态"""
+        start_time = time.time()
+        last_progress = 0
+        idle_ticks = 0  # 没有任何连接在下载的连续次数
+        refetch_rounds = 0  # 缺口重新下载后没有进展的连续次数
+        last_refetch_covered = -1
+        
+        # 等待进入下载状态（很小的文件可能在此期间已经下载完成）
+        self.downloaded_ranges.completed.wait(0.5)
         
         # 直到下载完成或停止
-        while self.is_running and not all(block.current_position >= block.end_position for block in self.blocks):
+        while self.is_running and not self._download_finished():
             try:
                 # 如果暂停，则暂停更新
                 if self.is_paused:
+                    self.speed_estimator.pause()
                     time.sleep(1)
                     continue
                 
                 # 记录任务已运行时间
                 elapsed_time = time.time() - start_time
                 
-                # 收集块状态和计算总进度
+                # 块列表的快照（工作线程可能同时追加新块），总进度直接取已下载区间的统计，不再逐块求和
+                blocks = [block for block in list(self.blocks) if isinstance(block, DownloadBlock)]
+                
+                # 收集块状态（仅旧版信号需要，订阅进度板的界面不再逐块构建字典）
                 block_status = []
+                if self.emit_block_progress:
+                    block_status = [{
+                        'start_pos': block.start_position,
+                        'progress': block.current_position,
+                        'end_pos': block.end_position,
+                        'status': "下载中" if block.active else "已暂停" if self.is_paused else "已完成" if block.current_position > block.end_position else "等待中"
+                    } for block in blocks]
                 
                 with self.progress_lock:
-                    self.current_progress = 0
-                    blocks_active = False
-                    all_blocks_complete = True
-                    all_blocks_inactive = True
-                    total_remaining_bytes = 0
-                    
-                    for i, block in enumerate(self.blocks):
-                        if not isinstance(block, DownloadBlock):
-                            continue
-                        
-                        # 检查块是否活跃
-                        if block.active:
-                            blocks_active = True
-                            all_blocks_inactive = False
-                        
-                        # 检查并修正可能的异常值
-                        if block.current_position > block.end_position + 1:
-                            self._log_download_debug(f"监控线程修正块#{i}位置: {block.current_position} -> {block.end_position + 1}")
-                            block.current_position = block.end_position + 1
-                        
-                        # 检查块是否完成
-                        if block.current_position < block.end_position:
-                            all_blocks_complete = False
-                            remaining = block.end_position - block.current_position
-                            total_remaining_bytes += remaining
-                        
-                        # 添加到总进度
-                        download_progress = max(0, block.current_position - block.start_position)
-                        self.current_progress += download_progress
-                        
-                        # 收集块状态
-                        block_status.append({
-                            'start_pos': block.start_position,
-                            'progress': block.current_position,
-                            'end_pos': block.end_position,
-                            'status': "下载中" if block.active else "已暂停" if self.is_paused else "已完成" if block.current_position >= block.end_position else "等待中"
-                        })
-                    
-                    # 检测最后一小段数据卡住的情况
-                    if total_remaining_bytes <= 10240:  # 剩余不到10KB
-                        # 检查进度是否长时间没变化
-                        current_time = time.time()
-                        if self.current_progress == last_progress:
-                            if current_time - last_progress_change_time > 2:  # 2秒内进度没变化
-                                stalled_count += 1
-                                if stalled_count >= 3:  # 连续3次检测到卡住
-                                    self._log_download_debug(f"检测到下载卡在最后 {total_remaining_bytes} 字节，自动补齐")
-                                    # 强制完成所有块
-                                    for block in self.blocks:
-                                        if block.current_position < block.end_position:
-                                            block.current_position = block.end_position
-                                    all_blocks_complete = True
-                                    
-                                    # 更新块状态
-                                    block_status = []
-                                    for block in self.blocks:
-                                        if isinstance(block, DownloadBlock):
-                                            block_status.append({
-                                                'start_pos': block.start_position,
-                                                'progress': block.end_position,
-                                                'end_pos': block.end_position,
-                                                'status': "已完成"
-                                            })
-                                    break
-                            else:
-                                last_progress = self.current_progress
-                                last_progress_change_time = current_time
-                                stalled_count = 0
-                        
-                        # 检测活跃下载块但进度停滞的情况
-                        active_blocks = [b for b in self.blocks if isinstance(b, DownloadBlock) and b.active]
-                        if active_blocks and all(b.last_position == b.current_position for b in active_blocks):
-                            active_stalled_count += 1
-                            # 如果活跃块全部停滞超过3次，可能是连接问题
-                            if active_stalled_count >= 5:  # 连续5次(约2.5秒)没有进度
-                                self._log_download_debug(f"检测到所有活跃块({len(active_blocks)}个)停滞，尝试重新激活")
-                                for b in active_blocks:
-                                    b.active = False  # 标记为非活跃以便重新分配
-                                active_stalled_count = 0
-                        else:
-                            active_stalled_count = 0  # 有进度，重置计数器
+                    self.current_progress = self._downloaded_bytes(blocks)
                     
                     # 文件大小未知且所有块都不活跃，视为下载完成
-                    if (self.known_file_size <= 0 or self.current_progress == 0) and all_blocks_inactive and not self.is_paused:
+                    if self.downloaded_ranges.total <= 0 and not self.is_paused and not any(block.active for block in blocks):
                         # 获取已下载文件的实际大小
                         try:
                             file_path = Path(self.save_path) / self.file_name
@@ -1473,8 +2310,6 @@ class DownloadEngine(QThread):
                                             block.end_position = actual_size - 1
                                             block.current_position = actual_size
                                     self._log_download_debug(f"文件大小未知但下载完成，设置实际大小: {getReadableSize(actual_size)}")
-                                    # 标记下载完成
-                                    all_blocks_complete = True
                                     break
                         except Exception as e:
                             self._log_download_debug(f"获取文件实际大小失败: {e}")
@@ -1484,8 +2319,7 @@ class DownloadEngine(QThread):
                     if self.current_progress == last_progress:
                         # 如果进度停止更新超过3秒，认为下载可能已完成
                         if elapsed_time - self.last_progress_time > 3:
-                            no_active_blocks = not any(block.active for block in self.blocks if isinstance(block, DownloadBlock))
-                            if no_active_blocks:
+                            if not any(block.active for block in blocks):
                                 self._log_download_debug("文件大小未知，但下载似乎已完成（进度停止更新）")
                                 # 获取已下载文件的实际大小
                                 try:
@@ -1507,39 +2341,62 @@ class DownloadEngine(QThread):
                         last_progress = self.current_progress
                         self.last_progress_time = elapsed_time
                 
-                # 更新NSF增强器状态（如果可用）
+                # 更新下载速度：按两次采样间的字节增量估计，停滞和恢复在一个半衰期左右反映出来
+                self.speed_estimator.update(
+                    self.current_progress,
+                    [(block.start_position, block.current_position) for block in blocks]
+                )
+                self.avg_speed = self.speed_estimator.speed
+                
+                # 固定IP时按各IP上活跃块的速度找出明显变差的IP并停用
+                self._evaluate_pinned_speeds()
+                
+                # 更新各下载源的吞吐量，新的分段请求按此分配
+                if self.mirror_set.has_alternates():
+                    self.mirror_set.sample()
+                
+                # 按测量结果调整连接数
+                self._adjust_concurrency()
+                
+                # 所有连接都已结束但文件仍有缺口：只对缺口重新发起分段请求（连续两次检测到空闲才处理，
+                # 避免与刚提交还没开始的请求重复）；多次重新请求都没有进展时停止，由下载线程报告错误
+                if self.downloaded_ranges.total > 0 and self.multi_thread_support and self._download_idle():
+                    idle_ticks += 1
+                    if idle_ticks >= 2:
+                        idle_ticks = 0
+                        covered = self.downloaded_ranges.covered
+                        refetch_rounds = refetch_rounds + 1 if covered == last_refetch_covered else 1
+                        last_refetch_covered = covered
+                        if refetch_rounds > GAP_REFETCH_ROUNDS:
+                            self._log_download_debug(f"缺口连续{GAP_REFETCH_ROUNDS}次重新下载都没有进展，停止下载", LOG_ERROR)
+                            break
+                        self._refetch_gaps()
+                else:
+                    idle_ticks = 0
+                
+                # 更新NSF增强器状态（如果可用），块速度使用估计器的结果
                 if self.enhancer and self.enhancer.auto_adjust_enabled:
                     # 更新块状态
-                    for i, block in enumerate(self.blocks):
+                    for i, block in enumerate(list(self.blocks)):
                         if isinstance(block, DownloadBlock):
                             self.enhancer.update_block_status(
                                 i, block.current_position, block.start_position, 
-                                block.end_position, block.active
+                                block.end_position, block.active,
+                                speed=self.speed_estimator.block_speed(block.start_position)
                             )
                 
-                # 更新下载速度
-                if elapsed_time >= 1:
-                    speed = self.current_progress / elapsed_time
-                    self.speed_history.append(speed)
-                    
-                    # 只保留最近10次速度记录
-                    if len(self.speed_history) > 10:
-                        self.speed_history.pop(0)
+                # 定期写入断点续传检查点（按时间或下载量）
+                if self.resume_journal and self.resume_journal.should_checkpoint(self.current_progress):
+                    self._checkpoint_resume_info()
                 
-                # 取平均速度
-                self.avg_speed = sum(self.speed_history) / len(self.speed_history) if self.speed_history else 0
-                
-                # 发出进度信号
-                self.block_progress_updated.emit(block_status)
+                # 发出进度信号：发布进度快照（无变化时跳过），旧版订阅者仍收到完整列表
+                self._publish_progress()
+                if self.emit_block_progress:
+                    self.block_progress_updated.emit(block_status)
                 self.speed_updated.emit(int(self.avg_speed))
                 
-                # 检查是否下载完成（两种情况：1. 明确的文件大小且进度达到 2. 所有块都完成）
-                if (self.known_file_size > 0 and self.current_progress >= self.known_file_size) or all_blocks_complete:
-                    self._log_download_debug(f"下载完成: 当前进度={self.current_progress}, 文件大小={self.known_file_size}, 所有块完成={all_blocks_complete}")
-                    break
-                
-                # 睡眠500毫秒
-                time.sleep(0.5)
+                # 等待下一次更新，区间覆盖整个文件时立即结束等待
+                self.downloaded_ranges.completed.wait(0.5)
                 
             except Exception as e:
                 self._log_download_debug(f"监控进度出错: {e}")
@@ -1547,13 +2404,9 @@ class DownloadEngine(QThread):
         
         # 下载完成，更新最终进度
         with self.progress_lock:
-            self.current_progress = 0
-            for block in self.blocks:
-                if isinstance(block, DownloadBlock):
-                    # 确保所有块都显示为完成状态
-                    if not self.is_paused and self.is_running:
-                        block.current_position = block.end_position
-                    self.current_progress += (block.current_position - block.start_position)
+            self.current_progress = self._downloaded_bytes()
+            if self.downloaded_ranges.is_complete():
+                self._log_download_debug(f"下载完成: 已下载区间覆盖整个文件 {getReadableSize(self.current_progress)}")
             
             # 如果文件大小未知但已下载完成，使用当前进度作为文件大小
             if self.known_file_size <= 0 and self.current_progress > 0:
@@ -1572,52 +2425,208 @@ class DownloadEngine(QThread):
                     })
             
             # 发送最终进度
-            self.block_progress_updated.emit(final_status)
+            self._publish_progress(finished=True)
+            if self.emit_block_progress:
+                self.block_progress_updated.emit(final_status)
+    
+    def _downloaded_bytes(self, blocks: Optional[List[DownloadBlock]] = None) -> int:
+        """已下载字节数：已知文件大小时直接取已下载区间的统计（O(1)），未知时按块位置求和
+        
+        参数:
+            blocks: 块列表快照，默认使用当前的块列表
+        """
+        if self.downloaded_ranges.total > 0:
+            return self.downloaded_ranges.covered
+        if blocks is None:
+            blocks = [block for block in list(self.blocks) if isinstance(block, DownloadBlock)]
+        return sum(max(0, block.current_position - block.start_position) for block in blocks)
+    
+    def _download_finished(self) -> bool:
+        """下载是否已完成：已知文件大小时以已下载区间覆盖整个文件为准，未知时所有块都已到达结束位置"""
+        if self.downloaded_ranges.total > 0:
+            return self.downloaded_ranges.is_complete()
+        return all(block.current_position > block.end_position
+                   for block in list(self.blocks) if isinstance(block, DownloadBlock))
+    
+    def _download_idle(self) -> bool:
+        """是否没有任何连接在下载（块下载任务和工作窃取线程都已结束）"""
+        if any(block.active for block in list(self.blocks) if isinstance(block, DownloadBlock)):
+            return False
+        if self.work_stealer is not None and self.work_stealer.active_workers > 0:
+            return False
+        with self.thread_lock:
+            return not self.block_runs
+    
+    def _refetch_gaps(self) -> None:
+        """重新下载已下载区间中的缺口
+        
+        缺口落在某个块未下载的部分时，该块从当前位置继续请求；不属于任何块剩余部分的缺口
+        （例如块位置之前丢失的数据）新建只覆盖缺口的块。请求范围都只包含缺口本身。
+        """
+        gaps = self.downloaded_ranges.gaps()
+        if not gaps or not self.executor:
+            return
+        self._log_download_debug(
+            f"所有连接已结束，重新下载 {len(gaps)} 个缺口: "
+            f"{', '.join(f'{start}-{end - 1}' for start, end in gaps[:10])}", LOG_INFO
+        )
+        
+        # 各块未下载的部分互不重叠，按起点排序后终点也有序，每个缺口用二分查找定位相交的块
+        remaining = sorted(
+            ((block.current_position, block.end_position + 1, block) for block in list(self.blocks)
+             if isinstance(block, DownloadBlock) and block.current_position <= block.end_position),
+            key=lambda item: item[0]
+        )
+        remaining_ends = [block_end for _, block_end, _ in remaining]
+        retry_blocks = []
+        new_blocks = []
+        for start, end in gaps:
+            position = start
+            for block_start, block_end, block in remaining[bisect_right(remaining_ends, start):]:
+                if block_start >= end:
+                    break
+                if block_start > position:
+                    new_blocks.append(self._create_stolen_block(position, block_start - 1))
+                if not retry_blocks or retry_blocks[-1] is not block:
+                    retry_blocks.append(block)
+                position = max(position, block_end)
+            if position < end:
+                new_blocks.append(self._create_stolen_block(position, end - 1))
+        
+        self._append_blocks(new_blocks)
+        retry_blocks.extend(new_blocks)
+        if self.work_stealer is not None:
+            # 工作窃取模式：重新启动工作线程领取这些块
+            self._start_steal_workers()
+        else:
+            for block in retry_blocks:
+                self._submit_block(block)
+    
+    def _append_blocks(self, blocks: List[DownloadBlock]) -> None:
+        """追加下载块（与工作窃取使用同一把锁，其他线程遍历的是块列表的快照）"""
+        if not blocks:
+            return
+        lock = self.work_stealer.lock if self.work_stealer is not None else self.thread_lock
+        with lock:
+            self.blocks.extend(blocks)
+    
+    def _evaluate_pinned_speeds(self) -> None:
+        """按各固定IP上活跃块的平均速度评估IP，停用明显变差的IP"""
+        pinned = self._get_pinned_host()
+        if pinned is None:
+            return
+        
+        totals = {}
+        for block in self.blocks:
+            if isinstance(block, DownloadBlock) and block.active and block.server_ip:
+                speed = self.speed_estimator.block_speed(block.start_position)
+                total, count = totals.get(block.server_ip, (0.0, 0))
+                totals[block.server_ip] = (total + speed, count + 1)
+        
+        degraded = pinned.update_speeds({ip: total / count for ip, (total, count) in totals.items()})
+        if degraded:
+            self._log_download_debug(f"停用变慢的IP: {', '.join(degraded)}，相关块将切换到其他IP", LOG_INFO)
+    
+    def _publish_progress(self, finished: bool = False) -> None:
+        """把块进度快照发布到进度板
+        
+        参数:
+            finished: 任务是否已结束（最终快照总是发布）
+        """
+        try:
+            snapshot = self.progress_tracker.capture(
+                [block for block in self.blocks if isinstance(block, DownloadBlock)],
+                paused=self.is_paused, speed=self.avg_speed,
+                finished=finished, force=finished
+            )
+            if snapshot is not None:
+                progress_board.publish(snapshot)
+        except Exception as e:
+            self._log_download_debug(f"发布进度快照失败: {e}")
+    
+    def _download_status(self) -> str:
+        """任务结束时的状态描述（写入下载总结）"""
+        if self.download_failed or self.retries_exhausted or self._error:
+            return "下载失败"
+        if self.is_paused:
+            return "已暂停"
+        if not self.is_running:
+            return "已停止"
+        return "已完成"
     
     def _write_download_summary(self) -> None:
-        """写入下载完成总结信息"""
+        """写入下载结束总结信息，并把日志同步到磁盘"""
+        download_log = getattr(self, 'download_log', None)
+        if download_log is None:
+            return
+        
         try:
-            with open(self.debug_log_path, "a", encoding="utf-8") as f:
-                f.write("\n===== 下载任务结束 =====\n")
-                f.write(f"完成时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}\n")
-                
-                # 计算总时长
-                total_time = time.time() - self.start_time
-                hours = int(total_time // 3600)
-                minutes = int((total_time % 3600) // 60)
-                seconds = int(total_time % 60)
-                time_str = f"{hours}小时 {minutes}分钟 {seconds}秒" if hours > 0 else f"{minutes}分钟 {seconds}秒"
-                
-                f.write(f"总耗时: {time_str}\n")
-                f.write(f"文件名: {self.file_name}\n")
-                f.write(f"文件大小: {getReadableSize(self.known_file_size)}\n")
-                f.write(f"保存路径: {self.save_path}\n")
-                f.write(f"状态: {'已完成' if not self.is_paused else '已暂停'}\n")
-                f.write(f"多线程: {self.multi_thread_support}\n")
-                f.write(f"块数量: {len(self.blocks)}\n")
-                
-                # 记录块信息
-                for i, block in enumerate(self.blocks):
-                    size = block.end_position - block.start_position + 1
-                    downloaded = block.current_position - block.start_position
-                    percent = (downloaded / size) * 100 if size > 0 else 0
-                    
-                    f.write(f"- 块 #{i}: 范围={block.start_position}-{block.end_position}, "
-                           f"大小={getReadableSize(size)}, 已下载={getReadableSize(downloaded)}, "
-                           f"完成率={percent:.2f}%\n")
+            lines = ["\n===== 下载任务结束 =====\n"]
+            lines.append(f"结束时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}\n")
+            
+            # 计算总时长
+            total_time = time.time() - self.start_time
+            hours = int(total_time // 3600)
+            minutes = int((total_time % 3600) // 60)
+            seconds = int(total_time % 60)
+            time_str = f"{hours}小时 {minutes}分钟 {seconds}秒" if hours > 0 else f"{minutes}分钟 {seconds}秒"
+            
+            lines.append(f"总耗时: {time_str}\n")
+            lines.append(f"文件名: {self.file_name}\n")
+            lines.append(f"文件大小: {getReadableSize(self.known_file_size)}\n")
+            lines.append(f"保存路径: {self.save_path}\n")
+            lines.append(f"状态: {self._download_status()}\n")
+            lines.append(f"多线程: {self.multi_thread_support}\n")
+            lines.append(f"块数量: {len(self.blocks)}\n")
+            if self.concurrency:
+                stats = self.concurrency.get_stats()
+                lines.append(f"自适应连接数: 最终={stats['target']}, 峰值={stats['peak']}, 调整次数={stats['decisions']}\n")
+            lines.append(f"{self.retry_tracker.describe()}\n")
+            
+            # 记录各下载源的情况
+            if self.mirror_set.has_alternates():
+                for source in self.mirror_set.get_stats():
+                    state = source["rejected"] or ("已停用" if source["down"] else "可用")
+                    lines.append(f"- 下载源{'(主)' if source['primary'] else ''}: {source['url']}, "
+                                 f"已下载={getReadableSize(source['received'])}, 失败={source['failures']}, 状态={state}\n")
+            
+            # 记录块信息
+            for i, block in enumerate(self.blocks):
+                size = block.end_position - block.start_position + 1
+                downloaded = block.current_position - block.start_position
+                percent = (downloaded / size) * 100 if size > 0 else 0
                 
-                f.write("=====================\n")
+                lines.append(f"- 块 #{i}: 范围={block.start_position}-{block.end_position}, "
+                             f"大小={getReadableSize(size)}, 已下载={getReadableSize(downloaded)}, "
+                             f"完成率={percent:.2f}%\n")
+            
+            lines.append("=====================\n")
+            download_log.write_raw("".join(lines))
         except Exception as e:
             logging.error(f"写入下载总结失败: {e}")
+        finally:
+            # 任务结束时立即落盘，不等待后台刷新
+            download_log.flush(sync=True)
 
+    def get_speed_estimate(self) -> dict:
+        """获取速度和剩余时间估计（供调度器、自动调优和界面使用）
+        
+        返回:
+            dict: speed 任务速度，speed_stddev 速度标准差，block_speeds 块起始位置 -> 速度，
+                remaining 剩余字节数（大小未知为-1），eta/eta_low/eta_high 剩余时间及其上下界（秒）
+        """
+        remaining = max(0, self.known_file_size - self.current_progress) if self.known_file_size > 0 else -1
+        return self.speed_estimator.get_stats(remaining)
+    
     def pause(self) -> None:
         """暂停下载任务"""
         if not self.is_running or self.is_paused:
             return
             
-        self._log_download_debug("暂停下载任务")
+        self._log_download_debug("暂停下载任务", LOG_INFO)
         self.status_updated.emit("已暂停")
         self.is_paused = True
+        self.pause_changed.emit(True)
         
         # 保存断点续传信息
         if self.multi_thread_support:
@@ -1628,21 +2637,28 @@ class DownloadEngine(QThread):
         if not self.is_running or not self.is_paused:
             return
             
-        self._log_download_debug("恢复下载任务")
+        self._log_download_debug("恢复下载任务", LOG_INFO)
         self.status_updated.emit("下载中...")
         self.is_paused = False
+        self.pause_changed.emit(False)
+        self.mirror_set.reset_rates()
         
         # 重新启动下载
         if self.executor is None:
             self._execute_download()
             return
             
+        # 工作窃取模式下重新启动工作线程，由工作线程领取未完成的块
+        if self.multi_thread_support and self.work_stealing:
+            self._start_steal_workers()
+            return
+            
         # 提交未完成的块到线程池
         for i, block in enumerate(self.blocks):
-            if block.current_position < block.end_position and not block.active:
+            if block.current_position <= block.end_position and not block.active:
                 self._log_download_debug(f"重新提交块 #{i} 至线程池")
                 if self.multi_thread_support:
-                    self.executor.submit(self._process_block, block)
+                    self._submit_block(block)
                 else:
                     self.executor.submit(self._process_single_block, block)
 
@@ -1651,7 +2667,7 @@ class DownloadEngine(QThread):
         if not self.is_running:
             return
             
-        self._log_download_debug("停止下载任务")
+        self._log_download_debug("停止下载任务", LOG_INFO)
         self.status_updated.emit("已停止")
         self.is_running = False
         
@@ -1683,16 +2699,11 @@ class DownloadEngine(QThread):
             except Exception as e:
                 self._log_download_debug(f"关闭文件写入缓冲区失败: {e}")
         
-        # 检查是否所有块都已完成，如果是，则删除断点续传文件而不是保存
-        all_blocks_completed = all(
-            block.current_position >= block.end_position 
-            for block in self.blocks 
-            if isinstance(block, DownloadBlock)
-        )
-        
-        if all_blocks_completed:
+        # 检查是否已下载完成，如果是，则删除断点续传文件而不是保存
+        if self._download_finished():
             # 下载已完成，清理断点续传文件
             try:
+                self._discard_resume_info()
                 file_path = Path(self.save_path) / self.file_name
                 resume_file = file_path.with_suffix(file_path.suffix + '.resume')
                 if resume_file.exists():
@@ -1751,12 +2762,6 @@ class DownloadEngine(QThread):
                     block.client = None
         except Exception as e:
             self._log_download_debug(f"关闭会话失败: {e}")
-        
-        # 释放内存
-        self.blocks.clear()
-        
-        # 记录最终状态
-        self._write_download_summary()
 
     def run(self) -> None:
         """启动下载引擎（QThread入口方法）"""
@@ -1819,8 +2824,8 @@ class DownloadEngine(QThread):
                 except Exception as e:
                     self._log_download_debug(f"刷新文件缓冲区失败: {e}")
                     
-            # 下载完成后进行文件验证
-            if self.is_running and not self.is_paused:
+            # 下载完成后进行文件验证（缺失区间或校验失败时保留断点续传信息）
+            if self.is_running and not self.is_paused and not self.download_failed:
                 file_path = Path(self.save_path) / self.file_name
                 if file_path.exists():
                     try:
@@ -1834,13 +2839,14 @@ class DownloadEngine(QThread):
                             
                             if not head or not tail:
                                 self._log_download_debug("警告：文件内容验证失败，头部或尾部无法读取")
-                                if self.file_size > 0 and file_path.stat().st_size < self.file_size:
+                                if self.known_file_size > 0 and file_path.stat().st_size < self.known_file_size:
                                     self.error_occurred.emit("文件下载不完整，请重试")
                             else:
                                 self._log_download_debug("文件可以正常打开并读取内容")
                                 
                                 # 下载成功完成，清理断点续传文件
                                 try:
+                                    self._discard_resume_info()
                                     resume_file = file_path.with_suffix(file_path.suffix + '.resume')
                                     if resume_file.exists():
                                         resume_file.unlink()
@@ -1849,7 +2855,7 @@ class DownloadEngine(QThread):
                                     self._log_download_debug(f"清理断点续传文件失败: {re}")
                     except Exception as e:
                         error_msg = f"文件验证失败: {e}"
-                        self._log_download_debug(error_msg)
+                        self._log_download_debug(error_msg, LOG_ERROR)
                         self.error_occurred.emit(error_msg)
                 else:
                     self.error_occurred.emit("下载完成但文件不存在")
@@ -1866,10 +2872,37 @@ class DownloadEngine(QThread):
         except Exception as e:
             error_msg = f"下载过程出错: {e}"
             logging.error(error_msg)
-            self._log_download_debug(error_msg)
+            self._log_download_debug(error_msg, LOG_ERROR)
             self.error_occurred.emit(str(e))
             self.is_running = False
 
+    def _block_request_headers(self, block: DownloadBlock, mirror: SourceMirror = None) -> Dict[str, str]:
+        """构建下载块剩余范围的请求头
+        
+        参数:
+            block: 下载块对象
+            mirror: 请求使用的下载源（If-Range使用该源自己的校验值），默认为主链接
+            
+        返回:
+            Dict[str, str]: 请求头（任务请求头的副本）
+        """
+        headers = dict(self.headers)  # 复制请求头以避免修改原始对象
+        
+        # 添加Range头，指定下载范围
+        if block.start_position <= block.end_position:
+            headers['Range'] = f'bytes={block.current_position}-{block.end_position}'
+        
+        # 分段请求必须使用identity编码，字节位置才与文件位置对应
+        headers['Connection'] = 'keep-alive'
+        headers['Accept-Encoding'] = 'identity'
+        
+        # 文件变更时服务器返回200完整内容，而不是错误的206分段
+        range_validator = self.range_validator if mirror is None or mirror.primary else mirror.range_validator
+        if range_validator:
+            headers['If-Range'] = range_validator
+        
+        return headers
+
     def _process_block(self, block: DownloadBlock) -> bool:
         """处理单个下载块
         
@@ -1885,24 +2918,6 @@ class DownloadEngine(QThread):
             block.status = "已暂停" if self.is_paused else "已停止" 
             return False
         
-        url = self.url
-        headers = dict(self.headers)  # 复制请求头以避免修改原始对象
-        
-        # 添加Range头，指定下载范围
-        if block.start_position <= block.end_position:
-            # 检查是否是小块数据（用于最后一点数据的情况）
-            block_size = block.end_position - block.current_position + 1
-            if block_size < 1024 * 20:  # 小于20KB的小块
-                self._log_download_debug(f"检测到小数据块({block_size}字节)，使用更小的缓冲区")
-                # 对于很小的块，直接一次性请求整个剩余范围
-                headers['Range'] = f'bytes={block.current_position}-{block.end_position}'
-            else:
-                headers['Range'] = f'bytes={block.current_position}-{block.end_position}'
-        
-        # 添加额外请求头以提高性能
-        headers['Connection'] = 'keep-alive'
-        headers['Accept-Encoding'] = 'gzip, deflate'
-        
         # 使用上次计算的区块为依据，防止在活跃状态下被多次提交
         if block.active:
             self._log_download_debug(f"块{block.start_position}-{block.end_position}: 已在下载中，跳过")
@@ -1912,22 +2927,64 @@ class DownloadEngine(QThread):
         with block.lock:
             block.active = True  # 标记块为活跃状态
             block.status = "连接中"  # 更新状态
-            block.retries = 0  # 重置重试计数
+            block.error_class = None  # 清除上次请求的错误
+            block.retry_after = None
+            block.last_error = None
+        
+        # 多源下载时按各源的吞吐量为本次请求选择下载源，源被停用时本块结束当前请求，改从其他源继续
+        mirror = self.mirror_set.acquire()
+        url = mirror.url
+        headers = self._block_request_headers(block, mirror)
+        
+        # 固定IP时记录本块连接的IP，IP失败或变差时本块结束当前请求，重新连接到其他IP
+        pinned = self._get_pinned_host(url)
+        pinned_address = None
+        block.server_ip = None
         
         try:
+            # 主机熔断时等待冷却结束（冷却后只放行一个试探请求）
+            if not self._wait_for_host(url):
+                block.active = False
+                block.status = "已暂停" if self.is_paused else "已停止"
+                return False
+            
             self._log_download_debug(f"块{block.start_position}-{block.end_position}: 开始下载部分 {block.current_position}-{block.end_position}")
             
             # 使用httpx发起请求，更短的超时
             timeout = httpx.Timeout(10.0, connect=5.0)
+            request_start = time.time()
             
             with block.client.stream("GET", url, headers=headers, timeout=timeout) as response:
+                # 首字节时间供自适应连接数判断排队和拥塞
+                controller = self.concurrency
+                if controller is not None:
+                    controller.record_request(time.time() - request_start)
+                
                 # 检查响应状态
                 if response.status_code not in [200, 206]:
                     self._log_download_debug(f"块{block.start_position}-{block.end_position}: 请求失败 {response.status_code}")
+                    self.mirror_set.report_failure(mirror, f"返回状态码 {response.status_code}")
+                    self._record_block_failure(block, url, classify_status(response.status_code),
+                                               parse_retry_after(response.headers.get('Retry-After')))
                     block.active = False
                     block.status = f"失败 ({response.status_code})"
                     return False
                 
+                # 分段请求得到200：If-Range校验失败或服务器忽略了Range（备用源出现时只停用该源）
+                if response.status_code == 200 and 'Range' in headers:
+                    if self.mirror_set.reject(mirror, "对分段请求返回了完整内容"):
+                        block.active = False
+                        block.status = "切换下载源"
+                        return False
+                    self._handle_origin_changed(block, response.status_code)
+                    return False
+                
+                self.retry_tracker.on_success(url)
+                
+                if pinned is not None:
+                    block.server_ip = get_response_ip(response)
+                    pinned_address = pinned.get(block.server_ip) if block.server_ip else None
+                
                 # 获取内容长度（如果有）
                 content_length = response.headers.get('Content-Length', None)
                 expected_length = block.end_position - block.current_position + 1
@@ -1936,28 +2993,22 @@ class DownloadEngine(QThread):
                 if content_length and content_length.isdigit():
                     content_length = int(content_length)
                     if content_length != expected_length:
+                        # 块的结束位置不变，少给的部分在本次请求结束后从断开处继续请求
                         self._log_download_debug(f"警告：服务器返回的长度({content_length})与预期长度({expected_length})不匹配")
-                        
-                        # 如果服务器返回的数据比期望的少，但差距很小(小于20KB)
-                        if content_length < expected_length and (expected_length - content_length) < 20480:
-                            # 调整块的结束位置以匹配服务器实际提供的数据长度
-                            new_end_pos = block.current_position + content_length - 1
-                            self._log_download_debug(f"调整块结束位置: {block.end_position} -> {new_end_pos}")
-                            block.end_position = new_end_pos
-                
-                # 根据文件大小选择合适的固定缓冲区大小
-                block_size = block.end_position - block.current_position + 1
-                
-                if block_size < 1024 * 20:  # 小于20KB的小块
-                    chunk_size = 1024  # 使用1KB的缓冲区
-                elif block_size < 1024 * 1024:  # 小于1MB的块
-                    chunk_size = 32 * 1024  # 使用32KB缓冲区
-                elif block_size < 10 * 1024 * 1024:  # 小于10MB的块
-                    chunk_size = 128 * 1024  # 使用128KB缓冲区
-                else:  # 大块
-                    chunk_size = 256 * 1024  # 使用256KB缓冲区
-                
-                self._log_download_debug(f"块{block.start_position}-{block.end_position}: 使用缓冲区大小 {getReadableSize(chunk_size)}")
+                
+                # 服务器按要求使用identity编码时直接读取原始数据，跳过解码和重新分块的复制
+                content_encoding = response.headers.get('Content-Encoding', 'identity').strip().lower()
+                if content_encoding in ('', 'identity'):
+                    stream = response.iter_raw()
+                else:
+                    self._log_download_debug(f"块{block.start_position}-{block.end_position}: 服务器使用{content_encoding}编码，读取解码后的数据")
+                    stream = response.iter_bytes()
+                
+                # 按本连接的吞吐量调整每批提交给写入器的数据量
+                sizer = AdaptiveChunkSizer()
+                pending_parts = []
+                pending_size = 0
+                batch_start_time = time.time()
                 
                 # 获取数据流
                 download_start_time = time.time()
@@ -1965,7 +3016,7 @@ class DownloadEngine(QThread):
                 total_received = 0
                 
                 # 处理数据流
-                for chunk in response.iter_bytes(chunk_size=chunk_size):
+                for chunk in stream:
                     # 检查是否暂停或停止
                     if not self.is_running or self.is_paused:
                         block.active = False
@@ -1975,57 +3026,59 @@ class DownloadEngine(QThread):
                     if chunk:
                         # 更新下载超时
                         download_start_time = time.time()
-                        
-                        # 计算写入位置
-                        current_position = block.current_position
                         chunk_size = len(chunk)
                         total_received += chunk_size
                         
-                        # 计算实际应写入的大小（防止超出范围）
-                        remaining_space = block.end_position + 1 - current_position
+                        # 计算实际应写入的大小（防止超出范围，结束位置可能已被其他线程窃取缩短）
+                        remaining_space = block.end_position + 1 - block.current_position - pending_size
+                        if remaining_space <= 0:
+                            break
                         if chunk_size > remaining_space:
-                            # 截断数据块，只保留应该属于这个块的部分
-                            chunk = chunk[:remaining_space]
-                            chunk_size = len(chunk)
+                            # 截断数据块，只保留应该属于这个块的部分（内存视图切片不复制数据）
+                            chunk = memoryview(chunk)[:remaining_space]
+                            chunk_size = remaining_space
                             self._log_download_debug(f"块{block.start_position}-{block.end_position}: 截断数据块，实际写入 {chunk_size} 字节")
                         
-                        with self.progress_lock:
-                            # 尝试写入块
-                            try:
-                                if self.file_writer:
-                                    # 使用优化的文件写入器
-                                    self.file_writer.write_at(current_position, chunk)
-                                else:
-                                    # 传统直接写入方式
-                                    file_path = Path(self.save_path) / self.file_name
-                                    with open(file_path, 'r+b') as f:
-                                        f.seek(current_position)
-                                        f.write(chunk)
-                            except Exception as e:
-                                self._log_download_debug(f"块{block.start_position}-{block.end_position}: 写入失败 {str(e)}")
-                                self.error_occurred.emit(f"写入失败: {str(e)}")
-                                block.active = False
-                                block.status = "写入失败"
-                                return False
-                            
-                            # 更新进度
-                            block.current_position += chunk_size
-                            
-                            # 确保不超过块的结束位置
-                            if block.current_position > block.end_position + 1:
-                                self._log_download_debug(f"块{block.start_position}-{block.end_position}: 修正超出范围的位置")
-                                block.current_position = block.end_position + 1
-                            
-                            # 更新下载速度
-                            current_time = time.time()
-                            time_diff = current_time - block.last_update_time
-                            if time_diff >= 1.0:
-                                position_diff = block.current_position - block.last_position
-                                if position_diff > 0 and time_diff > 0:
-                                    block.download_speed = position_diff / time_diff
-                                block.last_update_time = current_time
-                                block.last_position = block.current_position
-                                block.status = "下载中"
+                        pending_parts.append(chunk)
+                        pending_size += chunk_size
+                        if pending_size < sizer.size and chunk_size < remaining_space:
+                            continue
+                        
+                        # 提交一批数据并更新进度
+                        if not self._write_block_data(block, pending_parts, pending_size):
+                            return False
+                        mirror.add_bytes(pending_size)
+                        block.retries = 0
+                        if mirror.is_down():
+                            self._log_download_debug(f"块{block.start_position}-{block.end_position}: 下载源 {url} 已停用，改用其他源继续")
+                            block.active = False
+                            block.status = "切换下载源"
+                            return False
+                        if pinned_address is not None and pinned_address.is_down():
+                            self._log_download_debug(f"块{block.start_position}-{block.end_position}: IP {pinned_address.ip} 已停用，改用其他IP继续")
+                            block.active = False
+                            block.status = "切换IP"
+                            return False
+                        if controller is not None and controller.should_shed():
+                            self._log_download_debug(f"块{block.start_position}-{block.end_position}: 连接数减少，本连接退出")
+                            block.active = False
+                            block.status = "减少连接"
+                            return False
+                        current_time = time.time()
+                        sizer.observe(pending_size, current_time - batch_start_time)
+                        batch_start_time = current_time
+                        pending_parts = []
+                        pending_size = 0
+                        
+                        # 更新下载速度
+                        time_diff = current_time - block.last_update_time
+                        if time_diff >= 1.0:
+                            position_diff = block.current_position - block.last_position
+                            if position_diff > 0 and time_diff > 0:
+                                block.download_speed = position_diff / time_diff
+                            block.last_update_time = current_time
+                            block.last_position = block.current_position
+                            block.status = "下载中"
                         
                         # 检查此块是否已完成下载
                         if block.current_position >= block.end_position + 1:
@@ -2035,59 +3088,258 @@ class DownloadEngine(QThread):
                         # 检查下载超时
                         if time.time() - download_start_time > download_timeout:
                             self._log_download_debug(f"块{block.start_position}-{block.end_position}: 下载超时，已接收 {total_received} 字节")
-                            # 如果接收的数据量接近预期，则认为下载完成
-                            expected_size = block.end_position - block.current_position + 1
-                            if total_received > 0 and (expected_size - total_received) < 1024:  # 差距小于1KB
-                                self._log_download_debug("接收的数据接近预期，标记为完成")
-                                block.current_position = block.end_position + 1
-                                break
+                            self._record_block_failure(block, url, ERROR_TIMEOUT)
+                            block.active = False
+                            block.status = "超时"
                             return False
                 
+                # 提交剩余不足一批的数据
+                if pending_parts:
+                    if not self._write_block_data(block, pending_parts, pending_size):
+                        return False
+                    mirror.add_bytes(pending_size)
+                
                 # 检查是否下载完整个块
                 if block.current_position >= block.end_position + 1:
                     block.status = "已完成"
                     block.active = False
+                    self.mirror_set.report_success(mirror)
+                    if pinned_address is not None:
+                        pinned.report_success(pinned_address.ip)
                     self._log_download_debug(f"块{block.start_position}-{block.end_position}: 下载完成")
                     return True
                 else:
-                    # 如果剩余的数据非常少（小于5KB），认为下载完成
-                    remaining = block.end_position + 1 - block.current_position
-                    if remaining <= 5 * 1024:
-                        self._log_download_debug(f"块{block.start_position}-{block.end_position}: 剩余数据很少({remaining}字节)，标记为完成")
-                        block.current_position = block.end_position + 1
-                        block.status = "已完成"
-                        block.active = False
-                        return True
-                    
-                    # 块没有完成，记录实际下载了多少
+                    # 块没有完成（哪怕只差几个字节），记录实际下载了多少，按重试策略从断开处继续
                     self._log_download_debug(
                         f"块{block.start_position}-{block.end_position}: 不完整 "
                         f"({block.current_position-block.start_position}/{block.end_position-block.start_position+1})"
                     )
+                    self._record_block_failure(block, url, ERROR_CONNECTION)
                     block.status = "不完整"
                     block.active = False
                     return False
         
         except httpx.TimeoutException as e:
             self._log_download_debug(f"块{block.start_position}-{block.end_position}: 超时 {str(e)}")
+            self.mirror_set.report_failure(mirror, "请求超时")
+            if pinned_address is not None:
+                pinned.report_failure(pinned_address.ip, "请求超时")
+            self._record_block_failure(block, url, ERROR_TIMEOUT)
             block.active = False
             block.status = "超时"
             return False
         except httpx.HTTPError as e:
             self._log_download_debug(f"块{block.start_position}-{block.end_position}: HTTP错误 {str(e)}")
+            self.mirror_set.report_failure(mirror, "传输出错")
+            if pinned_address is not None:
+                pinned.report_failure(pinned_address.ip, "传输出错")
+            self._record_block_failure(block, url, classify_error(e))
             block.active = False
             block.status = "HTTP错误"
             return False
         except Exception as e:
             self._log_download_debug(f"块{block.start_position}-{block.end_position}: 出错 {str(e)}")
             logging.error(f"下载块处理错误: {e}")
+            self._record_block_failure(block, url, classify_error(e))
             block.active = False
             block.status = "出错"
             return False
+        finally:
+            self.mirror_set.release(mirror)
 
+    def _write_block_data(self, block: DownloadBlock, parts: list, size: int) -> bool:
+        """写入块的一批数据并推进块进度
+        
+        参数:
+            block: 下载块对象
+            parts: 从当前位置开始连续的数据片段
+            size: 数据总长度
+            
+        返回:
+            bool: 是否写入成功
+        """
+        # 限速（未设置限速时立即返回）
+        self._apply_speed_limit(size)
+        return self._commit_block_data(block, parts, size)
+    
+    def _commit_block_data(self, block: DownloadBlock, parts: list, size: int) -> bool:
+        """把已通过限速的一批数据交给写入器并推进块进度
+        
+        参数:
+            block: 下载块对象
+            parts: 从当前位置开始连续的数据片段
+            size: 数据总长度
+            
+        返回:
+            bool: 是否写入成功
+        """
+        current_position = block.current_position
+        
+        # 各块写入互不重叠的区间，无需全局锁
+        try:
+            if self.file_writer:
+                # 放入后写队列，由写入线程合并写盘（队列满时阻塞形成背压）
+                self.file_writer.submit(current_position, parts)
+            else:
+                # 传统直接写入方式
+                file_path = Path(self.save_path) / self.file_name
+                with open(file_path, 'r+b') as f:
+                    f.seek(current_position)
+                    for part in parts:
+                        f.write(part)
+                if self.integrity_verifier:
+                    self.integrity_verifier.written(current_position, parts, size)
+        except Exception as e:
+            block.active = False
+            if not self.is_running:
+                # 任务已停止，写入器已关闭，不再上报错误
+                return False
+            # 写入失败按重试策略重试，重试次数用尽时才由_give_up_block报告错误
+            self._log_download_debug(f"块{block.start_position}-{block.end_position}: 写入失败 {str(e)}", LOG_ERROR)
+            block.last_error = f"写入失败: {str(e)}"
+            block.status = "写入失败"
+            block.error_class = ERROR_OTHER  # 本地写入失败，按重试策略重试但不计入主机熔断
+            return False
+        
+        # 更新进度（只有当前工作线程修改本块的位置，监控线程只读）
+        new_position = current_position + size
+        
+        # 确保不超过块的结束位置
+        if new_position > block.end_position + 1:
+            self._log_download_debug(f"块{block.start_position}-{block.end_position}: 修正超出范围的位置")
+            new_position = block.end_position + 1
+        self.downloaded_ranges.add(current_position, new_position)
+        block.current_position = new_position
+        return True
+    
+    def _start_steal_workers(self) -> list:
+        """启动工作窃取模式的工作线程
+        
+        工作线程数等于初始分块数（不超过最大线程数），暂停恢复时只补足已退出的线程。
+        
+        返回:
+            list: 提交到线程池的任务
+        """
+        if self.work_stealer is None:
+            self.work_stealer = WorkStealer(
+                self.blocks, self._create_stolen_block, log_fn=self._log_download_debug
+            )
+            pending = sum(1 for block in self.blocks if block.current_position <= block.end_position)
+            self.steal_worker_count = max(1, min(self.thread_count, pending))
+        elif self.work_stealer.active_workers == 0:
+            # 之前的工作线程都已退出，清除残留的分配标记
+            self.work_stealer.reset()
+        
+        # 自适应连接数：从少量连接开始，由监控线程按测量结果增减；
+        # 有主机记录时直接从记录的连接数开始（最近错误较多时减半），不再慢启动
+        if self.adaptive_concurrency:
+            if self.concurrency is None or self.concurrency.closed:
+                initial, slow_start = min(INITIAL_CONNECTIONS, self.steal_worker_count), True
+                if self.host_profile and self.host_profile.best_connections:
+                    initial, slow_start = self.host_profile.best_connections, False
+                    if (self.host_profile.error_rate or 0) > PROFILE_ERROR_RATE_LIMIT:
+                        initial = max(1, initial // 2)
+                    initial = min(initial, self.connection_limit)
+                    self._log_download_debug(f"按主机记录使用初始连接数: {initial}", LOG_INFO)
+                self.concurrency = ConcurrencyController(
+                    self.connection_limit, initial=initial, slow_start=slow_start,
+                    log_fn=lambda message: self._log_download_debug(f"自适应连接数: {message}", LOG_INFO)
+                )
+            else:
+                self.concurrency.restart()
+            missing = self.concurrency.missing()
+            missing = self.concurrency.acquire(missing, at_least=1 if self.work_stealer.active_workers == 0 else 0)
+            self.steal_worker_count = self.concurrency.connections
+        else:
+            missing = self.steal_worker_count - self.work_stealer.active_workers
+        
+        futures = []
+        for _ in range(max(0, missing)):
+            self.work_stealer.worker_started()
+            futures.append(self._submit_steal_worker())
+        self._log_download_debug(f"工作窃取模式: 启动 {len(futures)} 个工作线程，共 {self.steal_worker_count} 个连接")
+        return futures
+    
+    def _has_stealable_work(self) -> bool:
+        """是否还有可以交给新连接的区间（未分配的块，或足够大、可以窃取一半的块）"""
+        with self.work_stealer.lock:
+            ranges = []
+            for i, block in enumerate(self.blocks):
+                if block.current_position > block.end_position:
+                    continue
+                if not block.assigned and not block.active:
+                    return True
+                ranges.append((i, block.current_position, block.end_position))
+        return choose_steal_split(ranges, self.work_stealer.min_split_size) is not None
+    
+    def _adjust_concurrency(self) -> None:
+        """监控线程调用：更新自适应控制器，目标连接数增加时启动新的工作线程（减少时由工作线程自行退出）"""
+        controller = self.concurrency
+        if controller is None or controller.closed or self.is_paused or self.work_stealer is None:
+            return
+        
+        controller.update(self.current_progress)
+        missing = controller.missing()
+        if missing <= 0 or not self._has_stealable_work():
+            return
+        
+        granted = controller.acquire(missing)
+        if granted < missing:
+            controller.limit_to_budget()
+        for _ in range(granted):
+            self.work_stealer.worker_started()
+            self._submit_steal_worker()
+        self.steal_worker_count = controller.connections
+    
+    def _create_stolen_block(self, start_pos: int, end_pos: int) -> DownloadBlock:
+        """为窃取到的区间创建下载块"""
+        return DownloadBlock(start_pos, start_pos, end_pos, self.client_manager.create_client(self.headers))
+    
+    def _steal_worker(self) -> None:
+        """工作窃取模式的工作线程：不断领取或窃取块，直到没有可下载的区间
+        
+        块请求失败时按重试策略退避后重新领取（失败的块可能先由其他线程继续），块的重试次数用尽时任务结束。
+        """
+        controller = self.concurrency
+        shed = False
+        try:
+            while self.is_running and not self.is_paused and self.multi_thread_support:
+                if controller is not None and controller.should_shed():
+                    shed = True
+                    break
+                block = self.work_stealer.claim()
+                if block is None:
+                    break
+                
+                try:
+                    success = self._process_block(block)
+                finally:
+                    self.work_stealer.release(block)
+                
+                if block.status == "减少连接":
+                    # 自适应控制器减少了连接数，块的剩余部分由其他连接继续
+                    shed = True
+                    break
+                if success or block.error_class is None:
+                    # 完成，或切换IP、下载源时块的剩余部分立即由其他连接继续，不算失败
+                    continue
+                if self.is_running and not self.is_paused:
+                    # 块下载失败，按重试策略退避后由本线程或其他线程重新领取
+                    if controller is not None:
+                        controller.record_error()
+                    delay = self._retry_delay(block)
+                    if delay is None or not self._wait_retry(delay):
+                        break
+        except Exception as e:
+            self._log_download_debug(f"工作线程出错: {e}")
+        finally:
+            self.work_stealer.worker_finished()
+            if controller is not None:
+                controller.release(shed)
+    
     def _switch_to_single_thread(self) -> None:
         """切换到单线程下载模式"""
-        self._log_download_debug("切换到单线程模式")
+        self._log_download_debug("切换到单线程模式", LOG_INFO)
         
         with self.thread_lock:
             self.multi_thread_support = False
@@ -2096,20 +3348,35 @@ class DownloadEngine(QThread):
             for block in self.blocks:
                 block.active = False
             
-            # 保存当前已下载的数据
-            self._save_resume_info()
-            
-            # 清除所有块
+            # 清除所有块，单线程模式从头下载，旧的断点续传日志不再有效
             self.blocks.clear()
+            self._discard_resume_info()
             
             # 创建单线程下载块
             client = self.client_manager.create_client(self.headers)
-            self.blocks.append(DownloadBlock(0, 0, self.known_file_size - 1 if self.known_file_size > 0 else 2**63 - 1, client))
+            single_block = DownloadBlock(0, 0, self.known_file_size - 1 if self.known_file_size > 0 else 2**63 - 1, client)
+            # 标记为已分配，避免工作窃取线程领取
+            single_block.assigned = True
+            self.blocks.append(single_block)
         
         # 如果仍在运行，启动单线程下载
         if self.is_running and not self.is_paused:
             self.executor.submit(self._process_single_block, self.blocks[0])
     
+    def _truncate_changed_file(self, file_size: int) -> None:
+        """服务器上的文件变小后，截掉本地文件末尾多出的旧数据
+        
+        参数:
+            file_size: 新的文件大小
+        """
+        file_path = Path(self.save_path) / self.file_name
+        try:
+            if file_path.exists() and file_path.stat().st_size > file_size:
+                os.truncate(file_path, file_size)
+                self._log_download_debug(f"文件已变小，截断到 {getReadableSize(file_size)}")
+        except OSError as e:
+            self._log_download_debug(f"截断文件失败: {e}")
+    
     def _process_single_block(self, block: DownloadBlock) -> bool:
         """处理单线程下载块
         
@@ -2124,14 +3391,17 @@ class DownloadEngine(QThread):
         # 标记为活跃状态
         block.active = True
         
-        # 下载重试配置
-        max_retries = 5  # 减少重试次数
-        retry_delay = 0.5  # 减少重试延迟
-        timeout = 30  # 缩短初始超时时间
+        # 初始超时时间（失败重试按Retry_Policy的策略退避）
+        timeout = 30
         
         # 下载过程
-        while (block.current_position < block.end_position or self.known_file_size <= 0) and self.is_running and not self.is_paused:
+        while (block.current_position <= block.end_position or self.known_file_size <= 0) and self.is_running and not self.is_paused:
+            attempt_start = block.current_position
             try:
+                # 主机熔断时等待冷却结束
+                if not self._wait_for_host(self.url):
+                    break
+                
                 # 准备请求头
                 headers = self.headers.copy()
                 
@@ -2139,9 +3409,12 @@ class DownloadEngine(QThread):
                 headers['Connection'] = 'keep-alive'
                 headers['Accept-Encoding'] = 'gzip, deflate'
                 
-                # 如果支持断点续传，添加Range头
+                # 如果支持断点续传，添加Range头（identity编码保证字节位置与文件一致）
                 if block.current_position > 0:
                     headers['Range'] = f'bytes={block.current_position}-'
+                    headers['Accept-Encoding'] = 'identity'
+                    if self.range_validator:
+                        headers['If-Range'] = self.range_validator
                     self._log_download_debug(f"断点续传: 从位置 {block.current_position} 开始")
                 
                 # 发送请求获取数据
@@ -2156,6 +3429,16 @@ class DownloadEngine(QThread):
                     follow_redirects=True
                 ) as response:
                     response.raise_for_status()
+                    self.retry_tracker.on_success(self.url)
+                    
+                    # 续传请求得到完整内容（文件已变更或不支持Range），从头写入
+                    full_response = 'Range' in headers and response.status_code == 200
+                    if full_response:
+                        self._log_download_debug(f"续传请求返回完整内容，从头重新下载 (已下载 {block.current_position} 字节作废)")
+                        block.current_position = 0
+                        block.last_position = 0
+                        # 已下载区间作废，进度从0开始；文件大小改用完整响应的长度
+                        self.downloaded_ranges.reset(-1)
                     
                     # 检查内容类型并更新文件扩展名
                     content_type = response.headers.get('Content-Type', '').lower()
@@ -2164,25 +3447,34 @@ class DownloadEngine(QThread):
                     # 根据内容类型调整文件扩展名
                     self._update_file_extension(content_type)
                     
-                    # 获取或更新文件大小
+                    # 获取或更新文件大小（压缩传输时Content-Length是压缩后的长度，不能作为文件大小）
                     content_length = response.headers.get('Content-Length')
-                    if content_length and content_length.isdigit():
+                    content_encoding = response.headers.get('Content-Encoding', 'identity').strip().lower()
+                    if content_length and content_length.isdigit() and content_encoding in ('', 'identity'):
                         new_size = int(content_length) + block.current_position
-                        if self.known_file_size <= 0 or new_size > self.known_file_size:
+                        # 完整响应的长度就是文件大小（变更后的文件可能比原来小）
+                        if full_response or self.known_file_size <= 0 or new_size > self.known_file_size:
                             old_size = self.known_file_size
                             self.known_file_size = new_size
                             self._log_download_debug(f"更新文件大小: {getReadableSize(old_size)} -> {getReadableSize(self.known_file_size)}")
                             
-                            # 更新块结束位置
-                            if block.end_position < new_size - 1:
-                                block.end_position = new_size - 1
+                            # 更新块结束位置，已下载区间按新的文件大小判断完成
+                            block.end_position = new_size - 1
+                            self.downloaded_ranges.set_total(new_size)
+                            
+                            if full_response and not self.file_writer:
+                                self._truncate_changed_file(new_size)
+                    elif full_response:
+                        # 完整响应没有可用的长度，文件大小按收到的数据量确定
+                        self.known_file_size = -1
+                        self.downloaded_ranges.set_total(-1)
                     
                     # 确保文件写入缓冲区已初始化
                     file_path = Path(self.save_path) / self.file_name
                     if not self.file_writer:
                         try:
                             # 根据文件大小选择合适的缓冲区大小
-                            file_size_mb = self.file_size / (1024 * 1024) if self.file_size > 0 else 50
+                            file_size_mb = self.known_file_size / (1024 * 1024) if self.known_file_size > 0 else 50
                             
                             if file_size_mb < 10:  # 小于10MB的文件
                                 buffer_size = 4 * 1024 * 1024  # 4MB缓冲区
@@ -2193,8 +3485,10 @@ class DownloadEngine(QThread):
                             else:  # 大文件
                                 buffer_size = 32 * 1024 * 1024  # 32MB缓冲区
                                 
-                            self.file_writer = OptimizedFileWriter(str(file_path), self.file_size, buffer_size=buffer_size)
+                            self.file_writer = OptimizedFileWriter(str(file_path), self.known_file_size, buffer_size=buffer_size)
                             self._log_download_debug(f"为单线程下载创建文件写入缓冲区: {getReadableSize(buffer_size)}")
+                            if self.integrity_verifier:
+                                self.file_writer.on_written = self.integrity_verifier.written
                         except Exception as e:
                             self._log_download_debug(f"创建文件写入缓冲区失败: {e}，将使用直接写入模式")
                     
@@ -2213,7 +3507,7 @@ class DownloadEngine(QThread):
                     
                     try:
                         # 根据文件大小选择合适的固定缓冲区大小
-                        file_size_mb = self.file_size / (1024 * 1024) if self.file_size > 0 else 50
+                        file_size_mb = self.known_file_size / (1024 * 1024) if self.known_file_size > 0 else 50
                         
                         if file_size_mb < 10:  # 小于10MB的文件
                             chunk_size = 256 * 1024  # 使用256KB缓冲区
@@ -2240,9 +3534,10 @@ class DownloadEngine(QThread):
                             
                             # 写入数据
                             data_size = len(chunk)
+                            self._apply_speed_limit(data_size)
                             if self.file_writer:
-                                # 使用优化的缓冲写入
-                                self.file_writer.write_at(block.current_position, chunk)
+                                # 使用优化的缓冲写入（后写队列）
+                                self.file_writer.submit(block.current_position, chunk)
                             else:
                                 # 直接写入
                                 file_handle.write(chunk)
@@ -2252,6 +3547,7 @@ class DownloadEngine(QThread):
                                     file_handle.flush()
                             
                             # 更新位置信息
+                            self.downloaded_ranges.add(block.current_position, block.current_position + data_size)
                             block.current_position += data_size
                             data_downloaded += data_size
                             total_chunks_count += 1
@@ -2272,21 +3568,11 @@ class DownloadEngine(QThread):
                             os.fsync(file_handle.fileno())
                             file_handle.close()
                         
-                        # 确认下载的文件大小
-                        try:
-                            actual_file_size = file_path.stat().st_size
-                            if actual_file_size != self.file_size and self.file_size > 0:
-                                self._log_download_debug(f"警告：实际文件大小({actual_file_size})与期望大小({self.file_size})不匹配")
-                                # 如果差距小，可以考虑忽略
-                                if abs(actual_file_size - self.file_size) <= 5:
-                                    self._log_download_debug("差距很小，忽略不匹配")
-                                else:
-                                    # 如果文件明显不完整
-                                    if actual_file_size < self.file_size:
-                                        # 这里不直接返回错误，而是记录，让上层决定是否重试
-                                        self._log_download_debug("文件下载不完整")
-                        except Exception as e:
-                            self._log_download_debug(f"检查文件大小出错: {e}")
+                        # 确认已下载的数据量（未完成时由外层循环从断开处继续请求）
+                        if self.known_file_size > 0 and block.current_position < self.known_file_size:
+                            self._log_download_debug(
+                                f"本次请求结束时已下载 {block.current_position}/{self.known_file_size} 字节"
+                            )
                 
                 # 如果因暂停或停止而中断
                 if self.is_paused:
@@ -2298,110 +3584,42 @@ class DownloadEngine(QThread):
                     block.active = False
                     return False
                 
-                # 如果文件大小未知但响应结束，认为下载完成
-                if self.file_size <= 0:
-                    actual_size = file_path.stat().st_size
-                    self.file_size = actual_size
-                    block.end_position = actual_size - 1
-                    block.current_position = actual_size
-                    self._log_download_debug(f"下载完成，文件大小: {getReadableSize(actual_size)}")
+                # 如果文件大小未知但响应结束，以收到的数据量作为文件大小
+                if self.known_file_size <= 0:
+                    self.known_file_size = block.current_position
+                    block.end_position = block.current_position - 1
+                    self._log_download_debug(f"下载完成，文件大小: {getReadableSize(block.current_position)}")
                     break
                 
                 # 检查是否已下载完成
-                if block.current_position >= block.end_position:
+                if block.current_position > block.end_position:
                     self._log_download_debug("下载完成")
                     break
             
-            except httpx.RequestError as e:
-                # 处理请求错误
-                block.retries += 1
-                error_msg = f"请求错误: {e}, 重试 {block.retries}/{max_retries}"
-                logging.warning(error_msg)
-                self._log_download_debug(error_msg)
-                
-                if block.retries >= max_retries:
-                    error_msg = f"达到最大重试次数: {max_retries}"
-                    logging.error(error_msg)
-                    self._log_download_debug(error_msg)
-                    self.error_occurred.emit(f"下载失败: 请求错误，已重试{max_retries}次")
-                    block.active = False
-                    return False
-                
-                # 指数退避重试
-                retry_time = min(60, retry_delay * (2 ** (block.retries - 1)))
-                self._log_download_debug(f"将在 {retry_time}秒后重试")
-                time.sleep(retry_time)
-            
-            except httpx.ConnectionError as e:
-                # 处理连接错误
-                block.retries += 1
-                error_msg = f"连接错误: {e}, 重试 {block.retries}/{max_retries}"
-                logging.warning(error_msg)
-                self._log_download_debug(error_msg)
-                
-                if block.retries >= max_retries:
-                    error_msg = f"达到最大重试次数: {max_retries}"
-                    logging.error(error_msg)
-                    self._log_download_debug(error_msg)
-                    self.error_occurred.emit(f"下载失败: 连接错误，已重试{max_retries}次")
-                    block.active = False
-                    return False
-                
-                # 指数退避重试
-                retry_time = min(60, retry_delay * (2 ** (block.retries - 1)))
-                self._log_download_debug(f"将在 {retry_time}秒后重试")
-                time.sleep(retry_time)
-            
-            except httpx.Timeout as e:
-                # 处理超时
-                block.retries += 1
-                error_msg = f"请求超时: {e}, 重试 {block.retries}/{max_retries}"
-                logging.warning(error_msg)
-                self._log_download_debug(error_msg)
-                
-                if block.retries >= max_retries:
-                    error_msg = f"达到最大重试次数: {max_retries}"
-                    logging.error(error_msg)
-                    self._log_download_debug(error_msg)
-                    self.error_occurred.emit(f"下载失败: 请求超时，已重试{max_retries}次")
-                    block.active = False
-                    return False
-                
-                # 增加超时时间，最多5分钟
-                timeout = min(300, timeout * 1.5)
-                
-                # 指数退避重试
-                retry_time = min(60, retry_delay * (2 ** (block.retries - 1)))
-                self._log_download_debug(f"将在 {retry_time}秒后重试")
-                time.sleep(retry_time)
-            
             except Exception as e:
-                # 处理其他异常
-                block.retries += 1
-                error_msg = f"下载错误: {e}"
-                logging.error(error_msg)
-                self._log_download_debug(error_msg)
-                
-                # 严重错误，停止下载
-                if isinstance(e, (httpx.RequestError, httpx.ConnectionError, httpx.Timeout)):
-                    self.error_occurred.emit(f"下载失败: {e}")
-                    self.is_running = False
-                    block.active = False
-                    return False
+                # 按错误类型和重试策略退避重试，请求写入过数据时重新计数
+                if block.current_position > attempt_start:
+                    block.retries = 0
+                if isinstance(e, httpx.HTTPStatusError):
+                    retry_after = parse_retry_after(e.response.headers.get('Retry-After'))
+                    self._record_block_failure(block, self.url, classify_error(e), retry_after)
+                else:
+                    self._record_block_failure(block, self.url, classify_error(e))
+                self._log_download_debug(f"下载错误: {e}", LOG_ERROR)
                 
-                # 其他错误重试
-                if block.retries >= max_retries:
-                    self.error_occurred.emit(f"下载失败: {e}，已重试{max_retries}次")
+                delay = self._retry_delay(block)
+                if delay is None:
                     block.active = False
                     return False
                 
-                # 指数退避重试
-                retry_time = min(60, retry_delay * (2 ** (block.retries - 1)))
-                self._log_download_debug(f"将在 {retry_time}秒后重试")
-                time.sleep(retry_time)
+                # 超时时延长超时时间，最多5分钟
+                if block.error_class == ERROR_TIMEOUT:
+                    timeout = min(300, timeout * 1.5)
+                if not self._wait_retry(delay):
+                    break
         
         # 确保下载完成状态
-        if self.file_size > 0 and block.current_position < block.end_position:
+        if self.known_file_size > 0 and block.current_position <= block.end_position:
             if self.is_paused:
                 self._log_download_debug(f"下载已暂停，进度: {block.current_position}/{block.end_position}")
             elif not self.is_running:
@@ -2410,10 +3628,9 @@ class DownloadEngine(QThread):
                 self._log_download_debug(f"下载异常结束，进度: {block.current_position}/{block.end_position}")
         else:
             self._log_download_debug("下载完成")
-            block.current_position = block.end_position
     
         block.active = False
-        return block.current_position >= block.end_position
+        return block.current_position > block.end_position
 
     def _update_file_extension(self, content_type: str) -> None:
         """根据内容类型更新文件扩展名
@@ -2496,36 +3713,29 @@ class DownloadEngine(QThread):
         except Exception as e:
             error_msg = f"重命名文件失败: {e}"
             logging.warning(error_msg)
-            self._log_download_debug(error_msg)
+            self._log_download_debug(error_msg, LOG_ERROR)
             # 如果重命名失败，恢复原文件名
             self.file_name = old_filename
 
+    def set_speed_limit(self, bytes_per_second: int) -> None:
+        """设置本任务的限速（仍受全局限速约束）
+        
+        参数:
+            bytes_per_second: 字节/秒，0表示只受全局限速约束
+        """
+        bandwidth_limiter.set_task_limit(self.limiter_key, bytes_per_second)
+        self._log_download_debug(
+            f"任务限速: {getReadableSize(bytes_per_second)}/s" if bytes_per_second > 0 else "任务限速已关闭"
+        )
+
     def _apply_speed_limit(self, data_size: int) -> None:
-        """应用下载速度限制
+        """应用下载速度限制（全局令牌桶 + 任务令牌桶）
         
         参数:
             data_size: 下载的数据大小(字节)
         """
         try:
-            # 获取速度限制设置 (KB/s)
-            speed_limit = 0
-            if hasattr(download_cfg, 'speedLimitation'):
-                if hasattr(download_cfg.speedLimitation, 'value'):
-                    speed_limit = download_cfg.speedLimitation.value
-            else:
-                speed_limit = download_cfg.speedLimitation
-            
-            # 转换为字节/秒
-            byte_limit = speed_limit * 1024
-            
-            # 如果有限速且当前块超过限制
-            if byte_limit > 0:
-                current_speed = sum(block.download_speed for block in self.blocks if block.active)
-                
-                if current_speed > byte_limit:
-                    # 计算需要暂停的时间
-                    delay = data_size / byte_limit
-                    time.sleep(max(0.01, min(0.5, delay)))  # 限制在10ms-500ms范围内
+            bandwidth_limiter.acquire(data_size, self.limiter_key)
         except Exception as e:
             logging.warning(f"速度限制处理出错: {e}")
             # 出错时不进行限速
@@ -2540,12 +3750,12 @@ class DownloadEngine(QThread):
             if 0 <= block_id < len(self.blocks):
                 block = self.blocks[block_id]
                 # 重置块处理逻辑
-                if block.active and block.current_position < block.end_position:
+                if block.active and block.current_position <= block.end_position:
                     block.active = False
                     self._log_download_debug(f"重置块 #{block_id}")
                     # 重新提交块到线程池
                     if self.executor and not self.executor._shutdown:
-                        self.executor.submit(self._process_block, block)
+                        self._submit_block(block)
         except Exception as e:
             self._log_download_debug(f"重置块失败: {e}")
     
@@ -2560,25 +3770,211 @@ class DownloadEngine(QThread):
             int: 新块ID，失败返回None
         """
         try:
-            if 0 <= block_id < len(self.blocks):
+            # 与工作窃取、缺口补充使用同一把锁，避免两个线程同时缩短同一个块或追加块
+            lock = self.work_stealer.lock if self.work_stealer is not None else self.thread_lock
+            with lock:
+                if not 0 <= block_id < len(self.blocks):
+                    return None
                 block = self.blocks[block_id]
                 # 确保分割点在有效范围内
-                if block.current_position < split_point < block.end_position:
-                    # 创建新块
-                    new_block = DownloadBlock(
-                        split_point, split_point, block.end_position,
-                        self.client_manager.create_client(self.headers)
-                    )
-                    # 更新原块结束位置
-                    block.end_position = split_point - 1
-                    # 添加新块到列表
-                    self.blocks.append(new_block)
-                    new_block_id = len(self.blocks) - 1
-                    self._log_download_debug(f"分割块 #{block_id} 在位置 {split_point}，生成新块 #{new_block_id}")
-                    # 提交新块到线程池
-                    if self.executor and not self.executor._shutdown:
-                        self.executor.submit(self._process_block, new_block)
-                    return new_block_id
+                if not block.current_position < split_point < block.end_position:
+                    return None
+                new_block = DownloadBlock(
+                    split_point, split_point, block.end_position,
+                    self.client_manager.create_client(self.headers)
+                )
+                # 先加入新块再缩短原块，遍历块列表快照的线程不会看到没有块负责的区间
+                self.blocks.append(new_block)
+                block.end_position = split_point - 1
+                new_block_id = len(self.blocks) - 1
+            self._log_download_debug(f"分割块 #{block_id} 在位置 {split_point}，生成新块 #{new_block_id}")
+            # 提交新块到线程池
+            if self.executor and not self.executor._shutdown:
+                self._submit_block(new_block)
+            return new_block_id
         except Exception as e:
             self._log_download_debug(f"分割块失败: {e}")
         return None
+
+
+# 测试代码
+if __name__ == "__main__":
+    import tempfile
+    from PySide6.QtCore import Qt
+    
+    def _benchmark_file_writer(thread_count: int, total_size: int = 256*1024*1024, chunk_size: int = 64*1024) -> float:
+        """多线程写入互不重叠区间的吞吐量测试，返回MB/s"""
+        fd, temp_path = tempfile.mkstemp(suffix=".nsfbench")
+        os.close(fd)
+        try:
+            createSparseFile(temp_path, total_size)
+            writer = OptimizedFileWriter(temp_path, total_size)
+            segment_size = total_size // thread_count
+            payload = os.urandom(chunk_size)
+            
+            def _writer_thread(index: int):
+                start = index * segment_size
+                end = total_size if index == thread_count - 1 else start + segment_size
+                position = start
+                while position < end:
+                    length = min(chunk_size, end - position)
+                    writer.write_at(position, payload[:length])
+                    position += length
+            
+            threads = [threading.Thread(target=_writer_thread, args=(i,)) for i in range(thread_count)]
+            begin = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            writer.flush()
+            elapsed = time.perf_counter() - begin
+            writer.close()
+            return total_size / (1024 * 1024) / max(elapsed, 1e-9)
+        finally:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+    
+    def _start_test_server(data: bytes, ignore_range: bool = False, connection_rate: int = 0):
+        """启动本地HTTP服务，返回(服务器, 下载链接)
+        
+        参数:
+            data: 文件内容
+            ignore_range: 是否忽略Range请求头，总是返回完整内容
+            connection_rate: 每个连接的发送速度上限（字节/秒），0表示不限速
+        """
+        import http.server
+        import socketserver
+        
+        size = len(data)
+        
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def _send_headers(self):
+                self.send_response(200)
+                self.send_header("Content-Length", str(size))
+                self.send_header("Accept-Ranges", "none" if ignore_range else "bytes")
+                self.end_headers()
+            
+            def do_HEAD(self):
+                self._send_headers()
+            
+            def do_GET(self):
+                match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                start, end = 0, size - 1
+                if match and not ignore_range:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                    self.send_response(206)
+                    self.send_header("Content-Length", str(end - start + 1))
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                    self.end_headers()
+                else:
+                    self._send_headers()
+                
+                # 按64KB分批发送，限速时每批之后补足等待时间
+                chunk_size = 64 * 1024
+                begin = time.perf_counter()
+                for position in range(start, end + 1, chunk_size):
+                    self.wfile.write(data[position:min(position + chunk_size, end + 1)])
+                    if connection_rate:
+                        delay = (position + chunk_size - start) / connection_rate - (time.perf_counter() - begin)
+                        if delay > 0:
+                            time.sleep(delay)
+            
+            def log_message(self, *args):
+                pass
+        
+        class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+            request_queue_size = 256
+            
+            def handle_error(self, request, client_address):
+                pass  # 客户端提前关闭连接不是错误
+        
+        server = _Server(("127.0.0.1", 0), _Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, f"http://127.0.0.1:{server.server_address[1]}/file.bin"
+    
+    def _download_to_temp(engine_class, url: str, data: bytes, **kwargs) -> Tuple[bool, float, List[str]]:
+        """用下载引擎下载到临时目录并与原数据比较，返回(内容一致, 耗时秒数, 错误信息)"""
+        save_dir = tempfile.mkdtemp(prefix="nsfcheck")
+        finished = threading.Event()
+        errors = []
+        try:
+            engine = engine_class(url=url, save_path=save_dir, file_name="file.bin", **kwargs)
+            # 没有事件循环，信号必须在下载线程中直接调用，否则只会排队到主线程
+            engine.download_completed.connect(finished.set, Qt.DirectConnection)
+            engine.error_occurred.connect(lambda message: (errors.append(message), finished.set()),
+                                          Qt.DirectConnection)
+            begin = time.perf_counter()
+            engine.start()
+            finished.wait(120)
+            elapsed = time.perf_counter() - begin
+            engine.wait(10000)
+            with open(os.path.join(save_dir, "file.bin"), "rb") as f:
+                ok = not errors and f.read() == data
+            return ok, elapsed, errors
+        finally:
+            for file_name in os.listdir(save_dir):
+                os.remove(os.path.join(save_dir, file_name))
+            os.rmdir(save_dir)
+    
+    def _check_single_connection(ignore_range: bool, size: int) -> None:
+        """单连接下载端到端检查：本地HTTP服务忽略Range（或文件小于分段阈值），下载结果必须与原数据一致"""
+        data = os.urandom(size)
+        server, url = _start_test_server(data, ignore_range=ignore_range)
+        try:
+            ok, _, errors = _download_to_temp(DownloadEngine, url, data)
+            name = "服务器忽略Range" if ignore_range else "小文件"
+            print(f"单连接下载({name}, {getReadableSize(size)}): {'通过' if ok else '失败'} {errors[0] if errors else ''}")
+        finally:
+            server.shutdown()
+    
+    class _FixedSegmentEngine(DownloadEngine):
+        """按固定分段数、每段一个连接下载，用于测量分段数与总吞吐量的关系
+        
+        关闭工作窃取和自适应连接数，并跳过智能分段（及疯狂模式分段）的上限
+        """
+        
+        segments = 1
+        
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.work_stealing = False
+            self.adaptive_concurrency = False
+            self.connection_limit = self.thread_count
+            # 疯狂模式会在实例上替换_calculate_blocks，这里在其之后覆盖
+            self._calculate_blocks = self._fixed_blocks
+        
+        def _fixed_blocks(self) -> List[List[int]]:
+            step = -(-self.known_file_size // self.segments)
+            return [[start, min(start + step, self.known_file_size) - 1]
+                    for start in range(0, self.known_file_size, step)]
+    
+    def _benchmark_segments(size: int = 64 * 1024 * 1024, connection_rate: int = 8 * 1024 * 1024) -> None:
+        """多分段下载端到端吞吐量：本地HTTP服务支持Range并对每个连接限速，分段数从1增加到128"""
+        data = os.urandom(size)
+        server, url = _start_test_server(data, connection_rate=connection_rate)
+        print(f"多分段下载: 文件 {getReadableSize(size)}，每个连接限速 {getReadableSize(connection_rate)}/s")
+        try:
+            for segments in (1, 4, 16, 64, 128):
+                _FixedSegmentEngine.segments = segments
+                ok, elapsed, errors = _download_to_temp(_FixedSegmentEngine, url, data, max_concurrent=segments)
+                print(f"{segments:>4} 分段: {size / (1024 * 1024) / max(elapsed, 1e-9):8.1f} MB/s, "
+                      f"校验{'通过' if ok else '失败'} {errors[0] if errors else ''}")
+        finally:
+            server.shutdown()
+    
+    _check_single_connection(ignore_range=True, size=5 * 1024 * 1024)
+    _check_single_connection(ignore_range=False, size=700 * 1024)
+    _benchmark_segments()
+    
+    print(f"定位写入: {'pwrite' if HAS_PWRITE else 'seek+write'}")
+    thread_count = 1
+    while thread_count <= 128:
+        print(f"{thread_count:>3} 线程: {_benchmark_file_writer(thread_count):8.1f} MB/s")
+        thread_count *= 2
@@ -0,0 +1,749 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Async_Mode.py - NSF异步引擎模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+NSF异步引擎模块
+标准NSF引擎每个分段占用一个阻塞线程，分段数上百时线程本身的开销和调度就成了瓶颈。
+异步引擎在一个事件循环线程中用httpx.AsyncClient驱动所有分段的流，
+分块、工作窃取、断点续传、固定IP、进度监控和信号与标准引擎完全相同，界面可以任选一种引擎。
+
+背压：
+- 同时打开的流数受信号量限制（不超过最大并发数）
+- 写入队列已满时流协程让出事件循环等待写入线程，不会阻塞其他流
+- 限速通过预支令牌后异步等待实现
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Any, Callable, List, Optional, Type
+
+try:
+    import httpx
+    HAS_HTTPX = True
+except ImportError:
+    HAS_HTTPX = False
+    logging.warning("未找到httpx库，NSF异步引擎不可用")
+
+from core.download_core.Hanabi_NSF_Kernel import DownloadEngine, DownloadBlock, LOG_INFO
+from core.download_core.core.methods import getProxy, getReadableSize
+from core.download_core.NSF_Utils.Adaptive_Chunk import AdaptiveChunkSizer
+from core.download_core.NSF_Utils.Connection_Pool import shared_pool, is_http2_enabled, DEFAULT_KEEPALIVE_EXPIRY
+from core.download_core.NSF_Utils.IP_Pinning import get_response_ip
+from core.download_core.NSF_Utils.Speed_Limiter import bandwidth_limiter
+from core.download_core.NSF_Utils.Retry_Policy import (
+    classify_error, classify_status, parse_retry_after, ERROR_TIMEOUT, ERROR_CONNECTION, ERROR_INTERNAL,
+    BREAKER_POLL_INTERVAL
+)
+
+# 引擎类型
+ENGINE_THREAD = "thread"
+ENGINE_ASYNC = "async"
+
+# 默认配置
+ASYNC_MAX_STREAMS = 1024                  # 异步引擎的最大并发流数
+ASYNC_MIN_SEGMENT_SIZE = 1024 * 1024      # 超过32个分段时每段至少1MB
+WRITER_POLL_INTERVAL = 0.005              # 写入队列已满时的检查间隔（秒）
+SHUTDOWN_TIMEOUT = 10.0                   # 关闭事件循环时等待的最长时间（秒）
+
+
+def get_configured_engine() -> str:
+    """读取设置中的NSF引擎类型（download.nsf_engine，"thread"或"async"，默认"thread"）"""
+    try:
+        from client.ui.client_interface.settings.config import config
+        engine = str(config.get_setting("download", "nsf_engine", ENGINE_THREAD)).lower()
+        return engine if engine in (ENGINE_THREAD, ENGINE_ASYNC) else ENGINE_THREAD
+    except ImportError:
+        return ENGINE_THREAD
+    except Exception as e:
+        logging.warning(f"读取NSF引擎设置失败: {e}")
+        return ENGINE_THREAD
+
+
+def get_engine_class(engine: str = None) -> Type[DownloadEngine]:
+    """获取NSF引擎类
+
+    Args:
+        engine: 引擎类型，默认读取设置
+
+    Returns:
+        Type[DownloadEngine]: 标准引擎或异步引擎（httpx不可用时总是返回标准引擎）
+    """
+    engine = engine or get_configured_engine()
+    if engine == ENGINE_ASYNC and HAS_HTTPX:
+        return AsyncDownloadEngine
+    return DownloadEngine
+
+
+class EventLoopExecutor:
+    """在独立线程中运行的事件循环
+
+    提供与ThreadPoolExecutor相同的submit/shutdown接口，协程函数直接在事件循环中运行，
+    普通函数（如不支持分段时的单线程下载）放到事件循环的默认线程池中运行。
+    """
+
+    def __init__(self, name: str = "NSF-AsyncLoop"):
+        self.loop = asyncio.new_event_loop()
+        self._shutdown = False
+        self._futures = set()
+        self._futures_lock = threading.Lock()
+        self._closers: List[Callable[[], Any]] = []
+        self._thread = threading.Thread(target=self._run_loop, name=name, daemon=True)
+        self._thread.start()
+
+    def _run_loop(self) -> None:
+        """事件循环线程"""
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            # 与asyncio.run相同：先结束未关闭的异步生成器（响应流），否则它们的aclose任务随事件循环一起被丢弃
+            try:
+                self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            except Exception as e:
+                logging.debug(f"关闭异步生成器失败: {e}")
+            try:
+                self.loop.run_until_complete(self.loop.shutdown_default_executor())
+            except Exception as e:
+                logging.debug(f"关闭事件循环默认线程池失败: {e}")
+            self.loop.close()
+
+    def _track(self, future: concurrent.futures.Future) -> concurrent.futures.Future:
+        """记录未完成的任务，关闭时可以取消"""
+        with self._futures_lock:
+            self._futures.add(future)
+        future.add_done_callback(self._untrack)
+        return future
+
+    def _untrack(self, future: concurrent.futures.Future) -> None:
+        with self._futures_lock:
+            self._futures.discard(future)
+
+    def submit(self, fn: Callable, *args) -> concurrent.futures.Future:
+        """提交任务
+
+        Args:
+            fn: 协程函数或普通函数
+            *args: 参数
+
+        Returns:
+            concurrent.futures.Future: 任务结果
+        """
+        if self._shutdown:
+            raise RuntimeError("事件循环已关闭")
+        if asyncio.iscoroutinefunction(fn):
+            coro = fn(*args)
+        else:
+            coro = asyncio.to_thread(fn, *args)
+        return self._track(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def call(self, coro, timeout: Optional[float] = None) -> Any:
+        """在事件循环中运行协程并等待结果（不能在事件循环线程中调用）"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def add_closer(self, closer: Callable[[], Any]) -> None:
+        """注册关闭事件循环前要执行的协程函数（如关闭AsyncClient）"""
+        self._closers.append(closer)
+
+    async def _finish(self, cancel: bool) -> None:
+        """取消或等待剩余任务，执行关闭回调后停止事件循环"""
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        if cancel:
+            for task in tasks:
+                task.cancel()
+        if tasks:
+            await asyncio.wait(tasks, timeout=SHUTDOWN_TIMEOUT)
+        for closer in self._closers:
+            try:
+                await closer()
+            except Exception as e:
+                logging.debug(f"关闭异步资源失败: {e}")
+        self.loop.stop()
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        """关闭事件循环
+
+        Args:
+            wait: 是否等待事件循环线程退出
+            cancel_futures: 是否取消未完成的任务
+        """
+        if self._shutdown:
+            return
+        self._shutdown = True
+        if cancel_futures:
+            with self._futures_lock:
+                pending = list(self._futures)
+            for future in pending:
+                future.cancel()
+        try:
+            asyncio.run_coroutine_threadsafe(self._finish(cancel_futures), self.loop)
+        except RuntimeError:
+            # 事件循环已经停止
+            return
+        if wait and self._thread is not threading.current_thread():
+            self._thread.join(SHUTDOWN_TIMEOUT)
+
+
+class AsyncDownloadEngine(DownloadEngine):
+    """NSF异步下载引擎
+
+    与DownloadEngine的信号、属性和控制方法完全相同，只是分段流由一个事件循环驱动：
+    分段数可以远超线程引擎的上限，线程数不随分段数增长。
+    """
+
+    # 异步引擎的分段不占用线程，不启用疯狂模式
+    CRAZY_MODE_THRESHOLD = ASYNC_MAX_STREAMS
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.thread_count = max(1, min(self.thread_count, ASYNC_MAX_STREAMS))
+        self.async_client = None
+        self._stream_slots = None
+        self._write_gate = None
+        self._log_download_debug(f"使用NSF异步引擎，最大并发流数: {self.thread_count}", LOG_INFO)
+
+    def _calculate_blocks(self) -> List[List[int]]:
+        """计算下载块边界
+
+        并发数不超过32时与标准引擎相同；更多时按并发数均分，每段不小于ASYNC_MIN_SEGMENT_SIZE。
+        """
+        if self.thread_count <= 32 or self.known_file_size <= 0:
+            return super()._calculate_blocks()
+
+        segment_count = max(1, min(self.thread_count, self.known_file_size // ASYNC_MIN_SEGMENT_SIZE))
+        block_size = self.known_file_size // segment_count
+        boundaries = []
+        start_pos = 0
+        for i in range(segment_count):
+            end_pos = self.known_file_size - 1 if i == segment_count - 1 else start_pos + block_size - 1
+            boundaries.append([start_pos, end_pos])
+            start_pos = end_pos + 1
+
+        self._log_download_debug(
+            f"异步引擎分块计算完成: 共{len(boundaries)}个块，每块约{getReadableSize(block_size)}", LOG_INFO
+        )
+        return boundaries
+
+    def _create_executor(self) -> EventLoopExecutor:
+        """创建事件循环执行器，并在事件循环中创建共享的AsyncClient"""
+        executor = EventLoopExecutor()
+        executor.call(self._open_async_client())
+        executor.add_closer(self._close_async_client)
+        self._log_download_debug(f"异步事件循环已启动，最大并发流数: {self.connection_limit}")
+        return executor
+
+    async def _open_async_client(self) -> None:
+        """创建AsyncClient和并发流信号量（在事件循环中调用）"""
+        proxy = getProxy()
+        proxy_url = None
+        if proxy:
+            proxy_url = proxy if proxy.startswith(('http://', 'https://')) else f"http://{proxy}"
+
+        # HTTP/2模式下httpcore把流复用到已协商HTTP/2的连接上，未协商时仍按HTTP/1.1每流一个连接；
+        # 已知不支持HTTP/2的源站（探测时回退或主机记录）直接使用HTTP/1.1
+        http2 = is_http2_enabled() and self.url.startswith("https://") and not shared_pool.is_http1_origin(self.url)
+        limits = httpx.Limits(
+            max_connections=self.connection_limit,
+            max_keepalive_connections=self.connection_limit,
+            keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY
+        )
+        # 不使用代理时按固定IP表建立连接，IP停用后块结束当前请求改用其他IP（与标准引擎相同）
+        self.async_client = shared_pool.create_async_client(
+            proxy_url, self.client_manager.ssl_verify, httpx.Timeout(10.0, connect=5.0), limits, http2=http2
+        )
+        self._stream_slots = asyncio.Semaphore(self.connection_limit)
+        self._write_gate = asyncio.Lock()
+
+    async def _close_async_client(self) -> None:
+        """关闭AsyncClient（在事件循环中调用）"""
+        if self.async_client is not None:
+            await self.async_client.aclose()
+            self.async_client = None
+
+    def _submit_block(self, block: DownloadBlock):
+        """提交一个分段下载块到事件循环"""
+        return self._track_block_run(self.executor.submit(self._run_block_async, block))
+
+    def _submit_steal_worker(self):
+        """提交一个工作窃取协程到事件循环"""
+        return self.executor.submit(self._steal_worker_async)
+
+    async def _wait_retry_async(self, delay: float) -> bool:
+        """等待重试（暂停或停止时提前返回False）"""
+        deadline = time.time() + delay
+        while self.is_running and not self.is_paused:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return True
+            await asyncio.sleep(min(remaining, 0.2))
+        return False
+
+    async def _wait_for_host_async(self, url: str) -> bool:
+        """请求前等待主机熔断结束（暂停或停止时返回False）"""
+        while self.is_running and not self.is_paused:
+            wait = self.retry_tracker.wait_time(url)
+            if wait <= 0:
+                return True
+            await asyncio.sleep(min(wait, BREAKER_POLL_INTERVAL))
+        return False
+
+    async def _run_block_async(self, block: DownloadBlock) -> bool:
+        """下载一个块，失败时按重试策略等待后继续（协程版_run_block）"""
+        while True:
+            success = await self._process_block_async(block)
+            if success or not self.is_running or self.is_paused:
+                return success
+            if block.error_class is None:
+                if block.status in ("切换IP", "切换下载源"):
+                    continue
+                return False
+            delay = self._retry_delay(block)
+            if delay is None or not await self._wait_retry_async(delay):
+                return False
+
+    async def _steal_worker_async(self) -> None:
+        """工作窃取协程：不断领取或窃取块，直到没有可下载的区间（失败的块按重试策略退避后重新领取）"""
+        controller = self.concurrency
+        shed = False
+        try:
+            while self.is_running and not self.is_paused and self.multi_thread_support:
+                if controller is not None and controller.should_shed():
+                    shed = True
+                    break
+                block = self.work_stealer.claim()
+                if block is None:
+                    break
+
+                try:
+                    success = await self._process_block_async(block)
+                finally:
+                    self.work_stealer.release(block)
+
+                if block.status == "减少连接":
+                    shed = True
+                    break
+                if success or block.error_class is None:
+                    continue
+                if self.is_running and not self.is_paused:
+                    # 块下载失败，按重试策略退避后由本协程或其他协程重新领取
+                    if controller is not None:
+                        controller.record_error()
+                    delay = self._retry_delay(block)
+                    if delay is None or not await self._wait_retry_async(delay):
+                        break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._log_download_debug(f"工作协程出错: {e}")
+        finally:
+            self.work_stealer.worker_finished()
+            if controller is not None:
+                controller.release(shed)
+
+    async def _write_block_data_async(self, block: DownloadBlock, parts: list, size: int) -> bool:
+        """限速和写入背压都以让出事件循环的方式等待，然后提交数据"""
+        wait = bandwidth_limiter.reserve(size, self.limiter_key)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        # 写入队列已满时等待写入线程腾出空间，之后的submit不会阻塞事件循环；
+        # 等待的流在锁上排队，同一时间只有一个协程轮询队列
+        writer = self.file_writer
+        if writer is not None and writer.pending_bytes + size > writer.buffer_size:
+            async with self._write_gate:
+                while (writer.pending_bytes and writer.pending_bytes + size > writer.buffer_size
+                       and self.is_running):
+                    await asyncio.sleep(WRITER_POLL_INTERVAL)
+
+        return self._commit_block_data(block, parts, size)
+
+    async def _process_block_async(self, block: DownloadBlock) -> bool:
+        """处理单个下载块（协程版_process_block）
+
+        参数:
+            block: 下载块对象
+
+        返回:
+            bool: 是否成功处理
+        """
+        if not self.is_running or self.is_paused:
+            block.active = False
+            block.status = "已暂停" if self.is_paused else "已停止"
+            return False
+
+        if block.active:
+            self._log_download_debug(f"块{block.start_position}-{block.end_position}: 已在下载中，跳过")
+            return False
+
+        with block.lock:
+            block.active = True
+            block.status = "等待连接"
+            block.error_class = None
+            block.retry_after = None
+            block.last_error = None
+
+        mirror = None
+        pinned = None
+        pinned_address = None
+        block.server_ip = None
+        try:
+            async with self._stream_slots:
+                if not self.is_running or self.is_paused:
+                    block.active = False
+                    block.status = "已暂停" if self.is_paused else "已停止"
+                    return False
+
+                block.status = "连接中"
+                mirror = self.mirror_set.acquire()
+                # 固定IP时记录本块连接的IP，IP失败或变差时本块结束当前请求，重新连接到其他IP
+                pinned = self._get_pinned_host(mirror.url)
+                if not await self._wait_for_host_async(mirror.url):
+                    block.active = False
+                    block.status = "已暂停" if self.is_paused else "已停止"
+                    return False
+                headers = self._block_request_headers(block, mirror)
+                self._log_download_debug(f"块{block.start_position}-{block.end_position}: 开始下载部分 {block.current_position}-{block.end_position}")
+
+                request_start = time.time()
+                async with self.async_client.stream("GET", mirror.url, headers=headers) as response:
+                    controller = self.concurrency
+                    if controller is not None:
+                        controller.record_request(time.time() - request_start)
+                    if response.status_code not in (200, 206):
+                        self._log_download_debug(f"块{block.start_position}-{block.end_position}: 请求失败 {response.status_code}")
+                        self.mirror_set.report_failure(mirror, f"返回状态码 {response.status_code}")
+                        self._record_block_failure(block, mirror.url, classify_status(response.status_code),
+                                                   parse_retry_after(response.headers.get('Retry-After')))
+                        block.active = False
+                        block.status = f"失败 ({response.status_code})"
+                        return False
+
+                    # 分段请求得到200：If-Range校验失败或服务器忽略了Range（备用源出现时只停用该源）
+                    if response.status_code == 200 and 'Range' in headers:
+                        if self.mirror_set.reject(mirror, "对分段请求返回了完整内容"):
+                            block.active = False
+                            block.status = "切换下载源"
+                            return False
+                        self._handle_origin_changed(block, response.status_code)
+                        return False
+
+                    self.retry_tracker.on_success(mirror.url)
+                    if pinned is not None:
+                        block.server_ip = get_response_ip(response)
+                        pinned_address = pinned.get(block.server_ip) if block.server_ip else None
+
+                    content_encoding = response.headers.get('Content-Encoding', 'identity').strip().lower()
+                    if content_encoding in ('', 'identity'):
+                        stream = response.aiter_raw()
+                    else:
+                        stream = response.aiter_bytes()
+
+                    sizer = AdaptiveChunkSizer()
+                    pending_parts = []
+                    pending_size = 0
+                    batch_start_time = time.time()
+
+                    async for chunk in stream:
+                        if not self.is_running or self.is_paused:
+                            block.active = False
+                            block.status = "已暂停" if self.is_paused else "已停止"
+                            return False
+                        if not chunk:
+                            continue
+
+                        # 结束位置可能已被其他协程窃取缩短
+                        chunk_size = len(chunk)
+                        remaining_space = block.end_position + 1 - block.current_position - pending_size
+                        if remaining_space <= 0:
+                            break
+                        if chunk_size > remaining_space:
+                            chunk = memoryview(chunk)[:remaining_space]
+                            chunk_size = remaining_space
+
+                        pending_parts.append(chunk)
+                        pending_size += chunk_size
+                        if pending_size < sizer.size and chunk_size < remaining_space:
+                            continue
+
+                        if not await self._write_block_data_async(block, pending_parts, pending_size):
+                            return False
+                        mirror.add_bytes(pending_size)
+                        block.retries = 0
+                        if mirror.is_down():
+                            block.active = False
+                            block.status = "切换下载源"
+                            return False
+                        if pinned_address is not None and pinned_address.is_down():
+                            self._log_download_debug(f"块{block.start_position}-{block.end_position}: IP {pinned_address.ip} 已停用，改用其他IP继续")
+                            block.active = False
+                            block.status = "切换IP"
+                            return False
+                        if controller is not None and controller.should_shed():
+                            block.active = False
+                            block.status = "减少连接"
+                            return False
+                        current_time = time.time()
+                        sizer.observe(pending_size, current_time - batch_start_time)
+                        batch_start_time = current_time
+                        pending_parts = []
+                        pending_size = 0
+
+                        time_diff = current_time - block.last_update_time
+                        if time_diff >= 1.0:
+                            position_diff = block.current_position - block.last_position
+                            if position_diff > 0:
+                                block.download_speed = position_diff / time_diff
+                            block.last_update_time = current_time
+                            block.last_position = block.current_position
+                            block.status = "下载中"
+
+                        if block.current_position >= block.end_position + 1:
+                            break
+
+                    if pending_parts:
+                        if not await self._write_block_data_async(block, pending_parts, pending_size):
+                            return False
+                        mirror.add_bytes(pending_size)
+
+            block.active = False
+            if block.current_position >= block.end_position + 1:
+                block.status = "已完成"
+                self.mirror_set.report_success(mirror)
+                if pinned_address is not None:
+                    pinned.report_success(pinned_address.ip)
+                self._log_download_debug(f"块{block.start_position}-{block.end_position}: 下载完成")
+                return True
+
+            self._log_download_debug(
+                f"块{block.start_position}-{block.end_position}: 不完整 "
+                f"({block.current_position-block.start_position}/{block.end_position-block.start_position+1})"
+            )
+            self._record_block_failure(block, mirror.url, ERROR_CONNECTION)
+            block.status = "不完整"
+            return False
+
+        except asyncio.CancelledError:
+            block.active = False
+            block.status = "已停止"
+            raise
+        except httpx.TimeoutException as e:
+            self._log_download_debug(f"块{block.start_position}-{block.end_position}: 超时 {str(e)}")
+            if mirror is not None:
+                self.mirror_set.report_failure(mirror, "请求超时")
+                if pinned_address is not None:
+                    pinned.report_failure(pinned_address.ip, "请求超时")
+                self._record_block_failure(block, mirror.url, ERROR_TIMEOUT)
+            block.active = False
+            block.status = "超时"
+            return False
+        except httpx.HTTPError as e:
+            self._log_download_debug(f"块{block.start_position}-{block.end_position}: HTTP错误 {str(e)}")
+            if mirror is not None:
+                self.mirror_set.report_failure(mirror, "传输出错")
+                if pinned_address is not None:
+                    pinned.report_failure(pinned_address.ip, "传输出错")
+                self._record_block_failure(block, mirror.url, classify_error(e))
+            block.active = False
+            block.status = "HTTP错误"
+            return False
+        except Exception as e:
+            self._log_download_debug(f"块{block.start_position}-{block.end_position}: 出错 {str(e)}")
+            logging.error(f"异步下载块处理错误: {e}")
+            if mirror is not None:
+                self._record_block_failure(block, mirror.url, classify_error(e))
+            else:
+                block.error_class = classify_error(e)
+                if block.error_class == ERROR_INTERNAL:
+                    logging.error(f"块{block.start_position}-{block.end_position}: 程序错误，不再重试", exc_info=True)
+            block.active = False
+            block.status = "出错"
+            return False
+        finally:
+            if mirror is not None:
+                self.mirror_set.release(mirror)
+
+
+# 测试代码
+if __name__ == "__main__":
+    # 端到端对比两种引擎：子进程提供支持Range的本地HTTP服务，
+    # 分别用DownloadEngine（每段一个线程）和AsyncDownloadEngine（一个事件循环）以8/64/256个分段下载到临时目录，
+    # 记录耗时、吞吐量、CPU时间和峰值线程数，并逐字节校验保存的文件。
+    # 两种场景：本地回环不限速（引擎本身的CPU开销），以及每个连接限速1MB/s（接近CDN单连接限速的真实下载）
+    # 运行: python -m core.download_core.NSF_Utils.Async_Mode
+    import http.server
+    import os
+    import re
+    import shutil
+    import socketserver
+    import subprocess
+    import sys
+    import tempfile
+
+    from PySide6.QtCore import Qt
+
+    SEND_SIZE = 64 * 1024
+    PATTERN = bytes(range(256)) * (SEND_SIZE // 256 + 1)
+
+    def _serve(rate: int):
+        """提供/<文件大小>/file.bin，内容第n个字节为n % 256，每个连接限速rate字节/秒（0不限速）"""
+        class RangeHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_headers(self, total: int, start: int, end: int, partial: bool):
+                self.send_response(206 if partial else 200)
+                self.send_header("Content-Length", str(end - start + 1))
+                self.send_header("Accept-Ranges", "bytes")
+                if partial:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{total}")
+                self.end_headers()
+
+            def do_HEAD(self):
+                total = int(self.path.split("/")[1])
+                self._send_headers(total, 0, total - 1, False)
+
+            def do_GET(self):
+                total = int(self.path.split("/")[1])
+                match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                start, end = 0, total - 1
+                if match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), total - 1) if match.group(2) else total - 1
+                self._send_headers(total, start, end, bool(match))
+                begin = time.monotonic()
+                sent = 0
+                while start <= end:
+                    size = min(SEND_SIZE, end - start + 1)
+                    self.wfile.write(memoryview(PATTERN)[start % 256:start % 256 + size])
+                    start += size
+                    sent += size
+                    if rate:
+                        delay = sent / rate - (time.monotonic() - begin)
+                        if delay > 0:
+                            time.sleep(delay)
+
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+            request_queue_size = 1024
+
+            def handle_error(self, request, client_address):
+                pass  # 客户端提前关闭连接不是错误
+
+        server = Server(("127.0.0.1", 0), RangeHandler)
+        print(server.server_address[1], flush=True)
+        server.serve_forever()
+
+    class _FixedSegments:
+        """按固定分段数、每段一个连接下载：关闭工作窃取和自适应连接数，并跳过智能分段和疯狂模式分段"""
+
+        segments = 1
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.work_stealing = False
+            self.adaptive_concurrency = False
+            self.connection_limit = self.thread_count
+
+        def _create_new_blocks(self) -> None:
+            self.blocks.clear()
+            self.resumed_from_file = False
+            step = -(-self.known_file_size // self.segments)
+            for start in range(0, self.known_file_size, step):
+                end = min(start + step, self.known_file_size) - 1
+                self.blocks.append(DownloadBlock(start, start, end, self.client_manager.create_client(self.headers)))
+
+    class _FixedThreadEngine(_FixedSegments, DownloadEngine):
+        pass
+
+    class _FixedAsyncEngine(_FixedSegments, AsyncDownloadEngine):
+        pass
+
+    def _file_matches(path: str, total: int) -> bool:
+        """逐块比较保存的文件与服务器内容（块大小是256的倍数，每块内容相同）"""
+        chunk = 1024 * 1024
+        expected = PATTERN[:256] * (chunk // 256)
+        if os.path.getsize(path) != total:
+            return False
+        with open(path, "rb") as f:
+            for position in range(0, total, chunk):
+                if f.read(chunk) != expected[:min(chunk, total - position)]:
+                    return False
+        return True
+
+    def _bench_engine(engine_class, url: str, segments: int, total: int):
+        """下载一次并校验，返回(耗时, CPU时间, 峰值线程数, 块数, 错误信息)"""
+        save_dir = tempfile.mkdtemp(prefix="nsfasync")
+        finished = threading.Event()
+        errors = []
+        peak = [threading.active_count()]
+
+        def sample():
+            while not finished.is_set():
+                peak[0] = max(peak[0], threading.active_count())
+                time.sleep(0.01)
+
+        try:
+            engine_class.segments = segments
+            engine = engine_class(url=url, save_path=save_dir, file_name="file.bin", max_concurrent=segments)
+            # 没有事件循环，信号必须在下载线程中直接调用
+            engine.download_completed.connect(finished.set, Qt.DirectConnection)
+            engine.error_occurred.connect(lambda message: (errors.append(message), finished.set()),
+                                          Qt.DirectConnection)
+            sampler = threading.Thread(target=sample, daemon=True)
+            sampler.start()
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            engine.start()
+            if not finished.wait(600):
+                errors.append("超时")
+                finished.set()
+            elapsed = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            engine.wait(30000)
+            sampler.join()
+            if not errors and not _file_matches(os.path.join(save_dir, "file.bin"), total):
+                errors.append("文件内容不一致")
+            return elapsed, cpu, peak[0], len(engine.blocks), errors
+        finally:
+            shutil.rmtree(save_dir, ignore_errors=True)
+
+    if sys.argv[1:2] == ["--serve"]:
+        _serve(int(sys.argv[2]))
+        raise SystemExit(0)
+
+    if not HAS_HTTPX:
+        raise SystemExit("需要httpx")
+
+    MB = 1024 * 1024
+    scenarios = [
+        ("本地回环，不限速，共256MB", 0, lambda segments: 256 * MB),
+        ("每连接限速1MB/s，每段2MB", MB, lambda segments: segments * 2 * MB),
+    ]
+    for title, rate, total_for in scenarios:
+        server_process = subprocess.Popen(
+            [sys.executable, "-m", "core.download_core.NSF_Utils.Async_Mode", "--serve", str(rate)],
+            stdout=subprocess.PIPE, text=True
+        )
+        port = int(server_process.stdout.readline())
+        print(f"\n{title}")
+        print(f"{'分段':>6}{'引擎':>8}{'耗时':>9}{'吞吐量':>12}{'CPU时间':>10}{'峰值线程':>8}  校验")
+        try:
+            for segments in (8, 64, 256):
+                total_size = total_for(segments)
+                url = f"http://127.0.0.1:{port}/{total_size}/file.bin"
+                for mode, engine_class in (("线程", _FixedThreadEngine), ("asyncio", _FixedAsyncEngine)):
+                    elapsed, cpu, threads, blocks, errors = _bench_engine(engine_class, url, segments, total_size)
+                    result = "通过" if not errors else f"失败 {errors[0]}"
+                    if blocks != segments:
+                        result += f"（实际{blocks}块）"
+                    print(f"{segments:>6}{mode:>8}{elapsed:>8.2f}s{total_size / elapsed / MB:>9.0f}MB/s"
+                          f"{cpu:>9.2f}s{threads:>8}  {result}", flush=True)
+        finally:
+            server_process.terminate()
@@ -146,7 +146,8 @@ class DownloadOptimizer:
             return True
     
     def update_block_status(self, block_id: int, current_pos: int, 
-                           start_pos: int, end_pos: int, active: bool = True) -> None:
+                           start_pos: int, end_pos: int, active: bool = True,
+                           speed: Optional[float] = None) -> None:
         """更新块状态
         
         Args:
@@ -155,6 +156,7 @@ class DownloadOptimizer:
             start_pos: 起始位置
             end_pos: 结束位置
             active: 是否激活
+            speed: 块速度估计(字节/秒)，由内核的速度估计器提供；None时按两次更新的位置差计算
         """
         with self.lock:
             # 获取现有状态或创建新状态
@@ -180,10 +182,12 @@ class DownloadOptimizer:
             time_diff = now - status["last_update"]
             if time_diff >= 0.5:  # 至少0.5秒才计算速度
                 pos_diff = current_pos - status["last_pos"]
-                if pos_diff > 0:
+                if speed is None and pos_diff > 0:
                     status["speed"] = pos_diff / time_diff
                 status["last_update"] = now
                 status["last_pos"] = current_pos
+            if speed is not None:
+                status["speed"] = speed
             
             # 更新位置和状态
             status["current_pos"] = current_pos
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Concurrency_Control.py - 自适应连接数控制模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+自适应连接数控制模块
+按实测的边际吞吐量闭环调整每个任务的连接数，代替按文件大小和速度分档的静态线程数表：
+从少量连接开始，像TCP慢启动一样成倍增加，新增的连接不再带来相应的吞吐量时退回；
+错误率升高或请求延迟（首字节时间）明显膨胀而吞吐量没有增长时按比例减少（AIMD）；
+稳定后交替向上、向下试探，网络条件变化时重新找到合适的连接数。
+所有任务的连接数之和受全局连接预算限制。
+"""
+
+import logging
+import statistics
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# 默认配置
+DEFAULT_MAX_CONNECTIONS = 128          # 全局连接预算（所有任务合计）
+DEFAULT_TASK_MAX_CONNECTIONS = 64      # 单个任务的最大连接数
+INITIAL_CONNECTIONS = 4                # 初始连接数
+MIN_CONNECTIONS = 1                    # 最少连接数
+SETTLE_TIME = 1.0                      # 调整后等待新连接建立、进入稳定传输的时间（秒）
+MEASURE_TIME = 2.0                     # 每次决策前测量吞吐量的时间（秒）
+MIN_GAIN_RATIO = 0.5                   # 新增连接的边际吞吐量至少达到原平均每连接吞吐量的比例
+MAX_LOSS_RATIO = 0.3                   # 减少连接时允许损失的吞吐量（按原平均每连接吞吐量计）
+ERROR_RATE_LIMIT = 0.2                 # 超过该错误率时减少连接
+RTT_INFLATION_LIMIT = 2.0              # 首字节时间超过基线的倍数时视为拥塞
+DECREASE_FACTOR = 0.75                 # 乘性减少的系数
+MAX_STEP = 16                          # 慢启动每次最多增加的连接数（连接数成倍增长）
+HOLD_ROUNDS = 5                        # 回退后保持不变的决策轮数
+MAX_DECISION_HISTORY = 50              # 保留的决策记录数
+
+
+def is_adaptive_concurrency_enabled() -> bool:
+    """读取设置中的自适应连接数开关（download.adaptive_concurrency，默认开启）"""
+    try:
+        from client.ui.client_interface.settings.config import config
+        return bool(config.get_setting("download", "adaptive_concurrency", True))
+    except ImportError:
+        return True
+    except Exception as e:
+        logging.warning(f"读取自适应连接数设置失败: {e}")
+        return True
+
+
+def _read_int_setting(key: str, default: int) -> int:
+    try:
+        from client.ui.client_interface.settings.config import config
+        return max(1, int(config.get_setting("download", key, default)))
+    except ImportError:
+        return default
+    except Exception as e:
+        logging.warning(f"读取设置 {key} 失败: {e}")
+        return default
+
+
+def get_task_connection_limit() -> int:
+    """单个任务的最大连接数（download.max_task_connections，默认64）"""
+    return _read_int_setting("max_task_connections", DEFAULT_TASK_MAX_CONNECTIONS)
+
+
+class ConnectionBudget:
+    """全局连接预算：所有下载任务的连接数之和不超过上限"""
+
+    def __init__(self, limit: int = DEFAULT_MAX_CONNECTIONS):
+        self.lock = threading.Lock()
+        self.limit = max(1, int(limit))
+        self.in_use = 0
+
+    def acquire(self, count: int, at_least: int = 0) -> int:
+        """申请连接数
+
+        Args:
+            count: 希望得到的连接数
+            at_least: 预算不足时也保证得到的连接数（保证每个任务至少有一个连接）
+
+        Returns:
+            int: 实际得到的连接数
+        """
+        with self.lock:
+            granted = max(min(count, at_least), min(count, self.limit - self.in_use))
+            self.in_use += granted
+            return granted
+
+    def release(self, count: int = 1) -> None:
+        with self.lock:
+            self.in_use = max(0, self.in_use - count)
+
+    @property
+    def available(self) -> int:
+        with self.lock:
+            return max(0, self.limit - self.in_use)
+
+
+# 全局连接预算实例（download.max_connections）
+connection_budget = ConnectionBudget(_read_int_setting("max_connections", DEFAULT_MAX_CONNECTIONS))
+
+
+class ConcurrencyController:
+    """单个任务的连接数控制器
+
+    监控线程定期调用update()传入累计下载字节数，控制器在“等待稳定-测量”周期结束时作出决策并返回目标连接数；
+    工作线程启动前用acquire()从全局预算申请连接，退出时release()；
+    目标连接数低于当前连接数时，工作线程在提交一批数据后通过should_shed()领取退出名额。
+    """
+
+    def __init__(self, maximum: int, initial: int = INITIAL_CONNECTIONS,
+                 budget: ConnectionBudget = None, log_fn: Callable[[str], None] = None,
+                 slow_start: bool = True):
+        """初始化控制器
+
+        Args:
+            maximum: 本任务的最大连接数
+            initial: 初始连接数
+            budget: 全局连接预算，默认使用connection_budget
+            log_fn: 记录决策的日志函数
+            slow_start: 是否从慢启动开始（初始连接数来自以往记录时不需要翻倍探测）
+        """
+        self.lock = threading.Lock()
+        self.maximum = max(MIN_CONNECTIONS, int(maximum))
+        self.target = max(MIN_CONNECTIONS, min(int(initial), self.maximum))
+        self.budget = budget or connection_budget
+        self.log_fn = log_fn or (lambda message: logging.info(f"[Concurrency] {message}"))
+
+        self.connections = 0              # 当前持有预算的连接数
+        self._shedding = 0                # 已领取退出名额但还没有退出的连接数
+        self._closed = False
+
+        # 控制状态
+        self.slow_start = slow_start      # 慢启动阶段每次把连接数翻倍
+        self.hold = 0                     # 剩余保持轮数
+        self.probe_up = True              # 保持结束后的试探方向
+        self.base_rtt = None              # 首字节时间基线（观测到的最小中位数）
+        self._last_target = None          # 上一轮测量时的连接数
+        self._last_throughput = None      # 上一轮测量的吞吐量
+
+        # 测量状态
+        self._phase = "settle"
+        self._phase_start = None
+        self._phase_bytes = 0
+        self._requests = 0
+        self._errors = 0
+        self._rtts: List[float] = []
+
+        # 统计信息
+        self.peak = self.target
+        self.best_target = self.target    # 测得最高吞吐量时的连接数
+        self.best_throughput = 0.0
+        self.total_requests = 0
+        self.total_errors = 0
+        self.decisions: List[Dict[str, Any]] = []
+
+    # ---- 连接管理 ----
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def acquire(self, count: int, at_least: int = 0) -> int:
+        """从全局预算为新的工作线程申请连接，返回得到的连接数"""
+        if count <= 0:
+            return 0
+        with self.lock:
+            if self._closed:
+                return 0
+            granted = self.budget.acquire(count, at_least)
+            self.connections += granted
+            self.peak = max(self.peak, self.connections)
+            return granted
+
+    def release(self, shed: bool = False) -> None:
+        """工作线程退出时归还连接
+
+        Args:
+            shed: 是否是因should_shed()返回True而退出
+        """
+        with self.lock:
+            if shed:
+                self._shedding = max(0, self._shedding - 1)
+            if self._closed or self.connections <= 0:
+                return
+            self.connections -= 1
+        self.budget.release(1)
+
+    def should_shed(self) -> bool:
+        """当前连接数超过目标时领取一个退出名额，领取到的工作线程应结束当前请求并退出"""
+        with self.lock:
+            if self.connections - self._shedding > self.target:
+                self._shedding += 1
+                return True
+            return False
+
+    def missing(self) -> int:
+        """距离目标连接数还差多少个连接"""
+        with self.lock:
+            return max(0, self.target - self.connections)
+
+    def limit_to_budget(self) -> None:
+        """全局预算不足、没能得到目标连接数时，把目标降到实际连接数，避免按没有建立的连接评估吞吐量"""
+        with self.lock:
+            if self.connections >= self.target or self.connections <= 0:
+                return
+            old_target, self.target = self.target, self.connections
+            self.slow_start = False
+            self._last_target = None
+        self.log_fn(f"全局连接预算不足（已用 {self.budget.in_use}/{self.budget.limit}），连接数 {old_target} -> {self.target}")
+
+    def back_off(self, reason: str) -> None:
+        """服务器限流或熔断时立即减少连接（之后按测量结果重新试探）"""
+        with self.lock:
+            if self._closed:
+                return
+            self.slow_start = False
+            self.hold = HOLD_ROUNDS
+            self._last_target = None
+            decision = self._set_target(max(MIN_CONNECTIONS, int(self.target * DECREASE_FACTOR)),
+                                        self._last_throughput or 0.0, f"{reason}，减少连接")
+        if decision:
+            self.log_fn(decision)
+
+    def close(self) -> None:
+        """任务结束：归还所有仍然持有的连接（包括已提交但被取消、没有运行的工作线程）"""
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+            held, self.connections = self.connections, 0
+        if held:
+            self.budget.release(held)
+
+    # ---- 信号采集 ----
+
+    def record_request(self, rtt: float) -> None:
+        """记录一次请求的首字节时间（秒）"""
+        with self.lock:
+            self._requests += 1
+            self.total_requests += 1
+            self._rtts.append(rtt)
+
+    def record_error(self) -> None:
+        """记录一次请求失败（超时、连接错误、429/503等）"""
+        with self.lock:
+            self._errors += 1
+            self.total_errors += 1
+
+    def restart(self) -> None:
+        """暂停恢复后重新开始测量，暂停期间不计入吞吐量"""
+        with self.lock:
+            self._phase = "settle"
+            self._phase_start = None
+            self._last_throughput = None
+            self._last_target = None
+
+    # ---- 决策 ----
+
+    def update(self, total_bytes: int, now: float = None) -> int:
+        """更新测量状态，周期结束时作出决策
+
+        Args:
+            total_bytes: 任务累计下载字节数
+            now: 当前时间（time.monotonic()）
+
+        Returns:
+            int: 目标连接数
+        """
+        now = now or time.monotonic()
+        with self.lock:
+            if self._closed:
+                return self.target
+            if self._phase_start is None:
+                self._phase_start = now
+                return self.target
+            elapsed = now - self._phase_start
+            if self._phase == "settle":
+                if elapsed >= SETTLE_TIME:
+                    self._phase = "measure"
+                    self._phase_start = now
+                    self._phase_bytes = total_bytes
+                    self._requests = 0
+                    self._errors = 0
+                    self._rtts = []
+                return self.target
+            if elapsed < MEASURE_TIME:
+                return self.target
+
+            throughput = max(0, total_bytes - self._phase_bytes) / elapsed
+            decision = self._decide(throughput)
+            self._phase = "settle"
+            self._phase_start = now
+
+        if decision:
+            self.log_fn(decision)
+        return self.target
+
+    def _decide(self, throughput: float) -> Optional[str]:
+        """根据本轮测量结果调整目标连接数（需持有锁），返回决策说明（不变时为None）"""
+        current = self.target
+        last_target, last_throughput = self._last_target, self._last_throughput
+        self._last_target, self._last_throughput = current, throughput
+        if throughput > self.best_throughput:
+            self.best_target, self.best_throughput = current, throughput
+
+        # 拥塞信号：错误率和首字节时间膨胀
+        attempts = max(self._requests, self._errors)
+        error_rate = self._errors / attempts if attempts else 0.0
+        rtt = statistics.median(self._rtts) if self._rtts else None
+        if rtt is not None and rtt > 0:
+            self.base_rtt = rtt if self.base_rtt is None else min(self.base_rtt, rtt)
+        inflation = rtt / self.base_rtt if rtt and self.base_rtt else 1.0
+        no_gain = last_throughput is not None and throughput <= last_throughput * 1.05
+
+        reason = None
+        if self._errors >= 2 and error_rate > ERROR_RATE_LIMIT:
+            reason = f"错误率 {error_rate:.0%}"
+        elif inflation > RTT_INFLATION_LIMIT and no_gain:
+            reason = f"首字节时间膨胀 {inflation:.1f} 倍且吞吐量没有增长"
+        if reason:
+            new_target = max(MIN_CONNECTIONS, int(current * DECREASE_FACTOR))
+            self.slow_start = False
+            self.hold = HOLD_ROUNDS
+            self._last_target = None
+            return self._set_target(new_target, throughput, f"{reason}，减少连接")
+
+        # 评估上一次调整的效果：边际吞吐量是否与连接数的变化相称
+        if last_target is not None and last_throughput is not None and last_target != current:
+            per_connection = last_throughput / last_target if last_target else 0.0
+            delta = current - last_target
+            gain = throughput - last_throughput
+            if delta > 0:
+                if per_connection > 0 and gain < delta * per_connection * MIN_GAIN_RATIO:
+                    # 新增的连接没有带来相应的吞吐量，退回并保持
+                    self.slow_start = False
+                    self.hold = HOLD_ROUNDS
+                    self.probe_up = False
+                    self._last_target = None
+                    return self._set_target(
+                        last_target, throughput,
+                        f"增加 {delta} 个连接只带来 {_format_speed(gain)} 的增长，退回"
+                    )
+            elif delta < 0:
+                loss = last_throughput - throughput
+                if loss > -delta * per_connection * MAX_LOSS_RATIO:
+                    # 减少连接损失了明显的吞吐量，恢复
+                    self.hold = HOLD_ROUNDS
+                    self.probe_up = True
+                    self._last_target = None
+                    return self._set_target(
+                        last_target, throughput,
+                        f"减少 {-delta} 个连接损失 {_format_speed(loss)}，恢复"
+                    )
+                self.hold = HOLD_ROUNDS
+
+        if self.hold > 0:
+            self.hold -= 1
+            return None
+
+        # 试探：慢启动阶段一直向上，之后交替向上、向下
+        if self.slow_start or self.probe_up:
+            self.probe_up = False
+            if current >= self.maximum:
+                return None
+            step = min(current, MAX_STEP) if self.slow_start else 1
+            return self._set_target(min(self.maximum, current + step), throughput, "试探增加连接")
+        self.probe_up = True
+        if current <= MIN_CONNECTIONS:
+            return None
+        return self._set_target(max(MIN_CONNECTIONS, current - max(1, current // 8)), throughput, "试探减少连接")
+
+    def _set_target(self, new_target: int, throughput: float, reason: str) -> Optional[str]:
+        """设置目标连接数并记录决策（需持有锁）"""
+        old_target = self.target
+        self.target = max(MIN_CONNECTIONS, min(self.maximum, new_target))
+        if self.target == old_target:
+            return None
+        self.decisions.append({
+            "time": time.time(),
+            "from": old_target,
+            "to": self.target,
+            "throughput": throughput,
+            "reason": reason
+        })
+        del self.decisions[:-MAX_DECISION_HISTORY]
+        return f"连接数 {old_target} -> {self.target}（{reason}，当前吞吐量 {_format_speed(throughput)}）"
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "target": self.target,
+                "connections": self.connections,
+                "peak": self.peak,
+                "best_target": self.best_target,
+                "best_throughput": self.best_throughput,
+                "total_requests": self.total_requests,
+                "total_errors": self.total_errors,
+                "maximum": self.maximum,
+                "base_rtt": self.base_rtt,
+                "decisions": len(self.decisions),
+                "budget_in_use": self.budget.in_use,
+                "budget_limit": self.budget.limit
+            }
+
+
+def _format_speed(value: float) -> str:
+    return f"{value / 1024 / 1024:.2f}MB/s"
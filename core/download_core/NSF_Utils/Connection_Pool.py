@@ -0,0 +1,695 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Connection_Pool.py - 共享连接池模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+共享连接池模块
+进程内所有下载引擎按源站(scheme, host, port)共享httpx客户端，
+连续下载同一CDN上的文件时可以直接复用已建立的TCP/TLS连接
+
+HTTP/2模式（download.http2）下各分段作为多路复用的流共用少数几个连接，
+每个源站的连接数和流数都有上限；服务器没有协商HTTP/2时该源站自动改用HTTP/1.1
+
+共享客户端不保存服务器设置的Cookie，避免一个任务收到的Cookie被带到其他任务的请求中，
+任务需要的Cookie只来自它自己的请求头
+"""
+
+import contextlib
+import http.cookiejar
+import logging
+import ssl
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from core.download_core.NSF_Utils.IP_Pinning import create_pinned_transport, create_pinned_async_transport
+
+try:
+    import h2  # noqa: F401  httpx的HTTP/2支持依赖h2
+    HAS_H2 = True
+except ImportError:
+    HAS_H2 = False
+
+# 默认配置
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 128   # 单个源站的最大连接数（疯狂模式最多128线程）
+DEFAULT_MAX_KEEPALIVE_PER_HOST = 32      # 单个源站保持的空闲连接数
+DEFAULT_KEEPALIVE_EXPIRY = 30.0          # 空闲连接保持时间（秒）
+DEFAULT_IDLE_TIMEOUT = 120.0             # 无人使用的客户端关闭时间（秒）
+REAPER_INTERVAL = 30.0                   # 清理线程检查间隔（秒）
+DEFAULT_H2_MAX_CONNECTIONS_PER_HOST = 2  # HTTP/2模式下单个源站的最大连接数
+DEFAULT_H2_MAX_STREAMS_PER_HOST = 64     # HTTP/2模式下单个源站同时打开的最大流数
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def is_http2_enabled() -> bool:
+    """读取设置中的HTTP/2分段开关（download.http2，默认关闭；未安装h2时总是关闭）"""
+    if not HAS_H2:
+        return False
+    try:
+        from client.ui.client_interface.settings.config import config
+        return bool(config.get_setting("download", "http2", False))
+    except ImportError:
+        return False
+    except Exception as e:
+        logging.warning(f"读取HTTP/2设置失败: {e}")
+        return False
+
+
+def get_origin(url: str) -> Tuple[str, str, int]:
+    """获取URL的源站(scheme, host, port)"""
+    parts = urlsplit(url)
+    scheme = (parts.scheme or "http").lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port or _DEFAULT_PORTS.get(scheme, 0)
+    return scheme, host, port
+
+
+class _RejectAllCookiesPolicy(http.cookiejar.DefaultCookiePolicy):
+    """拒绝保存和发送任何Cookie的策略（请求头中显式设置的Cookie不受影响）"""
+
+    def set_ok(self, cookie, request) -> bool:
+        return False
+
+    def return_ok(self, cookie, request) -> bool:
+        return False
+
+
+def _no_cookie_jar() -> http.cookiejar.CookieJar:
+    """共享客户端使用的Cookie容器，Set-Cookie不会被保存"""
+    return http.cookiejar.CookieJar(policy=_RejectAllCookiesPolicy())
+
+
+class _PoolEntry:
+    """连接池中的一个共享客户端
+
+    HTTP/2条目有多条通道，每条通道是一个只保持一个连接的客户端，
+    新的流放到流最少的通道上，所有通道都有流时再新建通道（不超过连接数上限）。
+    """
+
+    __slots__ = ("client", "refcount", "last_used", "requests", "http2", "lanes", "lane_streams",
+                 "stream_slots")
+
+    def __init__(self, client: httpx.Client, http2: bool = False, max_streams: int = 0):
+        self.client = client
+        self.refcount = 0
+        self.last_used = time.time()
+        self.requests = 0
+        self.http2 = http2
+        self.lanes = [client]
+        self.lane_streams = [0]
+        self.stream_slots = threading.BoundedSemaphore(max_streams) if http2 and max_streams > 0 else None
+
+    def close(self) -> None:
+        for client in self.lanes:
+            client.close()
+
+
+class SharedConnectionPool:
+    """按源站共享的httpx客户端池
+
+    - 同一源站、代理和证书校验设置的请求共用一个httpx.Client（即共用其连接池）
+    - 每个源站的连接数受max_connections_per_host限制
+    - 所有客户端共用一个SSL上下文，避免每个任务重复加载证书
+    - 后台线程关闭长时间无人引用的客户端
+    """
+
+    def __init__(self,
+                 max_connections_per_host: int = DEFAULT_MAX_CONNECTIONS_PER_HOST,
+                 max_keepalive_per_host: int = DEFAULT_MAX_KEEPALIVE_PER_HOST,
+                 keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 h2_max_connections_per_host: int = DEFAULT_H2_MAX_CONNECTIONS_PER_HOST,
+                 h2_max_streams_per_host: int = DEFAULT_H2_MAX_STREAMS_PER_HOST):
+        self.max_connections_per_host = max_connections_per_host
+        self.max_keepalive_per_host = max_keepalive_per_host
+        self.keepalive_expiry = keepalive_expiry
+        self.idle_timeout = idle_timeout
+        self.h2_max_connections_per_host = h2_max_connections_per_host
+        self.h2_max_streams_per_host = h2_max_streams_per_host
+        self.lock = threading.RLock()
+        self._entries: Dict[tuple, _PoolEntry] = {}
+        self._ssl_contexts: Dict[Tuple[bool, bool], Any] = {}
+        self._http1_origins = set()  # 没有协商出HTTP/2的源站，之后直接使用HTTP/1.1
+        self._reaper_thread = None
+        self._stop_event = threading.Event()
+
+        # 统计信息
+        self.clients_created = 0
+        self.clients_reused = 0
+        self.clients_evicted = 0
+        self.http2_fallbacks = 0
+
+    def _log_debug(self, message: str) -> None:
+        """记录调试日志"""
+        logging.debug(f"[SharedConnectionPool] {message}")
+
+    def get_ssl_context(self, verify: bool, http2: bool = False):
+        """获取共享的SSL上下文
+
+        httpcore建立连接时会在SSL上下文上设置ALPN协议列表，
+        HTTP/2客户端使用单独的上下文，避免与HTTP/1.1客户端互相覆盖。
+        """
+        context = self._ssl_contexts.get((verify, http2))
+        if context is None:
+            if hasattr(httpx, "create_ssl_context"):
+                context = httpx.create_ssl_context(verify=verify)
+            else:
+                context = ssl.create_default_context()
+                if not verify:
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+            self._ssl_contexts[(verify, http2)] = context
+        return context
+
+    def _create_client(self, proxy_url: Optional[str], verify: bool, timeout: float,
+                       http2: bool = False) -> httpx.Client:
+        """为一个源站创建客户端（HTTP/2时为一条只有一个连接的通道）"""
+        if http2:
+            limits = httpx.Limits(max_keepalive_connections=1, max_connections=1,
+                                  keepalive_expiry=self.keepalive_expiry)
+        else:
+            limits = httpx.Limits(
+                max_keepalive_connections=self.max_keepalive_per_host,
+                max_connections=self.max_connections_per_host,
+                keepalive_expiry=self.keepalive_expiry
+            )
+        ssl_context = self.get_ssl_context(verify, http2)
+        # 不使用代理时按固定IP表建立连接（见IP_Pinning），经代理时由代理负责解析
+        transport = None if proxy_url else create_pinned_transport(ssl_context, limits, http2=http2)
+        if transport is not None:
+            return httpx.Client(transport=transport, timeout=timeout, follow_redirects=True,
+                                cookies=_no_cookie_jar())
+        return httpx.Client(
+            verify=ssl_context,
+            proxy=proxy_url,
+            timeout=timeout,
+            limits=limits,
+            http2=http2,
+            follow_redirects=True,
+            cookies=_no_cookie_jar()
+        )
+
+    def create_async_client(self, proxy_url: Optional[str], verify: bool, timeout: Any,
+                            limits: httpx.Limits, http2: bool = False) -> httpx.AsyncClient:
+        """创建供NSF异步引擎使用的AsyncClient（需在事件循环中使用，由调用者关闭）
+
+        异步客户端不能放进本池共享，但与池中的客户端使用相同的SSL上下文、固定IP后端和Cookie策略。
+
+        Args:
+            proxy_url: 代理地址
+            verify: 是否校验SSL证书
+            timeout: 超时时间（秒或httpx.Timeout）
+            limits: 连接数限制
+            http2: 是否使用HTTP/2
+
+        Returns:
+            httpx.AsyncClient: 异步客户端
+        """
+        ssl_context = self.get_ssl_context(verify, http2)
+        # 不使用代理时按固定IP表建立连接，经代理时由代理负责解析
+        transport = None if proxy_url else create_pinned_async_transport(ssl_context, limits, http2=http2)
+        if transport is not None:
+            return httpx.AsyncClient(transport=transport, timeout=timeout, follow_redirects=True,
+                                     cookies=_no_cookie_jar())
+        return httpx.AsyncClient(
+            verify=ssl_context,
+            proxy=proxy_url,
+            timeout=timeout,
+            limits=limits,
+            http2=http2,
+            follow_redirects=True,
+            cookies=_no_cookie_jar()
+        )
+
+    def acquire(self, url: str, proxy_url: Optional[str] = None, verify: bool = True,
+                timeout: float = 30.0, http2: bool = False) -> Tuple[tuple, httpx.Client]:
+        """借用某个源站的共享客户端
+
+        Args:
+            url: 请求URL
+            proxy_url: 代理地址
+            verify: 是否校验SSL证书
+            timeout: 默认超时时间（秒）
+            http2: 是否使用HTTP/2（只对https源站有效，已知不支持HTTP/2的源站使用HTTP/1.1）
+
+        Returns:
+            Tuple[tuple, httpx.Client]: (池键, 客户端)，归还时需要传入池键；池键最后一项表示是否为HTTP/2
+        """
+        origin = get_origin(url)
+        http2 = bool(http2 and HAS_H2 and origin[0] == "https" and origin not in self._http1_origins)
+        key = origin + (proxy_url or "", bool(verify), http2)
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.client.is_closed:
+                entry = _PoolEntry(self._create_client(proxy_url, verify, timeout, http2),
+                                   http2, self.h2_max_streams_per_host)
+                self._entries[key] = entry
+                self.clients_created += 1
+                self._log_debug(f"创建源站客户端: {key[0]}://{key[1]}:{key[2]}{' (HTTP/2)' if http2 else ''}")
+            else:
+                self.clients_reused += 1
+            entry.refcount += 1
+            entry.last_used = time.time()
+            self._ensure_reaper()
+            return key, entry.client
+
+    @contextlib.contextmanager
+    def http2_lane(self, key: tuple, timeout: float = 30.0):
+        """为一个HTTP/2流分配通道
+
+        源站的流数达到上限时等待其他流结束；通道按流数最少优先，
+        所有通道都有流且未达到连接数上限时新建通道。
+
+        Args:
+            key: acquire返回的池键
+            timeout: 等待流名额的最长时间（秒）
+
+        Yields:
+            httpx.Client: 本次流使用的通道客户端
+        """
+        entry = self._entries.get(key)
+        if entry is None or not entry.http2:
+            raise ValueError("不是HTTP/2源站客户端")
+        if not entry.stream_slots.acquire(timeout=timeout):
+            raise httpx.PoolTimeout(f"等待HTTP/2流名额超时: {key[1]}")
+        try:
+            with self.lock:
+                index = min(range(len(entry.lanes)), key=entry.lane_streams.__getitem__)
+                if entry.lane_streams[index] > 0 and len(entry.lanes) < self.h2_max_connections_per_host:
+                    entry.lanes.append(self._create_client(key[3] or None, key[4], entry.client.timeout.read, True))
+                    entry.lane_streams.append(0)
+                    index = len(entry.lanes) - 1
+                    self._log_debug(f"{key[1]} 新建HTTP/2连接，共 {len(entry.lanes)} 个")
+                entry.lane_streams[index] += 1
+            try:
+                yield entry.lanes[index]
+            finally:
+                with self.lock:
+                    entry.lane_streams[index] -= 1
+        finally:
+            entry.stream_slots.release()
+
+    def mark_http1(self, key: tuple) -> None:
+        """记录源站没有协商出HTTP/2，之后借用该源站时改用HTTP/1.1客户端"""
+        origin = key[:3]
+        with self.lock:
+            if origin in self._http1_origins:
+                return
+            self._http1_origins.add(origin)
+            self.http2_fallbacks += 1
+        logging.info(f"{origin[1]} 未协商HTTP/2，改用HTTP/1.1")
+
+    def prefer_http1(self, url: str) -> None:
+        """按以往记录直接对源站使用HTTP/1.1（不计入回退次数）"""
+        with self.lock:
+            self._http1_origins.add(get_origin(url))
+
+    def is_http1_origin(self, url: str) -> bool:
+        """源站是否已确定只使用HTTP/1.1"""
+        with self.lock:
+            return get_origin(url) in self._http1_origins
+
+    def release(self, key: tuple) -> None:
+        """归还借用的客户端（连接保留在池中供后续任务复用）"""
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.refcount = max(0, entry.refcount - 1)
+                entry.last_used = time.time()
+
+    def touch(self, key: tuple) -> None:
+        """记录一次请求（用于空闲判断）"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.last_used = time.time()
+            entry.requests += 1
+
+    def evict_idle(self, idle_timeout: Optional[float] = None) -> int:
+        """关闭无人引用且空闲超时的客户端
+
+        Returns:
+            int: 关闭的客户端数
+        """
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+        now = time.time()
+        to_close = []
+        with self.lock:
+            for key, entry in list(self._entries.items()):
+                if entry.refcount == 0 and now - entry.last_used >= idle_timeout:
+                    to_close.append(entry)
+                    del self._entries[key]
+            self.clients_evicted += len(to_close)
+        for entry in to_close:
+            try:
+                entry.close()
+            except Exception as e:
+                self._log_debug(f"关闭空闲客户端失败: {e}")
+        if to_close:
+            self._log_debug(f"已关闭 {len(to_close)} 个空闲源站客户端")
+        return len(to_close)
+
+    def _ensure_reaper(self) -> None:
+        """启动空闲清理线程（需持有锁）"""
+        if self._reaper_thread is None or not self._reaper_thread.is_alive():
+            self._stop_event.clear()
+            self._reaper_thread = threading.Thread(target=self._reaper_loop, name="NSF-PoolReaper", daemon=True)
+            self._reaper_thread.start()
+
+    def _reaper_loop(self) -> None:
+        """空闲清理线程"""
+        while not self._stop_event.wait(REAPER_INTERVAL):
+            try:
+                self.evict_idle()
+                with self.lock:
+                    if not self._entries:
+                        self._reaper_thread = None
+                        return
+            except Exception as e:
+                logging.warning(f"连接池清理出错: {e}")
+
+    def close_all(self) -> None:
+        """关闭所有客户端（程序退出时调用）"""
+        self._stop_event.set()
+        with self.lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            try:
+                entry.close()
+            except Exception:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接池统计信息"""
+        with self.lock:
+            hosts = {
+                f"{key[0]}://{key[1]}:{key[2]}{' (HTTP/2)' if entry.http2 else ''}": {
+                    "refcount": entry.refcount,
+                    "requests": entry.requests,
+                    "connections": len(entry.lanes) if entry.http2 else None,
+                    "streams": sum(entry.lane_streams) if entry.http2 else None
+                }
+                for key, entry in self._entries.items()
+            }
+            http1_origins = [f"{origin[0]}://{origin[1]}:{origin[2]}" for origin in self._http1_origins]
+        return {
+            "hosts": hosts,
+            "clients_created": self.clients_created,
+            "clients_reused": self.clients_reused,
+            "clients_evicted": self.clients_evicted,
+            "http2_fallbacks": self.http2_fallbacks,
+            "http1_origins": http1_origins
+        }
+
+
+class PooledClient:
+    """下载引擎使用的客户端句柄
+
+    提供与httpx.Client相同的常用请求方法，按请求URL从共享池借用源站客户端，
+    并在每个请求上附加本任务的默认请求头；close()只归还借用，不关闭共享连接，
+    关闭后再次发起请求会重新借用。
+    http2为True时请求作为HTTP/2流分配到源站的通道上，响应不是HTTP/2时该源站改用HTTP/1.1。
+    """
+
+    def __init__(self, pool: SharedConnectionPool, headers: Dict[str, str] = None,
+                 proxy_url: Optional[str] = None, verify: bool = True, timeout: float = 30.0,
+                 http2: bool = False):
+        self.pool = pool
+        self.headers = dict(headers or {})
+        self.proxy_url = proxy_url
+        self.verify = verify
+        self.timeout = timeout
+        self.http2 = http2
+        self._borrowed: Dict[tuple, httpx.Client] = {}
+        self._lock = threading.Lock()
+        self.is_closed = False
+
+    def _client_for(self, url) -> Tuple[tuple, httpx.Client]:
+        """获取URL对应的共享客户端"""
+        origin = get_origin(str(url))
+        with self._lock:
+            # 关闭只是归还借用，之后再次使用时重新借用（暂停后恢复的任务）
+            self.is_closed = False
+            for key, client in self._borrowed.items():
+                if key[:3] == origin:
+                    break
+            else:
+                key, client = self.pool.acquire(str(url), self.proxy_url, self.verify, self.timeout, self.http2)
+                self._borrowed[key] = client
+        self.pool.touch(key)
+        return key, client
+
+    def _merge_headers(self, headers: Optional[Dict[str, str]]) -> Dict[str, str]:
+        """合并任务默认请求头和本次请求头"""
+        if not headers:
+            return dict(self.headers)
+        merged = dict(self.headers)
+        merged.update(headers)
+        return merged
+
+    def _check_protocol(self, key: tuple, response: httpx.Response) -> None:
+        """HTTP/2客户端收到非HTTP/2响应时，该源站改用HTTP/1.1（下次请求重新借用）"""
+        if response.http_version != "HTTP/2":
+            self.pool.mark_http1(key)
+            with self._lock:
+                if self._borrowed.pop(key, None) is None:
+                    return
+            self.pool.release(key)
+
+    def request(self, method: str, url, headers: Dict[str, str] = None, **kwargs) -> httpx.Response:
+        key, client = self._client_for(url)
+        if not key[-1]:
+            return client.request(method, url, headers=self._merge_headers(headers), **kwargs)
+        with self.pool.http2_lane(key, self.timeout) as lane:
+            response = lane.request(method, url, headers=self._merge_headers(headers), **kwargs)
+        self._check_protocol(key, response)
+        return response
+
+    def stream(self, method: str, url, headers: Dict[str, str] = None, **kwargs):
+        key, client = self._client_for(url)
+        if not key[-1]:
+            return client.stream(method, url, headers=self._merge_headers(headers), **kwargs)
+        return self._http2_stream(key, method, url, self._merge_headers(headers), kwargs)
+
+    @contextlib.contextmanager
+    def _http2_stream(self, key: tuple, method: str, url, headers: Dict[str, str], kwargs: dict):
+        """在源站的HTTP/2通道上打开一个流"""
+        with self.pool.http2_lane(key, self.timeout) as lane:
+            with lane.stream(method, url, headers=headers, **kwargs) as response:
+                self._check_protocol(key, response)
+                yield response
+
+    def get(self, url, **kwargs) -> httpx.Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs) -> httpx.Response:
+        return self.request("HEAD", url, **kwargs)
+
+    def close(self) -> None:
+        """归还所有借用的源站客户端"""
+        with self._lock:
+            if self.is_closed:
+                return
+            self.is_closed = True
+            borrowed = list(self._borrowed.keys())
+            self._borrowed.clear()
+        for key in borrowed:
+            self.pool.release(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# 全局连接池实例
+shared_pool = SharedConnectionPool()
+
+
+def get_shared_pool() -> SharedConnectionPool:
+    """获取全局共享连接池"""
+    return shared_pool
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """获取全局连接池统计信息"""
+    return shared_pool.get_stats()
+
+
+# 测试代码
+if __name__ == "__main__":
+    # 本地TLS服务对比HTTP/2多路复用分段和HTTP/1.1每段一个连接：
+    # h2服务（asyncio+h2，ALPN只提供h2）和HTTP/1.1服务（ALPN只提供http/1.1）提供同一份随机数据，
+    # 用PooledClient按8/32/64个分段并发下载，逐段与原始数据比对，记录耗时、吞吐量和服务端接受的连接数；
+    # 最后用HTTP/2客户端请求HTTP/1.1服务，检查回退。证书由openssl命令行临时生成。
+    # 运行: python -m core.download_core.NSF_Utils.Connection_Pool
+    import asyncio
+    import concurrent.futures
+    import http.server
+    import os
+    import re
+    import socketserver
+    import subprocess
+    import tempfile
+
+    if not HAS_H2:
+        raise SystemExit("需要h2: pip install httpx[http2]")
+
+    import h2.config
+    import h2.connection
+    import h2.events
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    MB = 1024 * 1024
+    PAYLOAD = os.urandom(64 * MB)
+    cert_dir = tempfile.mkdtemp()
+    cert_file, key_file = os.path.join(cert_dir, "cert.pem"), os.path.join(cert_dir, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=localhost", "-keyout", key_file, "-out", cert_file],
+                   check=True, capture_output=True)
+
+    def _server_context(alpn):
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert_file, key_file)
+        context.set_alpn_protocols(alpn)
+        return context
+
+    def _parse_range(value):
+        match = re.match(r"bytes=(\d+)-(\d+)", value or "")
+        return int(match.group(1)), int(match.group(2))
+
+    class H2Protocol(asyncio.Protocol):
+        connections = 0
+
+        def connection_made(self, transport):
+            H2Protocol.connections += 1
+            self.transport = transport
+            self.conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+            self.conn.initiate_connection()
+            self.pending = {}  # stream_id -> [起始偏移, 结束偏移]
+            self.transport.write(self.conn.data_to_send())
+
+        def data_received(self, data):
+            try:
+                events = self.conn.receive_data(data)
+            except Exception:
+                self.transport.close()
+                return
+            for event in events:
+                if isinstance(event, h2.events.RequestReceived):
+                    headers = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v
+                               for k, v in event.headers}
+                    start, end = _parse_range(headers.get("range"))
+                    self.conn.send_headers(event.stream_id, [
+                        (":status", "206"),
+                        ("content-length", str(end - start + 1)),
+                        ("accept-ranges", "bytes"),
+                    ])
+                    self.pending[event.stream_id] = [start, end]
+                elif isinstance(event, h2.events.DataReceived):
+                    self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamReset):
+                    self.pending.pop(event.stream_id, None)
+            self._send_pending()
+
+        def _send_pending(self):
+            # 按流控窗口轮流发送各个流的数据
+            for stream_id in list(self.pending):
+                start, end = self.pending[stream_id]
+                while start <= end:
+                    window = min(self.conn.local_flow_control_window(stream_id), self.conn.max_outbound_frame_size)
+                    if window <= 0:
+                        break
+                    size = min(window, end - start + 1)
+                    self.conn.send_data(stream_id, PAYLOAD[start:start + size])
+                    start += size
+                if start > end:
+                    self.conn.end_stream(stream_id)
+                    del self.pending[stream_id]
+                else:
+                    self.pending[stream_id][0] = start
+            self.transport.write(self.conn.data_to_send())
+
+    class RangeHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            start, end = _parse_range(self.headers.get("Range"))
+            self.send_response(206)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            self.wfile.write(PAYLOAD[start:end + 1])
+
+    class H1Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+        daemon_threads = True
+        request_queue_size = 1024
+        connections = 0
+
+        def get_request(self):
+            sock, address = super().get_request()
+            H1Server.connections += 1
+            return self.context.wrap_socket(sock, server_side=True), address
+
+    h1_server = H1Server(("127.0.0.1", 0), RangeHandler)
+    h1_server.context = _server_context(["http/1.1"])
+    threading.Thread(target=h1_server.serve_forever, daemon=True).start()
+
+    loop = asyncio.new_event_loop()
+    h2_server = loop.run_until_complete(
+        loop.create_server(H2Protocol, "127.0.0.1", 0, ssl=_server_context(["h2"]), backlog=1024))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    h2_url = f"https://127.0.0.1:{h2_server.sockets[0].getsockname()[1]}/file.bin"
+    h1_url = f"https://127.0.0.1:{h1_server.server_address[1]}/file.bin"
+
+    def _download(url, segments, http2):
+        pool = SharedConnectionPool()
+        client = PooledClient(pool, verify=False, timeout=60, http2=http2)
+        size = len(PAYLOAD) // segments
+        ranges = [(i * size, len(PAYLOAD) - 1 if i == segments - 1 else (i + 1) * size - 1)
+                  for i in range(segments)]
+        versions = set()
+
+        def fetch(byte_range):
+            start, end = byte_range
+            buffer = bytearray()
+            with client.stream("GET", url, headers={"Range": f"bytes={start}-{end}"}) as response:
+                versions.add(response.http_version)
+                for chunk in response.iter_bytes():
+                    buffer += chunk
+            assert buffer == PAYLOAD[start:end + 1], f"分段{start}-{end}数据不一致"
+            return len(buffer)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=segments) as executor:
+            total = sum(executor.map(fetch, ranges))
+        stats = pool.get_stats()
+        client.close()
+        pool.close_all()
+        assert total == len(PAYLOAD), total
+        return versions, stats
+
+    print(f"{'分段':>6}{'协议':>10}{'耗时':>9}{'吞吐量':>12}{'服务端连接数':>12}")
+    for segments in (8, 32, 64):
+        for label, url, http2, server in (("HTTP/1.1", h1_url, False, H1Server), ("HTTP/2", h2_url, True, H2Protocol)):
+            connections_before = server.connections
+            started = time.perf_counter()
+            versions, _ = _download(url, segments, http2)
+            elapsed = time.perf_counter() - started
+            assert versions == {label}, versions
+            print(f"{segments:>6}{label:>10}{elapsed:>8.2f}s{len(PAYLOAD) / elapsed / MB:>9.0f}MB/s"
+                  f"{server.connections - connections_before:>12}")
+
+    versions, stats = _download(h1_url, 8, True)
+    print(f"HTTP/2客户端请求HTTP/1.1服务: 协议 {sorted(versions)}, 回退 {stats['http2_fallbacks']} 次")
+    assert stats["http2_fallbacks"] == 1 and versions == {"HTTP/1.1"}
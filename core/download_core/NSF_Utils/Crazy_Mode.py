@@ -156,8 +156,8 @@ class CrazyModeManager:
                     # 调用原始方法
                     result = original_execute()
                     
-                    # 恢复原始executor
-                    if not self_engine.executor._shutdown:
+                    # 恢复原始executor（下载结束时引擎已关闭线程池并置为None）
+                    if self_engine.executor is not None and not self_engine.executor._shutdown:
                         self_engine.executor = original_executor
                     
                     return result
@@ -68,67 +68,210 @@ PUBLIC_DNS_SERVERS = [
     ('119.29.29.29', 'DNSPod')
 ]
 
+# DNS缓存配置
+DNS_MIN_TTL = 30             # 记录TTL的下限（秒）
+DNS_NEGATIVE_TTL = 30        # 解析失败结果的缓存时间（秒）
+DNS_STALE_TTL = 600          # 过期后仍先返回旧结果（同时后台刷新）的时间（秒）
+DNS_QUERY_WAIT = 10.0        # 等待同一域名进行中查询的最长时间（秒）
+DNS_MAX_ENTRIES = 1024       # 缓存条目数超过该值时清理完全过期的条目
+
+# IPv6连通性检测
+IPV6_PROBE_ADDRESS = ('2001:4860:4860::8888', 53)  # 用于查找路由的全局IPv6地址（不发送数据）
+IPV6_ROUTE_TTL = 60.0        # 检测结果的缓存时间（秒），网络切换后重新检测
+
+_ipv6_route = (False, 0.0)   # (是否有IPv6路由, 检测时间)
+
+def has_ipv6_route() -> bool:
+    """本机是否有到公网IPv6地址的路由
+
+    socket.has_ipv6只说明Python编译时支持IPv6，不代表本机有IPv6网络。
+    这里对全局IPv6地址做一次UDP connect：只查路由表、不发送数据包，没有IPv6路由时立即失败。
+    """
+    global _ipv6_route
+    routable, checked_at = _ipv6_route
+    now = time.monotonic()
+    if checked_at and now - checked_at < IPV6_ROUTE_TTL:
+        return routable
+
+    routable = False
+    if socket.has_ipv6:
+        try:
+            with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+                sock.connect(IPV6_PROBE_ADDRESS)
+                routable = True
+        except OSError:
+            routable = False
+    _ipv6_route = (routable, now)
+    return routable
+
+class _DNSCacheEntry:
+    """DNS缓存条目（ips为空表示解析失败的否定缓存）"""
+    
+    __slots__ = ("ips", "expire_time", "stale_until")
+    
+    def __init__(self, ips: Tuple[str, ...], expire_time: float, stale_until: float):
+        self.ips = ips
+        self.expire_time = expire_time
+        self.stale_until = stale_until
+
+class _DNSQuery:
+    """进行中的一次解析，同一域名的并发请求等待并共享它的结果"""
+    
+    __slots__ = ("event", "ips")
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.ips: Tuple[str, ...] = ()
+
 class DNSResolver:
-    """DNS解析器，支持多服务器查询和缓存"""
+    """DNS解析器，支持多服务器查询和缓存
+    
+    - 锁只保护缓存表，解析在锁外进行，不同域名的查询互不阻塞
+    - 同一域名同时只有一个查询，其余请求等待该查询的结果
+    - 解析失败的结果短时间缓存，避免对不存在的域名反复查询
+    - 缓存过期后一段时间内先返回旧结果，同时在后台刷新
+    - 支持A和AAAA记录
+    """
     
     def __init__(self, cache_ttl: int = 300):
         """初始化DNS解析器
         
         Args:
-            cache_ttl: 缓存有效期（秒）
+            cache_ttl: 缓存有效期上限（秒），dnspython返回的记录TTL更短时使用记录TTL
         """
-        self.cache = {}  # 域名 -> (IP列表, 过期时间)
+        self.cache: Dict[Tuple[str, str], _DNSCacheEntry] = {}  # (域名, 记录类型) -> 缓存条目
+        self.inflight: Dict[Tuple[str, str], _DNSQuery] = {}    # (域名, 记录类型) -> 进行中的查询
         self.cache_ttl = cache_ttl
-        self.lock = threading.RLock()
+        self.lock = threading.Lock()
         self.dns_servers = PUBLIC_DNS_SERVERS
+        
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.failures = 0
     
     def _log_debug(self, message: str) -> None:
         """记录调试信息"""
         logging.debug(f"[DNSResolver] {message}")
     
-    def resolve(self, domain: str, force_refresh: bool = False) -> List[str]:
+    def resolve(self, domain: str, force_refresh: bool = False, record_type: str = 'A') -> List[str]:
         """解析域名为IP地址列表
         
         Args:
             domain: 要解析的域名
             force_refresh: 是否强制刷新缓存
+            record_type: 记录类型，'A'或'AAAA'
             
         Returns:
-            IP地址列表
+            IP地址列表，解析失败时为空列表
         """
+        key = (domain.lower(), record_type)
+        now = time.time()
+        
         with self.lock:
-            now = time.time()
-            
-            # 检查缓存
-            if not force_refresh and domain in self.cache:
-                ips, expire_time = self.cache[domain]
-                if now < expire_time:
-                    return ips
-            
-            # 缓存未命中或已过期，执行解析
-            ips = self._resolve_domain(domain)
+            entry = self.cache.get(key)
+            if entry is not None and not force_refresh:
+                if now < entry.expire_time:
+                    if entry.ips:
+                        self.hits += 1
+                    else:
+                        self.negative_hits += 1
+                    return list(entry.ips)
+                
+                if entry.ips and now < entry.stale_until:
+                    # 旧结果仍可用：直接返回，后台刷新
+                    self.stale_hits += 1
+                    if key not in self.inflight:
+                        query = self.inflight[key] = _DNSQuery()
+                        self.refreshes += 1
+                        threading.Thread(target=self._run_query, args=(key, query),
+                                         name="NSF-DNSRefresh", daemon=True).start()
+                    return list(entry.ips)
+            
+            query = self.inflight.get(key)
+            owner = query is None
+            if owner:
+                query = self.inflight[key] = _DNSQuery()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        
+        if owner:
+            return list(self._run_query(key, query))
+        
+        if not query.event.wait(DNS_QUERY_WAIT):
+            self._log_debug(f"等待 {domain} 的解析结果超时")
+        return list(query.ips)
+    
+    def resolve_all(self, domain: str, force_refresh: bool = False) -> List[str]:
+        """解析域名的IPv4和IPv6地址（IPv4在前，本机没有IPv6路由时只解析IPv4）
+        
+        Args:
+            domain: 要解析的域名
+            force_refresh: 是否强制刷新缓存
             
-            # 更新缓存
+        Returns:
+            IP地址列表
+        """
+        ips = self.resolve(domain, force_refresh, 'A')
+        if has_ipv6_route():
+            ips.extend(self.resolve(domain, force_refresh, 'AAAA'))
+        return ips
+    
+    def _run_query(self, key: Tuple[str, str], query: _DNSQuery) -> Tuple[str, ...]:
+        """执行一次查询并写入缓存，完成后唤醒等待同一查询的请求"""
+        domain, record_type = key
+        try:
+            ips, ttl = self._resolve_domain(domain, record_type)
+        except Exception as e:
+            self._log_debug(f"解析 {domain} 出错: {e}")
+            ips, ttl = [], None
+        
+        now = time.time()
+        with self.lock:
             if ips:
-                self.cache[domain] = (ips, now + self.cache_ttl)
+                ttl = self.cache_ttl if ttl is None else max(DNS_MIN_TTL, min(ttl, self.cache_ttl))
+                self.cache[key] = _DNSCacheEntry(tuple(ips), now + ttl, now + ttl + DNS_STALE_TTL)
+            else:
+                self.failures += 1
+                old = self.cache.get(key)
+                if old is not None and old.ips and now < old.stale_until:
+                    # 刷新失败：旧结果继续使用一段时间，期间不再重试
+                    old.expire_time = min(now + DNS_NEGATIVE_TTL, old.stale_until)
+                    ips = list(old.ips)
+                else:
+                    self.cache[key] = _DNSCacheEntry((), now + DNS_NEGATIVE_TTL, now + DNS_NEGATIVE_TTL)
+            
+            if len(self.cache) > DNS_MAX_ENTRIES:
+                for expired in [k for k, v in self.cache.items() if now >= v.stale_until]:
+                    del self.cache[expired]
             
-            return ips
+            self.inflight.pop(key, None)
+            query.ips = tuple(ips)
+        
+        query.event.set()
+        return query.ips
     
-    def _resolve_domain(self, domain: str) -> List[str]:
+    def _resolve_domain(self, domain: str, record_type: str = 'A') -> Tuple[List[str], Optional[int]]:
         """执行实际的域名解析
         
         Args:
             domain: 要解析的域名
+            record_type: 记录类型，'A'或'AAAA'
             
         Returns:
-            IP地址列表
+            (IP地址列表, 记录TTL)，TTL未知时为None
         """
         ips = []
         
         # 首先尝试使用dnspython库（如果可用）
         if HAS_DNSPYTHON:
             try:
-                self._log_debug(f"使用dnspython解析 {domain}")
+                self._log_debug(f"使用dnspython解析 {domain} ({record_type})")
                 # 创建解析器
                 resolver = dns.resolver.Resolver()
                 
@@ -141,25 +284,47 @@ class DNSResolver:
                 resolver.lifetime = 4.0
                 
                 # 执行查询
-                answers = resolver.resolve(domain, 'A')
+                answers = resolver.resolve(domain, record_type)
                 for rdata in answers:
                     ips.append(str(rdata))
                 
                 self._log_debug(f"dnspython解析结果: {ips}")
-                return ips
+                return ips, answers.rrset.ttl if answers.rrset is not None else None
             except Exception as e:
                 self._log_debug(f"dnspython解析失败: {e}")
         
         # 回退到标准socket解析
         try:
-            self._log_debug(f"使用标准socket解析 {domain}")
-            socket_ips = socket.gethostbyname_ex(domain)[2]
-            ips.extend(socket_ips)
+            self._log_debug(f"使用标准socket解析 {domain} ({record_type})")
+            if record_type == 'AAAA':
+                for info in socket.getaddrinfo(domain, None, socket.AF_INET6, socket.SOCK_STREAM):
+                    if info[4][0] not in ips:
+                        ips.append(info[4][0])
+            else:
+                ips.extend(socket.gethostbyname_ex(domain)[2])
             self._log_debug(f"标准socket解析结果: {ips}")
         except Exception as e:
             self._log_debug(f"标准socket解析失败: {e}")
         
-        return ips
+        return ips, None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self.lock:
+            return {
+                "entries": len(self.cache),
+                "inflight": len(self.inflight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "negative_hits": self.negative_hits,
+                "coalesced": self.coalesced,
+                "refreshes": self.refreshes,
+                "failures": self.failures
+            }
+
+# 全局DNS解析器实例（进程内共享缓存）
+dns_resolver = DNSResolver()
 
 class CDNDetector:
     """CDN检测器，识别CDN提供商并优化连接"""
@@ -353,7 +518,8 @@ class ConnectionTester:
         
         try:
             # 创建socket
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_STREAM)
             sock.settimeout(self.timeout)
             
             # 连接
@@ -471,10 +637,11 @@ class CDNOptimizer:
     
     def __init__(self):
         """初始化CDN优化器"""
-        self.dns_resolver = DNSResolver()
+        self.dns_resolver = dns_resolver
         self.cdn_detector = CDNDetector()
         self.connection_tester = ConnectionTester()
         self.ip_cache = {}  # 域名 -> (最佳IP, 过期时间)
+        self.ranked_ip_cache = {}  # 域名 -> 连接成功的[(IP, 延迟)]，按延迟排序
         self.cache_ttl = 1800  # 30分钟
         self.lock = threading.RLock()
     
@@ -497,6 +664,7 @@ class CDNOptimizer:
             'original_headers': headers or {},
             'headers': headers.copy() if headers else {},
             'best_ip': None,
+            'ranked_ips': [],
             'cdn_provider': None,
             'optimizations': {}
         }
@@ -517,12 +685,13 @@ class CDNOptimizer:
                     best_ip, expire_time = self.ip_cache[domain]
                     if now < expire_time:
                         result['best_ip'] = best_ip
+                        result['ranked_ips'] = self.ranked_ip_cache.get(domain, [(best_ip, None)])
                         self._log_debug(f"使用缓存的最佳IP: {best_ip}")
             
             # 如果没有缓存的最佳IP，执行优化
             if not result['best_ip']:
                 # 解析域名
-                ips = self.dns_resolver.resolve(domain)
+                ips = self.dns_resolver.resolve_all(domain)
                 
                 if ips:
                     self._log_debug(f"域名 {domain} 解析结果: {ips}")
@@ -536,10 +705,12 @@ class CDNOptimizer:
                     if successful_results:
                         best_result = successful_results[0]  # 延迟最低的结果
                         result['best_ip'] = best_result['ip']
+                        result['ranked_ips'] = [(r['ip'], r['latency']) for r in successful_results]
                         
                         # 缓存最佳IP
                         with self.lock:
                             self.ip_cache[domain] = (best_result['ip'], now + self.cache_ttl)
+                            self.ranked_ip_cache[domain] = result['ranked_ips']
                         
                         self._log_debug(f"找到最佳IP: {best_result['ip']}，延迟: {best_result['latency']:.3f}秒")
             
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Download_Log.py - 下载日志缓冲模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+下载日志缓冲模块
+每个下载任务的日志先写入内存中的环形缓冲区，由一个进程级后台线程批量写入文件；
+任务结束、程序退出或出现未捕获异常时立即刷新并同步到磁盘。
+低于设定级别的日志在调用处直接丢弃，不做格式化和加锁。
+"""
+
+import atexit
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+from typing import Optional, Union
+
+# 日志级别
+LEVEL_DEBUG = 10
+LEVEL_INFO = 20
+LEVEL_WARNING = 30
+LEVEL_ERROR = 40
+LEVEL_OFF = 100
+
+LEVEL_NAMES = {
+    "debug": LEVEL_DEBUG,
+    "info": LEVEL_INFO,
+    "warning": LEVEL_WARNING,
+    "error": LEVEL_ERROR,
+    "off": LEVEL_OFF
+}
+
+# 默认配置
+DEFAULT_CAPACITY = 8192        # 环形缓冲区最多保留的日志行数
+FLUSH_INTERVAL = 1.0           # 后台刷新间隔（秒）
+
+
+def parse_level(level: Union[str, int, None], default: int = LEVEL_INFO) -> int:
+    """把配置中的级别名称或数值转换为日志级别"""
+    if level is None:
+        return default
+    if isinstance(level, int):
+        return level
+    return LEVEL_NAMES.get(str(level).strip().lower(), default)
+
+
+def get_configured_level() -> int:
+    """读取内核配置中的下载日志级别（download_cfg.downloadLogLevel）"""
+    try:
+        from core.download_core.core.config import download_cfg
+        return parse_level(getattr(download_cfg, "downloadLogLevel", None))
+    except Exception as e:
+        logging.debug(f"读取下载日志级别失败: {e}")
+        return LEVEL_INFO
+
+
+class DownloadLogSink:
+    """单个下载任务的缓冲日志
+
+    写入只是向deque追加一行（线程安全，不持有锁、不做系统调用），
+    缓冲区满时丢弃最旧的行并计数，避免后台线程跟不上时无限占用内存。
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], level: Optional[int] = None,
+                 capacity: int = DEFAULT_CAPACITY):
+        """初始化日志
+
+        Args:
+            path: 日志文件路径
+            level: 日志级别，默认读取配置
+            capacity: 环形缓冲区行数
+        """
+        self.path = str(path)
+        self.level = get_configured_level() if level is None else parse_level(level)
+        self.capacity = capacity
+        self._buffer = collections.deque(maxlen=capacity)
+        self._write_lock = threading.Lock()
+        self._file = None
+        self.closed = False
+        self.dropped = 0
+        _flusher.register(self)
+
+    def enabled_for(self, level: int) -> bool:
+        """该级别的日志是否会被记录"""
+        return level >= self.level and not self.closed
+
+    def log(self, message: str, level: int = LEVEL_DEBUG) -> None:
+        """记录一行带时间戳的日志"""
+        if level < self.level or self.closed:
+            return
+        buffer = self._buffer
+        if len(buffer) >= self.capacity:
+            self.dropped += 1
+        buffer.append(f"[{time.strftime('%H:%M:%S', time.localtime())}] {message}\n")
+
+    def write_raw(self, text: str) -> None:
+        """记录原样文本（用于文件头和任务总结），不受日志级别限制"""
+        if not self.closed:
+            self._buffer.append(text)
+
+    def flush(self, sync: bool = False) -> None:
+        """把缓冲区中的日志写入文件
+
+        Args:
+            sync: 是否同步到磁盘（fsync）
+        """
+        with self._write_lock:
+            lines = []
+            buffer = self._buffer
+            while True:
+                try:
+                    lines.append(buffer.popleft())
+                except IndexError:
+                    break
+            if not lines and not sync:
+                return
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                if self.dropped:
+                    self._file.write(f"[日志] 缓冲区已满，丢弃了 {self.dropped} 行日志\n")
+                    self.dropped = 0
+                if lines:
+                    self._file.write("".join(lines))
+                self._file.flush()
+                if sync:
+                    os.fsync(self._file.fileno())
+            except Exception as e:
+                logging.error(f"写入下载日志失败: {e}")
+
+    def close(self) -> None:
+        """刷新、同步并关闭日志文件"""
+        if self.closed:
+            return
+        self.flush(sync=True)
+        self.closed = True
+        _flusher.unregister(self)
+        with self._write_lock:
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except Exception:
+                    pass
+                self._file = None
+
+
+class _LogFlusher:
+    """进程级日志刷新线程，所有下载任务共用"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sinks = weakref.WeakSet()
+        self._thread = None
+        self._hooks_installed = False
+
+    def register(self, sink: DownloadLogSink) -> None:
+        with self.lock:
+            self.sinks.add(sink)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="NSF-LogFlusher", daemon=True)
+                self._thread.start()
+            if not self._hooks_installed:
+                self._install_hooks()
+
+    def unregister(self, sink: DownloadLogSink) -> None:
+        with self.lock:
+            self.sinks.discard(sink)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush_all()
+
+    def flush_all(self, sync: bool = False) -> None:
+        """刷新所有任务的日志"""
+        with self.lock:
+            sinks = list(self.sinks)
+        for sink in sinks:
+            try:
+                sink.flush(sync=sync)
+            except Exception as e:
+                logging.debug(f"刷新下载日志失败: {e}")
+
+    def _install_hooks(self) -> None:
+        """程序退出和未捕获异常时把日志同步到磁盘（需持有锁）"""
+        self._hooks_installed = True
+        atexit.register(self.flush_all, True)
+
+        previous_excepthook = sys.excepthook
+
+        def _excepthook(exc_type, exc_value, exc_traceback):
+            self.flush_all(sync=True)
+            previous_excepthook(exc_type, exc_value, exc_traceback)
+
+        sys.excepthook = _excepthook
+
+        if hasattr(threading, "excepthook"):
+            previous_thread_hook = threading.excepthook
+
+            def _thread_excepthook(args):
+                self.flush_all(sync=True)
+                previous_thread_hook(args)
+
+            threading.excepthook = _thread_excepthook
+
+
+_flusher = _LogFlusher()
+
+
+def flush_all_logs(sync: bool = True) -> None:
+    """刷新所有下载任务的日志（程序异常退出前调用）"""
+    _flusher.flush_all(sync=sync)
+
+
+# 测试代码
+if __name__ == "__main__":
+    import tempfile
+
+    # 对比每条日志打开/追加/关闭文件与缓冲日志的耗时
+    count = 20000
+    with tempfile.TemporaryDirectory() as temp_dir:
+        old_path = os.path.join(temp_dir, "old.log")
+        start = time.perf_counter()
+        for i in range(count):
+            with open(old_path, "a", encoding="utf-8") as f:
+                f.write(f"[{time.strftime('%H:%M:%S', time.localtime())}] 块{i}: 截断数据块\n")
+        old_time = time.perf_counter() - start
+
+        sink = DownloadLogSink(os.path.join(temp_dir, "new.log"), level=LEVEL_DEBUG, capacity=count)
+        start = time.perf_counter()
+        for i in range(count):
+            sink.log(f"块{i}: 截断数据块")
+        new_time = time.perf_counter() - start
+        sink.close()
+
+        with open(sink.path, "r", encoding="utf-8") as f:
+            lines = sum(1 for _ in f)
+        print(f"逐条打开文件: {old_time * 1e6 / count:.1f} 微秒/条")
+        print(f"缓冲日志:     {new_time * 1e6 / count:.1f} 微秒/条 (写入 {lines} 行)")
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Host_Profile.py - 主机性能记录模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+主机性能记录模块
+把每个主机测得的下载特性保存在SQLite数据库中（~/.hanabidownloadmanager/host_profiles.db）：
+是否支持Range、合适的连接数、单连接吞吐量上限、较快的IP、是否支持HTTP/2和最近的错误率。
+下载开始时读取记录，第二次从同一主机下载时直接从已知合适的配置开始，而不是每次都重新摸索；
+数值按指数加权合并，网络条件变化后几次下载内就会跟上。
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from core.download_core.NSF_Utils.Connection_Pool import get_origin
+
+# 默认配置
+PROFILE_DB_NAME = "host_profiles.db"
+PROFILE_MAX_AGE = 30 * 24 * 3600       # 超过30天没有更新的记录视为过期
+PROFILE_ALPHA = 0.5                    # 新测量值的权重
+PROFILE_MAX_IPS = 4                    # 保存的较快IP数量
+PROFILE_MAX_HOSTS = 2000               # 最多保存的主机数，超过时删除最久没有更新的记录
+HTTP2_RECHECK_DOWNLOADS = 10           # 记录为不支持HTTP/2的主机每隔几次下载重新尝试一次
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS host_profiles (
+    host TEXT PRIMARY KEY,
+    accept_ranges INTEGER,
+    connections REAL,
+    throughput REAL,
+    connection_speed REAL,
+    http2 INTEGER,
+    preferred_ips TEXT,
+    error_rate REAL,
+    downloads INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def is_host_profile_enabled() -> bool:
+    """读取设置中的主机性能记录开关（download.host_profiles，默认开启）"""
+    try:
+        from client.ui.client_interface.settings.config import config
+        return bool(config.get_setting("download", "host_profiles", True))
+    except ImportError:
+        return True
+    except Exception as e:
+        logging.warning(f"读取主机性能记录设置失败: {e}")
+        return True
+
+
+def host_key(url: str) -> str:
+    """主机记录的键：主机名，非默认端口时带上端口"""
+    scheme, host, port = get_origin(url)
+    default_port = 443 if scheme == "https" else 80
+    return host if port == default_port else f"{host}:{port}"
+
+
+def _blend(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    if new is None:
+        return old
+    if old is None:
+        return float(new)
+    return old * (1 - PROFILE_ALPHA) + new * PROFILE_ALPHA
+
+
+def _to_bool(value: Optional[int]) -> Optional[bool]:
+    return None if value is None else bool(value)
+
+
+def _from_bool(value: Optional[bool]) -> Optional[int]:
+    return None if value is None else int(bool(value))
+
+
+class HostProfile:
+    """一个主机的性能记录"""
+
+    __slots__ = ("host", "accept_ranges", "connections", "throughput", "connection_speed", "http2",
+                 "preferred_ips", "error_rate", "downloads", "updated_at")
+
+    def __init__(self, host: str):
+        self.host = host
+        self.accept_ranges: Optional[bool] = None       # 是否支持Range
+        self.connections: Optional[float] = None        # 合适的连接数（加权平均）
+        self.throughput: Optional[float] = None         # 总吞吐量（字节/秒）
+        self.connection_speed: Optional[float] = None   # 单连接吞吐量上限（字节/秒）
+        self.http2: Optional[bool] = None               # 是否协商出HTTP/2
+        self.preferred_ips: List[str] = []              # 较快的IP，按速度排序
+        self.error_rate: Optional[float] = None         # 最近的请求错误率
+        self.downloads = 0                              # 记录的下载次数
+        self.updated_at = 0.0
+
+    @property
+    def best_connections(self) -> Optional[int]:
+        """合适的连接数（整数），没有记录时为None"""
+        return max(1, int(round(self.connections))) if self.connections else None
+
+    def skip_http2(self) -> bool:
+        """是否按记录直接使用HTTP/1.1（定期重新尝试，服务器升级后能重新用上HTTP/2）"""
+        return self.http2 is False and self.downloads % HTTP2_RECHECK_DOWNLOADS != 0
+
+    def describe(self) -> str:
+        """日志用的简要描述"""
+        parts = []
+        if self.accept_ranges is not None:
+            parts.append(f"Range={'支持' if self.accept_ranges else '不支持'}")
+        if self.best_connections:
+            parts.append(f"连接数={self.best_connections}")
+        if self.throughput:
+            parts.append(f"吞吐量={self.throughput / 1024 / 1024:.2f}MB/s")
+        if self.connection_speed:
+            parts.append(f"单连接={self.connection_speed / 1024 / 1024:.2f}MB/s")
+        if self.http2 is not None:
+            parts.append(f"HTTP/2={'支持' if self.http2 else '不支持'}")
+        if self.error_rate is not None:
+            parts.append(f"错误率={self.error_rate:.0%}")
+        if self.preferred_ips:
+            parts.append(f"IP={','.join(self.preferred_ips)}")
+        return f"{self.host}: {', '.join(parts) or '无'}（{self.downloads} 次下载）"
+
+
+class HostProfileStore:
+    """主机性能记录数据库（线程安全，首次使用时打开）"""
+
+    def __init__(self, path: Optional[Path] = None):
+        """初始化记录库
+
+        Args:
+            path: 数据库文件路径，默认保存在配置目录中
+        """
+        self.path = Path(path) if path else Path.home() / ".hanabidownloadmanager" / PROFILE_DB_NAME
+        self.lock = threading.Lock()
+        self._conn = None
+        self._disabled = False
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """打开数据库（需持有锁），失败后本次运行不再使用记录库"""
+        if self._conn is not None or self._disabled:
+            return self._conn
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=5.0, check_same_thread=False)
+            conn.execute(_SCHEMA)
+            conn.commit()
+            self._conn = conn
+        except sqlite3.Error as e:
+            logging.warning(f"[Host_Profile] 无法打开主机性能记录 {self.path}: {e}")
+            self._disabled = True
+        return self._conn
+
+    @staticmethod
+    def _from_row(row: tuple) -> HostProfile:
+        profile = HostProfile(row[0])
+        profile.accept_ranges = _to_bool(row[1])
+        profile.connections = row[2]
+        profile.throughput = row[3]
+        profile.connection_speed = row[4]
+        profile.http2 = _to_bool(row[5])
+        try:
+            profile.preferred_ips = json.loads(row[6]) if row[6] else []
+        except ValueError:
+            profile.preferred_ips = []
+        profile.error_rate = row[7]
+        profile.downloads = row[8]
+        profile.updated_at = row[9]
+        return profile
+
+    def _load(self, conn: sqlite3.Connection, host: str) -> Optional[HostProfile]:
+        row = conn.execute(
+            "SELECT host, accept_ranges, connections, throughput, connection_speed, http2, "
+            "preferred_ips, error_rate, downloads, updated_at FROM host_profiles WHERE host = ?", (host,)
+        ).fetchone()
+        return self._from_row(row) if row else None
+
+    def get(self, host: str) -> Optional[HostProfile]:
+        """读取主机记录，没有记录或记录已过期时返回None"""
+        with self.lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            try:
+                profile = self._load(conn, host)
+            except sqlite3.Error as e:
+                logging.warning(f"[Host_Profile] 读取主机记录失败: {e}")
+                return None
+        if profile is None or time.time() - profile.updated_at > PROFILE_MAX_AGE:
+            return None
+        return profile
+
+    def record(self, host: str, accept_ranges: Optional[bool] = None, connections: Optional[int] = None,
+               throughput: Optional[float] = None, connection_speed: Optional[float] = None,
+               http2: Optional[bool] = None, preferred_ips: Optional[List[str]] = None,
+               error_rate: Optional[float] = None) -> Optional[HostProfile]:
+        """合并一次下载的测量结果（为None的项保持原记录）
+
+        Args:
+            host: 主机记录的键（host_key()）
+            accept_ranges: 是否支持Range
+            connections: 本次结束时的连接数
+            throughput: 本次的总吞吐量（字节/秒）
+            connection_speed: 本次的单连接最高吞吐量（字节/秒）
+            http2: 是否协商出HTTP/2
+            preferred_ips: 较快的IP，按速度排序
+            error_rate: 本次的请求错误率
+
+        Returns:
+            Optional[HostProfile]: 合并后的记录，记录库不可用时为None
+        """
+        with self.lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            try:
+                profile = self._load(conn, host)
+                if profile is None or time.time() - profile.updated_at > PROFILE_MAX_AGE:
+                    profile = HostProfile(host)
+                if accept_ranges is not None:
+                    profile.accept_ranges = accept_ranges
+                if http2 is not None:
+                    profile.http2 = http2
+                if preferred_ips:
+                    profile.preferred_ips = list(preferred_ips)[:PROFILE_MAX_IPS]
+                profile.connections = _blend(profile.connections, connections)
+                profile.throughput = _blend(profile.throughput, throughput)
+                profile.connection_speed = _blend(profile.connection_speed, connection_speed)
+                profile.error_rate = _blend(profile.error_rate, error_rate)
+                profile.downloads += 1
+                profile.updated_at = time.time()
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO host_profiles (host, accept_ranges, connections, throughput, "
+                    "connection_speed, http2, preferred_ips, error_rate, downloads, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (host, _from_bool(profile.accept_ranges), profile.connections, profile.throughput,
+                     profile.connection_speed, _from_bool(profile.http2), json.dumps(profile.preferred_ips),
+                     profile.error_rate, profile.downloads, profile.updated_at)
+                )
+                conn.execute(
+                    "DELETE FROM host_profiles WHERE host NOT IN "
+                    "(SELECT host FROM host_profiles ORDER BY updated_at DESC LIMIT ?)", (PROFILE_MAX_HOSTS,)
+                )
+                conn.commit()
+                return profile
+            except sqlite3.Error as e:
+                logging.warning(f"[Host_Profile] 保存主机记录失败: {e}")
+                return None
+
+    def forget(self, host: str) -> None:
+        """删除一个主机的记录"""
+        with self.lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                conn.execute("DELETE FROM host_profiles WHERE host = ?", (host,))
+                conn.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"[Host_Profile] 删除主机记录失败: {e}")
+
+    def close(self) -> None:
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            conn = self._connect()
+            if conn is None:
+                return {"path": str(self.path), "available": False, "hosts": 0}
+            try:
+                (count,) = conn.execute("SELECT COUNT(*) FROM host_profiles").fetchone()
+            except sqlite3.Error:
+                count = 0
+            return {"path": str(self.path), "available": True, "hosts": count}
+
+
+# 全局主机性能记录实例
+host_profiles = HostProfileStore()
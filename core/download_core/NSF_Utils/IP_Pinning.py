@@ -0,0 +1,587 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# IP_Pinning.py - 固定IP连接模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+固定IP连接模块
+把CDNOptimizer测出的延迟最低的几个IP固定给对应的源站：新建TCP连接时直接连接这些IP，
+URL中的主机名保持不变，因此Host请求头、TLS的SNI和证书校验都与原来一致。
+新连接分散到连接数最少的健康IP上，使各个分段使用不同的节点；
+某个IP连接失败或明显比其他IP慢时暂时停用，正在使用它的块结束当前请求后改用其他IP。
+
+httpx没有公开网络后端参数，固定IP需要替换HTTPTransport的内部连接池；
+该内部结构不符合预期时不固定IP，改用普通传输层。默认关闭（download.ip_pinning）。
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+try:
+    import httpcore
+    HAS_HTTPCORE = all(hasattr(httpcore, name) for name in
+                       ("NetworkBackend", "SyncBackend", "AsyncNetworkBackend", "AnyIOBackend"))
+except ImportError:
+    HAS_HTTPCORE = False
+    logging.warning("未找到httpcore网络后端接口，固定IP连接不可用")
+
+# 默认配置
+DEFAULT_MAX_ADDRESSES = 4          # 每个源站最多固定的IP数
+DEFAULT_PIN_TTL = 1800.0           # 固定IP的有效期（秒），与CDNOptimizer的缓存时间一致
+FAILURE_COOLDOWN = 15.0            # IP失败后的停用时间（秒），连续失败时翻倍
+MAX_FAILURE_COOLDOWN = 300.0       # 最长停用时间（秒）
+DEGRADED_SPEED_RATIO = 0.3         # 速度低于最快IP的该比例视为变差
+DEGRADED_CHECKS = 3                # 连续多少次评估变差才停用
+
+
+def is_ip_pinning_enabled() -> bool:
+    """读取设置中的固定IP开关（download.ip_pinning，默认关闭）"""
+    try:
+        from client.ui.client_interface.settings.config import config
+        return bool(config.get_setting("download", "ip_pinning", False))
+    except ImportError:
+        return False
+    except Exception as e:
+        logging.warning(f"读取固定IP设置失败: {e}")
+        return False
+
+
+class PinnedAddress:
+    """源站的一个固定IP及其健康状态"""
+
+    __slots__ = ("ip", "latency", "connections", "failures", "consecutive_failures",
+                 "down_until", "speed", "slow_checks")
+
+    def __init__(self, ip: str, latency: Optional[float] = None):
+        self.ip = ip
+        self.latency = latency if latency is not None else float("inf")
+        self.connections = 0           # 当前打开的连接数
+        self.failures = 0              # 累计失败次数
+        self.consecutive_failures = 0  # 连续失败次数
+        self.down_until = 0.0          # 停用截止时间
+        self.speed = 0.0               # 最近一次评估时该IP上各块的平均速度
+        self.slow_checks = 0           # 连续评估为变差的次数
+
+    def is_down(self, now: float = None) -> bool:
+        return (now or time.monotonic()) < self.down_until
+
+
+class PinnedHost:
+    """一个源站(host, port)的固定IP集合"""
+
+    def __init__(self, host: str, port: int, addresses: Sequence[Tuple[str, Optional[float]]],
+                 ttl: float = DEFAULT_PIN_TTL):
+        self.host = host
+        self.port = port
+        self.addresses = [PinnedAddress(ip, latency) for ip, latency in addresses]
+        self.expire_at = time.monotonic() + ttl
+        self.lock = threading.Lock()
+
+    def get(self, ip: str) -> Optional[PinnedAddress]:
+        for address in self.addresses:
+            if address.ip == ip:
+                return address
+        return None
+
+    def candidates(self) -> List[PinnedAddress]:
+        """按连接顺序排列的健康IP：连接数少的优先，其次延迟低的"""
+        now = time.monotonic()
+        with self.lock:
+            healthy = [address for address in self.addresses if not address.is_down(now)]
+            healthy.sort(key=lambda address: (address.connections, address.latency))
+            return healthy
+
+    def acquire(self, address: PinnedAddress) -> None:
+        with self.lock:
+            address.connections += 1
+
+    def release(self, address: PinnedAddress) -> None:
+        with self.lock:
+            address.connections = max(0, address.connections - 1)
+
+    def _mark_down(self, address: PinnedAddress, reason: str) -> None:
+        """停用IP（需持有锁）"""
+        address.consecutive_failures += 1
+        address.failures += 1
+        cooldown = min(MAX_FAILURE_COOLDOWN, FAILURE_COOLDOWN * 2 ** (address.consecutive_failures - 1))
+        address.down_until = time.monotonic() + cooldown
+        logging.info(f"[IP_Pinning] {self.host} 的IP {address.ip} {reason}，停用 {cooldown:.0f} 秒")
+
+    def report_failure(self, ip: str, reason: str = "连接失败") -> None:
+        """报告某个IP的请求失败"""
+        with self.lock:
+            address = self.get(ip)
+            if address is not None and not address.is_down():
+                self._mark_down(address, reason)
+
+    def report_success(self, ip: str) -> None:
+        """报告某个IP的请求成功"""
+        with self.lock:
+            address = self.get(ip)
+            if address is not None:
+                address.consecutive_failures = 0
+
+    def update_speeds(self, speeds: Dict[str, float]) -> List[str]:
+        """按各IP上正在下载的块的平均速度评估IP是否变差
+
+        Args:
+            speeds: IP -> 平均速度（字节/秒），只包含有活跃块的IP
+
+        Returns:
+            List[str]: 本次被停用的IP
+        """
+        degraded = []
+        with self.lock:
+            measured = {ip: speed for ip, speed in speeds.items() if self.get(ip) is not None}
+            if len(measured) < 2:
+                return degraded
+            best = max(measured.values())
+            for ip, speed in measured.items():
+                address = self.get(ip)
+                address.speed = speed
+                if best > 0 and speed < best * DEGRADED_SPEED_RATIO:
+                    address.slow_checks += 1
+                    if address.slow_checks >= DEGRADED_CHECKS and not address.is_down():
+                        self._mark_down(address, f"速度 {speed / 1024:.0f}KB/s 远低于最快IP {best / 1024:.0f}KB/s")
+                        address.slow_checks = 0
+                        degraded.append(ip)
+                else:
+                    address.slow_checks = 0
+        return degraded
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self.lock:
+            return [{
+                "ip": address.ip,
+                "latency": address.latency,
+                "connections": address.connections,
+                "failures": address.failures,
+                "down": address.is_down(now),
+                "speed": address.speed
+            } for address in self.addresses]
+
+
+class PinRegistry:
+    """进程级固定IP表：源站(host, port) -> PinnedHost"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts: Dict[Tuple[str, int], PinnedHost] = {}
+
+    def pin(self, host: str, port: int, addresses: Sequence[Union[str, Tuple[str, Optional[float]]]],
+            max_addresses: int = DEFAULT_MAX_ADDRESSES, ttl: float = DEFAULT_PIN_TTL) -> Optional[PinnedHost]:
+        """为源站固定IP
+
+        Args:
+            host: 主机名
+            port: 端口
+            addresses: 按优先级排列的IP或(IP, 延迟)列表
+            max_addresses: 最多使用的IP数
+            ttl: 有效期（秒）
+
+        Returns:
+            Optional[PinnedHost]: 固定结果，没有可用IP时返回None
+        """
+        normalized = []
+        for item in addresses:
+            ip, latency = (item, None) if isinstance(item, str) else (item[0], item[1])
+            if ip and ip not in [existing for existing, _ in normalized]:
+                normalized.append((ip, latency))
+        normalized = normalized[:max(1, max_addresses)]
+        if not normalized:
+            return None
+
+        pinned = PinnedHost(host.lower(), port, normalized, ttl)
+        with self.lock:
+            self.hosts[(pinned.host, port)] = pinned
+        return pinned
+
+    def unpin(self, host: str, port: int) -> None:
+        with self.lock:
+            self.hosts.pop((host.lower(), port), None)
+
+    def get(self, host: str, port: int) -> Optional[PinnedHost]:
+        """获取源站的固定IP（过期后自动移除）"""
+        key = (host.lower(), port)
+        with self.lock:
+            pinned = self.hosts.get(key)
+            if pinned is not None and time.monotonic() >= pinned.expire_at:
+                del self.hosts[key]
+                return None
+            return pinned
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            hosts = list(self.hosts.values())
+        return {f"{pinned.host}:{pinned.port}": pinned.get_stats() for pinned in hosts}
+
+
+# 全局固定IP表
+pin_registry = PinRegistry()
+
+
+def get_response_ip(response: Any) -> Optional[str]:
+    """获取响应所用连接的对端IP"""
+    try:
+        stream = response.extensions.get("network_stream")
+        if stream is None:
+            return None
+        ip = stream.get_extra_info("pinned_ip")
+        if ip:
+            return ip
+        server_addr = stream.get_extra_info("server_addr")
+        return server_addr[0] if server_addr else None
+    except Exception:
+        return None
+
+
+if HAS_HTTPCORE:
+
+    class _PinnedStream(httpcore.NetworkStream):
+        """连接到固定IP的网络流：关闭时归还连接计数，IP停用后空闲连接不再被复用"""
+
+        def __init__(self, stream, pinned: PinnedHost, address: PinnedAddress):
+            self._stream = stream
+            self._pinned = pinned
+            self._address = address
+            self._released = False
+
+        def read(self, max_bytes: int, timeout: Optional[float] = None) -> bytes:
+            return self._stream.read(max_bytes, timeout)
+
+        def write(self, buffer: bytes, timeout: Optional[float] = None) -> None:
+            self._stream.write(buffer, timeout)
+
+        def close(self) -> None:
+            if not self._released:
+                self._released = True
+                self._pinned.release(self._address)
+            self._stream.close()
+
+        def start_tls(self, ssl_context, server_hostname: Optional[str] = None,
+                      timeout: Optional[float] = None):
+            # server_hostname是URL中的主机名，SNI和证书校验不受固定IP影响
+            try:
+                stream = self._stream.start_tls(ssl_context, server_hostname, timeout)
+            except Exception:
+                self._pinned.report_failure(self._address.ip, "TLS握手失败")
+                self.close()
+                raise
+            # 连接计数随新的TLS流转移
+            self._released = True
+            return _PinnedStream(stream, self._pinned, self._address)
+
+        def get_extra_info(self, info: str) -> Any:
+            if info == "pinned_ip":
+                return self._address.ip
+            if info == "is_readable" and self._address.is_down():
+                # 连接池把空闲时"可读"的连接视为已断开并丢弃，停用的IP因此不再被复用
+                return True
+            return self._stream.get_extra_info(info)
+
+    class PinnedNetworkBackend(httpcore.NetworkBackend):
+        """按固定IP表建立TCP连接的网络后端，没有固定IP的源站使用系统解析"""
+
+        def __init__(self, registry: PinRegistry = None):
+            self.registry = registry or pin_registry
+            self._backend = httpcore.SyncBackend()
+
+        def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None,
+                        local_address: Optional[str] = None, socket_options=None):
+            pinned = self.registry.get(host, port)
+            if pinned is not None:
+                for address in pinned.candidates():
+                    pinned.acquire(address)
+                    try:
+                        stream = self._backend.connect_tcp(address.ip, port, timeout, local_address, socket_options)
+                    except Exception as e:
+                        pinned.release(address)
+                        pinned.report_failure(address.ip, f"连接失败({e})")
+                        continue
+                    return _PinnedStream(stream, pinned, address)
+                logging.debug(f"[IP_Pinning] {host}:{port} 的固定IP均不可用，使用系统解析")
+            return self._backend.connect_tcp(host, port, timeout, local_address, socket_options)
+
+        def connect_unix_socket(self, path: str, timeout: Optional[float] = None, socket_options=None):
+            return self._backend.connect_unix_socket(path, timeout, socket_options)
+
+        def sleep(self, seconds: float) -> None:
+            self._backend.sleep(seconds)
+
+    class _AsyncPinnedStream(httpcore.AsyncNetworkStream):
+        """_PinnedStream的异步版本（NSF异步引擎使用）"""
+
+        def __init__(self, stream, pinned: PinnedHost, address: PinnedAddress):
+            self._stream = stream
+            self._pinned = pinned
+            self._address = address
+            self._released = False
+
+        async def read(self, max_bytes: int, timeout: Optional[float] = None) -> bytes:
+            return await self._stream.read(max_bytes, timeout)
+
+        async def write(self, buffer: bytes, timeout: Optional[float] = None) -> None:
+            await self._stream.write(buffer, timeout)
+
+        async def aclose(self) -> None:
+            if not self._released:
+                self._released = True
+                self._pinned.release(self._address)
+            await self._stream.aclose()
+
+        async def start_tls(self, ssl_context, server_hostname: Optional[str] = None,
+                            timeout: Optional[float] = None):
+            try:
+                stream = await self._stream.start_tls(ssl_context, server_hostname, timeout)
+            except Exception:
+                self._pinned.report_failure(self._address.ip, "TLS握手失败")
+                await self.aclose()
+                raise
+            self._released = True
+            return _AsyncPinnedStream(stream, self._pinned, self._address)
+
+        def get_extra_info(self, info: str) -> Any:
+            if info == "pinned_ip":
+                return self._address.ip
+            if info == "is_readable" and self._address.is_down():
+                return True
+            return self._stream.get_extra_info(info)
+
+    class AsyncPinnedNetworkBackend(httpcore.AsyncNetworkBackend):
+        """PinnedNetworkBackend的异步版本，在asyncio事件循环中按固定IP表建立TCP连接"""
+
+        def __init__(self, registry: PinRegistry = None):
+            self.registry = registry or pin_registry
+            self._backend = httpcore.AnyIOBackend()
+
+        async def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None,
+                              local_address: Optional[str] = None, socket_options=None):
+            pinned = self.registry.get(host, port)
+            if pinned is not None:
+                for address in pinned.candidates():
+                    pinned.acquire(address)
+                    try:
+                        stream = await self._backend.connect_tcp(address.ip, port, timeout, local_address,
+                                                                 socket_options)
+                    except Exception as e:
+                        pinned.release(address)
+                        pinned.report_failure(address.ip, f"连接失败({e})")
+                        continue
+                    return _AsyncPinnedStream(stream, pinned, address)
+                logging.debug(f"[IP_Pinning] {host}:{port} 的固定IP均不可用，使用系统解析")
+            return await self._backend.connect_tcp(host, port, timeout, local_address, socket_options)
+
+        async def connect_unix_socket(self, path: str, timeout: Optional[float] = None, socket_options=None):
+            return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+        async def sleep(self, seconds: float) -> None:
+            await self._backend.sleep(seconds)
+
+
+def create_pinned_transport(ssl_context, limits, registry: PinRegistry = None, http2: bool = False):
+    """创建按固定IP表连接的httpx传输层
+
+    Args:
+        ssl_context: SSL上下文
+        limits: httpx.Limits
+        registry: 固定IP表，默认为全局表
+        http2: 是否通过ALPN协商HTTP/2（需要h2库，未协商成功时使用HTTP/1.1）
+
+    Returns:
+        httpx.HTTPTransport: 传输层，httpcore不可用或httpx内部结构不符合预期时返回None
+    """
+    if not HAS_HTTPCORE:
+        return None
+    import httpx
+
+    transport = httpx.HTTPTransport(verify=ssl_context, limits=limits, http2=http2)
+    # HTTPTransport没有公开网络后端参数，替换为使用固定IP后端的同配置连接池；
+    # 内部连接池不是httpcore.ConnectionPool时（httpx/httpcore版本变化）不替换，由调用方使用普通传输层
+    if not isinstance(getattr(transport, "_pool", None), httpcore.ConnectionPool):
+        logging.warning("[IP_Pinning] httpx传输层的内部连接池不是httpcore.ConnectionPool，不固定IP")
+        return None
+    transport._pool = httpcore.ConnectionPool(
+        ssl_context=ssl_context,
+        max_connections=limits.max_connections,
+        max_keepalive_connections=limits.max_keepalive_connections,
+        keepalive_expiry=limits.keepalive_expiry,
+        http1=True,
+        http2=http2,
+        network_backend=PinnedNetworkBackend(registry)
+    )
+    return transport
+
+
+def create_pinned_async_transport(ssl_context, limits, registry: PinRegistry = None, http2: bool = False):
+    """创建按固定IP表连接的httpx异步传输层（参数和返回值同create_pinned_transport）"""
+    if not HAS_HTTPCORE:
+        return None
+    import httpx
+
+    transport = httpx.AsyncHTTPTransport(verify=ssl_context, limits=limits, http2=http2)
+    if not isinstance(getattr(transport, "_pool", None), httpcore.AsyncConnectionPool):
+        logging.warning("[IP_Pinning] httpx异步传输层的内部连接池不是httpcore.AsyncConnectionPool，不固定IP")
+        return None
+    transport._pool = httpcore.AsyncConnectionPool(
+        ssl_context=ssl_context,
+        max_connections=limits.max_connections,
+        max_keepalive_connections=limits.max_keepalive_connections,
+        keepalive_expiry=limits.keepalive_expiry,
+        http1=True,
+        http2=http2,
+        network_backend=AsyncPinnedNetworkBackend(registry)
+    )
+    return transport
+
+
+def get_pinning_stats() -> Dict[str, Any]:
+    """获取全局固定IP表的状态"""
+    return pin_registry.get_stats()
+
+
+if __name__ == "__main__":
+    # 本地TLS服务检查固定IP连接：证书只签发给pinned.test和localhost，
+    # pinned.test无法通过DNS解析，只能经固定IP连接到127.0.0.1；
+    # 固定表中排在前面的127.0.0.2没有监听该端口，应被停用并改用下一个IP。
+    # 服务端记录每次握手的SNI，分段下载的数据逐段与原始数据比对；
+    # 最后检查证书校验仍按URL中的主机名进行、没有固定IP的源站使用系统解析，以及异步传输层同样固定IP。
+    # 证书由openssl命令行临时生成。
+    # 运行: python -m core.download_core.NSF_Utils.IP_Pinning
+    import concurrent.futures
+    import http.server
+    import os
+    import re
+    import socketserver
+    import ssl
+    import subprocess
+    import tempfile
+
+    if not HAS_HTTPCORE:
+        raise SystemExit("需要httpx和httpcore: pip install httpx")
+    import httpx
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    MB = 1024 * 1024
+    PAYLOAD = os.urandom(16 * MB)
+    PINNED_HOST = "pinned.test"
+    cert_dir = tempfile.mkdtemp()
+    cert_file, key_file = os.path.join(cert_dir, "cert.pem"), os.path.join(cert_dir, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", f"/CN={PINNED_HOST}", "-addext", f"subjectAltName=DNS:{PINNED_HOST},DNS:localhost",
+                    "-keyout", key_file, "-out", cert_file],
+                   check=True, capture_output=True)
+
+    server_names = []
+
+    def _record_sni(ssl_socket, server_name, context):
+        server_names.append(server_name)
+
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(cert_file, key_file)
+    server_context.sni_callback = _record_sni
+
+    class RangeHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range") or "")
+            start, end = (int(match.group(1)), int(match.group(2))) if match else (0, len(PAYLOAD) - 1)
+            self.send_response(206 if match else 200)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            self.wfile.write(PAYLOAD[start:end + 1])
+
+    class TLSServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+        daemon_threads = True
+
+        def get_request(self):
+            sock, address = super().get_request()
+            return server_context.wrap_socket(sock, server_side=True), address
+
+    server = TLSServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    registry = PinRegistry()
+    pinned = registry.pin(PINNED_HOST, port, [("127.0.0.2", 1.0), ("127.0.0.1", 5.0)])
+    client_context = ssl.create_default_context(cafile=cert_file)
+    limits = httpx.Limits(max_connections=8, max_keepalive_connections=8)
+    transport = create_pinned_transport(client_context, limits, registry=registry)
+    assert transport is not None, "当前httpx版本无法替换连接池"
+    client = httpx.Client(transport=transport, timeout=10)
+
+    segments = 8
+    size = len(PAYLOAD) // segments
+    ranges = [(i * size, len(PAYLOAD) - 1 if i == segments - 1 else (i + 1) * size - 1) for i in range(segments)]
+    response_ips = set()
+
+    def fetch(byte_range):
+        start, end = byte_range
+        buffer = bytearray()
+        with client.stream("GET", f"https://{PINNED_HOST}:{port}/file.bin",
+                           headers={"Range": f"bytes={start}-{end}"}) as response:
+            assert response.status_code == 206, response.status_code
+            response_ips.add(get_response_ip(response))
+            for chunk in response.iter_bytes():
+                buffer += chunk
+        assert buffer == PAYLOAD[start:end + 1], f"分段{start}-{end}数据不一致"
+        return len(buffer)
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=segments) as executor:
+        total = sum(executor.map(fetch, ranges))
+    elapsed = time.perf_counter() - started
+    assert total == len(PAYLOAD), total
+    stats = {address["ip"]: address for address in pinned.get_stats()}
+    print(f"固定IP下载 {total / MB:.0f}MB, {segments}个分段, 耗时 {elapsed:.2f}s, 对端IP {sorted(response_ips)}")
+    print(f"服务端收到的SNI: {sorted(set(server_names))}, 握手 {len(server_names)} 次")
+    print(f"IP状态: {stats}")
+    assert response_ips == {"127.0.0.1"}, response_ips
+    assert set(server_names) == {PINNED_HOST}, server_names
+    assert stats["127.0.0.2"]["down"] and stats["127.0.0.2"]["failures"] >= 1
+    client.close()
+    assert all(address["connections"] == 0 for address in pinned.get_stats()), pinned.get_stats()
+
+    # 证书校验按URL中的主机名进行：固定到同一IP但证书不包含该主机名时握手失败
+    registry.pin("wrong.test", port, ["127.0.0.1"])
+    client = httpx.Client(transport=create_pinned_transport(client_context, limits, registry=registry), timeout=10)
+    try:
+        client.get(f"https://wrong.test:{port}/file.bin", headers={"Range": "bytes=0-0"})
+        raise AssertionError("证书主机名不匹配时请求应当失败")
+    except httpx.ConnectError as e:
+        print(f"证书不包含主机名时拒绝连接: {e}")
+
+    # 没有固定IP的源站使用系统解析
+    response = client.get(f"https://localhost:{port}/file.bin", headers={"Range": "bytes=0-1023"})
+    assert response.content == PAYLOAD[:1024]
+    print(f"未固定的localhost使用系统解析: 对端IP {get_response_ip(response)}")
+    client.close()
+
+    # 异步传输层（NSF异步引擎）：同样经固定IP连接，SNI为URL中的主机名
+    import asyncio
+
+    async def _fetch_async():
+        registry.pin(PINNED_HOST, port, [("127.0.0.2", 1.0), ("127.0.0.1", 5.0)])
+        transport = create_pinned_async_transport(client_context, limits, registry=registry)
+        assert transport is not None, "当前httpx版本无法替换异步连接池"
+        async with httpx.AsyncClient(transport=transport, timeout=10) as async_client:
+            responses = await asyncio.gather(*(
+                async_client.get(f"https://{PINNED_HOST}:{port}/file.bin", headers={"Range": f"bytes={start}-{end}"})
+                for start, end in ranges))
+        for (start, end), response in zip(ranges, responses):
+            assert response.content == PAYLOAD[start:end + 1], f"异步分段{start}-{end}数据不一致"
+        return {get_response_ip(response) for response in responses}
+
+    server_names.clear()
+    async_ips = asyncio.run(_fetch_async())
+    print(f"异步固定IP下载: 对端IP {sorted(async_ips)}, SNI {sorted(set(server_names))}")
+    assert async_ips == {"127.0.0.1"} and set(server_names) == {PINNED_HOST}
+    server.shutdown()
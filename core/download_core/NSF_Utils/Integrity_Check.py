@@ -0,0 +1,588 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Integrity_Check.py - 流式完整性校验模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+流式完整性校验模块
+下载时给出期望的文件摘要（SHA-256/SHA-1/MD5/CRC32C/CRC32），数据写盘的同时计算摘要，
+最后一个字节写入后摘要随即可用，不需要下载完成后再把整个文件读一遍。
+
+- CRC32C/CRC32可以合并：每段数据写盘时计算该段的CRC，相邻区间的CRC随时合并，
+  乱序到达的分段不需要重新读取。
+- SHA-256/SHA-1/MD5只能顺序计算：校验游标跟随从文件开头连续写完的位置前进，
+  正好接在游标后面的数据直接计算；乱序写完的区间先记下，游标追上时从文件读回（通常仍在页缓存中）。
+
+每段写入的数据都记录一个CRC指纹。摘要不一致时重新读取这些区间与指纹比对，
+找出写盘后内容不对的区间、从未写入的空洞以及无法确认的区间（如上次会话下载的部分），交给引擎重新下载。
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import queue
+import threading
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import crc32c as _crc32c_module
+    HAS_CRC32C = True
+except ImportError:
+    try:
+        import google_crc32c as _crc32c_module
+        HAS_CRC32C = True
+    except ImportError:
+        _crc32c_module = None
+        HAS_CRC32C = False
+
+# 默认配置
+READ_CHUNK_SIZE = 4 * 1024 * 1024      # 读回文件时每次读取的字节数
+HASH_QUEUE_SIZE = 16                   # 校验线程队列的最大项数（每项最多为一次合并写入的数据）
+
+# 支持的算法及其十六进制摘要长度
+ALGORITHM_DIGEST_SIZES = {
+    "sha256": 64,
+    "sha1": 40,
+    "md5": 32,
+    "crc32c": 8,
+    "crc32": 8,
+}
+
+# 可合并的CRC算法：反射多项式
+_CRC_POLYNOMIALS = {
+    "crc32": 0xEDB88320,
+    "crc32c": 0x82F63B78,
+}
+
+
+def parse_checksum(value: str) -> Tuple[str, str]:
+    """解析期望摘要
+
+    支持"算法:摘要"或"算法=摘要"格式；只给出摘要时按十六进制长度推断算法
+    （8位视为CRC32C）。摘要可以是十六进制或base64。
+
+    Args:
+        value: 期望摘要，如"sha256:9f86d0..."
+
+    Returns:
+        Tuple[str, str]: (算法, 小写十六进制摘要)
+
+    Raises:
+        ValueError: 无法识别的算法或摘要格式
+    """
+    text = str(value or "").strip()
+    algorithm = None
+    for separator in (":", "="):
+        name, found, digest = text.partition(separator)
+        if found and name.strip().lower().replace("-", "") in ALGORITHM_DIGEST_SIZES:
+            algorithm = name.strip().lower().replace("-", "")
+            text = digest.strip()
+            break
+
+    if algorithm is None:
+        for name, size in ALGORITHM_DIGEST_SIZES.items():
+            if len(text) == size:
+                algorithm = name
+                break
+        if algorithm is None:
+            raise ValueError(f"无法识别的摘要: {value}")
+
+    size = ALGORITHM_DIGEST_SIZES[algorithm]
+    digest = text.lower()
+    if len(digest) != size or any(c not in "0123456789abcdef" for c in digest):
+        try:
+            raw = base64.b64decode(text, validate=True)
+        except Exception:
+            raw = b""
+        if len(raw) * 2 != size:
+            raise ValueError(f"{algorithm}摘要格式不正确: {text}")
+        digest = raw.hex()
+    return algorithm, digest
+
+
+# CRC合并：crc(A+B) = crc(A)在后面补len(B)个零字节后的值 ^ crc(B)，
+# 补零用GF(2)上的32x32矩阵表示，预先算出补2^k个零字节的矩阵，每次合并只做几十次矩阵乘向量
+def _gf2_times(matrix: List[int], vector: int) -> int:
+    result = 0
+    index = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[index]
+        vector >>= 1
+        index += 1
+    return result
+
+
+def _gf2_square(matrix: List[int]) -> List[int]:
+    return [_gf2_times(matrix, row) for row in matrix]
+
+
+_zero_operators: Dict[int, List[List[int]]] = {}
+_zero_operators_lock = threading.Lock()
+
+
+def _get_zero_operators(polynomial: int) -> List[List[int]]:
+    """补2^k个零字节对应的矩阵（k = 0..63）"""
+    operators = _zero_operators.get(polynomial)
+    if operators is None:
+        with _zero_operators_lock:
+            operators = _zero_operators.get(polynomial)
+            if operators is None:
+                # 补1个零比特的矩阵，平方三次得到补1个零字节
+                matrix = [polynomial] + [1 << n for n in range(31)]
+                for _ in range(3):
+                    matrix = _gf2_square(matrix)
+                operators = [matrix]
+                for _ in range(63):
+                    operators.append(_gf2_square(operators[-1]))
+                _zero_operators[polynomial] = operators
+    return operators
+
+
+def crc_combine(crc1: int, crc2: int, length2: int, algorithm: str = "crc32") -> int:
+    """合并两个相邻数据段的CRC
+
+    Args:
+        crc1: 前一段的CRC
+        crc2: 后一段的CRC
+        length2: 后一段的字节数
+        algorithm: "crc32"或"crc32c"
+
+    Returns:
+        int: 两段拼接后的CRC
+    """
+    if length2 <= 0:
+        return crc1
+    operators = _get_zero_operators(_CRC_POLYNOMIALS[algorithm])
+    index = 0
+    while length2:
+        if length2 & 1:
+            crc1 = _gf2_times(operators[index], crc1)
+        length2 >>= 1
+        index += 1
+    return crc1 ^ crc2
+
+
+_crc32c_table = None
+
+
+def _crc32c_python(data, crc: int = 0) -> int:
+    """纯Python的CRC32C（未安装crc32c库时使用，速度很慢）"""
+    global _crc32c_table
+    if _crc32c_table is None:
+        table = []
+        for n in range(256):
+            value = n
+            for _ in range(8):
+                value = (value >> 1) ^ 0x82F63B78 if value & 1 else value >> 1
+            table.append(value)
+        _crc32c_table = table
+    table = _crc32c_table
+    crc ^= 0xFFFFFFFF
+    for byte in bytes(data):
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def crc32c(data, crc: int = 0) -> int:
+    """计算CRC32C（优先使用crc32c或google-crc32c库）"""
+    if _crc32c_module is None:
+        return _crc32c_python(data, crc)
+    if hasattr(_crc32c_module, "crc32c"):
+        return _crc32c_module.crc32c(data, crc)
+    return _crc32c_module.extend(crc, bytes(data))
+
+
+def _crc_function(algorithm: str) -> Callable[[Any, int], int]:
+    """CRC算法对应的计算函数；SHA/MD5的区间指纹使用zlib.crc32"""
+    return crc32c if algorithm == "crc32c" else zlib.crc32
+
+
+def _crc_parts(function: Callable[[Any, int], int], parts: Iterable[Any]) -> int:
+    crc = 0
+    for part in parts:
+        crc = function(part, crc)
+    return crc
+
+
+class _RangeList:
+    """按起点排序的不相交半开区间[start, end)集合，相邻或重叠的区间自动合并"""
+
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+
+    def add(self, start: int, end: int) -> None:
+        if start >= end:
+            return
+        i = bisect_left(self.ends, start)
+        j = bisect_right(self.starts, end)
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+    def pop_first(self) -> Optional[Tuple[int, int]]:
+        if not self.starts:
+            return None
+        return self.starts.pop(0), self.ends.pop(0)
+
+    def first_start(self) -> Optional[int]:
+        return self.starts[0] if self.starts else None
+
+    def gaps(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """[start, end)中不在集合内的区间"""
+        result = []
+        position = start
+        for range_start, range_end in zip(self.starts, self.ends):
+            if range_end <= position:
+                continue
+            if range_start >= end:
+                break
+            if range_start > position:
+                result.append((position, range_start))
+            position = max(position, range_end)
+        if position < end:
+            result.append((position, end))
+        return result
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+
+def _read_range(fd: int, start: int, end: int, function: Callable[[bytes], Any]) -> None:
+    """按块读取文件的[start, end)区间并依次交给function"""
+    position = start
+    while position < end:
+        size = min(READ_CHUNK_SIZE, end - position)
+        if hasattr(os, "pread"):
+            data = os.pread(fd, size, position)
+        else:
+            os.lseek(fd, position, os.SEEK_SET)
+            data = os.read(fd, size)
+        if not data:
+            # 文件比预期短，缺少的部分按零计算（摘要自然不一致）
+            data = bytes(size)
+        function(data)
+        position += len(data)
+
+
+def compute_file_digest(file_path: str, algorithm: str, file_size: int = -1) -> str:
+    """读取整个文件计算摘要（修复后重新校验时使用）"""
+    if file_size < 0:
+        file_size = os.path.getsize(file_path)
+    fd = os.open(file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        if algorithm in _CRC_POLYNOMIALS:
+            function = _crc_function(algorithm)
+            state = [0]
+            _read_range(fd, 0, file_size, lambda data: state.__setitem__(0, function(data, state[0])))
+            return f"{state[0]:08x}"
+        hasher = hashlib.new(algorithm)
+        _read_range(fd, 0, file_size, hasher.update)
+        return hasher.hexdigest()
+    finally:
+        os.close(fd)
+
+
+class StreamingVerifier:
+    """一个下载任务的流式摘要计算
+
+    written()由文件写入线程在每段数据写盘后调用；mark_present()登记不经过写入器的已有数据
+    （断点续传恢复的部分）；finish()补算所有没有经过written()的区间并返回摘要。
+    """
+
+    def __init__(self, file_path: str, file_size: int, algorithm: str, expected: str):
+        if algorithm not in ALGORITHM_DIGEST_SIZES:
+            raise ValueError(f"不支持的校验算法: {algorithm}")
+        if algorithm == "crc32c" and not HAS_CRC32C:
+            logging.warning("[Integrity_Check] 未安装crc32c库，使用纯Python计算CRC32C，速度较慢")
+
+        self.file_path = file_path
+        self.file_size = file_size
+        self.algorithm = algorithm
+        self.expected = expected
+        self.combinable = algorithm in _CRC_POLYNOMIALS
+        self.lock = threading.Lock()
+        self.digest = None
+        self.done = threading.Event()
+        self._fingerprint = _crc_function(algorithm)
+        self._fingerprints: List[Tuple[int, int, int]] = []  # (位置, 长度, CRC指纹)
+        self._present = _RangeList()                         # 不经过写入器、无法确认内容的已有数据
+        self._closed = False
+
+        if self.combinable:
+            # 已计算CRC的区间：起点 -> (终点, CRC)，终点 -> 起点，以及有序的起点列表
+            self._segments: Dict[int, Tuple[int, int]] = {}
+            self._segment_ends: Dict[int, int] = {}
+            self._segment_starts: List[int] = []
+            self._dirty = False  # 出现重叠写入时，最后改为读取整个文件计算
+        else:
+            # 顺序摘要：_queued之前的数据已交给校验线程，乱序写完的区间暂存在_backlog
+            self._hasher = hashlib.new(algorithm)
+            self._hashed = 0
+            self._queued = 0
+            self._backlog = _RangeList()
+            self._queue: "queue.Queue" = queue.Queue(HASH_QUEUE_SIZE)
+            # 持锁时只把数据放进_outbox，由_flush_outbox在锁外按顺序交给（可能阻塞的）队列
+            self._outbox: deque = deque()
+            self._put_lock = threading.Lock()
+            self._error = None
+            self._thread = threading.Thread(target=self._hash_loop, name="NSF-Verifier", daemon=True)
+            self._thread.start()
+
+        # 空文件没有任何数据会经过written()，摘要直接取空输入的值
+        if file_size == 0:
+            self._set_digest("00000000" if self.combinable else hashlib.new(algorithm).hexdigest())
+
+    def written(self, position: int, parts: List[Any], size: int) -> None:
+        """数据已写入文件的[position, position+size)（由写入线程调用）"""
+        if self._closed or size <= 0:
+            return
+        crc = _crc_parts(self._fingerprint, parts)
+        with self.lock:
+            self._fingerprints.append((position, size, crc))
+            if self.combinable:
+                self._add_segment(position, position + size, crc)
+                return
+            self._advance(position, position + size, parts)
+        self._flush_outbox()
+
+    def mark_present(self, start: int, end: int) -> None:
+        """登记文件中已有的数据区间[start, end)（不经过写入器，最后从文件读取计算）"""
+        if start < end:
+            with self.lock:
+                self._present.add(start, end)
+                if self.combinable:
+                    return
+                self._advance(start, end, None)
+            self._flush_outbox()
+
+    def _add_segment(self, start: int, end: int, crc: int) -> None:
+        """记录一个区间的CRC并与相邻区间合并（需持有锁）"""
+        if self._dirty:
+            return
+        starts = self._segment_starts
+        index = bisect_right(starts, start) - 1
+        overlaps = (index >= 0 and self._segments[starts[index]][0] > start) or \
+                   (index + 1 < len(starts) and starts[index + 1] < end)
+        if overlaps:
+            self._dirty = True
+            return
+
+        left = self._segment_ends.pop(start, None)
+        if left is not None:
+            _, left_crc = self._segments.pop(left)
+            crc = crc_combine(left_crc, crc, end - start, self.algorithm)
+            start = left
+        else:
+            insort(starts, start)
+        right = self._segments.pop(end, None)
+        if right is not None:
+            right_end, right_crc = right
+            del self._segment_ends[right_end]
+            del starts[bisect_left(starts, end)]
+            crc = crc_combine(crc, right_crc, right_end - end, self.algorithm)
+            end = right_end
+        self._segments[start] = (end, crc)
+        self._segment_ends[end] = start
+        if start == 0 and end == self.file_size:
+            self._set_digest(f"{crc:08x}")
+
+    def _advance(self, start: int, end: int, parts: List[Any]) -> None:
+        """顺序摘要：接在游标后的数据直接交给校验线程，否则暂存区间（需持有锁）
+
+        parts为None表示数据只在文件中，轮到时从文件读回。
+        """
+        if end <= self._queued:
+            return
+        if start > self._queued or parts is None:
+            self._backlog.add(max(start, self._queued), end)
+            self._drain_backlog()
+            return
+
+        skip = self._queued - start
+        if skip:
+            views = []
+            for part in parts:
+                length = len(part)
+                if skip >= length:
+                    skip -= length
+                    continue
+                views.append(memoryview(part)[skip:])
+                skip = 0
+            parts = views
+        self._outbox.append(("data", parts, end - self._queued))
+        self._queued = end
+        self._drain_backlog()
+
+    def _drain_backlog(self) -> None:
+        """游标追上暂存区间时，让校验线程从文件读回这些区间（需持有锁）"""
+        while True:
+            first = self._backlog.first_start()
+            if first is None or first > self._queued:
+                return
+            start, end = self._backlog.pop_first()
+            if end > self._queued:
+                self._outbox.append(("read", self._queued, end))
+                self._queued = end
+
+    def _flush_outbox(self) -> None:
+        """把_outbox中的数据按顺序交给校验线程（不持有self.lock时调用）
+
+        队列满时在这里阻塞，对写入线程形成背压，但不会挡住其他线程登记区间。
+        """
+        with self._put_lock:
+            while True:
+                with self.lock:
+                    if not self._outbox:
+                        return
+                    item = self._outbox.popleft()
+                self._queue.put(item)
+
+    def _hash_loop(self) -> None:
+        """校验线程：按顺序计算摘要，直到收到结束标记"""
+        fd = -1
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                if self.done.is_set():
+                    # 摘要已完成或出错后只取出数据，避免写入线程在队列上阻塞
+                    continue
+                try:
+                    if item[0] == "data":
+                        for part in item[1]:
+                            self._hasher.update(part)
+                        self._hashed += item[2]
+                    else:
+                        _, start, end = item
+                        if fd < 0:
+                            fd = os.open(self.file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+                        _read_range(fd, start, end, self._hasher.update)
+                        self._hashed += end - start
+                    if self._hashed >= self.file_size:
+                        self._set_digest(self._hasher.hexdigest())
+                except Exception as e:
+                    logging.error(f"[Integrity_Check] 计算摘要出错: {e}")
+                    self._error = e
+                    self.done.set()
+        finally:
+            if fd >= 0:
+                os.close(fd)
+
+    def _set_digest(self, digest: str) -> None:
+        self.digest = digest
+        self.done.set()
+
+    def finish(self, timeout: Optional[float] = None) -> Optional[str]:
+        """补算没有经过written()的区间并返回摘要（写入器已排空后调用）
+
+        Args:
+            timeout: 等待校验线程的最长时间（秒）
+
+        Returns:
+            Optional[str]: 十六进制摘要，出错或超时返回None
+        """
+        if self.done.is_set():
+            return self.digest
+
+        if self.combinable:
+            with self.lock:
+                dirty = self._dirty
+                covered = _RangeList()
+                for start, (end, _) in self._segments.items():
+                    covered.add(start, end)
+                gaps = covered.gaps(0, self.file_size)
+            if dirty:
+                self._set_digest(compute_file_digest(self.file_path, self.algorithm, self.file_size))
+                return self.digest
+            function = _crc_function(self.algorithm)
+            fd = os.open(self.file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+            try:
+                for start, end in gaps:
+                    state = [0]
+                    _read_range(fd, start, end, lambda data: state.__setitem__(0, function(data, state[0])))
+                    with self.lock:
+                        self._add_segment(start, end, state[0])
+            finally:
+                os.close(fd)
+            return self.digest
+
+        with self.lock:
+            if self._queued < self.file_size:
+                self._backlog.add(self._queued, self.file_size)
+                self._drain_backlog()
+        self._flush_outbox()
+        if not self.done.wait(timeout):
+            logging.warning("[Integrity_Check] 等待摘要计算超时")
+            return None
+        return self.digest
+
+    def matches(self) -> bool:
+        return self.digest is not None and self.digest == self.expected
+
+    def find_corrupt_ranges(self) -> List[Tuple[int, int]]:
+        """摘要不一致时找出需要重新下载的区间
+
+        先读回每段写入的数据与指纹比对，并加上从未写入的空洞；
+        都没有问题时，无法确认的已有数据（上次会话下载的部分）是唯一的嫌疑。
+
+        Returns:
+            List[Tuple[int, int]]: 需要重新下载的区间（闭区间，与下载块的位置一致）
+        """
+        with self.lock:
+            fingerprints = list(self._fingerprints)
+            present = self._present
+
+        written = _RangeList()
+        corrupt = _RangeList()
+        fd = os.open(self.file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            for position, size, crc in fingerprints:
+                written.add(position, position + size)
+                state = [0]
+                _read_range(fd, position, position + size,
+                            lambda data: state.__setitem__(0, self._fingerprint(data, state[0])))
+                if state[0] != crc:
+                    corrupt.add(position, position + size)
+        finally:
+            os.close(fd)
+
+        unconfirmed = written.gaps(0, self.file_size)
+        holes = _RangeList()
+        for start, end in unconfirmed:
+            for hole in present.gaps(start, end):
+                holes.add(*hole)
+        for start, end in holes:
+            corrupt.add(start, end)
+        if not corrupt.starts:
+            for start, end in unconfirmed:
+                corrupt.add(start, end)
+        return [(start, end - 1) for start, end in corrupt]
+
+    def close(self) -> None:
+        """停止接收数据并结束校验线程"""
+        if self._closed:
+            return
+        self._closed = True
+        if not self.combinable:
+            with self.lock:
+                self._outbox.append(None)
+            self._flush_outbox()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "algorithm": self.algorithm,
+            "expected": self.expected,
+            "digest": self.digest,
+            "done": self.done.is_set(),
+            "hashed": self.file_size if self.combinable and self.done.is_set() else getattr(self, "_hashed", None),
+        }
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Multi_Source.py - 多源下载模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+多源下载模块
+同一个文件可以有多个等价的下载源（镜像、GitHub和CDN等）。备用源在下载前用bytes=0-0请求校验：
+必须支持Range、文件大小与主源一致，且校验值（ETag/Last-Modified）不与主源矛盾。
+每个分段请求开始时按各源实测的单连接吞吐量选择下载源，使各源承担的分段数与速度成正比；
+某个源连续失败时暂时停用，正在从它下载的块结束当前请求后改从其他源继续剩余部分。
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+from core.download_core.NSF_Utils.Speed_Estimator import EwmaRate
+
+# 默认配置
+MIRROR_HALF_LIFE = 5.0             # 源吞吐量估计的半衰期（秒）
+MIRROR_MIN_SAMPLES = 2             # 吞吐量估计至少需要的采样次数
+MIRROR_MAX_FAILURES = 3            # 连续失败多少次后停用该源
+MIRROR_COOLDOWN = 30.0             # 源停用时间（秒），再次停用时翻倍
+MIRROR_MAX_COOLDOWN = 600.0        # 最长停用时间（秒）
+
+
+def normalize_mirrors(url: str, mirrors: Optional[Iterable[str]]) -> List[str]:
+    """整理备用下载源：只保留http/https链接，去掉重复项和主链接本身
+
+    Args:
+        url: 主下载链接
+        mirrors: 备用链接列表（可以是任意可迭代对象，非字符串项忽略）
+
+    Returns:
+        List[str]: 整理后的备用链接
+    """
+    result = []
+    if not mirrors or isinstance(mirrors, str):
+        mirrors = [mirrors] if isinstance(mirrors, str) else []
+    for mirror in mirrors:
+        if not isinstance(mirror, str):
+            continue
+        mirror = mirror.strip()
+        if urlsplit(mirror).scheme.lower() not in ("http", "https"):
+            continue
+        if mirror != url and mirror not in result:
+            result.append(mirror)
+    return result
+
+
+class SourceMirror:
+    """一个下载源及其健康状态和吞吐量"""
+
+    __slots__ = ("url", "primary", "verified", "file_size", "etag", "last_modified", "streams", "received",
+                 "stream_time", "byte_rate", "stream_rate", "failures", "consecutive_failures",
+                 "down_until", "rejected")
+
+    def __init__(self, url: str, primary: bool = False):
+        self.url = url
+        self.primary = primary
+        self.verified = primary                        # 备用源需要校验后才使用
+        self.file_size = -1                            # 探测得到的文件大小
+        self.etag = None                               # 该源的ETag
+        self.last_modified = None                      # 该源的Last-Modified
+        self.streams = 0                               # 当前从该源下载的块数
+        self.received = 0                              # 累计接收字节数
+        self.stream_time = 0.0                         # 累计连接时间（连接数×秒）
+        self.byte_rate = EwmaRate(MIRROR_HALF_LIFE)    # 该源的总吞吐量
+        self.stream_rate = EwmaRate(MIRROR_HALF_LIFE)  # 该源的平均连接数
+        self.failures = 0                              # 累计失败次数
+        self.consecutive_failures = 0                  # 连续失败次数
+        self.down_until = 0.0                          # 停用截止时间
+        self.rejected = None                           # 永久停用的原因（校验失败、文件变更）
+
+    def is_down(self, now: float = None) -> bool:
+        return self.rejected is not None or (now or time.monotonic()) < self.down_until
+
+    @property
+    def range_validator(self) -> Optional[str]:
+        """该源的If-Range校验值：If-Range只接受强ETag，弱ETag时退回Last-Modified"""
+        if self.etag and not self.etag.startswith('W/'):
+            return self.etag
+        return self.last_modified
+
+    @property
+    def speed(self) -> Optional[float]:
+        """单连接吞吐量估计（字节/秒），还没有足够采样时为None"""
+        if self.byte_rate.samples < MIRROR_MIN_SAMPLES or self.stream_rate.rate <= 0:
+            return None
+        return self.byte_rate.rate / self.stream_rate.rate
+
+    def add_bytes(self, size: int) -> None:
+        # 只用于估计速度，偶尔丢失一次累加不影响结果，不加锁
+        self.received += size
+
+
+class MirrorSet:
+    """一个下载任务的所有等价下载源"""
+
+    def __init__(self, url: str, mirrors: Optional[Iterable[str]] = None):
+        self.lock = threading.Lock()
+        self.sources = [SourceMirror(url, primary=True)]
+        self.sources.extend(SourceMirror(mirror) for mirror in normalize_mirrors(url, mirrors))
+        self.last_sample = None
+
+    @property
+    def primary(self) -> SourceMirror:
+        return self.sources[0]
+
+    @property
+    def alternates(self) -> List[SourceMirror]:
+        return self.sources[1:]
+
+    def has_alternates(self) -> bool:
+        return len(self.sources) > 1
+
+    def set_primary(self, url: str, file_size: int, etag: Optional[str], last_modified: Optional[str]) -> None:
+        """主链接重定向或探测完成后更新主源"""
+        primary = self.primary
+        primary.url = url
+        primary.file_size = file_size
+        primary.etag = etag
+        primary.last_modified = last_modified
+        self.sources[1:] = [mirror for mirror in self.alternates if mirror.url != url]
+
+    def verify(self, mirror: SourceMirror, file_size: int, etag: Optional[str],
+               last_modified: Optional[str], accept_ranges: bool, url: Optional[str] = None) -> bool:
+        """按bytes=0-0探测结果校验备用源与主源是否是同一个文件
+
+        文件大小必须一致；不同服务器的ETag格式通常不同，因此强ETag不同时要求Last-Modified一致，
+        Last-Modified不同时要求ETag相同，否则认为是另一个文件。
+
+        Args:
+            mirror: 备用源
+            file_size: 备用源Content-Range中的文件大小（未知时为-1）
+            etag: 备用源的ETag
+            last_modified: 备用源的Last-Modified
+            accept_ranges: 备用源是否支持Range
+            url: 备用源重定向后的最终链接
+
+        Returns:
+            bool: 是否通过校验
+        """
+        primary = self.primary
+        reason = None
+        if not accept_ranges:
+            reason = "不支持Range"
+        elif file_size <= 0 or file_size != primary.file_size:
+            reason = f"文件大小不一致({file_size}，主源{primary.file_size})"
+        else:
+            etag_differs = (self._strong(etag) and self._strong(primary.etag) and etag != primary.etag)
+            modified_known = bool(last_modified and primary.last_modified)
+            modified_differs = modified_known and last_modified != primary.last_modified
+            if etag_differs and (modified_differs or not modified_known):
+                reason = "ETag与主源不一致"
+            elif modified_differs and not (etag and etag == primary.etag):
+                reason = "Last-Modified与主源不一致"
+
+        with self.lock:
+            if reason:
+                mirror.rejected = reason
+            else:
+                if url:
+                    mirror.url = url
+                mirror.file_size = file_size
+                mirror.etag = etag
+                mirror.last_modified = last_modified
+                mirror.verified = True
+        if reason:
+            logging.info(f"[Multi_Source] 备用源 {mirror.url} 未通过校验: {reason}")
+            return False
+        return True
+
+    @staticmethod
+    def _strong(etag: Optional[str]) -> bool:
+        return bool(etag) and not etag.startswith('W/')
+
+    def acquire(self) -> SourceMirror:
+        """为一个分段请求选择下载源
+
+        按单连接吞吐量分配连接数：选择(当前连接数+1)/速度最小的健康源；
+        还没有测出速度的源按已测出的最快速度计算，保证每个源都能得到试用。
+        所有源都不可用时使用主源。
+        """
+        now = time.monotonic()
+        with self.lock:
+            usable = [mirror for mirror in self.sources if mirror.verified and not mirror.is_down(now)]
+            if not usable:
+                usable = [self.primary]
+            if len(usable) == 1:
+                chosen = usable[0]
+            else:
+                measured = [mirror.speed for mirror in usable if mirror.speed is not None]
+                fastest = max(measured, default=1.0)
+                chosen = min(usable, key=lambda mirror: (mirror.streams + 1) / max(
+                    fastest if mirror.speed is None else mirror.speed, 1.0))
+            chosen.streams += 1
+            return chosen
+
+    def release(self, mirror: SourceMirror) -> None:
+        with self.lock:
+            mirror.streams = max(0, mirror.streams - 1)
+
+    def _usable_count(self, now: float) -> int:
+        return sum(1 for mirror in self.sources if mirror.verified and not mirror.is_down(now))
+
+    def report_failure(self, mirror: SourceMirror, reason: str = "请求失败") -> None:
+        """报告某个源的请求失败，连续失败达到上限且还有其他可用源时停用该源"""
+        now = time.monotonic()
+        with self.lock:
+            mirror.failures += 1
+            mirror.consecutive_failures += 1
+            if mirror.is_down(now) or mirror.consecutive_failures < MIRROR_MAX_FAILURES:
+                return
+            if self._usable_count(now) <= 1:
+                return
+            cooldown = min(MIRROR_MAX_COOLDOWN,
+                           MIRROR_COOLDOWN * 2 ** (mirror.consecutive_failures - MIRROR_MAX_FAILURES))
+            mirror.down_until = now + cooldown
+        logging.info(f"[Multi_Source] 下载源 {mirror.url} {reason}，停用 {cooldown:.0f} 秒")
+
+    def report_success(self, mirror: SourceMirror) -> None:
+        with self.lock:
+            mirror.consecutive_failures = 0
+
+    def reject(self, mirror: SourceMirror, reason: str) -> bool:
+        """永久停用一个备用源（主源不能停用）
+
+        Returns:
+            bool: 是否已停用；主源返回False，由调用方按主源出错处理
+        """
+        if mirror.primary:
+            return False
+        with self.lock:
+            mirror.rejected = reason
+        logging.warning(f"[Multi_Source] 备用源 {mirror.url} {reason}，不再使用")
+        return True
+
+    def sample(self, now: float = None) -> None:
+        """更新各源的吞吐量估计（由监控线程定期调用）"""
+        now = now or time.monotonic()
+        with self.lock:
+            elapsed = now - self.last_sample if self.last_sample is not None else 0.0
+            self.last_sample = now
+            for mirror in self.sources:
+                mirror.stream_time += mirror.streams * elapsed
+                mirror.byte_rate.update(mirror.received, now)
+                mirror.stream_rate.update(mirror.stream_time, now)
+
+    def reset_rates(self) -> None:
+        """暂停恢复后重新开始估计吞吐量"""
+        with self.lock:
+            self.last_sample = None
+            for mirror in self.sources:
+                mirror.byte_rate = EwmaRate(MIRROR_HALF_LIFE)
+                mirror.stream_rate = EwmaRate(MIRROR_HALF_LIFE)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self.lock:
+            return [{
+                "url": mirror.url,
+                "primary": mirror.primary,
+                "verified": mirror.verified,
+                "streams": mirror.streams,
+                "received": mirror.received,
+                "speed": mirror.speed or 0.0,
+                "failures": mirror.failures,
+                "down": mirror.is_down(now),
+                "rejected": mirror.rejected
+            } for mirror in self.sources]
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Range_Set.py - 已下载区间记录模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+已下载区间记录模块
+记录已经交给写入器的字节区间（按起点排序的不相交半开区间，相邻或重叠时合并），
+已记录字节数在添加区间时累加。区间覆盖整个文件的那一刻设置完成事件，
+监控线程直接等待该事件，不再按块位置估算"差不多完成"；没有覆盖的区间就是需要重新下载的缺口。
+
+区间保存在两个有序整数列表中，每个区间只占两个整数，不随下载块数量增加锁和对象：
+- 标记完成用二分查找定位，下载块延长自己已完成前缀（最常见的情况）时原地修改，不移动列表
+- 已下载字节数随添加累加，查询为O(1)；区间内的已下载字节数只遍历与之相交的区间
+- 最大缺口查找供分割使用，序列化为紧凑的字节串供保存和恢复
+"""
+
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import List, Optional, Tuple
+
+# 序列化格式: <qI 文件大小, 区间数> + 区间数×2个<q（起点、终点交替）
+SERIAL_HEADER_FORMAT = "<qI"
+SERIAL_HEADER_SIZE = struct.calcsize(SERIAL_HEADER_FORMAT)
+
+
+class RangeSet:
+    """线程安全的已下载区间集合"""
+
+    __slots__ = ("lock", "completed", "total", "_starts", "_ends", "_covered")
+
+    def __init__(self, total: int = -1):
+        """初始化区间集合
+
+        Args:
+            total: 文件大小（字节），未知时为-1，此时不会设置完成事件
+        """
+        self.lock = threading.Lock()
+        self.completed = threading.Event()
+        self.total = total
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._covered = 0
+
+    def reset(self, total: int = -1) -> None:
+        """清空记录并设置文件大小"""
+        with self.lock:
+            self.total = total
+            self._starts = []
+            self._ends = []
+            self._covered = 0
+            self.completed.clear()
+
+    def set_total(self, total: int) -> None:
+        """下载过程中得知文件大小时设置（保留已记录的区间）"""
+        with self.lock:
+            self.total = total
+            if 0 < total <= self._covered:
+                self.completed.set()
+
+    def add(self, start: int, end: int) -> None:
+        """记录区间[start, end)已下载（超出文件大小的部分忽略）"""
+        with self.lock:
+            if self.total >= 0:
+                end = min(end, self.total)
+            if start >= end:
+                return
+            starts, ends = self._starts, self._ends
+            i = bisect_left(ends, start)
+            if i < len(ends) and starts[i] <= start and end <= ends[i]:
+                return
+            if i < len(ends) and ends[i] == start and (i + 1 == len(starts) or starts[i + 1] > end):
+                # 延长已有区间的末尾，不需要移动列表
+                ends[i] = end
+                self._covered += end - start
+            else:
+                j = bisect_right(starts, end)
+                merged = 0
+                if i < j:
+                    for k in range(i, j):
+                        merged += ends[k] - starts[k]
+                    start = min(start, starts[i])
+                    end = max(end, ends[j - 1])
+                starts[i:j] = [start]
+                ends[i:j] = [end]
+                self._covered += end - start - merged
+            if 0 < self.total <= self._covered:
+                self.completed.set()
+
+    def discard(self, start: int, end: int) -> None:
+        """移除区间[start, end)（数据需要重新下载时使用）"""
+        with self.lock:
+            if start >= end:
+                return
+            i = bisect_right(self._ends, start)
+            j = bisect_left(self._starts, end)
+            if i >= j:
+                return
+            removed = sum(self._ends[k] - self._starts[k] for k in range(i, j))
+            kept_starts, kept_ends = [], []
+            if self._starts[i] < start:
+                kept_starts.append(self._starts[i])
+                kept_ends.append(start)
+            if self._ends[j - 1] > end:
+                kept_starts.append(end)
+                kept_ends.append(self._ends[j - 1])
+            self._starts[i:j] = kept_starts
+            self._ends[i:j] = kept_ends
+            self._covered -= removed - sum(e - s for s, e in zip(kept_starts, kept_ends))
+            self.completed.clear()
+
+    @property
+    def covered(self) -> int:
+        """已下载的字节数"""
+        return self._covered
+
+    def covered_between(self, start: int, end: int) -> int:
+        """区间[start, end)中已下载的字节数"""
+        with self.lock:
+            total = 0
+            for i in range(bisect_right(self._ends, start), bisect_left(self._starts, end)):
+                total += min(end, self._ends[i]) - max(start, self._starts[i])
+            return total
+
+    def is_complete(self) -> bool:
+        """是否已覆盖整个文件"""
+        return self.completed.is_set()
+
+    def contains(self, start: int, end: int) -> bool:
+        """区间[start, end)是否已全部下载"""
+        with self.lock:
+            i = bisect_right(self._starts, start) - 1
+            return i >= 0 and self._ends[i] >= end
+
+    def gaps(self, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, int]]:
+        """[start, end)中尚未下载的区间（end默认为文件大小）"""
+        with self.lock:
+            if end is None:
+                end = self.total
+            result = []
+            position = start
+            for i in range(bisect_right(self._ends, start), len(self._starts)):
+                range_start, range_end = self._starts[i], self._ends[i]
+                if range_start >= end:
+                    break
+                if range_start > position:
+                    result.append((position, range_start))
+                position = max(position, range_end)
+            if position < end:
+                result.append((position, end))
+            return result
+
+    def largest_gap(self, start: int = 0, end: Optional[int] = None) -> Optional[Tuple[int, int]]:
+        """[start, end)中最大的未下载区间，没有缺口时返回None（大小相同时取靠前的）"""
+        best = None
+        for gap_start, gap_end in self.gaps(start, end):
+            if best is None or gap_end - gap_start > best[1] - best[0]:
+                best = (gap_start, gap_end)
+        return best
+
+    def ranges(self) -> List[Tuple[int, int]]:
+        """已下载的区间列表"""
+        with self.lock:
+            return list(zip(self._starts, self._ends))
+
+    def to_bytes(self) -> bytes:
+        """序列化为紧凑的字节串（每个区间16字节）"""
+        with self.lock:
+            values = array("q", [0]) * (2 * len(self._starts))
+            values[0::2] = array("q", self._starts)
+            values[1::2] = array("q", self._ends)
+            header = struct.pack(SERIAL_HEADER_FORMAT, self.total, len(self._starts))
+        if sys.byteorder != "little":
+            values.byteswap()
+        return header + values.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "RangeSet":
+        """从to_bytes()的结果恢复
+
+        Raises:
+            ValueError: 数据不完整，或区间无序、重叠、超出文件大小
+        """
+        if len(data) < SERIAL_HEADER_SIZE:
+            raise ValueError("区间数据不完整")
+        total, count = struct.unpack_from(SERIAL_HEADER_FORMAT, data, 0)
+        if len(data) != SERIAL_HEADER_SIZE + count * 16:
+            raise ValueError("区间数据长度不匹配")
+        values = array("q")
+        values.frombytes(data[SERIAL_HEADER_SIZE:])
+        if sys.byteorder != "little":
+            values.byteswap()
+
+        result = cls(total)
+        starts, ends = values[0::2].tolist(), values[1::2].tolist()
+        position = -1
+        for range_start, range_end in zip(starts, ends):
+            if range_start <= position or range_start >= range_end or (total >= 0 and range_end > total):
+                raise ValueError(f"区间无效: {range_start}-{range_end}")
+            position = range_end
+        result._starts, result._ends = starts, ends
+        result._covered = sum(ends) - sum(starts)
+        if 0 < total <= result._covered:
+            result.completed.set()
+        return result
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+
+# 测试代码
+if __name__ == "__main__":
+    import random
+    import time
+
+    ranges = RangeSet(100)
+    ranges.add(0, 10)
+    ranges.add(20, 30)
+    ranges.add(10, 20)
+    assert ranges.ranges() == [(0, 30)] and ranges.covered == 30
+    ranges.add(50, 200)
+    assert ranges.gaps() == [(30, 50)] and ranges.covered == 80
+    assert not ranges.is_complete()
+    ranges.discard(60, 70)
+    assert ranges.gaps() == [(30, 50), (60, 70)] and ranges.covered == 70
+    assert ranges.largest_gap() == (30, 50) and ranges.covered_between(25, 65) == 5 + 10
+    assert ranges.contains(0, 30) and not ranges.contains(25, 55)
+    restored = RangeSet.from_bytes(ranges.to_bytes())
+    assert restored.ranges() == ranges.ranges() and restored.covered == 70 and restored.total == 100
+    ranges.add(30, 50)
+    ranges.add(60, 70)
+    assert ranges.is_complete() and ranges.gaps() == [] and len(ranges) == 1
+
+    # 随机添加与逐字节集合对照
+    rng = random.Random(1)
+    for _ in range(200):
+        size = rng.randint(1, 500)
+        reference = set()
+        ranges = RangeSet(size)
+        for _ in range(rng.randint(1, 40)):
+            start = rng.randrange(size)
+            end = start + rng.randint(1, 60)
+            if rng.random() < 0.2:
+                ranges.discard(start, end)
+                reference -= set(range(start, end))
+            else:
+                ranges.add(start, end)
+                reference |= set(range(start, min(end, size)))
+            assert ranges.covered == len(reference)
+        assert sum(e - s for s, e in ranges.gaps()) == size - len(reference)
+        assert ranges.is_complete() == (len(reference) == size)
+    print("RangeSet测试通过")
+
+    # 微基准：N个分段并发下载时的标记完成、进度查询、最大缺口查找和序列化，
+    # 进度查询与逐个遍历下载块对象求和（原监控线程的做法）对比
+    # 运行: python -m core.download_core.NSF_Utils.Range_Set
+    class _Block:
+        __slots__ = ("start_position", "current_position", "end_position", "lock")
+
+        def __init__(self, start: int, end: int):
+            self.start_position = start
+            self.current_position = start
+            self.end_position = end
+            self.lock = threading.RLock()
+
+    def _timeit(fn, repeat: int) -> float:
+        begin = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        return (time.perf_counter() - begin) / repeat
+
+    batch = 64 * 1024
+    print(f"{'分段数':>8}{'标记完成':>14}{'进度(区间)':>14}{'进度(遍历块)':>14}{'最大缺口':>12}{'序列化':>12}{'字节数':>10}")
+    for segments in (16, 1000, 5000, 20000):
+        segment_size = 4 * batch
+        total = segments * segment_size
+        blocks = [_Block(i * segment_size, (i + 1) * segment_size - 1) for i in range(segments)]
+        ranges = RangeSet(total)
+
+        # 各分段轮流写入一批数据，与多个连接交替提交相同（只推进一半，留下缺口）
+        order = list(range(segments))
+        begin = time.perf_counter()
+        operations = 0
+        for _ in range(2):
+            rng.shuffle(order)
+            for index in order:
+                block = blocks[index]
+                ranges.add(block.current_position, block.current_position + batch)
+                block.current_position += batch
+                operations += 1
+        add_time = (time.perf_counter() - begin) / operations
+
+        progress_ranges = _timeit(lambda: ranges.covered, 1000)
+        progress_blocks = _timeit(lambda: sum(b.current_position - b.start_position for b in blocks), 20)
+        assert ranges.covered == sum(b.current_position - b.start_position for b in blocks)
+        gap_time = _timeit(ranges.largest_gap, 20)
+        data = ranges.to_bytes()
+        serial_time = _timeit(lambda: RangeSet.from_bytes(ranges.to_bytes()), 20)
+        print(f"{segments:>8}{add_time * 1e6:>12.2f}us{progress_ranges * 1e6:>12.3f}us"
+              f"{progress_blocks * 1e6:>12.1f}us{gap_time * 1e3:>10.2f}ms{serial_time * 1e3:>10.2f}ms{len(data):>10}")
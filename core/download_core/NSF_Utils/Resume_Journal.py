@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Resume_Journal.py - 断点续传日志模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+断点续传日志模块
+以追加写入、带校验的日志记录每个下载块的进度，崩溃或断电后最多丢失几秒的进度
+
+文件格式（版本3，与旧版.resume共用文件头）:
+    文件头: <IQI 版本号, 文件大小, URL长度> + URL + <I 校验值长度> + 校验值(ETag或Last-Modified)
+    记录:   <QQQI 起始位置, 当前位置, 结束位置, CRC32>
+同一起始位置的块以最后一条有效记录为准，遇到第一条损坏或不完整的记录即停止读取。
+版本2没有校验值字段，其余与版本3相同。
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+# 日志格式
+JOURNAL_VERSION = 3
+NO_VALIDATOR_VERSION = 2
+LEGACY_VERSION = 1
+HEADER_FORMAT = "<IQI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+VALIDATOR_LEN_FORMAT = "<I"
+VALIDATOR_LEN_SIZE = struct.calcsize(VALIDATOR_LEN_FORMAT)
+BLOCK_FORMAT = "<QQQ"
+BLOCK_SIZE = struct.calcsize(BLOCK_FORMAT)
+RECORD_FORMAT = "<QQQI"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# 默认检查点间隔
+DEFAULT_CHECKPOINT_INTERVAL = 3.0              # 秒
+DEFAULT_CHECKPOINT_BYTES = 64 * 1024 * 1024    # 自上次检查点以来下载的字节数
+
+
+def _pack_record(start: int, current: int, end: int) -> bytes:
+    """打包一条带校验的块记录"""
+    body = struct.pack(BLOCK_FORMAT, start, current, end)
+    return body + struct.pack("<I", zlib.crc32(body) & 0xFFFFFFFF)
+
+
+def _normalize_blocks(blocks: Dict[int, Tuple[int, int]], file_size: int) -> List[Tuple[int, int, int]]:
+    """整理回放得到的块：裁剪重叠区间，并为未覆盖的区间补充新块
+
+    分块被拆分时，原块缩短和新块创建的两条记录可能只有一条落盘，
+    这里保证回放结果始终完整覆盖[0, file_size)。
+
+    Args:
+        blocks: 起始位置 -> (当前位置, 结束位置)
+        file_size: 文件大小
+
+    Returns:
+        List[Tuple[int, int, int]]: 按起始位置排序的(起始位置, 当前位置, 结束位置)
+    """
+    result = []
+    next_start = 0
+    for start in sorted(blocks):
+        current, end = blocks[start]
+        if start >= file_size:
+            continue
+        end = min(end, file_size - 1)
+        if start < next_start:
+            # 与前一块重叠：只保留未覆盖的部分
+            if end < next_start:
+                continue
+            start = next_start
+        elif start > next_start:
+            # 中间缺失的区间从头下载
+            result.append((next_start, next_start, start - 1))
+        current = max(start, min(current, end + 1))
+        result.append((start, current, end))
+        next_start = end + 1
+    if next_start < file_size:
+        result.append((next_start, next_start, file_size - 1))
+    return result
+
+
+class ResumeJournal:
+    """断点续传日志
+
+    检查点只追加进度发生变化的块，写入开销与块数量成正比，与下载速度无关；
+    暂停、停止时压缩为每块一条记录。
+    """
+
+    def __init__(self, path: Union[str, Path], url: str, file_size: int,
+                 interval: float = DEFAULT_CHECKPOINT_INTERVAL,
+                 bytes_threshold: int = DEFAULT_CHECKPOINT_BYTES,
+                 validator: str = ""):
+        """初始化日志
+
+        Args:
+            path: 日志文件路径（即.resume文件）
+            url: 下载URL
+            file_size: 文件大小
+            interval: 检查点时间间隔（秒）
+            bytes_threshold: 触发检查点的下载字节数
+            validator: 服务器文件的校验值（ETag或Last-Modified），用于发现文件变更
+        """
+        self.path = Path(path)
+        self.url = url
+        self.file_size = file_size
+        self.validator = validator or ""
+        self.interval = interval
+        self.bytes_threshold = bytes_threshold
+        self.lock = threading.Lock()
+        self._file = None
+        self._last_written: Dict[int, Tuple[int, int]] = {}
+        self._last_checkpoint_time = time.time()
+        self._last_checkpoint_bytes = 0
+        self.records_written = 0
+
+    @staticmethod
+    def load(path: Union[str, Path], url: str, file_size: int,
+             validator: str = "") -> List[Tuple[int, int, int]]:
+        """回放日志，得到每个块的进度
+
+        同时兼容旧版（版本1）的.resume快照格式和没有校验值的版本2日志。
+
+        Args:
+            path: 日志文件路径
+            url: 当前下载URL，必须与日志中记录的一致
+            file_size: 当前文件大小，必须与日志中记录的一致
+            validator: 当前服务器文件的校验值，日志和当前都有校验值时必须一致
+
+        Returns:
+            List[Tuple[int, int, int]]: (起始位置, 当前位置, 结束位置)列表
+
+        Raises:
+            ValueError: 文件头损坏、版本不兼容或与当前任务不匹配
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if len(data) < HEADER_SIZE:
+            raise ValueError("断点续传文件格式错误：文件头不完整")
+        version, saved_size, url_len = struct.unpack_from(HEADER_FORMAT, data, 0)
+        if version not in (LEGACY_VERSION, NO_VALIDATOR_VERSION, JOURNAL_VERSION):
+            raise ValueError(f"断点续传文件版本不兼容: {version}")
+
+        offset = HEADER_SIZE + url_len
+        if len(data) < offset:
+            raise ValueError("断点续传文件格式错误：URL不完整")
+        saved_url = data[HEADER_SIZE:offset].decode("utf-8")
+        if saved_url != url:
+            raise ValueError("断点续传URL不匹配")
+        if saved_size != file_size:
+            raise ValueError("断点续传文件大小不匹配")
+
+        if version == JOURNAL_VERSION:
+            if len(data) < offset + VALIDATOR_LEN_SIZE:
+                raise ValueError("断点续传文件格式错误：校验值不完整")
+            (validator_len,) = struct.unpack_from(VALIDATOR_LEN_FORMAT, data, offset)
+            offset += VALIDATOR_LEN_SIZE
+            saved_validator = data[offset:offset + validator_len].decode("utf-8", errors="replace")
+            offset += validator_len
+            if saved_validator and validator and saved_validator != validator:
+                raise ValueError("服务器文件已变更（校验值不匹配），已下载的数据无效")
+
+        blocks: Dict[int, Tuple[int, int]] = {}
+        if version == LEGACY_VERSION:
+            while offset + BLOCK_SIZE <= len(data):
+                start, current, end = struct.unpack_from(BLOCK_FORMAT, data, offset)
+                offset += BLOCK_SIZE
+                if start > end or end >= file_size:
+                    raise ValueError(f"块范围无效: {start}-{end}")
+                blocks[start] = (current, end)
+        else:
+            while offset + RECORD_SIZE <= len(data):
+                start, current, end, checksum = struct.unpack_from(RECORD_FORMAT, data, offset)
+                if zlib.crc32(data[offset:offset + BLOCK_SIZE]) & 0xFFFFFFFF != checksum:
+                    logging.warning(f"断点续传日志在偏移 {offset} 处校验失败，忽略之后的记录")
+                    break
+                offset += RECORD_SIZE
+                if start > end or end >= file_size:
+                    logging.warning(f"断点续传日志包含无效块范围: {start}-{end}，已忽略")
+                    continue
+                blocks[start] = (current, end)
+
+        if not blocks:
+            raise ValueError("未能从断点续传文件中读取任何块信息")
+        return _normalize_blocks(blocks, file_size)
+
+    def _header(self) -> bytes:
+        """生成文件头"""
+        url_bytes = self.url.encode("utf-8")
+        validator_bytes = self.validator.encode("utf-8")
+        return (struct.pack(HEADER_FORMAT, JOURNAL_VERSION, self.file_size, len(url_bytes)) + url_bytes
+                + struct.pack(VALIDATOR_LEN_FORMAT, len(validator_bytes)) + validator_bytes)
+
+    def compact(self, positions: List[Tuple[int, int, int]]) -> None:
+        """压缩日志：原子地重写为每块一条记录
+
+        Args:
+            positions: (起始位置, 当前位置, 结束位置)列表
+        """
+        with self.lock:
+            self._close_file()
+            temp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(temp_path, "wb") as f:
+                f.write(self._header())
+                f.write(b"".join(_pack_record(*item) for item in positions))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self._last_written = {start: (current, end) for start, current, end in positions}
+            self._last_checkpoint_time = time.time()
+
+    def checkpoint(self, positions: List[Tuple[int, int, int]]) -> int:
+        """追加进度变化的块记录并同步到磁盘
+
+        调用前必须确保positions中记录的进度对应的数据已经落盘。
+
+        Args:
+            positions: (起始位置, 当前位置, 结束位置)列表
+
+        Returns:
+            int: 本次追加的记录数
+        """
+        with self.lock:
+            changed = [item for item in positions
+                       if self._last_written.get(item[0]) != (item[1], item[2])]
+            self._last_checkpoint_time = time.time()
+            if not changed:
+                return 0
+
+            if self._file is None:
+                if not self.path.exists():
+                    with open(self.path, "wb") as f:
+                        f.write(self._header())
+                self._file = open(self.path, "ab", buffering=0)
+
+            self._file.write(b"".join(_pack_record(*item) for item in changed))
+            os.fsync(self._file.fileno())
+            for start, current, end in changed:
+                self._last_written[start] = (current, end)
+            self.records_written += len(changed)
+            return len(changed)
+
+    def should_checkpoint(self, downloaded_bytes: int) -> bool:
+        """判断是否到达检查点（按时间或字节数）
+
+        Args:
+            downloaded_bytes: 当前已下载的总字节数
+        """
+        if time.time() - self._last_checkpoint_time >= self.interval:
+            self._last_checkpoint_bytes = downloaded_bytes
+            return True
+        if downloaded_bytes - self._last_checkpoint_bytes >= self.bytes_threshold:
+            self._last_checkpoint_bytes = downloaded_bytes
+            return True
+        return False
+
+    def _close_file(self) -> None:
+        """关闭追加句柄（需持有锁）"""
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception as e:
+                logging.debug(f"关闭断点续传日志失败: {e}")
+            self._file = None
+
+    def close(self) -> None:
+        """关闭日志文件"""
+        with self.lock:
+            self._close_file()
+
+    def discard(self) -> None:
+        """下载完成后删除日志"""
+        with self.lock:
+            self._close_file()
+            try:
+                if self.path.exists():
+                    self.path.unlink()
+            except Exception as e:
+                logging.warning(f"删除断点续传日志失败: {e}")
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Retry_Policy.py - 重试策略模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+重试策略模块
+请求失败按错误类型（超时、5xx、429/503限流、连接中断、TLS、其他4xx）使用各自的重试次数和退避时间，
+退避按指数增长并加入随机抖动，服务器给出Retry-After时至少等待该时间。
+程序错误（AttributeError、TypeError等）重试也不会成功，不重试，直接结束任务并记录调用栈。
+每个主机有一个熔断器：被限流或连续失败时暂停向该主机发送请求，冷却后只放行一个试探请求，
+试探成功才恢复，避免所有连接一起反复请求正在限流的服务器。
+只有说明主机或网络有问题的错误（超时、连接中断、5xx、限流、TLS）计入熔断，4xx和本地错误不计入。
+"""
+
+import logging
+import random
+import ssl
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+from core.download_core.NSF_Utils.Connection_Pool import get_origin
+
+# 错误类型
+ERROR_TIMEOUT = "timeout"
+ERROR_SERVER = "server_error"
+ERROR_THROTTLED = "throttled"
+ERROR_CONNECTION = "connection"
+ERROR_TLS = "tls"
+ERROR_CLIENT = "client_error"
+ERROR_INTERNAL = "internal"
+ERROR_OTHER = "other"
+
+ERROR_NAMES = {
+    ERROR_TIMEOUT: "超时",
+    ERROR_SERVER: "服务器错误",
+    ERROR_THROTTLED: "限流",
+    ERROR_CONNECTION: "连接中断",
+    ERROR_TLS: "TLS错误",
+    ERROR_CLIENT: "请求错误",
+    ERROR_INTERNAL: "程序错误",
+    ERROR_OTHER: "其他错误",
+}
+
+# 默认配置
+MAX_RETRY_AFTER = 300.0                # Retry-After最多等待的秒数
+RETRY_AFTER_JITTER = 1.0               # 按Retry-After重试时附加的随机等待上限（秒）
+BREAKER_FAILURE_THRESHOLD = 5          # 连续失败多少次后熔断
+BREAKER_BASE_COOLDOWN = 5.0            # 没有Retry-After时第一次熔断的冷却时间（秒），连续熔断时翻倍
+BREAKER_MAX_COOLDOWN = 60.0            # 没有Retry-After时的最长冷却时间（秒）
+BREAKER_PROBE_TIMEOUT = 30.0           # 试探请求超过该时间没有结果时放行新的试探
+BREAKER_POLL_INTERVAL = 0.5            # 等待试探结果时的轮询间隔（秒）
+
+# 程序错误：重试也不会成功，直接结束任务
+PROGRAMMING_ERRORS = (AttributeError, TypeError, NameError, AssertionError)
+
+
+class RetryPolicy:
+    """一类错误的重试策略"""
+
+    __slots__ = ("max_attempts", "base_delay", "max_delay", "trips_breaker", "counts_for_breaker")
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float, trips_breaker: bool = False,
+                 counts_for_breaker: bool = True):
+        """
+        Args:
+            max_attempts: 同一块连续失败的最多重试次数
+            base_delay: 第一次重试的退避时间（秒）
+            max_delay: 退避时间上限（秒）
+            trips_breaker: 出现一次就熔断主机（限流）
+            counts_for_breaker: 是否计入主机的连续失败次数
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.trips_breaker = trips_breaker
+        self.counts_for_breaker = counts_for_breaker
+
+
+DEFAULT_POLICIES = {
+    ERROR_TIMEOUT: RetryPolicy(6, 1.0, 30.0),
+    ERROR_SERVER: RetryPolicy(6, 2.0, 60.0),
+    ERROR_THROTTLED: RetryPolicy(10, 5.0, 120.0, trips_breaker=True),
+    ERROR_CONNECTION: RetryPolicy(8, 0.5, 30.0),
+    ERROR_TLS: RetryPolicy(3, 2.0, 30.0),
+    ERROR_CLIENT: RetryPolicy(2, 2.0, 10.0, counts_for_breaker=False),
+    ERROR_INTERNAL: RetryPolicy(0, 0.0, 0.0, counts_for_breaker=False),
+    ERROR_OTHER: RetryPolicy(5, 1.0, 30.0, counts_for_breaker=False),
+}
+
+
+def get_retry_policy(error_class: str) -> RetryPolicy:
+    return DEFAULT_POLICIES.get(error_class, DEFAULT_POLICIES[ERROR_OTHER])
+
+
+def is_circuit_breaker_enabled() -> bool:
+    """读取设置中的主机熔断开关（download.circuit_breaker，默认开启）"""
+    try:
+        from client.ui.client_interface.settings.config import config
+        return bool(config.get_setting("download", "circuit_breaker", True))
+    except ImportError:
+        return True
+    except Exception as e:
+        logging.warning(f"读取主机熔断设置失败: {e}")
+        return True
+
+
+def classify_status(status_code: int) -> str:
+    """按HTTP状态码分类（503通常表示过载，与429一样按限流处理）"""
+    if status_code in (429, 503):
+        return ERROR_THROTTLED
+    if status_code == 408:
+        return ERROR_TIMEOUT
+    if status_code >= 500:
+        return ERROR_SERVER
+    if status_code >= 400:
+        return ERROR_CLIENT
+    return ERROR_OTHER
+
+
+def classify_error(error: BaseException) -> str:
+    """按异常分类（沿异常链查找TLS错误，httpx把它包装在ConnectError中）"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return classify_status(error.response.status_code)
+    if isinstance(error, PROGRAMMING_ERRORS):
+        return ERROR_INTERNAL
+
+    seen = set()
+    cause = error
+    while cause is not None and id(cause) not in seen:
+        seen.add(id(cause))
+        if isinstance(cause, (ssl.SSLError, ssl.CertificateError)):
+            return ERROR_TLS
+        cause = cause.__cause__ or cause.__context__
+    if isinstance(error, httpx.ConnectError) and "ssl" in str(error).lower():
+        return ERROR_TLS
+
+    if isinstance(error, (httpx.TimeoutException, TimeoutError)):
+        return ERROR_TIMEOUT
+    if isinstance(error, (httpx.NetworkError, httpx.RemoteProtocolError, ConnectionError)):
+        return ERROR_CONNECTION
+    return ERROR_OTHER
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After（秒数或HTTP日期），无效时返回None"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def backoff_delay(policy: RetryPolicy, attempt: int, retry_after: Optional[float] = None) -> float:
+    """计算第attempt次重试前的等待时间
+
+    服务器给出Retry-After时按它等待；否则指数退避，上限的一半固定、一半随机。
+    两种情况都带随机部分，多个连接同时失败时不会在同一时刻重试。
+    """
+    if retry_after is not None:
+        return min(retry_after, MAX_RETRY_AFTER) + random.uniform(0, RETRY_AFTER_JITTER)
+    ceiling = min(policy.max_delay, policy.base_delay * (2 ** max(0, attempt - 1)))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class HostCircuitBreaker:
+    """单个主机的熔断器：closed（正常）-> open（冷却）-> half_open（一个试探请求）-> closed"""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0               # 连续失败次数
+        self.open_until = 0.0
+        self.probe_started = None       # 试探请求的开始时间
+        self.consecutive_trips = 0      # 恢复前的连续熔断次数，决定冷却时间
+        self.trips = 0
+        self.last_reason = None
+
+    def check(self) -> float:
+        """请求前检查，返回需要等待的秒数（0表示可以发送）"""
+        now = time.monotonic()
+        with self.lock:
+            if self.state == "open":
+                if now < self.open_until:
+                    return self.open_until - now
+                self.state = "half_open"
+                self.probe_started = None
+            if self.state == "half_open":
+                if self.probe_started is not None and now - self.probe_started < BREAKER_PROBE_TIMEOUT:
+                    return BREAKER_POLL_INTERVAL
+                self.probe_started = now
+            return 0.0
+
+    def record_success(self) -> bool:
+        """请求成功，返回熔断器是否因此恢复"""
+        with self.lock:
+            self.failures = 0
+            if self.state == "closed":
+                return False
+            self.state = "closed"
+            self.consecutive_trips = 0
+            self.probe_started = None
+            return True
+
+    def record_failure(self, error_class: str, retry_after: Optional[float] = None) -> float:
+        """请求失败，熔断时返回冷却时间（秒），否则返回0
+
+        4xx和本地错误不说明主机有问题，不计入连续失败；试探请求因此失败时放行新的试探。
+        """
+        with self.lock:
+            if not get_retry_policy(error_class).counts_for_breaker:
+                if self.state == "half_open":
+                    self.probe_started = None
+                return 0.0
+            self.failures += 1
+            if not (self.state == "half_open" or get_retry_policy(error_class).trips_breaker
+                    or self.failures >= BREAKER_FAILURE_THRESHOLD):
+                return 0.0
+            if self.state == "open":
+                # 冷却期间仍在进行的请求失败，只按Retry-After延长冷却
+                if retry_after:
+                    self.open_until = max(self.open_until, time.monotonic() + min(retry_after, MAX_RETRY_AFTER))
+                return 0.0
+
+            self.consecutive_trips += 1
+            self.trips += 1
+            # 服务器给出Retry-After时按它冷却，否则按连续熔断次数指数增长
+            if retry_after:
+                cooldown = min(retry_after, MAX_RETRY_AFTER)
+            else:
+                cooldown = min(BREAKER_MAX_COOLDOWN, BREAKER_BASE_COOLDOWN * (2 ** (self.consecutive_trips - 1)))
+            self.state = "open"
+            self.open_until = time.monotonic() + cooldown
+            self.probe_started = None
+            self.last_reason = ERROR_NAMES.get(error_class, error_class)
+            return cooldown
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "trips": self.trips,
+                "reopen_in": max(0.0, self.open_until - time.monotonic()) if self.state == "open" else 0.0,
+                "last_reason": self.last_reason
+            }
+
+
+class BreakerRegistry:
+    """进程级主机熔断器表：同一主机的所有任务共享熔断状态"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.breakers: Dict[str, HostCircuitBreaker] = {}
+
+    def get(self, url: str) -> HostCircuitBreaker:
+        scheme, host, port = get_origin(url)
+        key = f"{host}:{port}"
+        with self.lock:
+            breaker = self.breakers.get(key)
+            if breaker is None:
+                breaker = self.breakers[key] = HostCircuitBreaker(key)
+            return breaker
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            breakers = list(self.breakers.values())
+        return {breaker.host: breaker.get_stats() for breaker in breakers}
+
+
+# 全局熔断器表
+host_breakers = BreakerRegistry()
+
+
+class RetryTracker:
+    """单个任务的重试记录：给出每次失败后的等待时间，并统计重试情况供日志和界面显示"""
+
+    def __init__(self, log_fn: Callable[[str], None] = None,
+                 on_trip: Callable[[str, float, str], None] = None):
+        """
+        Args:
+            log_fn: 日志函数
+            on_trip: 主机熔断时的回调(主机, 冷却秒数, 原因)
+        """
+        self.lock = threading.Lock()
+        self.log_fn = log_fn or (lambda message: logging.info(f"[Retry] {message}"))
+        self.on_trip = on_trip
+        self.use_breaker = is_circuit_breaker_enabled()
+
+        self.retries = 0
+        self.failures_by_class: Dict[str, int] = {}
+        self.backoff_time = 0.0
+        self.breaker_trips = 0
+        self.breaker_wait = 0.0
+        self.gave_up = 0
+
+    def wait_time(self, url: str) -> float:
+        """请求前调用：主机熔断时返回需要等待的秒数"""
+        if not self.use_breaker:
+            return 0.0
+        wait = host_breakers.get(url).check()
+        if wait > 0:
+            with self.lock:
+                self.breaker_wait += min(wait, BREAKER_POLL_INTERVAL)
+        return wait
+
+    def on_success(self, url: str) -> None:
+        if self.use_breaker and host_breakers.get(url).record_success():
+            self.log_fn(f"{get_origin(url)[1]} 试探请求成功，恢复正常请求")
+
+    def on_failure(self, url: str, error_class: str, retry_after: Optional[float] = None) -> None:
+        """记录一次请求失败，限流或连续失败（只算主机和网络错误）时熔断该主机
+
+        Args:
+            url: 请求的URL
+            error_class: 错误类型
+            retry_after: 服务器给出的Retry-After（秒）
+        """
+        with self.lock:
+            self.failures_by_class[error_class] = self.failures_by_class.get(error_class, 0) + 1
+        if not self.use_breaker:
+            return
+
+        breaker = host_breakers.get(url)
+        cooldown = breaker.record_failure(error_class, retry_after)
+        if cooldown > 0:
+            name = ERROR_NAMES.get(error_class, error_class)
+            with self.lock:
+                self.breaker_trips += 1
+            self.log_fn(f"{breaker.host} {name}，暂停请求 {cooldown:.1f} 秒")
+            if self.on_trip:
+                self.on_trip(breaker.host, cooldown, name)
+
+    def next_delay(self, attempt: int, error_class: str, retry_after: Optional[float] = None) -> Optional[float]:
+        """计算重试前的等待时间
+
+        Args:
+            attempt: 同一块的第几次连续失败（从1开始）
+            error_class: 错误类型
+            retry_after: 服务器给出的Retry-After（秒）
+
+        Returns:
+            Optional[float]: 等待秒数，超过该类错误的重试次数时返回None
+        """
+        if attempt > get_retry_policy(error_class).max_attempts:
+            with self.lock:
+                self.gave_up += 1
+            return None
+
+        delay = backoff_delay(get_retry_policy(error_class), attempt, retry_after)
+        with self.lock:
+            self.retries += 1
+            self.backoff_time += delay
+        return delay
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "retries": self.retries,
+                "failures": dict(self.failures_by_class),
+                "backoff_time": self.backoff_time,
+                "breaker_trips": self.breaker_trips,
+                "breaker_wait": self.breaker_wait,
+                "gave_up": self.gave_up
+            }
+
+    def describe(self) -> str:
+        """日志用的简要描述"""
+        stats = self.get_stats()
+        failures = ", ".join(f"{ERROR_NAMES.get(name, name)}={count}" for name, count in stats["failures"].items())
+        return (f"重试={stats['retries']}, 失败=[{failures or '无'}], 退避={stats['backoff_time']:.1f}秒, "
+                f"熔断={stats['breaker_trips']}次, 熔断等待={stats['breaker_wait']:.1f}秒")
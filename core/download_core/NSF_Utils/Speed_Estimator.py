@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Speed_Estimator.py - 下载速度估计模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+下载速度估计模块
+按相邻两次采样之间的字节增量计算瞬时速度，再做按时间加权的指数移动平均（EWMA），
+分别估计每个下载块和整个任务的速度；同时跟踪速度的波动，给出带上下界的剩余时间估计。
+与"已下载总量 / 总耗时"相比，停滞、恢复和网络变化都能在一个半衰期左右反映出来。
+"""
+
+import logging
+import math
+import threading
+import time
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+# 默认配置
+DEFAULT_HALF_LIFE = 3.0          # 任务速度的半衰期（秒）
+DEFAULT_BLOCK_HALF_LIFE = 2.0    # 下载块速度的半衰期（秒）
+DEFAULT_CONFIDENCE_Z = 1.645     # 剩余时间上下界对应的标准差倍数（约90%区间）
+MIN_SAMPLE_INTERVAL = 0.05       # 小于该间隔的采样并入下一次（秒）
+
+
+def get_configured_half_life() -> float:
+    """读取内核配置中的速度半衰期（download_cfg.speedHalfLife，秒）"""
+    try:
+        from core.download_core.core.config import download_cfg
+        half_life = float(getattr(download_cfg, "speedHalfLife", DEFAULT_HALF_LIFE))
+        return half_life if half_life > 0 else DEFAULT_HALF_LIFE
+    except Exception as e:
+        logging.debug(f"读取速度半衰期失败: {e}")
+        return DEFAULT_HALF_LIFE
+
+
+class EwmaRate:
+    """单个计数器的速度估计（按时间加权的EWMA，同时估计方差）"""
+
+    __slots__ = ("half_life", "rate", "variance", "last_value", "last_time", "samples")
+
+    def __init__(self, half_life: float = DEFAULT_HALF_LIFE):
+        self.half_life = half_life
+        self.rate = 0.0
+        self.variance = 0.0
+        self.last_value = None
+        self.last_time = None
+        self.samples = 0
+
+    def update(self, value: int, now: float) -> float:
+        """记录计数器的当前值
+
+        Args:
+            value: 累计字节数
+            now: 当前时间（time.monotonic()）
+
+        Returns:
+            float: 当前速度估计（字节/秒）
+        """
+        if self.last_time is None or value < self.last_value:
+            # 第一次采样、暂停恢复后或计数器被重置：只记录基准
+            self.last_value = value
+            self.last_time = now
+            return self.rate
+
+        elapsed = now - self.last_time
+        if elapsed < MIN_SAMPLE_INTERVAL:
+            return self.rate
+
+        sample = (value - self.last_value) / elapsed
+        self.last_value = value
+        self.last_time = now
+        self.samples += 1
+
+        if self.samples == 1:
+            self.rate = sample
+            self.variance = 0.0
+        else:
+            # 时间越长新样本权重越大，与采样频率无关
+            alpha = 1.0 - 0.5 ** (elapsed / self.half_life)
+            diff = sample - self.rate
+            self.rate += alpha * diff
+            self.variance = (1.0 - alpha) * (self.variance + alpha * diff * diff)
+        return self.rate
+
+    def pause(self) -> None:
+        """暂停：丢弃基准，恢复后的第一个增量不会把暂停时间算进去"""
+        self.last_time = None
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.variance)
+
+
+def estimate_eta(remaining: int, rate: float, stddev: float = 0.0,
+                 z: float = DEFAULT_CONFIDENCE_Z) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+    """估计剩余时间
+
+    Args:
+        remaining: 剩余字节数
+        rate: 速度估计（字节/秒）
+        stddev: 速度的标准差
+        z: 上下界对应的标准差倍数
+
+    Returns:
+        Tuple[Optional[float], Optional[float], Optional[float]]: (剩余时间, 下界, 上界)，单位秒；
+            速度未知时为None，上界在速度可能降到接近0时为None
+    """
+    if remaining <= 0:
+        return 0.0, 0.0, 0.0
+    if rate <= 0:
+        return None, None, None
+    fast = rate + z * stddev
+    slow = rate - z * stddev
+    eta = remaining / rate
+    return eta, remaining / fast, (remaining / slow if slow > rate * 0.05 else None)
+
+
+class SpeedEstimator:
+    """任务及其下载块的速度估计器（线程安全）"""
+
+    def __init__(self, half_life: float = None, block_half_life: float = None):
+        """初始化
+
+        Args:
+            half_life: 任务速度的半衰期（秒），默认读取配置
+            block_half_life: 下载块速度的半衰期（秒），默认与任务相同但不超过DEFAULT_BLOCK_HALF_LIFE
+        """
+        self.half_life = half_life if half_life and half_life > 0 else get_configured_half_life()
+        self.block_half_life = block_half_life or min(self.half_life, DEFAULT_BLOCK_HALF_LIFE)
+        self.lock = threading.Lock()
+        self.task = EwmaRate(self.half_life)
+        self.blocks: Dict[Hashable, EwmaRate] = {}
+
+    def update(self, total_bytes: int, blocks: Iterable[Tuple[Hashable, int]] = (),
+               now: float = None) -> float:
+        """记录一次采样
+
+        Args:
+            total_bytes: 任务累计下载的字节数
+            blocks: (块标识, 块累计位置)，不再出现的块会被移除
+            now: 采样时间，默认time.monotonic()
+
+        Returns:
+            float: 任务速度估计（字节/秒）
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            seen = set()
+            for key, position in blocks:
+                rate = self.blocks.get(key)
+                if rate is None:
+                    rate = self.blocks[key] = EwmaRate(self.block_half_life)
+                rate.update(position, now)
+                seen.add(key)
+            if len(seen) != len(self.blocks):
+                for key in [key for key in self.blocks if key not in seen]:
+                    del self.blocks[key]
+            return self.task.update(total_bytes, now)
+
+    def pause(self) -> None:
+        """任务暂停（恢复后重新建立基准，速度估计保留）"""
+        with self.lock:
+            self.task.pause()
+            for rate in self.blocks.values():
+                rate.pause()
+
+    def reset(self) -> None:
+        """清除所有估计"""
+        with self.lock:
+            self.task = EwmaRate(self.half_life)
+            self.blocks.clear()
+
+    @property
+    def speed(self) -> float:
+        """任务速度估计（字节/秒）"""
+        return max(0.0, self.task.rate)
+
+    def block_speed(self, key: Hashable) -> float:
+        """下载块速度估计（字节/秒），未知的块返回0"""
+        rate = self.blocks.get(key)
+        return max(0.0, rate.rate) if rate else 0.0
+
+    def block_speeds(self) -> Dict[Hashable, float]:
+        """所有下载块的速度估计"""
+        with self.lock:
+            return {key: max(0.0, rate.rate) for key, rate in self.blocks.items()}
+
+    def eta(self, remaining: int, z: float = DEFAULT_CONFIDENCE_Z
+            ) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+        """估计任务剩余时间，返回(剩余时间, 下界, 上界)，见estimate_eta"""
+        return estimate_eta(remaining, self.speed, self.task.stddev, z)
+
+    def get_stats(self, remaining: int = -1) -> Dict[str, Any]:
+        """获取估计结果
+
+        Args:
+            remaining: 剩余字节数，未知时为-1（不估计剩余时间）
+        """
+        eta, eta_low, eta_high = self.eta(remaining) if remaining >= 0 else (None, None, None)
+        return {
+            "speed": self.speed,
+            "speed_stddev": self.task.stddev,
+            "half_life": self.half_life,
+            "block_speeds": self.block_speeds(),
+            "remaining": remaining,
+            "eta": eta,
+            "eta_low": eta_low,
+            "eta_high": eta_high
+        }
+
+
+# 测试代码
+if __name__ == "__main__":
+    # 回放一段速度曲线（4 MB/s -> 停滞10秒 -> 8 MB/s），每500毫秒采样一次，
+    # 对比旧算法（总量/总耗时，再取最近10次平均）与EWMA估计
+    MB = 1024 * 1024
+    profile = [(20, 4 * MB), (10, 0), (20, 8 * MB)]
+
+    estimator = SpeedEstimator(half_life=DEFAULT_HALF_LIFE)
+    history = []
+    downloaded = 0.0
+    now = 0.0
+    print(f"{'时间':>6}{'实际':>10}{'旧算法':>10}{'EWMA':>10}   剩余时间(下界-上界) 剩余200MB")
+    for duration, speed in profile:
+        for _ in range(duration * 2):
+            now += 0.5
+            downloaded += speed * 0.5
+            history.append(downloaded / now)
+            history = history[-10:]
+            old_speed = sum(history) / len(history)
+            new_speed = estimator.update(int(downloaded), now=now)
+            if int(now * 2) % 10 == 0:
+                eta, low, high = estimator.eta(200 * MB)
+                eta_text = (f"{eta:6.1f}s ({low:.1f}-{high:.1f}s)" if high else
+                            f"{eta:6.1f}s ({low:.1f}s-未知)" if eta else "未知")
+                print(f"{now:>5.0f}s{speed / MB:>8.1f}MB{old_speed / MB:>8.2f}MB{new_speed / MB:>8.2f}MB   {eta_text}")
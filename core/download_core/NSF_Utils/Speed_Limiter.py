@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Speed_Limiter.py - 全局限速模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+全局限速模块
+进程级分层令牌桶：一个全局桶限制所有下载任务的总带宽，
+每个任务可以再设置独立的任务桶，所有下载块共享同一组桶
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional, Any
+
+# 令牌桶默认突发时间窗口（秒），决定桶容量 = 速率 * 窗口
+DEFAULT_BURST_WINDOW = 0.25
+# 单次等待上限，保证限速调整后能尽快生效
+MAX_WAIT_SLICE = 0.5
+
+
+class TokenBucket:
+    """令牌桶
+
+    采用"预支"方式：acquire时直接扣除令牌，令牌不足时允许为负，
+    返回需要等待的时间，调用方在锁外休眠，避免持锁等待。
+    """
+
+    def __init__(self, rate: float = 0, burst: Optional[float] = None):
+        """初始化令牌桶
+
+        Args:
+            rate: 速率（字节/秒），0表示不限速
+            burst: 桶容量（字节），默认为速率 * DEFAULT_BURST_WINDOW
+        """
+        self.lock = threading.Lock()
+        self.rate = 0.0
+        self.capacity = 0.0
+        self.tokens = 0.0
+        self.last_refill = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float, burst: Optional[float] = None) -> None:
+        """修改速率（可在下载过程中调用）
+
+        Args:
+            rate: 速率（字节/秒），0表示不限速
+            burst: 桶容量（字节）
+        """
+        with self.lock:
+            self.rate = max(0.0, float(rate))
+            self.capacity = float(burst) if burst else max(self.rate * DEFAULT_BURST_WINDOW, 1.0)
+            # 修改限速会唤醒等待中的线程，它们预支的数据随即发出；
+            # 欠账最多保留一个桶容量，新速率很快生效，同时突发量不超过桶容量
+            self.tokens = max(-self.capacity, min(self.tokens, self.capacity))
+            self.last_refill = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        """是否不限速"""
+        return self.rate <= 0
+
+    def reserve(self, amount: int) -> float:
+        """预支令牌
+
+        Args:
+            amount: 字节数
+
+        Returns:
+            float: 需要等待的秒数
+        """
+        with self.lock:
+            if self.rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class BandwidthLimiter:
+    """分层带宽限制器（全局 + 任务）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.global_bucket = TokenBucket(0)
+        self.task_buckets: Dict[Any, TokenBucket] = {}
+        self._reconfigured = threading.Event()
+        self._settings_loaded = False
+
+        # 统计信息
+        self.throttled_count = 0
+        self.throttled_time = 0.0
+
+    def _notify_reconfigured(self) -> None:
+        """唤醒正在等待的线程，使新的限速立即生效"""
+        event = self._reconfigured
+        self._reconfigured = threading.Event()
+        event.set()
+
+    def set_global_limit(self, bytes_per_second: int) -> None:
+        """设置全局限速
+
+        Args:
+            bytes_per_second: 字节/秒，0表示不限速
+        """
+        self._settings_loaded = True
+        self.global_bucket.set_rate(bytes_per_second)
+        self._notify_reconfigured()
+        if bytes_per_second > 0:
+            logging.info(f"全局下载限速: {bytes_per_second / 1024:.0f} KB/s")
+        else:
+            logging.info("全局下载限速已关闭")
+
+    def set_task_limit(self, task_id: Any, bytes_per_second: int) -> None:
+        """设置单个任务的限速
+
+        Args:
+            task_id: 任务标识
+            bytes_per_second: 字节/秒，0表示只受全局限速约束
+        """
+        with self.lock:
+            if bytes_per_second > 0:
+                bucket = self.task_buckets.get(task_id)
+                if bucket is None:
+                    self.task_buckets[task_id] = TokenBucket(bytes_per_second)
+                else:
+                    bucket.set_rate(bytes_per_second)
+            else:
+                self.task_buckets.pop(task_id, None)
+        self._notify_reconfigured()
+
+    def remove_task(self, task_id: Any) -> None:
+        """移除任务的限速桶"""
+        with self.lock:
+            self.task_buckets.pop(task_id, None)
+
+    def reserve(self, amount: int, task_id: Any = None) -> float:
+        """为下载的数据预支带宽，不阻塞（供异步引擎自行等待）
+
+        未设置任何限速时直接返回，不加锁。
+
+        Args:
+            amount: 本次下载的字节数
+            task_id: 任务标识
+
+        Returns:
+            float: 需要等待的秒数
+        """
+        if not self._settings_loaded:
+            self.load_settings()
+
+        task_bucket = self.task_buckets.get(task_id) if task_id is not None else None
+        if self.global_bucket.rate <= 0 and task_bucket is None:
+            return 0.0
+
+        # 先向全局桶预支，再向任务桶预支：所有任务的数据都计入全局欠账，
+        # 等待时间取两者中较长的一个
+        wait = self.global_bucket.reserve(amount)
+        if task_bucket is not None:
+            wait = max(wait, task_bucket.reserve(amount))
+        return max(0.0, wait)
+
+    def acquire(self, amount: int, task_id: Any = None) -> float:
+        """为下载的数据申请带宽，必要时阻塞
+
+        未设置任何限速时直接返回，不加锁。
+
+        Args:
+            amount: 本次下载的字节数
+            task_id: 任务标识
+
+        Returns:
+            float: 实际等待的秒数
+        """
+        wait = self.reserve(amount, task_id)
+        if wait <= 0:
+            return 0.0
+
+        # 在锁外分片等待，限速被修改时提前醒来
+        start = time.monotonic()
+        deadline = start + wait
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self._reconfigured.wait(min(remaining, MAX_WAIT_SLICE)):
+                break
+
+        waited = time.monotonic() - start
+        self.throttled_count += 1
+        self.throttled_time += waited
+        return waited
+
+    def load_settings(self) -> None:
+        """从设置中加载全局限速（network.speed_limit.download_limit，单位KB/s）"""
+        self._settings_loaded = True
+        limit = 0
+        try:
+            from client.ui.client_interface.settings.config import config
+            if config.get_setting("network", "speed_limit.download_enabled", False):
+                limit = int(config.get_setting("network", "speed_limit.download_limit", 0) or 0) * 1024
+        except ImportError:
+            # 没有界面配置时使用内核配置（字节/秒）
+            try:
+                from core.download_core.core.config import download_cfg
+                limit = int(getattr(download_cfg, "speedLimitation", 0) or 0)
+            except Exception as e:
+                logging.debug(f"读取内核限速配置失败: {e}")
+        except Exception as e:
+            logging.warning(f"读取限速设置失败: {e}")
+        if limit > 0:
+            self.set_global_limit(limit)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取限速统计信息"""
+        return {
+            "global_limit": self.global_bucket.rate,
+            "task_limits": {str(k): v.rate for k, v in list(self.task_buckets.items())},
+            "throttled_count": self.throttled_count,
+            "throttled_time": self.throttled_time
+        }
+
+
+# 全局限速器实例
+bandwidth_limiter = BandwidthLimiter()
+
+
+def set_global_speed_limit(bytes_per_second: int) -> None:
+    """设置全局下载限速（字节/秒，0表示不限速）"""
+    bandwidth_limiter.set_global_limit(bytes_per_second)
+
+
+def reload_speed_limit_settings() -> None:
+    """重新从设置中读取全局限速"""
+    bandwidth_limiter.set_global_limit(0)
+    bandwidth_limiter.load_settings()
+
+
+# 测试代码
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    limiter = BandwidthLimiter()
+    limiter.set_global_limit(2 * 1024 * 1024)
+    limiter.set_task_limit("task-a", 512 * 1024)
+
+    def _worker(task_id, totals, deadline, chunk=64 * 1024):
+        while time.monotonic() < deadline:
+            limiter.acquire(chunk, task_id)
+            with totals_lock:
+                totals[task_id] = totals.get(task_id, 0) + chunk
+
+    # 截止前最后预支的数据要等到截止之后才放行，按最后一个线程结束的时间计算速度
+    totals = {}
+    totals_lock = threading.Lock()
+    start = time.monotonic()
+    threads = [threading.Thread(target=_worker, args=(task, totals, start + 3.0))
+               for task in ("task-a", "task-b", "task-b", "task-b")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    for task_id, total in sorted(totals.items()):
+        print(f"{task_id}: {total / elapsed / 1024:.0f} KB/s")
+    print(f"总计: {sum(totals.values()) / elapsed / 1024:.0f} KB/s (全局上限 2048 KB/s)")
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Work_Stealing.py - 工作窃取动态分段模块
+# 作为Hanabi NSF内核组件
+# 开发者: ZZBuAoYe
+
+"""
+工作窃取动态分段模块
+初始分块只决定每个连接从哪里开始；连接空闲后先领取尚未分配的块，
+没有可领取的块时从剩余最多的块尾部"窃取"一半，直到剩余区间小于最小分割大小，
+这样所有连接都能工作到最后一个字节，而不是由最慢的一个块独自拖完尾段
+"""
+
+import logging
+import random
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# 默认配置
+DEFAULT_MIN_SPLIT_SIZE = 1024 * 1024   # 窃取后双方至少各剩1MB，避免为小尾巴反复建立连接
+SPLIT_ALIGNMENT = 64 * 1024            # 分割点按64KB对齐
+
+
+def is_work_stealing_enabled() -> bool:
+    """读取设置中的工作窃取开关（download.work_stealing，默认开启）"""
+    try:
+        from client.ui.client_interface.settings.config import config
+        return bool(config.get_setting("download", "work_stealing", True))
+    except ImportError:
+        return True
+    except Exception as e:
+        logging.warning(f"读取工作窃取设置失败: {e}")
+        return True
+
+
+def choose_steal_split(ranges: Sequence[Tuple[Any, int, int]],
+                       min_split_size: int = DEFAULT_MIN_SPLIT_SIZE) -> Optional[Tuple[Any, int]]:
+    """选择被窃取的区间和分割点
+
+    Args:
+        ranges: (标识, 当前位置, 结束位置)列表，结束位置包含在区间内
+        min_split_size: 最小分割大小，分割后双方都不小于该值
+
+    Returns:
+        Optional[Tuple[Any, int]]: (被窃取区间的标识, 分割点)，
+            被窃取方保留[当前位置, 分割点-1]，窃取方下载[分割点, 结束位置]；无法分割时返回None
+    """
+    best = None
+    best_remaining = 0
+    for key, current, end in ranges:
+        remaining = end - current + 1
+        if remaining > best_remaining:
+            best, best_remaining = (key, current, end), remaining
+
+    if best is None or best_remaining < 2 * min_split_size:
+        return None
+
+    key, current, end = best
+    split_point = current + best_remaining // 2
+    aligned = split_point - split_point % SPLIT_ALIGNMENT
+    if aligned - current >= min_split_size:
+        split_point = aligned
+    return key, split_point
+
+
+class WorkStealer:
+    """下载块分配器
+
+    工作线程通过claim()领取块，块下载结束（完成、失败或暂停）后调用release()。
+    窃取只缩短被窃取块的结束位置，正在下载该块的线程每写一段数据都会重新读取结束位置，
+    到达新的结束位置后自行停止；极端情况下多写的一小段与窃取方写入的内容相同，不影响文件。
+    """
+
+    def __init__(self, blocks: List[Any], block_factory: Callable[[int, int], Any],
+                 min_split_size: int = DEFAULT_MIN_SPLIT_SIZE,
+                 log_fn: Callable[[str], None] = None):
+        """初始化分配器
+
+        Args:
+            blocks: 下载块列表（新块会追加到该列表中）
+            block_factory: 创建新块的函数 block_factory(起始位置, 结束位置)
+            min_split_size: 最小分割大小（字节）
+            log_fn: 日志函数
+        """
+        self.blocks = blocks
+        self.block_factory = block_factory
+        self.min_split_size = max(1, int(min_split_size))
+        self.log_fn = log_fn or (lambda message: logging.debug(f"[WorkStealer] {message}"))
+        self.lock = threading.Lock()
+        self.active_workers = 0
+
+        # 统计信息
+        self.steal_count = 0
+        self.stolen_bytes = 0
+
+    @staticmethod
+    def _is_pending(block: Any) -> bool:
+        """块是否还有未下载的数据"""
+        return block.current_position <= block.end_position
+
+    def claim(self) -> Optional[Any]:
+        """领取一个待下载的块，没有可领取的块时尝试窃取
+
+        Returns:
+            Optional[Any]: 下载块，全部分配完毕且无法再分割时返回None
+        """
+        with self.lock:
+            for block in self.blocks:
+                if not block.assigned and not block.active and self._is_pending(block):
+                    block.assigned = True
+                    return block
+            return self._steal()
+
+    def _steal(self) -> Optional[Any]:
+        """从剩余最多的已分配块尾部窃取一半（需持有锁）"""
+        ranges = [(i, block.current_position, block.end_position)
+                  for i, block in enumerate(self.blocks)
+                  if block.assigned and self._is_pending(block)]
+        choice = choose_steal_split(ranges, self.min_split_size)
+        if choice is None:
+            return None
+
+        index, split_point = choice
+        victim = self.blocks[index]
+        old_end = victim.end_position
+        if not victim.current_position < split_point <= old_end:
+            return None
+
+        # 先加入新块再缩短原块，遍历块列表快照的线程不会看到没有块负责的区间
+        new_block = self.block_factory(split_point, old_end)
+        new_block.assigned = True
+        self.blocks.append(new_block)
+        victim.end_position = split_point - 1
+
+        self.steal_count += 1
+        self.stolen_bytes += old_end - split_point + 1
+        self.log_fn(f"窃取块 #{index} 尾部 {split_point}-{old_end}，生成新块 #{len(self.blocks) - 1}")
+        return new_block
+
+    def release(self, block: Any) -> None:
+        """归还块（之后可以被其他工作线程重新领取）"""
+        with self.lock:
+            block.assigned = False
+
+    def reset(self) -> None:
+        """清除所有分配标记（暂停后重新启动工作线程时调用）"""
+        with self.lock:
+            for block in self.blocks:
+                block.assigned = False
+
+    def worker_started(self) -> None:
+        with self.lock:
+            self.active_workers += 1
+
+    def worker_finished(self) -> None:
+        with self.lock:
+            self.active_workers = max(0, self.active_workers - 1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取窃取统计信息"""
+        return {
+            "blocks": len(self.blocks),
+            "active_workers": self.active_workers,
+            "steal_count": self.steal_count,
+            "stolen_bytes": self.stolen_bytes
+        }
+
+
+class _SimBlock:
+    """模拟用的下载块"""
+
+    def __init__(self, start: int, end: int):
+        self.start_position = start
+        self.current_position = start
+        self.end_position = end
+        self.assigned = False
+        self.active = False
+
+
+def _static_boundaries(file_size: int, segments: int) -> List[Tuple[int, int]]:
+    """与内核静态分块相同的均匀分块"""
+    size = file_size // segments
+    bounds = []
+    for i in range(segments):
+        start = i * size
+        end = file_size - 1 if i == segments - 1 else start + size - 1
+        bounds.append((start, end))
+    return bounds
+
+
+def simulate(file_size: int, traces: List[List[float]], work_stealing: bool = True,
+             min_split_size: int = DEFAULT_MIN_SPLIT_SIZE, tick: float = 0.1,
+             connect_delay: float = 0.0) -> Dict[str, float]:
+    """回放每个连接的速度曲线，模拟一次分段下载
+
+    Args:
+        file_size: 文件大小（字节）
+        traces: 每个连接每秒的速度（字节/秒），曲线结束后保持最后一个值
+        work_stealing: 是否启用工作窃取（否则为静态分块）
+        min_split_size: 最小分割大小
+        tick: 模拟时间步长（秒）
+        connect_delay: 每次领取新块时建立连接的耗时（秒）
+
+    Returns:
+        Dict[str, float]: total_time 总耗时，first_idle 第一个连接空闲的时刻，
+            tail_time 尾部时长（第一个连接空闲到下载完成），idle_ratio 连接空闲时间占比，steals 窃取次数
+    """
+    connections = len(traces)
+    blocks = [_SimBlock(start, end) for start, end in _static_boundaries(file_size, connections)]
+    stealer = WorkStealer(blocks, _SimBlock, min_split_size, log_fn=lambda message: None)
+
+    # 每个连接初始各领取一个块
+    current: List[Optional[_SimBlock]] = [stealer.claim() for _ in range(connections)]
+    waiting = [connect_delay] * connections
+    idle_time = 0.0
+    first_idle = None
+    now = 0.0
+
+    while any(block.current_position <= block.end_position for block in blocks):
+        for conn in range(connections):
+            block = current[conn]
+            if block is None or block.current_position > block.end_position:
+                if block is not None:
+                    stealer.release(block)
+                block = stealer.claim() if work_stealing else None
+                current[conn] = block
+                waiting[conn] = connect_delay
+                if block is None:
+                    idle_time += tick
+                    if first_idle is None:
+                        first_idle = now
+                    continue
+            if waiting[conn] > 0:
+                waiting[conn] -= tick
+                continue
+            trace = traces[conn]
+            speed = trace[min(int(now), len(trace) - 1)]
+            block.current_position = min(block.end_position + 1,
+                                         block.current_position + int(speed * tick))
+        now += tick
+
+    first_idle = now if first_idle is None else first_idle
+    return {
+        "total_time": now,
+        "first_idle": first_idle,
+        "tail_time": now - first_idle,
+        "idle_ratio": idle_time / (now * connections) if now > 0 else 0.0,
+        "steals": stealer.steal_count
+    }
+
+
+def generate_traces(connections: int, duration: int = 600, base_speed: float = 2 * 1024 * 1024,
+                    seed: int = None) -> List[List[float]]:
+    """生成随机速度曲线：各连接基准速度服从对数正态分布，并带有随机抖动和偶发降速"""
+    rng = random.Random(seed)
+    traces = []
+    for _ in range(connections):
+        mean = base_speed * rng.lognormvariate(0, 0.6)
+        trace = []
+        for _ in range(duration):
+            speed = mean * rng.uniform(0.7, 1.3)
+            if rng.random() < 0.02:
+                speed *= 0.1  # 偶发拥塞
+            trace.append(speed)
+        traces.append(trace)
+    return traces
+
+
+# 测试代码
+if __name__ == "__main__":
+    import json
+    import sys
+
+    # 用法: python Work_Stealing.py [速度曲线.json]
+    # 曲线文件格式: {"file_size": 字节数, "traces": [[每秒速度, ...], ...]}
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            data = json.load(f)
+        scenarios = [("曲线文件", data["file_size"], data["traces"])]
+    else:
+        scenarios = [
+            (f"随机曲线 #{seed}", 512 * 1024 * 1024, generate_traces(8, seed=seed))
+            for seed in range(5)
+        ]
+
+    print(f"{'场景':<14}{'模式':<8}{'总耗时':>10}{'尾部时长':>10}{'空闲占比':>10}{'窃取次数':>10}")
+    for name, file_size, traces in scenarios:
+        for stealing in (False, True):
+            result = simulate(file_size, traces, work_stealing=stealing, connect_delay=0.3)
+            print(f"{name:<14}{'窃取' if stealing else '静态':<8}"
+                  f"{result['total_time']:>9.1f}s{result['tail_time']:>9.1f}s"
+                  f"{result['idle_ratio'] * 100:>9.1f}%{result['steals']:>10}")
@@ -23,6 +23,22 @@ __all__ = [
     "DNS_CDN_Check",
     "Auto_adjust",
     "Crazy_Mode",
+    "Resume_Journal",
+    "Speed_Limiter",
+    "Connection_Pool",
+    "Work_Stealing",
+    "Adaptive_Chunk",
+    "Download_Log",
+    "Progress_Snapshot",
+    "Speed_Estimator",
+    "IP_Pinning",
+    "Async_Mode",
+    "Multi_Source",
+    "Integrity_Check",
+    "Concurrency_Control",
+    "Host_Profile",
+    "Retry_Policy",
+    "Range_Set",
     "NSFEnhancer"
 ]
 
@@ -180,27 +196,19 @@ class NSFEnhancer:
             return False
     
     def _reset_block(self, engine, block_id):
-        """重置下载块
+        """重置下载块（由引擎按重试策略重新提交）
         
         Args:
             engine: 下载引擎
             block_id: 块ID
         """
         try:
-            if 0 <= block_id < len(engine.blocks):
-                block = engine.blocks[block_id]
-                # 重置块处理逻辑
-                if block.active and block.current_position < block.end_position:
-                    block.active = False
-                    engine._log_download_debug(f"[优化器] 重置块 #{block_id}")
-                    # 重新提交块到线程池
-                    if engine.executor and not engine.executor._shutdown:
-                        engine.executor.submit(engine._process_block, block)
+            engine._reset_block(block_id)
         except Exception as e:
             logging.error(f"重置块失败: {e}")
     
     def _split_block(self, engine, block_id, split_point):
-        """分割下载块
+        """分割下载块（由引擎加锁分割并提交新块）
         
         Args:
             engine: 下载引擎
@@ -211,25 +219,7 @@ class NSFEnhancer:
             int: 新块ID，失败返回None
         """
         try:
-            if 0 <= block_id < len(engine.blocks):
-                block = engine.blocks[block_id]
-                # 确保分割点在有效范围内
-                if block.current_position < split_point < block.end_position:
-                    # 创建新块
-                    new_block = type(block)(
-                        split_point, split_point, block.end_position,
-                        engine.client_manager.create_client(engine.headers)
-                    )
-                    # 更新原块结束位置
-                    block.end_position = split_point - 1
-                    # 添加新块到列表
-                    engine.blocks.append(new_block)
-                    new_block_id = len(engine.blocks) - 1
-                    engine._log_download_debug(f"[优化器] 分割块 #{block_id} 在位置 {split_point}，生成新块 #{new_block_id}")
-                    # 提交新块到线程池
-                    if engine.executor and not engine.executor._shutdown:
-                        engine.executor.submit(engine._process_block, new_block)
-                    return new_block_id
+            return engine._split_block(block_id, split_point)
         except Exception as e:
             logging.error(f"分割块失败: {e}")
         return None
@@ -254,7 +244,7 @@ class NSFEnhancer:
             return self.download_optimizer.stop_optimization()
         return False
     
-    def update_block_status(self, block_id, current_pos, start_pos, end_pos, active=True):
+    def update_block_status(self, block_id, current_pos, start_pos, end_pos, active=True, speed=None):
         """更新块状态
         
         Args:
@@ -263,10 +253,11 @@ class NSFEnhancer:
             start_pos: 起始位置
             end_pos: 结束位置
             active: 是否激活
+            speed: 块速度估计(字节/秒)，None时由优化器自行计算
         """
         if self.auto_adjust_enabled and self.download_optimizer:
             self.download_optimizer.update_block_status(
-                block_id, current_pos, start_pos, end_pos, active
+                block_id, current_pos, start_pos, end_pos, active, speed
             )
     
     def optimize_thread_count(self, file_size=-1, connection_speed=-1):
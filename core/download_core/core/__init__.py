@@ -1,5 +1,5 @@
 # Core module initialization
 from .config import cfg
-from .methods import getProxy, getReadableSize, getLinkInfo, createSparseFile
+from .methods import getProxy, getReadableSize, getLinkInfo, createSparseFile, preallocateFile
 
-__all__ = ['cfg', 'getProxy', 'getReadableSize', 'getLinkInfo', 'createSparseFile'] 
\ No newline at end of file
+__all__ = ['cfg', 'getProxy', 'getReadableSize', 'getLinkInfo', 'createSparseFile', 'preallocateFile'] 
\ No newline at end of file
@@ -410,6 +410,8 @@ class DownloadConfig:
         self.SSLVerify = True
         self.speedLimitation = 0  # 字节/秒，0表示不限速
         self.maxReassignSize = 10  # MB，重分配分段的最小大小
+        self.downloadLogLevel = "info"  # 下载任务日志级别: debug/info/warning/error/off
+        self.speedHalfLife = 3.0  # 秒，速度估计的半衰期（越小越灵敏，越大越平稳）
         self.proxyServer = "Auto"
         
         # 路径设置
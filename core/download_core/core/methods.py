@@ -371,7 +371,6 @@ def isSparseSupported(filePath: str) -> bool:
             # Linux实现
             try:
                 # 尝试获取文件系统类型
-                import os.path
                 st = os.statvfs(filePath)
                 if hasattr(st, 'f_basetype'):
                     fs_type = st.f_basetype
@@ -479,18 +478,64 @@ def createSparseFile(file_path: Union[str, Path], size: Optional[int] = None):
             win32file.CloseHandle(handle)
             
         except ImportError:
-            # 如果win32file模块不可用，则使用普通方法
-            with open(path, "wb") as f:
-                f.truncate(size)
+            # 如果win32file模块不可用，则使用普通方法（不截断已有数据）
+            os.truncate(path, size)
                 
     else:  # Linux/macOS
         try:
-            with open(path, "wb") as f:
-                f.truncate(size)
+            # 仅调整文件长度，不清空已下载的数据
+            os.truncate(path, size)
         except Exception as e:
             logging.error(f"创建稀疏文件失败: {repr(e)}")
 
 
+def preallocateFile(file_path: Union[str, Path], size: Optional[int] = None) -> int:
+    """
+    预分配下载文件空间，已存在的文件不会被截断或清空
+
+    支持posix_fallocate的文件系统上分配连续空间，否则退回到稀疏扩展。
+
+    Args:
+        file_path: 文件路径
+        size: 文件大小（字节），如果为None或不大于0则只确保文件存在
+
+    Returns:
+        int: 预分配前文件已有的大小（字节），新建或空文件返回0；
+            断点续传时只有这个长度以内的已下载数据还在文件中
+    """
+    path = Path(file_path) if isinstance(file_path, str) else file_path
+    existing_size = path.stat().st_size if path.exists() else 0
+
+    fd = os.open(str(path), os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        if not size or size <= 0:
+            return existing_size
+
+        if existing_size < size:
+            allocated = False
+            # 仅在原生支持的文件系统上使用fallocate，避免glibc逐块写零的慢速模拟
+            try:
+                use_fallocate = hasattr(os, "posix_fallocate") and isSparseSupported(str(path.parent))
+            except Exception as e:
+                logger.debug(f"文件系统检测失败，改用稀疏扩展: {repr(e)}")
+                use_fallocate = False
+            if use_fallocate:
+                try:
+                    os.posix_fallocate(fd, existing_size, size - existing_size)
+                    allocated = True
+                except OSError as e:
+                    logger.debug(f"posix_fallocate失败，改用稀疏扩展: {repr(e)}")
+            if not allocated:
+                os.ftruncate(fd, size)
+        elif existing_size > size:
+            # 只去掉超出部分，前面的数据保持不变
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+    return existing_size
+
+
 # 清理函数 - 在程序退出时调用
 def cleanup():
     # 关闭线程池
@@ -510,3 +555,25 @@ def cleanup():
 # 注册清理函数
 import atexit
 atexit.register(cleanup)
+
+
+# 测试代码
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        target = os.path.join(temp_dir, "preallocate.bin")
+        print(f"文件系统支持预分配: {isSparseSupported(temp_dir)}")
+
+        # 新建文件预分配到完整大小
+        assert preallocateFile(target, 8 * 1024 * 1024) == 0
+        assert os.path.getsize(target) == 8 * 1024 * 1024
+
+        # 已有数据的文件扩展时保留原数据
+        with open(target, "r+b") as f:
+            f.write(b"hanabi")
+        assert preallocateFile(target, 16 * 1024 * 1024) == 8 * 1024 * 1024
+        assert os.path.getsize(target) == 16 * 1024 * 1024
+        with open(target, "rb") as f:
+            assert f.read(6) == b"hanabi"
+    print("预分配测试通过")
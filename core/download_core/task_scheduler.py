@@ -0,0 +1,399 @@
+# ================================================
+# Hanabi Download Scheduler
+# 统一的下载任务调度器
+# Developed By ZZBuAoYe
+# Tips: 所有入口（主窗口、浏览器扩展弹窗）都通过这里提交下载任务
+#================================================
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Any, Callable
+
+from PySide6.QtCore import QObject, Signal, Qt
+
+from core.download_core.core.config import cfg
+
+
+# 优先级（数值越小越优先）
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# 排队策略
+ORDER_FIFO = "fifo"   # 先到先下
+ORDER_SJF = "sjf"     # 小文件优先（未知大小的排在最后）
+
+# 任务状态
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_PAUSED = "paused"
+
+# 队列持久化文件
+QUEUE_FILE = os.path.join(os.path.expanduser('~'), '.hanabidownloadmanager', 'download_queue.json')
+
+
+class ScheduledTask:
+    """调度器中的一个下载任务"""
+
+    def __init__(self, task_id: str, payload: Dict[str, Any], source: str,
+                 priority: int = PRIORITY_NORMAL, size: int = -1,
+                 launcher: Callable = None, persist: bool = True,
+                 submitted_at: float = None, seq: int = 0):
+        self.task_id = task_id
+        self.payload = payload          # 传给启动函数的数据（需可JSON序列化才能持久化）
+        self.source = source            # 提交来源，用于查找已注册的启动函数
+        self.priority = priority
+        self.size = size                # 文件大小，未知为-1
+        self.launcher = launcher        # 单个任务指定的启动函数（不持久化）
+        self.persist = persist
+        self.submitted_at = submitted_at or time.time()
+        self.seq = seq
+        self.state = STATE_QUEUED
+        self.handle = None              # 启动函数返回的下载引擎
+
+    def sort_key(self, order: str):
+        """排队顺序"""
+        if order == ORDER_SJF:
+            size = self.size if self.size and self.size > 0 else float("inf")
+            return (self.priority, size, self.seq)
+        return (self.priority, self.seq)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为可持久化的字典"""
+        return {
+            "task_id": self.task_id,
+            "payload": self.payload,
+            "source": self.source,
+            "priority": self.priority,
+            "size": self.size,
+            "submitted_at": self.submitted_at
+        }
+
+
+class DownloadScheduler(QObject):
+    """下载任务调度器
+
+    同时运行的任务数不超过max_active，其余任务按优先级和排队策略等待；
+    暂停的任务不占用名额，恢复后重新计入（此时允许暂时超出max_active）；
+    排队中的任务会保存到磁盘，重启后在对应来源注册启动函数时恢复。
+    任务的启动总是在调度器所在的（界面）线程中进行。
+    """
+
+    task_queued = Signal(str)           # 任务ID
+    task_started = Signal(str)          # 任务ID
+    task_finished = Signal(str, bool)   # 任务ID, 是否成功
+    _pump_requested = Signal()
+
+    def __init__(self, max_active: int = None, order: str = ORDER_FIFO, queue_file: str = QUEUE_FILE):
+        super().__init__()
+        self.logger = logging.getLogger("DownloadScheduler")
+        self.lock = threading.RLock()
+        self.max_active = max(1, int(max_active or cfg.maxTaskNum or 3))
+        self.order = order
+        self.queue_file = queue_file
+        self.launchers: Dict[str, Callable] = {}
+        self.queued: List[ScheduledTask] = []
+        self.running: Dict[str, ScheduledTask] = {}
+        self.paused: Dict[str, ScheduledTask] = {}
+        self._pending_restore: List[Dict[str, Any]] = self._load_queue()
+        self._seq = 0
+
+        # 跨线程提交时，统一回到调度器线程启动任务
+        self._pump_requested.connect(self._pump, Qt.QueuedConnection)
+
+    # ---------- 配置 ----------
+
+    def set_max_active(self, count: int) -> None:
+        """设置同时下载的最大任务数"""
+        with self.lock:
+            self.max_active = max(1, int(count))
+        self.logger.info(f"最大同时下载任务数: {self.max_active}")
+        self._request_pump()
+
+    def set_order(self, order: str) -> None:
+        """设置排队策略（ORDER_FIFO或ORDER_SJF）"""
+        if order not in (ORDER_FIFO, ORDER_SJF):
+            raise ValueError(f"未知的排队策略: {order}")
+        with self.lock:
+            self.order = order
+
+    def register_launcher(self, source: str, launcher: Callable, restore: bool = True) -> int:
+        """注册某个来源的任务启动函数
+
+        启动函数签名为 launcher(payload) -> 下载引擎或None。
+        返回的对象如果有finished/download_completed/error_occurred信号，
+        调度器会自动在任务结束时释放名额；否则需要调用finish()。
+        有pause_changed信号时，任务暂停期间释放名额。
+
+        Args:
+            source: 来源名称
+            launcher: 启动函数
+            restore: 是否恢复该来源上次未开始的任务
+
+        Returns:
+            int: 恢复的任务数
+        """
+        restored = 0
+        with self.lock:
+            self.launchers[source] = launcher
+            remaining = []
+            for item in self._pending_restore:
+                if item.get("source") != source:
+                    remaining.append(item)
+                    continue
+                if restore:
+                    self._enqueue(ScheduledTask(
+                        item.get("task_id") or self._new_task_id(),
+                        item.get("payload") or {},
+                        source,
+                        priority=item.get("priority", PRIORITY_NORMAL),
+                        size=item.get("size", -1),
+                        submitted_at=item.get("submitted_at")
+                    ))
+                    restored += 1
+            self._pending_restore = remaining
+            if restored or not restore:
+                self._save_queue()
+
+        if restored:
+            self.logger.info(f"已恢复 {restored} 个排队中的任务 (来源: {source})")
+            self._request_pump()
+        return restored
+
+    # ---------- 提交与结束 ----------
+
+    def submit(self, payload: Dict[str, Any], source: str = "default", launcher: Callable = None,
+               priority: int = PRIORITY_NORMAL, size: int = -1, persist: bool = True,
+               task_id: str = None) -> str:
+        """提交下载任务
+
+        Args:
+            payload: 任务数据，会原样传给启动函数
+            source: 来源名称
+            launcher: 本任务专用的启动函数，默认使用来源注册的启动函数
+            priority: 优先级
+            size: 文件大小（字节），用于小文件优先策略
+            persist: 排队期间是否保存到磁盘
+            task_id: 任务ID，默认自动生成
+
+        Returns:
+            str: 任务ID
+        """
+        with self.lock:
+            task = ScheduledTask(task_id or self._new_task_id(), payload, source, priority=priority,
+                                 size=size, launcher=launcher, persist=persist)
+            self._enqueue(task)
+            self._save_queue()
+            position = len(self.queued)
+
+        self.logger.info(f"任务已加入队列 [ID: {task.task_id}, 来源: {source}], 排队数: {position}, 运行数: {len(self.running)}")
+        self.task_queued.emit(task.task_id)
+        self._request_pump()
+        return task.task_id
+
+    def finish(self, task_id: str, success: bool = True) -> None:
+        """任务结束（完成、失败或被取消），释放名额或从队列中移除（可重复调用）"""
+        with self.lock:
+            task = self.running.pop(task_id, None) or self.paused.pop(task_id, None)
+            if task is None:
+                for i, queued_task in enumerate(self.queued):
+                    if queued_task.task_id == task_id:
+                        task = self.queued.pop(i)
+                        self._save_queue()
+                        break
+            if task is None:
+                return
+
+        self.logger.info(f"任务结束 [ID: {task_id}], 成功: {success}")
+        self.task_finished.emit(task_id, success)
+        self._request_pump()
+
+    def cancel(self, task_id: str) -> None:
+        """取消任务"""
+        self.finish(task_id, False)
+
+    def set_priority(self, task_id: str, priority: int) -> bool:
+        """修改排队中任务的优先级"""
+        with self.lock:
+            for task in self.queued:
+                if task.task_id == task_id:
+                    task.priority = priority
+                    self._sort_queue()
+                    self._save_queue()
+                    return True
+        return False
+
+    def is_queued(self, task_id: str) -> bool:
+        """任务是否仍在排队"""
+        with self.lock:
+            return any(task.task_id == task_id for task in self.queued)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度状态"""
+        with self.lock:
+            return {
+                "max_active": self.max_active,
+                "order": self.order,
+                "running": list(self.running.keys()),
+                "paused": list(self.paused.keys()),
+                "queued": [task.task_id for task in self.queued]
+            }
+
+    def get_estimates(self) -> Dict[str, Dict[str, Any]]:
+        """获取运行中任务的速度和剩余时间估计（下载引擎提供get_speed_estimate时）"""
+        with self.lock:
+            handles = {task_id: task.handle for task_id, task in self.running.items()}
+
+        estimates = {}
+        for task_id, handle in handles.items():
+            get_estimate = getattr(handle, "get_speed_estimate", None)
+            if get_estimate is None:
+                continue
+            try:
+                estimates[task_id] = get_estimate()
+            except Exception as e:
+                self.logger.debug(f"获取任务速度估计失败 [ID: {task_id}]: {e}")
+        return estimates
+
+    # ---------- 内部实现 ----------
+
+    def _new_task_id(self) -> str:
+        self._seq += 1
+        return f"task_{int(time.time() * 1000)}_{self._seq}"
+
+    def _enqueue(self, task: ScheduledTask) -> None:
+        """加入队列（需持有锁）"""
+        self._seq += 1
+        task.seq = self._seq
+        task.state = STATE_QUEUED
+        self.queued.append(task)
+        self._sort_queue()
+
+    def _sort_queue(self) -> None:
+        self.queued.sort(key=lambda task: task.sort_key(self.order))
+
+    def _request_pump(self) -> None:
+        """请求在调度器线程中启动等待的任务"""
+        self._pump_requested.emit()
+
+    def _pump(self) -> None:
+        """在有空闲名额时启动排队中的任务"""
+        while True:
+            with self.lock:
+                if len(self.running) >= self.max_active or not self.queued:
+                    return
+                task = None
+                for i, candidate in enumerate(self.queued):
+                    if (candidate.launcher or self.launchers.get(candidate.source)) is not None:
+                        task = self.queued.pop(i)
+                        break
+                if task is None:
+                    # 排队任务的来源都还没有注册启动函数
+                    return
+                task.state = STATE_RUNNING
+                self.running[task.task_id] = task
+                self._save_queue()
+                launcher = task.launcher or self.launchers.get(task.source)
+
+            self._launch(task, launcher)
+
+    def _launch(self, task: ScheduledTask, launcher: Callable) -> None:
+        """调用启动函数并跟踪任务结束"""
+        try:
+            self.logger.info(f"启动任务 [ID: {task.task_id}, 来源: {task.source}]")
+            handle = launcher(task.payload)
+        except Exception as e:
+            self.logger.error(f"启动任务失败 [ID: {task.task_id}]: {e}")
+            self.finish(task.task_id, False)
+            return
+
+        with self.lock:
+            still_running = task.task_id in self.running
+            task.handle = handle
+        if not still_running:
+            return
+
+        self.task_started.emit(task.task_id)
+        if handle is not None:
+            self._watch(task.task_id, handle)
+
+    def _set_paused(self, task_id: str, paused: bool) -> None:
+        """任务暂停时释放名额，恢复时重新占用名额"""
+        with self.lock:
+            source, target = (self.running, self.paused) if paused else (self.paused, self.running)
+            task = source.pop(task_id, None)
+            if task is None:
+                return
+            task.state = STATE_PAUSED if paused else STATE_RUNNING
+            target[task_id] = task
+
+        self.logger.info(f"任务{'暂停' if paused else '恢复'} [ID: {task_id}], 运行数: {len(self.running)}")
+        if paused:
+            self._request_pump()
+
+    def _watch(self, task_id: str, handle: Any) -> None:
+        """连接下载引擎的结束和暂停信号"""
+        try:
+            if hasattr(handle, "pause_changed"):
+                handle.pause_changed.connect(lambda paused: self._set_paused(task_id, paused))
+            if hasattr(handle, "finished"):
+                # QThread结束即run()返回，覆盖完成、停止和出错；
+                # 只有发出过完成信号且没有出错才算成功（停止和出错都是失败）
+                outcome = {"completed": not hasattr(handle, "download_completed"), "failed": False}
+                if hasattr(handle, "download_completed"):
+                    handle.download_completed.connect(lambda: outcome.update(completed=True))
+                if hasattr(handle, "error_occurred"):
+                    handle.error_occurred.connect(lambda error: outcome.update(failed=True))
+                handle.finished.connect(lambda: self.finish(task_id, outcome["completed"] and not outcome["failed"]))
+            else:
+                if hasattr(handle, "download_completed"):
+                    handle.download_completed.connect(lambda: self.finish(task_id, True))
+                if hasattr(handle, "error_occurred"):
+                    handle.error_occurred.connect(lambda error: self.finish(task_id, False))
+        except Exception as e:
+            self.logger.warning(f"无法跟踪任务 [ID: {task_id}] 的结束信号，需要手动调用finish: {e}")
+
+    def _load_queue(self) -> List[Dict[str, Any]]:
+        """读取上次保存的排队任务"""
+        try:
+            if os.path.exists(self.queue_file):
+                with open(self.queue_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                tasks = data.get("tasks", []) if isinstance(data, dict) else []
+                if tasks:
+                    self.logger.info(f"读取到 {len(tasks)} 个上次未开始的下载任务")
+                return tasks
+        except Exception as e:
+            self.logger.warning(f"读取下载队列失败: {e}")
+        return []
+
+    def _save_queue(self) -> None:
+        """保存排队中的任务（需持有锁），尚未恢复的任务一并保留"""
+        try:
+            tasks = [task.to_dict() for task in self.queued if task.persist]
+            tasks.extend(self._pending_restore)
+            os.makedirs(os.path.dirname(self.queue_file), exist_ok=True)
+            temp_file = self.queue_file + ".tmp"
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "tasks": tasks}, f, ensure_ascii=False, indent=2, default=str)
+            os.replace(temp_file, self.queue_file)
+        except Exception as e:
+            self.logger.warning(f"保存下载队列失败: {e}")
+
+
+# 全局调度器实例（首次使用时在界面线程中创建）
+_scheduler_instance = None
+_scheduler_lock = threading.Lock()
+
+
+def get_download_scheduler() -> DownloadScheduler:
+    """获取全局下载调度器"""
+    global _scheduler_instance
+    if _scheduler_instance is None:
+        with _scheduler_lock:
+            if _scheduler_instance is None:
+                _scheduler_instance = DownloadScheduler()
+    return _scheduler_instance
@@ -656,6 +656,8 @@ function sendDownloadInfo(requestInfo) {
             mimeType: requestInfo.mimeType,
             timestamp: Date.now(),
             referrer: requestInfo.referrer,
+            mirrors: requestInfo.mirrors || [], // 同一文件的备用下载链接（镜像、CDN等）
+            checksum: requestInfo.checksum || null, // 期望的文件摘要，如 sha256:...
             headers: {
                 'User-Agent': navigator.userAgent,
                 'Referer': requestInfo.referrer